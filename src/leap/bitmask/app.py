@@ -165,6 +165,8 @@ def start_app():
     flags.STANDALONE = opts.standalone
     flags.OFFLINE = opts.offline
     flags.MAIL_LOGFILE = opts.mail_log_file
+    flags.MAIL_ON_DEMAND = opts.mail_on_demand
+    flags.MAIL_IDLE_TIMEOUT = opts.mail_idle_timeout
     flags.APP_VERSION_CHECK = opts.app_version_check
     flags.API_VERSION_CHECK = opts.api_version_check
     flags.OPENVPN_VERBOSITY = opts.openvpn_verb
@@ -56,20 +56,25 @@ API = (
     "soledad_cancel_bootstrap",
     "soledad_change_password",
     "soledad_close",
+    "soledad_get_sync_status",
     "soledad_load_offline",
+    "soledad_sync",
     "tear_fw_down",
     "bitmask_root_vpn_down",
     "user_cancel_login",
     "user_change_password",
+    "user_get_accounts",
     "user_get_logged_in_status",
     "user_login",
     "user_logout",
     "user_register",
+    "user_switch_account",
 )
 
 
 SIGNALS = (
     "backend_bad_call",
+    "client_cert_renewed",
     "eip_alien_openvpn_already_running",
     "eip_can_start",
     "eip_cancelled_setup",
@@ -125,6 +130,7 @@ SIGNALS = (
     "prov_https_connection",
     "prov_name_resolution",
     "prov_problem_with_provider",
+    "prov_refreshed",
     "prov_unsupported_api",
     "prov_unsupported_client",
     "soledad_bootstrap_failed",
@@ -133,8 +139,13 @@ SIGNALS = (
     "soledad_invalid_auth_token",
     "soledad_offline_failed",
     "soledad_offline_finished",
+    "soledad_offline_timings",
     "soledad_password_change_error",
     "soledad_password_change_ok",
+    "soledad_sync_stats",
+    "soledad_sync_status",
+    "srp_account_switched",
+    "srp_accounts",
     "srp_auth_bad_user_or_password",
     "srp_auth_connection_error",
     "srp_auth_error",
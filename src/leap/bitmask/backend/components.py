@@ -21,19 +21,22 @@ Backend components
 #          all of it into its own threadpool.
 
 import os
-import socket
 import time
 
 from functools import partial
 
-from twisted.internet import threads, defer
+from twisted.internet import threads, defer, reactor
+from twisted.internet.error import DNSLookupError
 from twisted.python import log
 
 import zope.interface
 import zope.proxy
 
 from leap.bitmask.backend.settings import Settings, GATEWAY_AUTOMATIC
+from leap.bitmask.config import flags
 from leap.bitmask.config.providerconfig import ProviderConfig
+from leap.bitmask.crypto.certrenewer import ClientCertRenewer
+from leap.bitmask.crypto.certstore import get_cert_store
 from leap.bitmask.crypto.srpauth import SRPAuth
 from leap.bitmask.crypto.srpregister import SRPRegister
 from leap.bitmask.logs.utils import get_logger
@@ -55,10 +58,10 @@ from leap.bitmask.services.mail.smtpconfig import SMTPConfig
 
 from leap.bitmask.services.soledad.soledadbootstrapper import \
     SoledadBootstrapper
-from leap.bitmask.util import force_eval
+from leap.bitmask.services.warmup import get_session_warmup
+from leap.bitmask.util import force_eval, get_account_id
 from leap.bitmask.util.privilege_policies import LinuxPolicyChecker
-
-from leap.common import certs as leap_certs
+from leap.bitmask.util.resolver import get_resolver
 
 from leap.keymanager import openpgp
 
@@ -151,6 +154,7 @@ class Provider(object):
         """
         self.key = "provider"
         self._signaler = signaler
+        self._bypass_checks = bypass_checks
         self._provider_bootstrapper = ProviderBootstrapper(signaler,
                                                            bypass_checks)
         self._download_provider_defer = None
@@ -168,10 +172,28 @@ class Provider(object):
         """
         log.msg("Setting up provider %s..." % (provider.encode("idna"),))
         pb = self._provider_bootstrapper
+
+        if pb.is_verified(provider, pb.STAGE_SELECT):
+            logger.debug("Provider %s was recently verified, checking it "
+                         "again in the background." % (provider,))
+            pb.notify_verified(pb.STAGE_SELECT)
+            self._revalidate().run_provider_select_checks(
+                provider, download_if_needed=True, notify_success=False)
+            return defer.succeed(None)
+
         d = pb.run_provider_select_checks(provider, download_if_needed=True)
         self._download_provider_defer = d
         return d
 
+    def _revalidate(self):
+        """
+        Return a new bootstrapper to check again, in the background, the
+        data we used from the disk. It only signals the failures.
+
+        :rtype: ProviderBootstrapper
+        """
+        return ProviderBootstrapper(self._signaler, self._bypass_checks)
+
     def cancel_setup_provider(self):
         """
         Cancel the ongoing setup provider defer (if any).
@@ -194,9 +216,17 @@ class Provider(object):
 
         config = ProviderConfig.get_provider_config(provider)
         self._provider_config = config
-        if config is not None:
-            d = self._provider_bootstrapper.run_provider_setup_checks(
-                config, download_if_needed=True)
+        pb = self._provider_bootstrapper
+        if config is not None and pb.is_verified(provider, pb.STAGE_SETUP):
+            logger.debug("Provider %s certificates were recently verified, "
+                         "checking them again in the background." %
+                         (provider,))
+            pb.notify_verified(pb.STAGE_SETUP)
+            self._revalidate().run_provider_setup_checks(
+                config, download_if_needed=True, notify_success=False)
+            d = defer.succeed(None)
+        elif config is not None:
+            d = pb.run_provider_setup_checks(config, download_if_needed=True)
         else:
             if self._signaler is not None:
                 self._signaler.signal(
@@ -373,8 +403,10 @@ class EIP(object):
             if skip_network:
                 return defer.Deferred()
             eb = self._eip_bootstrapper
-            d = eb.run_eip_setup_checks(self._provider_config,
-                                        download_if_needed=True)
+            # don't download again what the post login warm up is getting
+            d = get_session_warmup().wait(domain)
+            d.addCallback(lambda _: eb.run_eip_setup_checks(
+                self._provider_config, download_if_needed=True))
             self._eip_setup_defer = d
             return d
         else:
@@ -670,7 +702,7 @@ class EIP(object):
         client_cert_path = eip_config.\
             get_client_cert_path(provider_config, about_to_download=True)
 
-        if leap_certs.should_redownload(client_cert_path):
+        if get_cert_store().should_redownload(client_cert_path):
             logger.error("The client should redownload the certificate,"
                          " cannot autostart")
             return False
@@ -710,7 +742,9 @@ class EIP(object):
             """
             Try to resolve the domain name.
             """
-            socket.gethostbyname(domain.encode('idna'))
+            d = get_resolver().resolve(domain)
+            d.addCallback(check_ok)
+            d.addErrback(check_err)
 
         def check_ok(_):
             """
@@ -729,14 +763,11 @@ class EIP(object):
             logger.debug("Can't resolve hostname. {0!r}".format(failure))
 
             self._signaler.signal(self._signaler.eip_dns_error)
+            failure.trap(DNSLookupError)
 
-            # python 2.7.4 raises socket.error
-            # python 2.7.5 raises socket.gaierror
-            failure.trap(socket.gaierror, socket.error)
-
-        d = threads.deferToThread(do_check)
-        d.addCallback(check_ok)
-        d.addErrback(check_err)
+        # the resolver is not thread safe, we need to use it from the
+        # reactor thread.
+        reactor.callFromThread(do_check)
 
 
 class Soledad(object):
@@ -764,6 +795,59 @@ class Soledad(object):
         self._soledad_bootstrapper = SoledadBootstrapper(signaler)
         self._soledad_defer = None
 
+        # One bootstrapper, and so one soledad and keymanager, for each
+        # account, by user@provider. The proxies point to the ones of the
+        # current account.
+        self._bootstrappers = {}
+        self._account_id = None
+
+    def _use_account(self, account_id):
+        """
+        Make account_id the current account, creating its bootstrapper if
+        needed.
+
+        :param account_id: the account, as user@provider
+        :type account_id: unicode
+
+        :rtype: SoledadBootstrapper
+        """
+        sb = self._bootstrappers.get(account_id)
+        if sb is None:
+            sb = SoledadBootstrapper(self._signaler)
+            self._bootstrappers[account_id] = sb
+        self._account_id = account_id
+        self._soledad_bootstrapper = sb
+        return sb
+
+    def is_loaded(self, account_id):
+        """
+        Return whether the soledad database of an account is loaded.
+
+        :param account_id: the account, as user@provider
+        :type account_id: unicode
+
+        :rtype: bool
+        """
+        sb = self._bootstrappers.get(account_id)
+        return sb is not None and sb.soledad is not None
+
+    def switch_account(self, account_id):
+        """
+        Point the soledad and keymanager proxies to the ones of another
+        account, if they are already loaded.
+
+        :param account_id: the account, as user@provider
+        :type account_id: unicode
+
+        :returns: whether the account had soledad loaded.
+        :rtype: bool
+        """
+        if not self.is_loaded(account_id):
+            return False
+        self._use_account(account_id)
+        self._set_proxies_cb(None)
+        return True
+
     def bootstrap(self, username, domain, password):
         """
         Bootstrap Soledad with the user credentials.
@@ -781,10 +865,21 @@ class Soledad(object):
         """
         provider_config = ProviderConfig.get_provider_config(domain)
         if provider_config is not None:
-            sb = self._soledad_bootstrapper
-            self._soledad_defer = sb.run_soledad_setup_checks(
-                provider_config, username, password,
-                download_if_needed=True)
+            account_id = get_account_id(username, domain)
+            if self.switch_account(account_id):
+                logger.debug("Soledad already loaded for %s" % (account_id,))
+                if self._signaler is not None:
+                    self._signaler.signal(
+                        self._signaler.soledad_bootstrap_finished)
+                self._soledad_defer = defer.succeed(None)
+                return self._soledad_defer
+
+            sb = self._use_account(account_id)
+            self._soledad_defer = get_session_warmup().wait(domain)
+            self._soledad_defer.addCallback(
+                lambda _: sb.run_soledad_setup_checks(
+                    provider_config, username, password,
+                    download_if_needed=True))
             self._soledad_defer.addCallback(self._set_proxies_cb)
         else:
             if self._signaler is not None:
@@ -818,6 +913,8 @@ class Soledad(object):
             Signaler.soledad_offline_finished
             Signaler.soledad_offline_failed
         """
+        user, domain = username.split('@', 1)
+        self._use_account(get_account_id(user, domain))
         d = self._soledad_bootstrapper.load_offline_soledad(
             username, password, uuid)
         d.addCallback(self._set_proxies_cb)
@@ -833,11 +930,62 @@ class Soledad(object):
 
     def close(self):
         """
-        Close soledad database.
+        Close the soledad databases of all the accounts.
+        """
+        bootstrappers = set(self._bootstrappers.values())
+        bootstrappers.add(self._soledad_bootstrapper)
+        for sb in bootstrappers:
+            sb.stop_sync_scheduler()
+            if sb.soledad is not None:
+                sb.soledad.close()
+        zope.proxy.setProxiedObject(self._soledad_proxy, None)
+
+        # the next bootstrap of each account has to load it again
+        self._bootstrappers.clear()
+        self._account_id = None
+
+    def sync(self):
+        """
+        Sync the soledad database of the current account now, or right
+        after the ongoing background sync.
         """
-        if not zope.proxy.sameProxiedObjects(self._soledad_proxy, None):
-            self._soledad_proxy.close()
-            zope.proxy.setProxiedObject(self._soledad_proxy, None)
+        d = self.request_sync()
+        if d is None:
+            logger.warning("Soledad is not syncing in the background.")
+            return
+        # the errors are already logged by the syncer
+        d.addErrback(lambda failure: None)
+
+    def request_sync(self):
+        """
+        Request a sync of the soledad database of the current account, to
+        the background syncs.
+
+        :returns: a deferred that fires when the sync is done, or None if
+                  soledad is not syncing in the background.
+        :rtype: Deferred or None
+        """
+        scheduler = self._soledad_bootstrapper.sync_scheduler
+        if scheduler is None:
+            return None
+        return scheduler.request_sync()
+
+    def get_sync_status(self):
+        """
+        Signal when the next background sync of the current account is and
+        how the last one went.
+        """
+        scheduler = self._soledad_bootstrapper.sync_scheduler
+        if scheduler is None:
+            status = None
+        else:
+            status = {
+                "next_sync": scheduler.get_next_sync_time(),
+                "last_sync": scheduler.get_last_sync_time(),
+                "last_stats": scheduler.get_last_stats(),
+            }
+        if self._signaler is not None:
+            self._signaler.signal(self._signaler.soledad_sync_status, status)
 
     def _change_password_ok(self, _):
         """
@@ -976,7 +1124,8 @@ class Mail(object):
 
     zope.interface.implements(ILEAPComponent)
 
-    def __init__(self, soledad_proxy, keymanager_proxy, signaler=None):
+    def __init__(self, soledad_proxy, keymanager_proxy, signaler=None,
+                 request_sync=None):
         """
         Constructor for the Mail component.
 
@@ -987,16 +1136,24 @@ class Mail(object):
         :param signaler: Object in charge of handling communication
                          back to the frontend
         :type signaler: Signaler
+        :param request_sync: requests a soledad sync for the incoming mail,
+                             see Soledad.request_sync.
+        :type request_sync: callable or None
         """
         self.key = "mail"
         self._signaler = signaler
         self._soledad_proxy = soledad_proxy
         self._keymanager_proxy = keymanager_proxy
         self._imap_controller = IMAPController(self._soledad_proxy,
-                                               self._keymanager_proxy)
+                                               self._keymanager_proxy,
+                                               request_sync)
         self._smtp_bootstrapper = SMTPBootstrapper()
         self._smtp_config = SMTPConfig()
 
+        # the account the services were started for, if they are running
+        self._smtp_user_id = None
+        self._imap_user_id = None
+
     def start_smtp_service(self, full_user_id, download_if_needed=False):
         """
         Start the SMTP service.
@@ -1010,9 +1167,13 @@ class Mail(object):
         :returns: a defer to interact with.
         :rtype: twisted.internet.defer.Deferred
         """
-        return threads.deferToThread(
+        self._smtp_user_id = full_user_id
+        domain = full_user_id.split('@')[-1]
+        d = get_session_warmup().wait(domain)
+        d.addCallback(lambda _: threads.deferToThread(
             self._smtp_bootstrapper.start_smtp_service,
-            self._keymanager_proxy, full_user_id, download_if_needed)
+            self._keymanager_proxy, full_user_id, download_if_needed))
+        return d
 
     def start_imap_service(self, full_user_id, offline=False):
         """
@@ -1026,9 +1187,25 @@ class Mail(object):
         :returns: a defer to interact with.
         :rtype: twisted.internet.defer.Deferred
         """
-        return threads.deferToThread(
-            self._imap_controller.start_imap_service,
-            full_user_id, offline)
+        self._imap_user_id = full_user_id
+        controller = self._imap_controller
+        d = controller.release_early_listener()
+        if flags.MAIL_ON_DEMAND:
+            d.addCallback(lambda _: controller.start_imap_on_demand(
+                full_user_id, offline, flags.MAIL_IDLE_TIMEOUT))
+        else:
+            d.addCallback(lambda _: threads.deferToThread(
+                controller.start_imap_service, full_user_id, offline))
+        d.addBoth(controller.hand_over_early_connections)
+        return d
+
+    def start_imap_listener(self):
+        """
+        Start accepting IMAP connections before the IMAP service can start,
+        while the soledad database is being opened. They are answered once
+        the service starts.
+        """
+        self._imap_controller.start_early_listener()
 
     def stop_smtp_service(self):
         """
@@ -1037,6 +1214,7 @@ class Mail(object):
         :returns: a defer to interact with.
         :rtype: twisted.internet.defer.Deferred
         """
+        self._smtp_user_id = None
         return threads.deferToThread(self._smtp_bootstrapper.stop_smtp_service)
 
     def _stop_imap_service(self):
@@ -1056,8 +1234,35 @@ class Mail(object):
         :returns: a defer to interact with.
         :rtype: twisted.internet.defer.Deferred
         """
+        self._imap_user_id = None
         return threads.deferToThread(self._stop_imap_service)
 
+    def switch_account(self, full_user_id):
+        """
+        Restart the running mail services for another account. The IMAP
+        and SMTP ports serve a single account at a time.
+
+        :param full_user_id: user id, in the form "user@provider"
+        :type full_user_id: str
+
+        :returns: a defer to interact with.
+        :rtype: twisted.internet.defer.Deferred
+        """
+        restart_smtp = self._smtp_user_id not in (None, full_user_id)
+        restart_imap = self._imap_user_id not in (None, full_user_id)
+
+        d = defer.succeed(None)
+        if restart_smtp:
+            d.addCallback(lambda _: self.stop_smtp_service())
+            d.addCallback(lambda _: self.start_smtp_service(
+                full_user_id, download_if_needed=True))
+        if restart_imap:
+            self._imap_user_id = None
+            d.addCallback(lambda _: threads.deferToThread(
+                self._imap_controller.stop_imap_service))
+            d.addCallback(lambda _: self.start_imap_service(full_user_id))
+        return d
+
 
 class Authenticate(object):
     """
@@ -1078,6 +1283,8 @@ class Authenticate(object):
         self._signaler = signaler
         self._login_defer = None
         self._srp_auth = SRPAuth(ProviderConfig(), self._signaler)
+        self._cert_renewer = ClientCertRenewer(
+            self._signaler, is_authenticated=self._is_logged_in)
 
     def login(self, domain, username, password):
         """
@@ -1095,14 +1302,84 @@ class Authenticate(object):
         """
         config = ProviderConfig.get_provider_config(domain)
         if config is not None:
-            self._srp_auth = SRPAuth(config, self._signaler)
-            self._login_defer = self._srp_auth.authenticate(username, password)
+            # The password is always checked, also for the accounts that are
+            # logged in already: their session is replaced by the new one.
+            # Use switch_account to change accounts without a password.
+            self._login_defer = SRPAuth.authenticate_account(
+                config, username, password, self._signaler)
+            self._login_defer.addCallback(self._set_srp_auth)
+            self._login_defer.addCallback(
+                self._start_cert_renewer, config, username, domain)
+            self._login_defer.addCallback(
+                self._warm_up, config, username, domain)
             return self._login_defer
         else:
             if self._signaler is not None:
                 self._signaler.signal(self._signaler.srp_auth_error)
             logger.error("Could not load provider configuration.")
 
+    def _set_srp_auth(self, srp_auth):
+        """
+        Use the session of the account that just logged in.
+
+        :param srp_auth: the new current session, None if the login failed.
+        :type srp_auth: SRPAuth or None
+        """
+        if srp_auth is not None:
+            self._srp_auth = srp_auth
+        return srp_auth
+
+    def _start_cert_renewer(self, srp_auth, config, username, domain):
+        """
+        Start renewing the client certificates of the logged in user.
+        """
+        if srp_auth is not None:
+            userid = get_account_id(username, domain)
+            self._cert_renewer.start(config, userid)
+        return srp_auth
+
+    def _warm_up(self, srp_auth, config, username, domain):
+        """
+        Start downloading what the services of the logged in user need.
+        It runs in the background, the login doesn't wait for it.
+        """
+        if srp_auth is not None:
+            userid = get_account_id(username, domain)
+            get_session_warmup().run(config, userid)
+        return srp_auth
+
+    def switch_account(self, account_id):
+        """
+        Make another logged in account the current one, without going
+        through the authentication again.
+
+        :param account_id: the account to switch to, as user@provider
+        :type account_id: str
+
+        :returns: whether there was a session for that account.
+        :rtype: bool
+        """
+        srp_auth = SRPAuth.switch_account(account_id)
+        if srp_auth is None:
+            if self._signaler is not None:
+                self._signaler.signal(self._signaler.srp_not_logged_in_error)
+            return False
+
+        self._srp_auth = srp_auth
+        self._cert_renewer.start(srp_auth.get_provider_config(), account_id)
+        if self._signaler is not None:
+            self._signaler.signal(self._signaler.srp_account_switched,
+                                  account_id)
+        return True
+
+    def get_accounts(self):
+        """
+        Signal the accounts that are logged in, the current one first.
+        """
+        if self._signaler is not None:
+            self._signaler.signal(self._signaler.srp_accounts,
+                                  SRPAuth.get_accounts())
+
     def cancel_login(self):
         """
         Cancel the ongoing login defer (if any).
@@ -1140,6 +1417,7 @@ class Authenticate(object):
                 self._signaler.signal(self._signaler.srp_not_logged_in_error)
             return
 
+        self._cert_renewer.stop()
         self._srp_auth.logout()
 
     def _is_logged_in(self):
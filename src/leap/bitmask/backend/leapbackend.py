@@ -24,6 +24,7 @@ from leap.bitmask.backend import components
 from leap.bitmask.backend.backend import Backend
 from leap.bitmask.backend.settings import Settings
 from leap.bitmask.logs.utils import get_logger
+from leap.bitmask.provider.refresher import ProviderRefresher
 
 logger = get_logger()
 
@@ -60,7 +61,13 @@ class LeapBackend(Backend):
                                                  self._signaler)
         self._mail = components.Mail(self._soledad_proxy,
                                      self._keymanager_proxy,
-                                     self._signaler)
+                                     self._signaler,
+                                     self._soledad.request_sync)
+
+        # Keep the configured providers definitions fresh while we are idle
+        self._provider_refresher = ProviderRefresher(
+            self._signaler, is_busy=lambda: bool(self._ongoing_defers))
+        self._provider_refresher.start()
 
     def _check_type(self, obj, expected_type):
         """
@@ -78,6 +85,10 @@ class LeapBackend(Backend):
         """
         Initiate the setup for a provider.
 
+        If the provider was verified within its configured TTL the success
+        signals are emitted right away, and the checks run again in the
+        background. A failure there is signaled as usual.
+
         :param provider: URL for the provider
         :type provider: unicode
 
@@ -100,6 +111,9 @@ class LeapBackend(Backend):
         """
         Second stage of bootstrapping for a provider.
 
+        Like `provider_setup`, it uses the verified data right away while
+        it is fresh.
+
         :param provider: URL for the provider
         :type provider: unicode
 
@@ -340,6 +354,8 @@ class LeapBackend(Backend):
             srp_auth_server_error
             srp_auth_connection_error
             srp_auth_error
+            client_cert_renewed -> 'vpn' or 'smtp', later on, whenever a
+                                   client certificate is renewed.
         """
         self._authenticate.login(provider, username, password)
 
@@ -402,6 +418,39 @@ class LeapBackend(Backend):
         """
         self._authenticate.get_logged_in_status()
 
+    def user_switch_account(self, account_id):
+        """
+        Make another logged in account the current one. The soledad
+        database and the mail services follow the current account.
+
+        Nothing is switched until the soledad database of the account is
+        loaded, the account would be left without its mail.
+
+        :param account_id: the account to switch to, as user@provider
+        :type account_id: str
+
+        Signals:
+            srp_account_switched -> account_id
+            srp_not_logged_in_error
+        """
+        if not self._soledad.is_loaded(account_id):
+            logger.warning("Soledad is not loaded for %s, not switching "
+                           "to it." % (account_id,))
+            return
+        if not self._authenticate.switch_account(account_id):
+            return
+        self._soledad.switch_account(account_id)
+        self._mail.switch_account(account_id)
+
+    def user_get_accounts(self):
+        """
+        Signal the logged in accounts.
+
+        Signals:
+            srp_accounts -> list of user@provider, the current one first
+        """
+        self._authenticate.get_accounts()
+
     def soledad_bootstrap(self, username, domain, password):
         """
         Bootstrap the soledad database.
@@ -417,6 +466,7 @@ class LeapBackend(Backend):
             soledad_bootstrap_finished
             soledad_bootstrap_failed
             soledad_invalid_auth_token
+            soledad_sync_stats -> dict with the stats of each sync attempt
         """
         self._check_type(username, unicode)
         self._check_type(domain, unicode)
@@ -434,8 +484,16 @@ class LeapBackend(Backend):
         :param uuid: the user uuid
         :type uuid: str or unicode
 
+        The IMAP port starts accepting connections right away, they are
+        answered once the IMAP service starts.
+
         Signals:
+            soledad_offline_finished
+            soledad_offline_failed
+            soledad_offline_timings -> dict with the seconds each phase of
+                                       the unlock took.
         """
+        self._mail.start_imap_listener()
         self._soledad.load_offline(username, password, uuid)
 
     def soledad_cancel_bootstrap(self):
@@ -450,6 +508,27 @@ class LeapBackend(Backend):
         """
         self._soledad.close()
 
+    def soledad_sync(self):
+        """
+        Sync the soledad database now, or right after the ongoing sync.
+        The requests that arrive during a sync are done in a single sync.
+
+        Signals:
+            soledad_sync_stats -> dict with the stats of each sync attempt
+        """
+        self._soledad.sync()
+
+    def soledad_get_sync_status(self):
+        """
+        Signal the status of the background soledad syncs.
+
+        Signals:
+            soledad_sync_status -> dict with the next_sync and last_sync
+                                   times and the last_stats, or None if
+                                   soledad is not syncing.
+        """
+        self._soledad.get_sync_status()
+
     def keymanager_list_keys(self):
         """
         Signal a list of public keys locally stored.
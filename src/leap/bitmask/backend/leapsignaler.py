@@ -27,6 +27,7 @@ class LeapSignaler(SignalerQt):
     Signaling server subclass, used to define the API signals.
     """
     backend_bad_call = QtCore.Signal(object)
+    client_cert_renewed = QtCore.Signal(object)
 
     eip_alien_openvpn_already_running = QtCore.Signal()
     eip_can_start = QtCore.Signal()
@@ -86,6 +87,7 @@ class LeapSignaler(SignalerQt):
     prov_https_connection = QtCore.Signal(object)
     prov_name_resolution = QtCore.Signal(object)
     prov_problem_with_provider = QtCore.Signal()
+    prov_refreshed = QtCore.Signal(object)
     prov_unsupported_api = QtCore.Signal()
     prov_unsupported_client = QtCore.Signal()
 
@@ -95,9 +97,14 @@ class LeapSignaler(SignalerQt):
     soledad_invalid_auth_token = QtCore.Signal()
     soledad_offline_failed = QtCore.Signal()
     soledad_offline_finished = QtCore.Signal()
+    soledad_offline_timings = QtCore.Signal(object)
     soledad_password_change_error = QtCore.Signal()
     soledad_password_change_ok = QtCore.Signal()
+    soledad_sync_stats = QtCore.Signal(object)
+    soledad_sync_status = QtCore.Signal(object)
 
+    srp_account_switched = QtCore.Signal(object)
+    srp_accounts = QtCore.Signal(object)
     srp_auth_bad_user_or_password = QtCore.Signal()
     srp_auth_connection_error = QtCore.Signal()
     srp_auth_error = QtCore.Signal()
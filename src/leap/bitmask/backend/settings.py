@@ -39,6 +39,13 @@ class Settings(object):
 
     # keys
     GATEWAY_KEY = "Gateway"
+    RESUME_SESSION_KEY = "ResumeSession"
+    VERIFIED_TTL_KEY = "VerifiedTTL"
+    VERIFIED_KEY = "Verified_%s"
+
+    # Seconds we trust the provider data we verified, unless configured
+    # otherwise for the provider.
+    DEFAULT_VERIFIED_TTL = 60 * 60
 
     def __init__(self):
         """
@@ -155,3 +162,110 @@ class Settings(object):
             self._settings.set(provider, full_user_id, value)
 
         self._save()
+
+    def get_provider_verified_ttl(self, provider):
+        """
+        Return for how many seconds we can use the provider data without
+        checking it again. 0 means that it is always checked.
+
+        :param provider: provider domain
+        :type provider: str
+
+        :rtype: int
+        """
+        leap_assert(len(provider) > 0, "We need a nonempty provider")
+        value = self._get_value(provider, self.VERIFIED_TTL_KEY,
+                                self.DEFAULT_VERIFIED_TTL)
+        try:
+            return max(int(value), 0)
+        except ValueError:
+            logger.warning("Invalid %s for %s: %r" %
+                           (self.VERIFIED_TTL_KEY, provider, value))
+            return self.DEFAULT_VERIFIED_TTL
+
+    def set_provider_verified_ttl(self, provider, ttl):
+        """
+        Set for how many seconds we can use the provider data without
+        checking it again.
+
+        :param provider: provider domain
+        :type provider: str
+        :param ttl: the seconds, 0 to always check.
+        :type ttl: int
+        """
+        leap_assert(len(provider) > 0, "We need a nonempty provider")
+        leap_assert_type(ttl, int)
+
+        self._add_section(provider)
+        self._settings.set(provider, self.VERIFIED_TTL_KEY, str(ttl))
+        self._save()
+
+    def get_provider_verified(self, provider, stage):
+        """
+        Return when the given stage of the provider checks passed for the
+        last time.
+
+        :param provider: provider domain
+        :type provider: str
+        :param stage: the name of the group of checks
+        :type stage: str
+
+        :returns: a timestamp, or None if unknown.
+        :rtype: float or None
+        """
+        leap_assert(len(provider) > 0, "We need a nonempty provider")
+        value = self._get_value(provider, self.VERIFIED_KEY % (stage,), None)
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+
+    def set_provider_verified(self, provider, stage, timestamp):
+        """
+        Save when the given stage of the provider checks passed.
+
+        :param provider: provider domain
+        :type provider: str
+        :param stage: the name of the group of checks
+        :type stage: str
+        :param timestamp: the time of the checks, or None to remove it.
+        :type timestamp: float or None
+        """
+        leap_assert(len(provider) > 0, "We need a nonempty provider")
+        key = self.VERIFIED_KEY % (stage,)
+
+        if timestamp is None:
+            try:
+                self._settings.remove_option(provider, key)
+            except ConfigParser.NoSectionError:
+                return
+        else:
+            self._add_section(provider)
+            self._settings.set(provider, key, repr(timestamp))
+
+        self._save()
+
+    def get_resume_session(self):
+        """
+        Return whether the session tokens are kept in the keyring to skip
+        the authentication on the next login.
+
+        :rtype: bool
+        """
+        value = self._get_value(GENERAL_SECTION, self.RESUME_SESSION_KEY,
+                                "False")
+        return value == "True"
+
+    def set_resume_session(self, enabled):
+        """
+        Set whether the session tokens are kept in the keyring to skip the
+        authentication on the next login.
+
+        :param enabled: whether to keep the tokens.
+        :type enabled: bool
+        """
+        leap_assert_type(enabled, bool)
+        self._add_section(GENERAL_SECTION)
+        self._settings.set(GENERAL_SECTION, self.RESUME_SESSION_KEY,
+                           str(enabled))
+        self._save()
@@ -33,6 +33,12 @@ STANDALONE = False
 
 MAIL_LOGFILE = None
 
+# Start the IMAP and SMTP services when a mail client connects, instead of
+# as soon as soledad is ready, and stop them after MAIL_IDLE_TIMEOUT
+# seconds without clients.
+MAIL_ON_DEMAND = False
+MAIL_IDLE_TIMEOUT = 600
+
 # The APP/API version check flags are used to provide a way to skip
 # that checks.
 # This can be used for:
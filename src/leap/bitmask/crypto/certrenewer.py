@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+# certrenewer.py
+# Copyright (C) 2015 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Background renewal of the client certificates before they expire.
+"""
+import calendar
+
+import requests
+
+from twisted.internet import defer, reactor, threads
+
+from leap.bitmask.crypto.certs import download_client_cert
+from leap.bitmask.crypto.certstore import get_cert_store
+from leap.bitmask.logs.utils import get_logger
+from leap.bitmask.services import EIP_SERVICE, MX_SERVICE
+from leap.bitmask.services.eip.eipconfig import EIPConfig
+from leap.bitmask.services.mail.smtpconfig import SMTPConfig
+
+logger = get_logger()
+
+
+class ClientCertRenewer(object):
+    """
+    Renews the VPN and SMTP client certificates of the logged in user some
+    time before they expire, so starting EIP or SMTP never has to wait for
+    a certificate download.
+
+    The new certificate replaces the old one atomically, a service starting
+    at the same time reads one of them, never a partial file.
+
+    Signals:
+        client_cert_renewed -> the kind of certificate: 'vpn' or 'smtp'
+    """
+
+    # Seconds before the expiration when we renew a certificate.
+    RENEW_BEFORE = 7 * 24 * 60 * 60
+    # Max seconds between checks.
+    CHECK_INTERVAL = 12 * 60 * 60
+    # Seconds to wait before retrying a failed renewal.
+    RETRY_DELAY = 30 * 60
+
+    def __init__(self, signaler=None, is_authenticated=None, clock=None):
+        """
+        Constructor for the certificate renewer.
+
+        :param signaler: Object in charge of handling communication
+                         back to the frontend
+        :type signaler: Signaler
+        :param is_authenticated: callable that returns True while we have
+                                 a valid session to download with.
+        :type is_authenticated: callable
+        :param clock: provider of callLater, used for testing.
+        :type clock: twisted.internet.interfaces.IReactorTime
+        """
+        if clock is None:
+            clock = reactor
+        if is_authenticated is None:
+            is_authenticated = lambda: False
+
+        self._signaler = signaler
+        self._is_authenticated = is_authenticated
+        self._clock = clock
+        self._provider_config = None
+        self._userid = None
+        self._delayed_call = None
+        self._running = None
+
+    def start(self, provider_config, userid):
+        """
+        Start watching the certificates of a user.
+
+        :param provider_config: the provider the user is logged in.
+        :type provider_config: ProviderConfig
+        :param userid: the user id, in user@provider form
+        :type userid: str
+        """
+        self.stop()
+        self._provider_config = provider_config
+        self._userid = userid
+        self._schedule(0)
+
+    def stop(self):
+        """
+        Stop watching the certificates. A renewal in progress finishes on
+        its own.
+        """
+        if self._delayed_call is not None and self._delayed_call.active():
+            self._delayed_call.cancel()
+        self._delayed_call = None
+        self._provider_config = None
+
+    def _schedule(self, delay):
+        if self._delayed_call is not None and self._delayed_call.active():
+            self._delayed_call.cancel()
+        self._delayed_call = self._clock.callLater(delay, self._tick)
+
+    def _get_certs(self):
+        """
+        Return the client certificates of the user that we should look
+        after.
+
+        :returns: a list of (kind, path)
+        :rtype: list of tuple(str, str)
+        """
+        services = self._provider_config.get_services()
+        certs = []
+        if EIP_SERVICE in services:
+            path = EIPConfig().get_client_cert_path(
+                self._provider_config, about_to_download=True)
+            certs.append(("vpn", path))
+        if MX_SERVICE in services:
+            path = SMTPConfig().get_client_cert_path(
+                self._userid, self._provider_config, about_to_download=True)
+            certs.append(("smtp", path))
+        return certs
+
+    def _time_left(self, path):
+        """
+        Return the seconds left until the certificate at path expires.
+
+        :param path: path to the certificate
+        :type path: str
+        :returns: the seconds left, or None if there is no certificate
+                  to renew.
+        :rtype: float or None
+        """
+        not_after = get_cert_store().get_not_after(path)
+        if not_after is None:
+            return None
+        return calendar.timegm(not_after) - self._clock.seconds()
+
+    def _tick(self):
+        self._delayed_call = None
+        if self._provider_config is None or self._running is not None:
+            return
+
+        if not self._is_authenticated():
+            logger.debug("Not logged in, not renewing the certificates.")
+            self._schedule(self.CHECK_INTERVAL)
+            return
+
+        next_check = self.CHECK_INTERVAL
+        to_renew = []
+        for kind, path in self._get_certs():
+            left = self._time_left(path)
+            if left is None:
+                # it was never downloaded, the bootstrap takes care of it
+                continue
+            if left <= self.RENEW_BEFORE:
+                to_renew.append((kind, path))
+            else:
+                next_check = min(next_check, left - self.RENEW_BEFORE)
+
+        if not to_renew:
+            self._schedule(next_check)
+            return
+
+        d = defer.DeferredList([self._renew(kind, path)
+                                for kind, path in to_renew])
+        self._running = d
+        d.addCallback(self._renew_done, next_check)
+
+    def _renew(self, kind, path):
+        """
+        Download a new certificate in a thread.
+
+        :param kind: the kind of certificate: 'vpn' or 'smtp'
+        :type kind: str
+        :param path: path to the certificate
+        :type path: str
+        :rtype: twisted.internet.defer.Deferred
+        """
+        logger.debug("Renewing the %s client certificate" % (kind,))
+        d = threads.deferToThread(download_client_cert,
+                                  self._provider_config, path,
+                                  requests.session(), kind=kind)
+        d.addCallback(lambda _: self._renewed(kind))
+        d.addErrback(self._renew_failed, kind)
+        return d
+
+    def _renewed(self, kind):
+        logger.debug("The %s client certificate was renewed" % (kind,))
+        if self._signaler is not None:
+            self._signaler.signal(self._signaler.client_cert_renewed, kind)
+        return True
+
+    def _renew_failed(self, failure, kind):
+        logger.warning("Could not renew the %s client certificate: %r" %
+                       (kind, failure.value))
+        return False
+
+    def _renew_done(self, results, next_check):
+        self._running = None
+        if self._provider_config is None:
+            # stopped while we were renewing
+            return
+
+        if all(result for _, result in results):
+            self._schedule(next_check)
+        else:
+            self._schedule(min(next_check, self.RETRY_DELAY))
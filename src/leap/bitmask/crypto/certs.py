@@ -18,10 +18,14 @@
 Utilities for dealing with client certs
 """
 import os
+import stat
+import tempfile
 
+from leap.bitmask.crypto.certstore import get_cert_store
 from leap.bitmask.crypto.srpauth import SRPAuth
 from leap.bitmask.logs.utils import get_logger
-from leap.bitmask.util.constants import REQUEST_TIMEOUT
+from leap.bitmask.platform_init import IS_WIN
+from leap.bitmask.util import retry
 from leap.common.files import check_and_fix_urw_only
 from leap.common.files import mkdir_p
 
@@ -75,11 +79,11 @@ def download_client_cert(provider_config, path, session, kind="vpn"):
     if token is not None:
         headers["Authorization"] = 'Token token={0}'.format(token)
 
-    call = getattr(session, method)
-    res = call(cert_uri, verify=provider_config.get_ca_cert_path(),
-               cookies=cookies, params=params,
-               timeout=REQUEST_TIMEOUT,
-               headers=headers, data=params)
+    # the smtp cert is a POST but asking twice just gives us another cert
+    res = retry.request(session, method, cert_uri, idempotent=True,
+                        verify=provider_config.get_ca_cert_path(),
+                        cookies=cookies, params=params,
+                        headers=headers, data=params)
     res.raise_for_status()
     client_cert = res.content
 
@@ -90,11 +94,37 @@ def download_client_cert(provider_config, path, session, kind="vpn"):
     mkdir_p(os.path.dirname(path))
 
     try:
-        with open(path, "w") as f:
-            f.write(client_cert)
-    except IOError as exc:
+        _write_atomically(path, client_cert)
+    except (IOError, OSError) as exc:
         logger.error(
             "Error saving client cert: %r" % (exc,))
         raise
 
+    get_cert_store().invalidate(path)
     check_and_fix_urw_only(path)
+
+
+def _write_atomically(path, data):
+    """
+    Write data to path, so that anyone reading the file finds either the
+    old or the new contents, never a partial write.
+
+    :param path: the path of the file
+    :type path: str
+    :param data: the new contents
+    :type data: str
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                    prefix=".tmp-", suffix=".pem")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(data)
+        os.chmod(tmp_path, stat.S_IRUSR | stat.S_IWUSR)
+        if IS_WIN and os.path.isfile(path):
+            # rename does not replace existing files on windows
+            os.remove(path)
+        os.rename(tmp_path, path)
+    except:
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+        raise
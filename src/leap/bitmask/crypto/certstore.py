@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+# certstore.py
+# Copyright (C) 2015 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+In memory index of the certificates we keep on disk.
+
+The CA and client certificates of each provider are checked several times
+during a session (provider setup, EIP and SMTP bootstrap, EIP autostart).
+The CertStore parses each file once and keeps its fingerprints and time
+boundaries around until the file changes on disk.
+"""
+import os
+import threading
+import time
+
+from OpenSSL import crypto
+from dateutil.parser import parse as dateparse
+
+from leap.bitmask.logs.utils import get_logger
+
+logger = get_logger()
+
+
+class CertInfo(object):
+    """
+    What we know about a certificate file.
+    """
+
+    def __init__(self, x509, has_key):
+        """
+        Constructor for the certificate info.
+
+        :param x509: the parsed certificate, or None if it can't be parsed.
+        :type x509: OpenSSL.crypto.X509 or None
+        :param has_key: whether the file also holds a valid private key.
+        :type has_key: bool
+        """
+        self._x509 = x509
+        self._digests = {}
+
+        self.has_key = has_key
+        self.not_before = None
+        self.not_after = None
+
+        if x509 is not None:
+            self.not_before = dateparse(x509.get_notBefore()).timetuple()
+            self.not_after = dateparse(x509.get_notAfter()).timetuple()
+
+    def is_valid_cert(self):
+        """
+        Return True if the file holds a certificate.
+
+        :rtype: bool
+        """
+        return self._x509 is not None
+
+    def is_valid_pem(self):
+        """
+        Return True if the file holds both a certificate and a private key,
+        like the client certificates do.
+
+        :rtype: bool
+        """
+        return self.is_valid_cert() and self.has_key
+
+    def get_digest(self, method):
+        """
+        Return the fingerprint of the certificate, in the same format as
+        leap.common.certs.get_digest.
+
+        :param method: the digest method, i.e. 'SHA256'
+        :type method: str
+        :rtype: str or None
+        """
+        if self._x509 is None:
+            return None
+        method = method.upper()
+        digest = self._digests.get(method)
+        if digest is None:
+            digest = self._x509.digest(method).replace(":", "").lower()
+            self._digests[method] = digest
+        return digest
+
+
+class CertStore(object):
+    """
+    Index of certificate files, keyed by path.
+
+    Each entry is invalidated as soon as the modification time, size or
+    inode of its file changes, so a cert written by any means is parsed
+    again the next time it is looked at.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # path -> (stat key, CertInfo)
+        self._index = {}
+
+    def _stat_key(self, st):
+        return (st.st_mtime, st.st_size, st.st_ino)
+
+    def _parse(self, path):
+        """
+        Read and parse a certificate file.
+
+        :param path: path to the certificate
+        :type path: str
+        :rtype: CertInfo
+        """
+        try:
+            with open(path, "r") as f:
+                data = f.read()
+        except IOError as e:
+            logger.warning("Could not read certificate %s: %r" % (path, e))
+            return CertInfo(None, False)
+
+        x509 = None
+        has_key = False
+        try:
+            x509 = crypto.load_certificate(crypto.FILETYPE_PEM, data)
+        except crypto.Error as e:
+            logger.warning("Could not load certificate %s: %r" % (path, e))
+        try:
+            crypto.load_privatekey(crypto.FILETYPE_PEM, data)
+            has_key = True
+        except crypto.Error:
+            pass
+
+        return CertInfo(x509, has_key)
+
+    def get_info(self, path):
+        """
+        Return the info of a certificate file, parsing it only if it
+        changed since the last time.
+
+        :param path: path to the certificate
+        :type path: str
+        :returns: the certificate info, or None if the file does not exist.
+        :rtype: CertInfo or None
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            self.invalidate(path)
+            return None
+
+        key = self._stat_key(st)
+        with self._lock:
+            entry = self._index.get(path)
+            if entry is not None and entry[0] == key:
+                return entry[1]
+
+        info = self._parse(path)
+        with self._lock:
+            self._index[path] = (key, info)
+        return info
+
+    def invalidate(self, path):
+        """
+        Forget what we know about a file. Whoever writes a certificate
+        should call this, in case the write does not change the stat info.
+
+        :param path: path to the certificate
+        :type path: str
+        """
+        with self._lock:
+            self._index.pop(path, None)
+
+    def clear(self):
+        """
+        Forget every indexed certificate.
+        """
+        with self._lock:
+            self._index.clear()
+
+    def should_redownload(self, path, now=time.gmtime):
+        """
+        Return True if the client certificate at path is missing, broken
+        or out of its validity period. It is a cached version of
+        leap.common.certs.should_redownload.
+
+        :param path: path to the certificate
+        :type path: str
+        :param now: current date function, ONLY USED FOR TESTING
+
+        :rtype: bool
+        """
+        info = self.get_info(path)
+        if info is None or not info.is_valid_pem():
+            return True
+        return not (info.not_before < now() < info.not_after)
+
+    def get_digest(self, path, method):
+        """
+        Return the fingerprint of the certificate at path.
+
+        :param path: path to the certificate
+        :type path: str
+        :param method: the digest method, i.e. 'SHA256'
+        :type method: str
+        :returns: the fingerprint, or None if the file is missing or it
+                  does not hold a certificate.
+        :rtype: str or None
+        """
+        info = self.get_info(path)
+        if info is None:
+            return None
+        return info.get_digest(method)
+
+    def get_not_after(self, path):
+        """
+        Return the expiration time of the certificate at path.
+
+        :param path: path to the certificate
+        :type path: str
+        :returns: the UTC expiration time, or None if unknown.
+        :rtype: time.struct_time or None
+        """
+        info = self.get_info(path)
+        if info is None:
+            return None
+        return info.not_after
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_cert_store():
+    """
+    Return the certificate store shared by the whole application.
+
+    :rtype: CertStore
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = CertStore()
+    return _store
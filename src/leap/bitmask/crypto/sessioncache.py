@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+# sessioncache.py
+# Copyright (C) 2015 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Keyring backed cache of the authenticated sessions.
+"""
+import binascii
+import hashlib
+import hmac
+import json
+import os
+
+from leap.bitmask.logs.utils import get_logger
+from leap.bitmask.util.keyring_helpers import get_keyring
+
+logger = get_logger()
+
+
+class SessionCache(object):
+    """
+    Keeps the uuid, token and session id of the last session of each user
+    in the keyring, so the next login can resume it instead of going
+    through the whole SRP exchange.
+
+    It is opt-in, see Settings.set_resume_session. Without a usable
+    keyring nothing is stored, the tokens never touch the disk in plain
+    text.
+
+    A salted hash of the password is stored along with the session, a
+    session is only resumed with the password that created it.
+    """
+
+    KEYRING_SERVICE = "bitmask-session"
+
+    UUID_KEY = "uuid"
+    TOKEN_KEY = "token"
+    SESSION_ID_KEY = "session_id"
+    PASSWORD_SALT_KEY = "password_salt"
+    PASSWORD_HASH_KEY = "password_hash"
+
+    PASSWORD_HASH_ITERATIONS = 100000
+
+    def __init__(self, settings):
+        """
+        Constructor for the session cache.
+
+        :param settings: the backend settings, to check if it's enabled.
+        :type settings: Settings
+        """
+        self._settings = settings
+
+    def _get_keyring(self):
+        """
+        Return the keyring to use, or None if we shouldn't store anything.
+
+        :rtype: keyringBackend or None
+        """
+        if not self._settings.get_resume_session():
+            return None
+        return get_keyring() or None
+
+    def load(self, full_user_id):
+        """
+        Return the cached session of a user.
+
+        :param full_user_id: the user id, in user@provider form
+        :type full_user_id: str
+
+        :returns: a dict with the uuid, token, session_id and password
+                  hash, or None if there is no cached session.
+        :rtype: dict or None
+        """
+        keyring = self._get_keyring()
+        if keyring is None:
+            return None
+
+        try:
+            data = keyring.get_password(self.KEYRING_SERVICE,
+                                        full_user_id.encode("utf8"))
+        except Exception as e:
+            logger.warning("Could not read the session from the keyring: "
+                           "%r" % (e,))
+            return None
+
+        if data is None:
+            return None
+
+        try:
+            session = json.loads(data)
+            keys = (self.UUID_KEY, self.TOKEN_KEY, self.SESSION_ID_KEY,
+                    self.PASSWORD_SALT_KEY, self.PASSWORD_HASH_KEY)
+            if all(session.get(key) for key in keys):
+                return session
+        except (ValueError, AttributeError):
+            pass
+
+        logger.warning("Ignoring a malformed cached session.")
+        self.delete(full_user_id)
+        return None
+
+    def _hash_password(self, password, salt):
+        """
+        Return the hash of a password, hex encoded.
+
+        :param password: the password
+        :type password: unicode
+        :param salt: the salt, hex encoded
+        :type salt: str
+
+        :rtype: str
+        """
+        digest = hashlib.pbkdf2_hmac(
+            "sha256", password.encode("utf8"), binascii.unhexlify(salt),
+            self.PASSWORD_HASH_ITERATIONS)
+        return binascii.hexlify(digest)
+
+    def check_password(self, session, password):
+        """
+        Return whether a cached session was created with the given password.
+
+        :param session: the session, as returned by load
+        :type session: dict
+        :param password: the password the user typed
+        :type password: unicode
+
+        :rtype: bool
+        """
+        try:
+            expected = self._hash_password(
+                password, str(session[self.PASSWORD_SALT_KEY]))
+        except (TypeError, ValueError):
+            return False
+        return hmac.compare_digest(
+            expected, str(session[self.PASSWORD_HASH_KEY]))
+
+    def save(self, full_user_id, uuid, token, session_id, password):
+        """
+        Cache the session of a user.
+
+        :param full_user_id: the user id, in user@provider form
+        :type full_user_id: str
+        :param uuid: the uuid of the user
+        :type uuid: str
+        :param token: the authentication token
+        :type token: str
+        :param session_id: the session id cookie
+        :type session_id: str
+        :param password: the password used to authenticate, only a salted
+                         hash of it is stored
+        :type password: unicode
+        """
+        keyring = self._get_keyring()
+        if keyring is None:
+            return
+
+        salt = binascii.hexlify(os.urandom(16))
+        data = json.dumps({
+            self.UUID_KEY: uuid,
+            self.TOKEN_KEY: token,
+            self.SESSION_ID_KEY: session_id,
+            self.PASSWORD_SALT_KEY: salt,
+            self.PASSWORD_HASH_KEY: self._hash_password(password, salt),
+        })
+        try:
+            keyring.set_password(self.KEYRING_SERVICE,
+                                 full_user_id.encode("utf8"), data)
+        except Exception as e:
+            logger.warning("Could not save the session in the keyring: "
+                           "%r" % (e,))
+
+    def delete(self, full_user_id):
+        """
+        Forget the cached session of a user.
+
+        :param full_user_id: the user id, in user@provider form
+        :type full_user_id: str
+        """
+        keyring = self._get_keyring()
+        if keyring is None:
+            return
+
+        try:
+            keyring.delete_password(self.KEYRING_SERVICE,
+                                    full_user_id.encode("utf8"))
+        except Exception:
+            # there was nothing to delete, or we can't do it anyway
+            pass
@@ -19,22 +19,22 @@ import threading
 import sys
 
 import requests
-import srp
 import json
 
 # this error is raised from requests
 from simplejson.decoder import JSONDecodeError
 from functools import partial
-from requests.adapters import HTTPAdapter
 
 from twisted.internet import threads
 from twisted.internet.defer import CancelledError
 
 from leap.bitmask.backend.settings import Settings
+from leap.bitmask.crypto.sessioncache import SessionCache
+from leap.bitmask.crypto.srpengine import get_srp_engine
 from leap.bitmask.logs.utils import get_logger
+from leap.bitmask.util import get_account_id
 from leap.bitmask.util import request_helpers as reqhelper
-from leap.bitmask.util.compat import requests_has_max_retries
-from leap.bitmask.util.constants import REQUEST_TIMEOUT
+from leap.bitmask.util import retry
 from leap.common.check import leap_assert
 from leap.common.events import emit, catalog
 
@@ -141,12 +141,13 @@ class SRPAuthImpl(object):
 
         self._provider_config = provider_config
         self._settings = Settings()
+        self._session_cache = SessionCache(self._settings)
 
         # **************************************************** #
         # Dependency injection helpers, override this for more
         # granular testing
         self._fetcher = requests
-        self._srp = srp
+        self._srp = get_srp_engine()
         self._hashfun = self._srp.SHA256
         self._ng = self._srp.NG_1024
         # **************************************************** #
@@ -162,6 +163,7 @@ class SRPAuthImpl(object):
 
         self._srp_user = None
         self._srp_a = None
+        self._resumed = False
 
         # User credentials stored for password changing checks
         self._username = None
@@ -169,19 +171,10 @@ class SRPAuthImpl(object):
 
     def _reset_session(self):
         """
-        Resets the current session and sets max retries to 30.
+        Resets the current session. The requests are retried by the
+        retry policy, see leap.bitmask.util.retry.
         """
         self._session = self._fetcher.session()
-        # We need to bump the default retries, otherwise logout
-        # fails most of the times
-        # NOTE: This is a workaround for the moment, the server
-        # side seems to return correctly every time, but it fails
-        # on the client end.
-        if requests_has_max_retries:
-            adapter = HTTPAdapter(max_retries=30)
-        else:
-            adapter = HTTPAdapter()
-        self._session.mount('https://', adapter)
 
     def _safe_unhexlify(self, val):
         """
@@ -249,10 +242,12 @@ class SRPAuthImpl(object):
             ca_cert_path = self._provider_config.get_ca_cert_path()
             ca_cert_path = ca_cert_path.encode(sys.getfilesystemencoding())
 
-            init_session = self._session.post(sessions_url,
-                                              data=auth_data,
-                                              verify=ca_cert_path,
-                                              timeout=REQUEST_TIMEOUT)
+            # starting a new srp session can be safely repeated
+            init_session = retry.request(self._session, "POST",
+                                         sessions_url,
+                                         idempotent=True,
+                                         data=auth_data,
+                                         verify=ca_cert_path)
             # Clean up A value, we don't need it anymore
             self._srp_a = None
         except requests.exceptions.ConnectionError as e:
@@ -329,11 +324,10 @@ class SRPAuthImpl(object):
         }
 
         try:
-            auth_result = self._session.put(auth_url,
-                                            data=auth_data,
-                                            verify=self._provider_config.
-                                            get_ca_cert_path(),
-                                            timeout=REQUEST_TIMEOUT)
+            auth_result = retry.request(self._session, "PUT", auth_url,
+                                        data=auth_data,
+                                        verify=self._provider_config.
+                                        get_ca_cert_path())
         except requests.exceptions.ConnectionError as e:
             logger.error("No connection made (HAMK): %r" % (e,))
             raise SRPAuthConnectionError()
@@ -436,6 +430,110 @@ class SRPAuthImpl(object):
         logger.debug("SUCCESS LOGIN")
         return True
 
+    def _get_full_user_id(self):
+        return get_account_id(self._username,
+                              self._provider_config.get_domain())
+
+    def _resume_session(self, password):
+        """
+        Try to reuse the session cached by a previous login, checking that
+        the server still accepts its token with a single request.
+
+        The session is only reused with the password that created it.
+        Otherwise the whole SRP authentication decides, the password may
+        have been changed from another device.
+
+        :param password: password for this user
+        :type password: unicode
+
+        :returns: whether the session was resumed.
+        :rtype: bool
+        """
+        cached = self._session_cache.load(self._get_full_user_id())
+        if cached is None:
+            return False
+
+        if not self._session_cache.check_password(cached, password):
+            logger.debug("The password doesn't match the cached session.")
+            return False
+
+        logger.debug("Trying to resume the previous session...")
+        uuid = cached[SessionCache.UUID_KEY]
+        token = cached[SessionCache.TOKEN_KEY]
+        session_id = cached[SessionCache.SESSION_ID_KEY]
+
+        url = "%s/%s/users/%s.json" % (
+            self._provider_config.get_api_uri(),
+            self._provider_config.get_api_version(),
+            uuid)
+        cookies = {self.SESSION_ID_KEY: session_id}
+        headers = {
+            self.AUTHORIZATION_KEY: "Token token={0}".format(token)
+        }
+        try:
+            res = retry.request(
+                self._session, "GET", url, cookies=cookies, headers=headers,
+                verify=self._provider_config.get_ca_cert_path())
+        except requests.exceptions.RequestException as e:
+            logger.debug("Could not check the cached session: %r" % (e,))
+            return False
+
+        if res.status_code != 200:
+            logger.debug("The cached session was rejected (%s)." %
+                         (res.status_code,))
+            self._session_cache.delete(self._get_full_user_id())
+            return False
+
+        self.set_uuid(uuid)
+        self.set_token(token)
+        self.set_session_id(session_id)
+        self._session.cookies.set(self.SESSION_ID_KEY, session_id)
+        self._resumed = True
+
+        # make the rpc calls async
+        emit(catalog.CLIENT_UID, uuid)
+        emit(catalog.CLIENT_SESSION_ID, session_id)
+
+        logger.debug("SUCCESS LOGIN (resumed session)")
+        return True
+
+    def _save_session(self, result):
+        """
+        Cache the new session, so the next login can resume it.
+        """
+        self._session_cache.save(self._get_full_user_id(), self.get_uuid(),
+                                 self.get_token(), self.get_session_id(),
+                                 self._password)
+        return result
+
+    def _authenticate_if_not_resumed(self, resumed, username, password):
+        """
+        Go through the whole SRP authentication unless the previous session
+        was resumed.
+
+        :param resumed: whether the previous session was resumed.
+        :type resumed: bool
+        :param username: username for this session
+        :type username: unicode
+        :param password: password for this user
+        :type password: unicode
+
+        :rtype: bool or twisted.internet.defer.Deferred
+        """
+        if resumed:
+            return True
+
+        d = threads.deferToThread(self._authentication_preprocessing,
+                                  username=username,
+                                  password=password)
+        d.addCallback(partial(self._start_authentication, username=username))
+
+        d.addCallback(partial(self._process_challenge, username=username))
+        d.addCallback(self._extract_data)
+        d.addCallback(self._verify_session)
+        d.addCallback(self._save_session)
+        return d
+
     def _threader(self, cb, res, *args, **kwargs):
         return threads.deferToThread(cb, res, *args, **kwargs)
 
@@ -478,11 +576,10 @@ class SRPAuthImpl(object):
             self.USER_SALT_KEY: binascii.hexlify(salt)
         }
 
-        change_password = self._session.put(
-            url, data=user_data,
+        change_password = retry.request(
+            self._session, "PUT", url, data=user_data,
             verify=self._provider_config.get_ca_cert_path(),
             cookies=cookies,
-            timeout=REQUEST_TIMEOUT,
             headers=headers)
 
         # In case of non 2xx it raises HTTPError
@@ -526,15 +623,10 @@ class SRPAuthImpl(object):
         self._password = password
 
         self._reset_session()
+        self._resumed = False
 
-        d = threads.deferToThread(self._authentication_preprocessing,
-                                  username=username,
-                                  password=password)
-        d.addCallback(partial(self._start_authentication, username=username))
-
-        d.addCallback(partial(self._process_challenge, username=username))
-        d.addCallback(self._extract_data)
-        d.addCallback(self._verify_session)
+        d = threads.deferToThread(self._resume_session, password)
+        d.addCallback(self._authenticate_if_not_resumed, username, password)
         return d
 
     def logout(self):
@@ -558,18 +650,20 @@ class SRPAuthImpl(object):
             "Token token={0}".format(self.get_token())
         }
         try:
-            res = self._session.delete(
+            res = retry.request(
+                self._session, "DELETE",
                 logout_url,
                 cookies=cookies,
                 headers=headers,
                 verify=self._provider_config.
-                get_ca_cert_path(),
-                timeout=REQUEST_TIMEOUT)
+                get_ca_cert_path())
         except Exception as e:
             logger.warning("Something went wrong with the logout: %r" %
                            (e,))
             raise
         else:
+            self._session_cache.delete(self._get_full_user_id())
+            self._resumed = False
             self.set_session_id(None)
             self.set_uuid(None)
             self.set_token(None)
@@ -590,10 +684,8 @@ class SRPAuthImpl(object):
 
     def set_uuid(self, uuid):
         with self._uuid_lock:
-            full_uid = "%s@%s" % (
-                self._username, self._provider_config.get_domain())
             if uuid is not None:  # avoid removing the uuid from settings
-                self._settings.set_uuid(full_uid, uuid)
+                self._settings.set_uuid(self._get_full_user_id(), uuid)
             self._uuid = uuid
 
     def get_uuid(self):
@@ -614,6 +706,9 @@ class SRPAuthImpl(object):
 
         :rtype: bool
         """
+        if self._resumed:
+            return self.get_session_id() is not None
+
         user = self._srp_user
         if user is not None:
             return user.authenticated()
@@ -726,6 +821,9 @@ class SRPAuth(object):
 
     __instance = None
 
+    # The authenticated sessions of the other accounts, by user@provider.
+    __accounts = {}
+
     def __init__(self, provider_config, signaler=None):
         """
         Create a singleton instance if needed
@@ -751,6 +849,98 @@ class SRPAuth(object):
         if provider_config is not None:
             SRPAuth.__instance._provider_config = provider_config
 
+    @classmethod
+    def authenticate_account(cls, provider_config, username, password,
+                             signaler=None):
+        """
+        Authenticate an account in a new session, which becomes the current
+        one if the authentication succeeds.
+
+        The previous current session is kept aside so we can switch back to
+        it, unless it is of the same account. A session of the same account
+        is replaced by the new one: logging in again into an account
+        authenticates it again, it doesn't add another session for it.
+        If the authentication fails, the sessions are left as they were.
+
+        :param provider_config: ProviderConfig needed to authenticate.
+        :type provider_config: ProviderConfig
+        :param username: username for this session
+        :type username: str
+        :param password: password for this user
+        :type password: str
+        :param signaler: Signaler object used to send notifications
+                         from the backend
+        :type signaler: Signaler
+
+        :returns: a Deferred that fires with a handle to the new current
+                  session, or None if the authentication failed.
+        :rtype: Deferred
+        """
+        session = cls.__impl(provider_config, signaler)
+
+        def use_session(_):
+            account_id = session._get_full_user_id()
+            cls.__accounts.pop(account_id, None)
+            current = cls.__instance
+            if current is not None and current.is_authenticated():
+                current_id = current._get_full_user_id()
+                if current_id != account_id:
+                    cls.__accounts[current_id] = current
+            cls.__instance = session
+
+        def authenticated(_):
+            if session.is_authenticated():
+                return cls(None)
+            return None
+
+        # the new session is the current one when srp_auth_ok is signaled
+        d = SRPAuthImpl.authenticate(session, username.lower(), password)
+        d.addCallback(use_session)
+        d.addCallback(session._authenticate_ok)
+        d.addErrback(session._authenticate_error)
+        d.addCallback(authenticated)
+        return d
+
+    @classmethod
+    def switch_account(cls, account_id):
+        """
+        Make the session of another authenticated account the current one.
+        The current session is kept aside if it is authenticated.
+
+        :param account_id: the account to switch to, as user@provider
+        :type account_id: str
+
+        :returns: a handle to the new current session, or None if that
+                  account has no authenticated session.
+        :rtype: SRPAuth or None
+        """
+        session = cls.__accounts.pop(account_id, None)
+        if session is None or not session.is_authenticated():
+            return None
+
+        current = cls.__instance
+        if current is not None and current.is_authenticated():
+            cls.__accounts[current._get_full_user_id()] = current
+        cls.__instance = session
+        return cls(None)
+
+    @classmethod
+    def get_accounts(cls):
+        """
+        Return the accounts that have an authenticated session, the current
+        one first.
+
+        :rtype: list of str
+        """
+        accounts = []
+        current = cls.__instance
+        if current is not None and current.is_authenticated():
+            accounts.append(current._get_full_user_id())
+        accounts.extend(sorted(account for account, session in
+                               cls.__accounts.items()
+                               if session.is_authenticated()))
+        return accounts
+
     def authenticate(self, username, password):
         """
         Executes the whole authentication process for a user
@@ -802,6 +992,20 @@ class SRPAuth(object):
             return None
         return self.__instance._username
 
+    def get_account_id(self):
+        """
+        Returns the account of this session, as user@provider, or None if
+        it is not authenticated.
+
+        :rtype: str or None
+        """
+        if not self.is_authenticated():
+            return None
+        return self.__instance._get_full_user_id()
+
+    def get_provider_config(self):
+        return self.__instance._provider_config
+
     def get_session_id(self):
         return self.__instance.get_session_id()
 
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+# srpbench.py
+# Copyright (C) 2015 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Micro benchmark of the SRP engines.
+
+It times the client side math of a login (what SRPAuthImpl.authenticate
+does) and the verifier generation of a password change or a signup, for
+every engine available on this machine.
+
+Usage: python -m leap.bitmask.crypto.srpbench [--rounds N]
+"""
+import argparse
+
+from timeit import default_timer
+
+from leap.bitmask.crypto import srpengine
+
+USERNAME = "benchmark"
+PASSWORD = "benchmark password"
+
+
+def bench_authenticate(engine, rounds):
+    """
+    Return the average seconds the client spends in the SRP math of a
+    login. The server side is not timed.
+
+    :param engine: the engine to benchmark
+    :type engine: SRPEngine
+    :param rounds: number of logins to average
+    :type rounds: int
+
+    :rtype: float
+    """
+    hashfun, ng = engine.SHA256, engine.NG_1024
+    salt, verifier = engine.create_salted_verification_key(
+        USERNAME, PASSWORD, hashfun, ng)
+
+    total = 0
+    for _ in range(rounds):
+        start = default_timer()
+        user = engine.User(USERNAME, PASSWORD, hashfun, ng)
+        _, A = user.start_authentication()
+        total += default_timer() - start
+
+        server = engine.Verifier(USERNAME, salt, verifier, A, hashfun, ng)
+        s, B = server.get_challenge()
+
+        start = default_timer()
+        M = user.process_challenge(s, B)
+        total += default_timer() - start
+
+        user.verify_session(server.verify_session(M))
+        assert user.authenticated(), "Authentication failed"
+
+    return total / rounds
+
+
+def bench_verifier(engine, rounds):
+    """
+    Return the average seconds it takes to create a new salt and verifier,
+    like on a password change.
+
+    :param engine: the engine to benchmark
+    :type engine: SRPEngine
+    :param rounds: number of verifiers to average
+    :type rounds: int
+
+    :rtype: float
+    """
+    start = default_timer()
+    for _ in range(rounds):
+        engine.create_salted_verification_key(
+            USERNAME, PASSWORD, engine.SHA256, engine.NG_1024)
+    return (default_timer() - start) / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SRP engines benchmark")
+    parser.add_argument("--rounds", type=int, default=20,
+                        help="number of iterations of each operation")
+    args = parser.parse_args()
+
+    print "%-10s %15s %15s" % ("engine", "authenticate", "verifier")
+    for name in srpengine.ENGINES:
+        engine = srpengine.load_engine(name)
+        if engine is None:
+            print "%-10s %31s" % (name, "not available")
+            continue
+        if not srpengine.verify_engine(engine):
+            print "%-10s %31s" % (name, "wrong results, skipped")
+            continue
+
+        auth = bench_authenticate(engine, args.rounds)
+        verifier = bench_verifier(engine, args.rounds)
+        print "%-10s %13.2fms %13.2fms" % (name, auth * 1000,
+                                           verifier * 1000)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+# srpengine.py
+# Copyright (C) 2015 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Big integer backends for the SRP math.
+
+The srp package does the modular exponentiations either with OpenSSL
+through ctypes or in pure python, which is slow on low end machines. Here
+we also offer the pure python implementation with gmpy2 doing the
+exponentiations, and we only use an engine after checking that it gives
+the same results as the reference pure python one.
+"""
+import imp
+import os
+import threading
+
+import srp._pysrp
+
+from leap.bitmask.logs.utils import get_logger
+
+logger = get_logger()
+
+OPENSSL = "openssl"
+GMPY2 = "gmpy2"
+PYTHON = "python"
+
+# Engines in order of preference.
+ENGINES = (OPENSSL, GMPY2, PYTHON)
+
+
+class SRPEngine(object):
+    """
+    Wraps one of the srp implementations, exposing the same names as the
+    srp module so it can be used in its place.
+    """
+
+    def __init__(self, name, module):
+        """
+        Constructor for the engine.
+
+        :param name: the engine name, one of ENGINES
+        :type name: str
+        :param module: the module with the srp implementation
+        :type module: module
+        """
+        self.name = name
+        self.User = module.User
+        self.Verifier = module.Verifier
+        self.create_salted_verification_key = \
+            module.create_salted_verification_key
+        self.SHA256 = module.SHA256
+        self.NG_1024 = module.NG_1024
+
+    def __repr__(self):
+        return "<SRPEngine %s>" % (self.name,)
+
+
+def _load_openssl():
+    """
+    Return the srp implementation that uses OpenSSL.
+
+    :rtype: module
+    """
+    import srp._ctsrp
+    return srp._ctsrp
+
+
+_gmpy2 = None
+
+
+def _powmod(base, exp, mod=None):
+    """
+    Replacement for the builtin pow that uses gmpy2 for the modular
+    exponentiations.
+    """
+    if mod is None:
+        return pow(base, exp)
+    return long(_gmpy2.powmod(base, exp, mod))
+
+
+def _load_gmpy2():
+    """
+    Return a private copy of the pure python srp implementation that does
+    the modular exponentiations with gmpy2.
+
+    :rtype: module
+    """
+    global _gmpy2
+    import gmpy2
+    _gmpy2 = gmpy2
+
+    path = os.path.splitext(srp._pysrp.__file__)[0] + ".py"
+    module = imp.new_module("leap_srp_gmpy2")
+    module.__dict__["pow"] = _powmod
+    execfile(path, module.__dict__)
+    return module
+
+
+def _load_python():
+    """
+    Return the pure python srp implementation.
+
+    :rtype: module
+    """
+    return srp._pysrp
+
+
+_loaders = {
+    OPENSSL: _load_openssl,
+    GMPY2: _load_gmpy2,
+    PYTHON: _load_python,
+}
+
+
+def load_engine(name):
+    """
+    Load an engine by name.
+
+    :param name: the engine name, one of ENGINES
+    :type name: str
+
+    :returns: the engine, or None if it is not available here.
+    :rtype: SRPEngine or None
+    """
+    try:
+        return SRPEngine(name, _loaders[name]())
+    except (ImportError, OSError, IOError, AttributeError) as e:
+        logger.debug("SRP engine %s not available: %r" % (name, e))
+        return None
+
+
+def _make_user(engine, username, password, secret):
+    """
+    Return an engine User with a fixed ephemeral secret. The
+    implementations disagree on the size of the secret, but leading
+    zeros don't change its value.
+
+    :param engine: the engine to create the user with
+    :type engine: SRPEngine
+    :param secret: the ephemeral secret, 32 bytes
+    :type secret: str
+
+    :rtype: User
+    """
+    try:
+        return engine.User(username, password, engine.SHA256,
+                           engine.NG_1024, bytes_a=secret)
+    except ValueError:
+        return engine.User(username, password, engine.SHA256,
+                           engine.NG_1024, bytes_a=secret.rjust(256, "\0"))
+
+
+def verify_engine(engine, reference=None):
+    """
+    Check that an engine gives byte identical results to the reference
+    implementation for a known set of inputs, on both sides of the SRP
+    exchange.
+
+    :param engine: the engine to check
+    :type engine: SRPEngine
+    :param reference: the engine to compare with, pure python by default.
+    :type reference: SRPEngine
+
+    :rtype: bool
+    """
+    if reference is None:
+        reference = load_engine(PYTHON)
+
+    username = "leap-srp-check"
+    password = "some password"
+    secret_a = "\x5a" * 32
+    secret_b = "\xa5" * 32
+    hashfun, ng = reference.SHA256, reference.NG_1024
+
+    try:
+        salt, verifier = engine.create_salted_verification_key(
+            username, password, engine.SHA256, engine.NG_1024)
+
+        # the verifier from the engine must work with the reference server
+        ref_user = _make_user(reference, username, password, secret_a)
+        user = _make_user(engine, username, password, secret_a)
+        _, ref_A = ref_user.start_authentication()
+        _, A = user.start_authentication()
+        if A != ref_A:
+            return False
+
+        ref_verifier = reference.Verifier(
+            username, salt, verifier, ref_A, hashfun, ng,
+            bytes_b=secret_b.rjust(256, "\0"))
+        s, B = ref_verifier.get_challenge()
+        if B is None:
+            return False
+
+        ref_M = ref_user.process_challenge(s, B)
+        M = user.process_challenge(s, B)
+        if ref_M is None or M != ref_M:
+            return False
+
+        HAMK = ref_verifier.verify_session(M)
+        user.verify_session(HAMK)
+        ref_user.verify_session(HAMK)
+        return (user.authenticated() and
+                user.get_session_key() == ref_user.get_session_key())
+    except Exception as e:
+        logger.warning("Error checking the SRP engine %s: %r" %
+                       (engine.name, e))
+        return False
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_srp_engine():
+    """
+    Return the fastest available engine that passes the verification.
+    The choice is done once per process.
+
+    :rtype: SRPEngine
+    """
+    global _engine
+    with _engine_lock:
+        if _engine is not None:
+            return _engine
+
+        for name in ENGINES:
+            engine = load_engine(name)
+            if engine is None:
+                continue
+            if name == PYTHON or verify_engine(engine):
+                _engine = engine
+                break
+            logger.warning("SRP engine %s gives wrong results, not using "
+                           "it." % (name,))
+
+        logger.debug("Using SRP engine: %s" % (_engine.name,))
+        return _engine
@@ -20,13 +20,14 @@ import json
 import logging
 
 import requests
-import srp
 
 from PySide import QtCore
 from urlparse import urlparse
 
 from leap.bitmask.config.providerconfig import ProviderConfig
+from leap.bitmask.crypto.srpengine import get_srp_engine
 from leap.bitmask.logs.utils import get_logger
+from leap.bitmask.util import retry
 from leap.bitmask.util.constants import SIGNUP_TIMEOUT
 from leap.bitmask.util.request_helpers import get_content
 from leap.common.check import leap_assert, leap_assert_type
@@ -50,7 +51,7 @@ class SRPRegisterImpl:
         # Dependency injection helpers, override this for more
         # granular testing
         self._fetcher = requests
-        self._srp = srp
+        self._srp = get_srp_engine()
         self._hashfun = self._srp.SHA256
         self._ng = self._srp.NG_1024
         # **************************************************** #
@@ -101,11 +102,11 @@ class SRPRegisterImpl:
         ok = False
         req = None
         try:
-            req = self._session.post(uri,
-                                     data=user_data,
-                                     timeout=SIGNUP_TIMEOUT,
-                                     verify=self._provider_config.
-                                     get_ca_cert_path())
+            req = retry.request(self._session, "POST", uri,
+                                data=user_data,
+                                timeout=SIGNUP_TIMEOUT,
+                                verify=self._provider_config.
+                                get_ca_cert_path())
 
         except requests.exceptions.RequestException as exc:
             logger.error(exc.message)
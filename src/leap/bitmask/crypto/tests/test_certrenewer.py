@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+# test_certrenewer.py
+# Copyright (C) 2015 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the client certificate renewer.
+"""
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+import mock
+
+from twisted.internet import defer, task
+
+from leap.bitmask.crypto.certrenewer import ClientCertRenewer
+from leap.common.testing.basetest import BaseLeapTest
+
+DAY = 24 * 60 * 60
+
+
+class ClientCertRenewerTest(BaseLeapTest):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.signaler = mock.Mock()
+        self.renewer = ClientCertRenewer(
+            self.signaler, is_authenticated=lambda: True, clock=self.clock)
+        self.renewer._get_certs = mock.Mock(
+            return_value=[("vpn", "/vpn.pem"), ("smtp", "/smtp.pem")])
+        self.time_left = {"/vpn.pem": 30 * DAY, "/smtp.pem": 30 * DAY}
+        self.renewer._time_left = self.time_left.get
+        self.renewer._renew = mock.Mock(
+            side_effect=lambda kind, path: defer.succeed(
+                self.renewer._renewed(kind)))
+
+    def tearDown(self):
+        self.renewer.stop()
+
+    def test_nothing_to_renew(self):
+        self.renewer.start(mock.Mock(), "user@provider.test")
+        self.clock.advance(0)
+
+        self.assertFalse(self.renewer._renew.called)
+        self.assertFalse(self.signaler.signal.called)
+
+    def test_renews_before_expiration(self):
+        self.time_left["/vpn.pem"] = 2 * DAY
+        self.renewer.start(mock.Mock(), "user@provider.test")
+        self.clock.advance(0)
+
+        self.renewer._renew.assert_called_once_with("vpn", "/vpn.pem")
+        self.signaler.signal.assert_called_once_with(
+            self.signaler.client_cert_renewed, "vpn")
+
+    def test_missing_certs_are_left_to_the_bootstrap(self):
+        self.time_left["/smtp.pem"] = None
+        self.renewer.start(mock.Mock(), "user@provider.test")
+        self.clock.advance(0)
+
+        self.assertFalse(self.renewer._renew.called)
+
+    def test_waits_for_a_session(self):
+        self.time_left["/vpn.pem"] = 0
+        self.renewer._is_authenticated = lambda: False
+        self.renewer.start(mock.Mock(), "user@provider.test")
+        self.clock.advance(0)
+
+        self.assertFalse(self.renewer._renew.called)
+
+    def test_stop(self):
+        self.time_left["/vpn.pem"] = 0
+        self.renewer.start(mock.Mock(), "user@provider.test")
+        self.renewer.stop()
+        self.clock.advance(ClientCertRenewer.CHECK_INTERVAL)
+
+        self.assertFalse(self.renewer._renew.called)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
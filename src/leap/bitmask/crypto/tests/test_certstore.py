@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+# test_certstore.py
+# Copyright (C) 2015 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the certificate store.
+"""
+import os
+import time
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+import mock
+
+from OpenSSL import crypto
+
+from leap.bitmask.crypto import certstore
+from leap.bitmask.crypto.certstore import CertStore
+from leap.common.certs import get_digest
+from leap.common.testing.basetest import BaseLeapTest
+
+
+def make_cert(not_after_days, serial=1):
+    """
+    Return a self signed certificate and its private key, in PEM format.
+    """
+    key = crypto.PKey()
+    key.generate_key(crypto.TYPE_RSA, 1024)
+    cert = crypto.X509()
+    cert.set_serial_number(serial)
+    cert.get_subject().CN = "test"
+    cert.set_issuer(cert.get_subject())
+    cert.gmtime_adj_notBefore(-60)
+    cert.gmtime_adj_notAfter(not_after_days * 24 * 60 * 60)
+    cert.set_pubkey(key)
+    cert.sign(key, "sha256")
+    return (crypto.dump_certificate(crypto.FILETYPE_PEM, cert),
+            crypto.dump_privatekey(crypto.FILETYPE_PEM, key))
+
+
+class CertStoreTest(BaseLeapTest):
+
+    def setUp(self):
+        self.store = CertStore()
+        self.path = os.path.join(self.tempdir, "openvpn.pem")
+
+    def tearDown(self):
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+    def _write(self, data):
+        with open(self.path, "w") as f:
+            f.write(data)
+
+    def test_missing_file(self):
+        self.assertIsNone(self.store.get_info(self.path))
+        self.assertTrue(self.store.should_redownload(self.path))
+
+    def test_client_cert(self):
+        cert, key = make_cert(30)
+        self._write(cert + key)
+
+        self.assertFalse(self.store.should_redownload(self.path))
+        self.assertEqual(self.store.get_digest(self.path, "sha256"),
+                         get_digest(cert, "SHA256"))
+
+    def test_cert_without_key_should_be_redownloaded(self):
+        cert, _ = make_cert(30)
+        self._write(cert)
+
+        self.assertTrue(self.store.should_redownload(self.path))
+        # but we can still check the fingerprint of a CA
+        self.assertIsNotNone(self.store.get_digest(self.path, "SHA256"))
+
+    def test_expired_cert(self):
+        cert, key = make_cert(1)
+        self._write(cert + key)
+
+        later = lambda: time.gmtime(time.time() + 2 * 24 * 60 * 60)
+        self.assertTrue(self.store.should_redownload(self.path, now=later))
+
+    def test_file_is_parsed_once(self):
+        cert, key = make_cert(30)
+        self._write(cert + key)
+
+        with mock.patch.object(self.store, "_parse",
+                               wraps=self.store._parse) as parse:
+            self.store.should_redownload(self.path)
+            self.store.get_digest(self.path, "SHA256")
+            self.store.get_not_after(self.path)
+            self.assertEqual(parse.call_count, 1)
+
+    def test_changed_file_is_parsed_again(self):
+        cert, key = make_cert(30, serial=1)
+        self._write(cert + key)
+        first = self.store.get_digest(self.path, "SHA256")
+
+        cert, key = make_cert(30, serial=2)
+        self._write(cert + key)
+        self.store.invalidate(self.path)
+
+        self.assertNotEqual(self.store.get_digest(self.path, "SHA256"),
+                            first)
+
+    def test_shared_store(self):
+        self.assertIs(certstore.get_cert_store(),
+                      certstore.get_cert_store())
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
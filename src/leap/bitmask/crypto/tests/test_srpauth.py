@@ -34,13 +34,15 @@ from functools import partial
 from mock import MagicMock
 from nose.twistedtools import reactor, deferred
 from twisted.python import log
-from twisted.internet import threads
+from twisted.internet import defer, threads
 from requests.models import Response
 from simplejson.decoder import JSONDecodeError
 
 from leap.bitmask.config.providerconfig import ProviderConfig
 from leap.bitmask.crypto import srpregister, srpauth
+from leap.bitmask.crypto.sessioncache import SessionCache
 from leap.bitmask.crypto.tests import fake_provider
+from leap.bitmask.util import retry
 from leap.bitmask.util.request_helpers import get_content
 from leap.common.testing.https_server import where
 from leap.common.files import mkdir_p
@@ -102,8 +104,9 @@ class SRPAuthTestCase(unittest.TestCase):
         self.TEST_USER = "register_test_auth"
         self.TEST_PASS = "pass"
 
-        # Reset the singleton
+        # Reset the singleton and the failures seen by previous tests
         srpauth.SRPAuth._SRPAuth__instance = None
+        retry.reset_breakers()
         self.auth = srpauth.SRPAuth(self.provider)
         self.auth_backend = self.auth._SRPAuth__instance
 
@@ -672,6 +675,124 @@ class SRPAuthTestCase(unittest.TestCase):
 
         return d
 
+    @deferred()
+    def test_authenticate_resumes_session(self):
+        self.auth_backend._resume_session = mock.create_autospec(
+            self.auth_backend._resume_session,
+            return_value=True)
+        self.auth_backend._authentication_preprocessing = mock.create_autospec(
+            self.auth_backend._authentication_preprocessing,
+            return_value=None)
+
+        d = self.auth_backend.authenticate(self.TEST_USER, self.TEST_PASS)
+
+        def check(*args):
+            self.auth_backend._resume_session.assert_called_once_with(
+                self.TEST_PASS)
+            self.assertFalse(
+                self.auth_backend._authentication_preprocessing.called)
+
+        d.addCallback(check)
+        return d
+
+    def _cache_session(self, password):
+        """
+        Make the session cache return a session created with the given
+        password.
+        """
+        cache = SessionCache(mock.MagicMock())
+        salt = binascii.hexlify("somesalt")
+        cache.load = mock.Mock(return_value={
+            "uuid": "someuuid", "token": "sometoken",
+            "session_id": "somesession", "password_salt": salt,
+            "password_hash": cache._hash_password(password, salt)})
+        cache.save = mock.Mock()
+        cache.delete = mock.Mock()
+        self.auth_backend._session_cache = cache
+
+    @deferred()
+    def test_resume_session(self):
+        self.auth_backend._username = self.TEST_USER
+        self._cache_session(self.TEST_PASS)
+        response = Response()
+        response.status_code = 200
+        self.auth_backend._session.get = mock.create_autospec(
+            self.auth_backend._session.get, return_value=response)
+
+        def wrapper(*args):
+            self.assertTrue(
+                self.auth_backend._resume_session(self.TEST_PASS))
+            self.assertEqual(self.auth_backend.get_uuid(), "someuuid")
+            self.assertEqual(self.auth_backend.get_token(), "sometoken")
+            self.assertEqual(self.auth_backend.get_session_id(),
+                             "somesession")
+            self.assertTrue(self.auth_backend.is_authenticated())
+
+        d = threads.deferToThread(wrapper)
+        return d
+
+    @deferred()
+    def test_resume_session_rejected(self):
+        self.auth_backend._username = self.TEST_USER
+        self._cache_session(self.TEST_PASS)
+        response = Response()
+        response.status_code = 401
+        self.auth_backend._session.get = mock.create_autospec(
+            self.auth_backend._session.get, return_value=response)
+
+        def wrapper(*args):
+            self.assertFalse(
+                self.auth_backend._resume_session(self.TEST_PASS))
+            self.assertIsNone(self.auth_backend.get_session_id())
+            self.assertTrue(self.auth_backend._session_cache.delete.called)
+
+        d = threads.deferToThread(wrapper)
+        return d
+
+    @deferred()
+    def test_resume_session_wrong_password(self):
+        self.auth_backend._username = self.TEST_USER
+        self._cache_session(self.TEST_PASS)
+        self.auth_backend._session.get = mock.Mock()
+
+        def wrapper(*args):
+            self.assertFalse(
+                self.auth_backend._resume_session("wrong password"))
+            self.assertFalse(self.auth_backend._session.get.called)
+            self.assertIsNone(self.auth_backend.get_session_id())
+            self.assertFalse(self.auth_backend._session_cache.delete.called)
+
+        d = threads.deferToThread(wrapper)
+        return d
+
+    @deferred()
+    def test_authenticate_wrong_password_with_cached_session(self):
+        self._cache_session(self.TEST_PASS)
+        # keep the session we watch
+        self.auth_backend._reset_session = mock.Mock()
+        self.auth_backend._session.get = mock.Mock()
+        self.auth_backend._authentication_preprocessing = mock.create_autospec(
+            self.auth_backend._authentication_preprocessing,
+            return_value=None)
+        self.auth_backend._start_authentication = mock.create_autospec(
+            self.auth_backend._start_authentication,
+            return_value=None)
+        self.auth_backend._process_challenge = mock.create_autospec(
+            self.auth_backend._process_challenge,
+            side_effect=srpauth.SRPAuthBadUserOrPassword())
+
+        d = self.auth_backend.authenticate(self.TEST_USER, "wrong password")
+
+        def check(*args):
+            # the SRP exchange decided, not the cached session
+            self.assertTrue(self.auth_backend._process_challenge.called)
+            self.assertFalse(self.auth_backend._session.get.called)
+            self.assertIsNone(self.auth_backend.get_session_id())
+            self.assertFalse(self.auth_backend.is_authenticated())
+
+        d.addCallback(check)
+        return d
+
     @deferred()
     def test_logout_does_not_fail_if_not_logged_in(self):
 
@@ -745,3 +866,121 @@ class SRPAuthSingletonTestCase(unittest.TestCase):
             side_effect=Exception())
 
         self.assertFalse(auth.logout())
+
+
+class SRPAuthAccountsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.old_instance = srpauth.SRPAuth._SRPAuth__instance
+        self.old_authenticate = srpauth.SRPAuthImpl.authenticate
+        srpauth.SRPAuthImpl.authenticate = self._fake_authenticate
+        srpauth.SRPAuth._SRPAuth__accounts = {}
+        self.config = MagicMock()
+        self.config.get_domain.return_value = "provider.test"
+        self.signaler = MagicMock()
+
+    def tearDown(self):
+        srpauth.SRPAuth._SRPAuth__instance = self.old_instance
+        srpauth.SRPAuthImpl.authenticate = self.old_authenticate
+        srpauth.SRPAuth._SRPAuth__accounts = {}
+
+    @staticmethod
+    def _fake_authenticate(session, username, password):
+        session._username = username
+        if password != "right password":
+            return defer.fail(srpauth.SRPAuthBadUserOrPassword())
+        session._resumed = True
+        session.set_session_id("somesession")
+        return defer.succeed(True)
+
+    def _login(self, account_id):
+        session = MagicMock()
+        session.is_authenticated.return_value = True
+        session._get_full_user_id.return_value = account_id
+        srpauth.SRPAuth._SRPAuth__instance = session
+        return session
+
+    def _current(self):
+        return srpauth.SRPAuth._SRPAuth__instance
+
+    @deferred()
+    @defer.inlineCallbacks
+    def test_login_keeps_the_other_account(self):
+        alice = self._login("alice@provider.test")
+        auth = yield srpauth.SRPAuth.authenticate_account(
+            self.config, "bob", "right password", self.signaler)
+
+        self.assertEqual(auth.get_account_id(), "bob@provider.test")
+        self.assertEqual(srpauth.SRPAuth.get_accounts(),
+                         ["bob@provider.test", "alice@provider.test"])
+        auth = srpauth.SRPAuth.switch_account("alice@provider.test")
+        self.assertEqual(auth._SRPAuth__instance, alice)
+
+    @deferred()
+    @defer.inlineCallbacks
+    def test_login_again_replaces_the_session(self):
+        alice = self._login("alice@provider.test")
+        auth = yield srpauth.SRPAuth.authenticate_account(
+            self.config, "alice", "right password", self.signaler)
+
+        self.assertNotEqual(auth._SRPAuth__instance, alice)
+        self.assertEqual(srpauth.SRPAuth.get_accounts(),
+                         ["alice@provider.test"])
+
+    @deferred()
+    @defer.inlineCallbacks
+    def test_login_again_into_an_account_aside(self):
+        alice = self._login("alice@provider.test")
+        srpauth.SRPAuth._SRPAuth__instance = None
+        srpauth.SRPAuth._SRPAuth__accounts["alice@provider.test"] = alice
+        self._login("bob@provider.test")
+
+        # the usernames are case insensitive
+        auth = yield srpauth.SRPAuth.authenticate_account(
+            self.config, "Alice", "right password", self.signaler)
+
+        self.assertNotEqual(auth._SRPAuth__instance, alice)
+        self.assertEqual(auth.get_account_id(), "alice@provider.test")
+        self.assertEqual(srpauth.SRPAuth.get_accounts(),
+                         ["alice@provider.test", "bob@provider.test"])
+
+    @deferred()
+    @defer.inlineCallbacks
+    def test_wrong_password_keeps_the_sessions(self):
+        alice = self._login("alice@provider.test")
+        srpauth.SRPAuth._SRPAuth__instance = None
+        srpauth.SRPAuth._SRPAuth__accounts["alice@provider.test"] = alice
+        bob = self._login("bob@provider.test")
+
+        for username in ("alice", "bob", "carol"):
+            auth = yield srpauth.SRPAuth.authenticate_account(
+                self.config, username, "wrong password", self.signaler)
+            self.assertIsNone(auth)
+
+        self.assertEqual(self._current(), bob)
+        self.assertEqual(srpauth.SRPAuth.get_accounts(),
+                         ["bob@provider.test", "alice@provider.test"])
+        self.signaler.signal.assert_called_with(
+            self.signaler.srp_auth_bad_user_or_password)
+
+    def test_switch_account(self):
+        alice = self._login("alice@provider.test")
+        srpauth.SRPAuth._SRPAuth__instance = None
+        srpauth.SRPAuth._SRPAuth__accounts["alice@provider.test"] = alice
+        bob = self._login("bob@provider.test")
+
+        self.assertEqual(srpauth.SRPAuth.get_accounts(),
+                         ["bob@provider.test", "alice@provider.test"])
+
+        auth = srpauth.SRPAuth.switch_account("alice@provider.test")
+        self.assertEqual(auth._SRPAuth__instance, alice)
+        self.assertEqual(srpauth.SRPAuth.get_accounts(),
+                         ["alice@provider.test", "bob@provider.test"])
+
+        auth = srpauth.SRPAuth.switch_account("bob@provider.test")
+        self.assertEqual(auth._SRPAuth__instance, bob)
+
+    def test_switch_to_unknown_account(self):
+        alice = self._login("alice@provider.test")
+
+        self.assertIsNone(srpauth.SRPAuth.switch_account("bob@provider.test"))
+        self.assertEqual(srpauth.SRPAuth._SRPAuth__instance, alice)
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+# test_srpengine.py
+# Copyright (C) 2015 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the SRP engines.
+"""
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+import mock
+
+from leap.bitmask.crypto import srpengine
+from leap.common.testing.basetest import BaseLeapTest
+
+
+class SRPEngineTest(BaseLeapTest):
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def test_reference_engine_is_verified(self):
+        engine = srpengine.load_engine(srpengine.PYTHON)
+        self.assertTrue(srpengine.verify_engine(engine))
+
+    def test_selected_engine_is_verified(self):
+        with mock.patch.object(srpengine, "_engine", None):
+            engine = srpengine.get_srp_engine()
+        self.assertTrue(srpengine.verify_engine(engine),
+                        "%s gives wrong results" % (engine.name,))
+
+    def test_wrong_engine_is_detected(self):
+        engine = srpengine.load_engine(srpengine.PYTHON)
+        real_user = engine.User
+
+        def bad_user(*args, **kwargs):
+            kwargs["bytes_a"] = kwargs["bytes_a"].replace("\x5a", "\x01")
+            return real_user(*args, **kwargs)
+
+        engine.User = bad_user
+        self.assertFalse(srpengine.verify_engine(engine))
+
+    def test_falls_back_to_python(self):
+        with mock.patch.object(srpengine, "_engine", None):
+            with mock.patch.object(srpengine, "verify_engine",
+                                   return_value=False):
+                engine = srpengine.get_srp_engine()
+        self.assertEqual(engine.name, srpengine.PYTHON)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
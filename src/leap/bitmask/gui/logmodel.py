@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+# logmodel.py
+# Copyright (C) 2015 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Qt models for the log window.
+"""
+from PySide import QtCore, QtGui
+
+import logbook
+
+from leap.bitmask.logs.logfilter import IndexedRecord, LogFilter
+
+
+class LogTableModel(QtCore.QAbstractTableModel):
+    """
+    The history of logs, a row per record. It follows the LogHistory through
+    the insertions emitted by the log controller.
+    """
+
+    # (background, foreground, bold) of each level
+    STYLES = {
+        logbook.DEBUG: ("#CDFFFF", None, False),
+        logbook.INFO: ("white", None, False),
+        logbook.WARNING: ("#FFFF66", None, False),
+        logbook.ERROR: ("red", "white", False),
+        logbook.CRITICAL: ("red", "white", True),
+    }
+
+    def __init__(self, parent=None):
+        QtCore.QAbstractTableModel.__init__(self, parent)
+        self._rows = []
+        self._sequence = 0
+
+        self._backgrounds = {}
+        self._foregrounds = {}
+        self._fonts = {}
+        for level, (background, foreground, bold) in self.STYLES.items():
+            self._backgrounds[level] = QtGui.QBrush(QtGui.QColor(background))
+            if foreground is not None:
+                self._foregrounds[level] = QtGui.QBrush(
+                    QtGui.QColor(foreground))
+            if bold:
+                font = QtGui.QFont()
+                font.setBold(True)
+                self._fonts[level] = font
+
+    def load(self, history):
+        """
+        Load the records of the history.
+
+        :param history: the history of logs.
+        :type history: leap.bitmask.logs.loghistory.LogHistory
+        """
+        self.beginResetModel()
+        self._sequence, records = history.snapshot()
+        self._rows = [IndexedRecord(record) for record in records]
+        self.endResetModel()
+
+    def add_insertion(self, insertion):
+        """
+        Apply a change of the history.
+
+        :param insertion: where a record was added in the history.
+        :type insertion: leap.bitmask.logs.loghistory.LogInsertion
+        """
+        if insertion.sequence <= self._sequence:
+            # already loaded with the history
+            return
+        self._sequence = insertion.sequence
+
+        evicted = min(insertion.evicted, len(self._rows))
+        if evicted:
+            self.beginRemoveRows(QtCore.QModelIndex(), 0, evicted - 1)
+            del self._rows[:evicted]
+            self.endRemoveRows()
+
+        row = min(insertion.row, len(self._rows))
+        self.beginInsertRows(QtCore.QModelIndex(), row, row)
+        self._rows.insert(row, IndexedRecord(insertion.record))
+        self.endInsertRows()
+
+    def entry(self, row):
+        """
+        Return the record at the given row.
+
+        :rtype: leap.bitmask.logs.logfilter.IndexedRecord
+        """
+        return self._rows[row]
+
+    def get_text(self):
+        """
+        Return the messages of all the records, a line each.
+
+        :rtype: unicode
+        """
+        return u"\n".join(entry.text for entry in self._rows)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._rows)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return 1
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        """
+        Return the data of a cell, the view only asks for the visible ones.
+        """
+        if not index.isValid():
+            return None
+        entry = self._rows[index.row()]
+        if role == QtCore.Qt.DisplayRole:
+            return entry.text
+        if role == QtCore.Qt.BackgroundRole:
+            return self._backgrounds.get(entry.level)
+        if role == QtCore.Qt.ForegroundRole:
+            return self._foregrounds.get(entry.level)
+        if role == QtCore.Qt.FontRole:
+            return self._fonts.get(entry.level)
+        return None
+
+
+class LogFilterProxyModel(QtGui.QSortFilterProxyModel):
+    """
+    Shows the records of a LogTableModel that pass the filter of the log
+    window.
+    """
+
+    def __init__(self, parent=None):
+        QtGui.QSortFilterProxyModel.__init__(self, parent)
+        self._filter = LogFilter()
+
+    def set_filter(self, text, case_insensitive, levels):
+        """
+        Change the filter, see LogFilter.set.
+        """
+        if self._filter.set(text, case_insensitive, levels):
+            self.invalidateFilter()
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        return self._filter.accepts(self.sourceModel().entry(source_row))
+
+    def get_text(self):
+        """
+        Return the messages of the records shown, a line each.
+
+        :rtype: unicode
+        """
+        source = self.sourceModel()
+        lines = []
+        for row in range(self.rowCount()):
+            source_row = self.mapToSource(self.index(row, 0)).row()
+            lines.append(source.entry(source_row).text)
+        return u"\n".join(lines)
@@ -18,14 +18,13 @@
 """
 History log window
 """
-import cgi
-
 from PySide import QtCore, QtGui
 
 import logbook
 
 from ui_loggerwindow import Ui_LoggerWindow
 
+from leap.bitmask.gui.logmodel import LogFilterProxyModel, LogTableModel
 from leap.bitmask.logs.utils import get_logger, LOG_CONTROLLER
 from leap.bitmask.util.constants import PASTEBIN_API_DEV_KEY
 from leap.bitmask.util import pastebin
@@ -50,85 +49,73 @@ class LoggerWindow(QtGui.QDialog):
         self.ui = Ui_LoggerWindow()
         self.ui.setupUi(self)
 
+        # The records are shown through a model, the view only renders the
+        # rows that are visible
+        self._model = LogTableModel(self)
+        self._proxy = LogFilterProxyModel(self)
+        self._proxy.setSourceModel(self._model)
+
+        view = self.ui.tvLogHistory
+        view.setModel(self._proxy)
+        vertical_header = view.verticalHeader()
+        vertical_header.setResizeMode(QtGui.QHeaderView.Fixed)
+        vertical_header.setDefaultSectionSize(view.fontMetrics().height() + 4)
+        self._follow_new_logs = True
+
         # Make connections
         self.ui.btnSave.clicked.connect(self._save_log_to_file)
-        self.ui.btnDebug.toggled.connect(self._load_history),
-        self.ui.btnInfo.toggled.connect(self._load_history),
-        self.ui.btnWarning.toggled.connect(self._load_history),
-        self.ui.btnError.toggled.connect(self._load_history),
-        self.ui.btnCritical.toggled.connect(self._load_history)
+        self.ui.btnDebug.toggled.connect(self._update_filter),
+        self.ui.btnInfo.toggled.connect(self._update_filter),
+        self.ui.btnWarning.toggled.connect(self._update_filter),
+        self.ui.btnError.toggled.connect(self._update_filter),
+        self.ui.btnCritical.toggled.connect(self._update_filter)
         self.ui.leFilterBy.textEdited.connect(self._filter_by)
-        self.ui.cbCaseInsensitive.stateChanged.connect(self._load_history)
+        self.ui.cbCaseInsensitive.stateChanged.connect(self._update_filter)
         self.ui.btnPastebin.clicked.connect(self._pastebin_this)
 
+        self._proxy.rowsAboutToBeInserted.connect(self._before_new_logs)
+        self._proxy.rowsInserted.connect(self._after_new_logs)
+
         self._paste_ok.connect(self._pastebin_ok)
         self._paste_error.connect(self._pastebin_err)
 
         self._current_filter = ""
-        self._current_history = ""
 
-        self._set_logs_to_display()
-
-        LOG_CONTROLLER.new_log.connect(self._add_log_line)
+        LOG_CONTROLLER.new_log.connect(self._model.add_insertion)
         self._load_history()
 
-    def _add_log_line(self, log):
-        """
-        Adds a line to the history, only if it's in the desired levels to show.
-
-        :param log: a log record to be inserted in the widget
-        :type log: Logbook.LogRecord.
-        """
-        html_style = {
-            logbook.DEBUG: "background: #CDFFFF;",
-            logbook.INFO: "background: white;",
-            logbook.WARNING: "background: #FFFF66;",
-            logbook.ERROR: "background: red; color: white;",
-            logbook.CRITICAL: "background: red; color: white; font: bold;"
-        }
-        level = log.level
-        message = cgi.escape(log.msg)
-
-        if self._logs_to_display[level]:
-            open_tag = "<tr style='" + html_style[level] + "'>"
-            open_tag += "<td width='100%' style='padding: 5px;'>"
-            close_tag = "</td></tr>"
-            message = open_tag + message + close_tag
-
-            filter_by = self._current_filter
-            msg = message
-            if self.ui.cbCaseInsensitive.isChecked():
-                msg = msg.upper()
-                filter_by = filter_by.upper()
-
-            if msg.find(filter_by) != -1:
-                self.ui.txtLogHistory.append(message)
-
     def _load_history(self):
         """
         Load the previous logged messages in the widget.
         They are stored in the custom handler.
         """
-        self._set_logs_to_display()
-        self.ui.txtLogHistory.clear()
-        current_history = []
-        for record in LOG_CONTROLLER.get_logs():
-            self._add_log_line(record)
-            current_history.append(record.msg)
+        self._model.load(LOG_CONTROLLER.get_history())
+        self._update_filter()
+        self.ui.tvLogHistory.scrollToBottom()
 
-        self._current_history = "\n".join(current_history)
-
-    def _set_logs_to_display(self):
+    def _get_levels_to_display(self):
         """
-        Sets the logs_to_display dict getting the toggled options from the ui
+        Return the levels to show, getting the toggled options from the ui.
+
+        :rtype: list of int
         """
-        self._logs_to_display = {
-            logbook.DEBUG: self.ui.btnDebug.isChecked(),
-            logbook.INFO: self.ui.btnInfo.isChecked(),
-            logbook.WARNING: self.ui.btnWarning.isChecked(),
-            logbook.ERROR: self.ui.btnError.isChecked(),
-            logbook.CRITICAL: self.ui.btnCritical.isChecked()
+        buttons = {
+            logbook.DEBUG: self.ui.btnDebug,
+            logbook.INFO: self.ui.btnInfo,
+            logbook.WARNING: self.ui.btnWarning,
+            logbook.ERROR: self.ui.btnError,
+            logbook.CRITICAL: self.ui.btnCritical
         }
+        return [level for level, button in buttons.items()
+                if button.isChecked()]
+
+    def _update_filter(self):
+        """
+        Filter the logs shown with the options of the ui.
+        """
+        self._proxy.set_filter(self._current_filter,
+                               self.ui.cbCaseInsensitive.isChecked(),
+                               self._get_levels_to_display())
 
     def _filter_by(self, text):
         """
@@ -138,7 +125,22 @@ class LoggerWindow(QtGui.QDialog):
         :type text: str
         """
         self._current_filter = text
-        self._load_history()
+        self._update_filter()
+
+    def _before_new_logs(self, parent, first, last):
+        """
+        Remember whether the view shows the latest logs, to keep showing
+        them as new ones arrive.
+        """
+        scroll_bar = self.ui.tvLogHistory.verticalScrollBar()
+        self._follow_new_logs = scroll_bar.value() == scroll_bar.maximum()
+
+    def _after_new_logs(self, parent, first, last):
+        """
+        Scroll to the new logs if the view was showing the latest ones.
+        """
+        if self._follow_new_logs:
+            self.ui.tvLogHistory.scrollToBottom()
 
     def _save_log_to_file(self):
         """
@@ -151,13 +153,8 @@ class LoggerWindow(QtGui.QDialog):
         if fileName:
             try:
                 with open(fileName, 'w') as output:
-                    history = self.ui.txtLogHistory.toPlainText()
-                    # Chop some \n.
-                    # html->plain adds several \n because the html is made
-                    # using table cells.
-                    history = history.replace('\n\n\n', '\n')
-
-                    output.write(history)
+                    history = self._proxy.get_text()
+                    output.write(history.encode("utf-8"))
                 logger.debug('Log saved in %s' % (fileName, ))
             except IOError, e:
                 logger.error("Error saving log file: %r" % (e, ))
@@ -227,7 +224,7 @@ class LoggerWindow(QtGui.QDialog):
             """
             Send content to pastebin and return the link.
             """
-            content = self._current_history
+            content = history
             pb = pastebin.PastebinAPI()
             try:
                 link = pb.paste(PASTEBIN_API_DEV_KEY, content,
@@ -240,6 +237,8 @@ class LoggerWindow(QtGui.QDialog):
             except Exception as e:
                 self._paste_error.emit(e)
 
+        # taken here, the models are only used from the GUI thread
+        history = self._model.get_text()
         self._set_pastebin_sending(True)
 
         self._paste_thread = QtCore.QThread()
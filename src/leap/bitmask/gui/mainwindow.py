@@ -54,7 +54,7 @@ from leap.bitmask.platform_init import locks
 from leap.bitmask.platform_init.initializers import init_platform
 from leap.bitmask.platform_init.initializers import init_signals
 
-from leap.bitmask.util import autostart, make_address
+from leap.bitmask.util import autostart, get_account_id
 from leap.bitmask.util.keyring_helpers import has_keyring
 
 from leap.common.events import register
@@ -1381,7 +1381,7 @@ class MainWindow(QtGui.QMainWindow, SignalTracker):
         provider_domain = self._providers.get_selected_provider()
 
         if flags.OFFLINE:
-            full_user_id = make_address(username, provider_domain)
+            full_user_id = get_account_id(username, provider_domain)
             uuid = self._backend_settings.get_uuid(full_user_id)
             self._mail_conductor.userid = full_user_id
 
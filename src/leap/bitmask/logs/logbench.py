@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+# logbench.py
+# Copyright (C) 2015 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Benchmark of the cost of a log record.
+
+Almost every module calls get_logger when it is imported. This times a log
+record after get_logger was called by more and more modules, the cost has
+to stay the same however many there are.
+
+The log file goes to a temporary directory and the stderr output is
+discarded. A zmq subscriber receives the records, like the log window.
+
+Usage: python -m leap.bitmask.logs.logbench [--records N]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+
+from timeit import default_timer
+
+# before anything reads the configuration path
+_CONFIG_HOME = tempfile.mkdtemp(prefix="bitmask-logbench-")
+os.environ["XDG_CONFIG_HOME"] = _CONFIG_HOME
+
+import logbook
+import zmq
+
+from leap.bitmask.config import flags
+from leap.bitmask.logs.utils import get_logger
+
+LOGS_URI = 'tcp://127.0.0.1:5000'
+
+MODULE_COUNTS = (1, 10, 100, 1000)
+
+
+class Receiver(threading.Thread):
+    """
+    Receives the records sent to the log window and drops them.
+    """
+
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self._context = zmq.Context()
+        self._socket = self._context.socket(zmq.PULL)
+        self._socket.bind(LOGS_URI)
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            if self._socket.poll(100):
+                self._socket.recv()
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+        self._socket.close(0)
+        self._context.term()
+
+
+def import_modules(first, count):
+    """
+    Call get_logger like count modules do when they are imported.
+
+    :param first: the number of the first module.
+    :type first: int
+    :param count: how many modules.
+    :type count: int
+
+    :returns: the logger of the last module.
+    :rtype: logbook.Logger
+    """
+    logger = None
+    for number in range(first, first + count):
+        module_globals = {
+            "__name__": "leap.bitmask.logbench%s" % (number,),
+            "get_logger": get_logger,
+        }
+        logger = eval("get_logger()", module_globals)
+    return logger
+
+
+def bench_records(logger, records):
+    """
+    Return the average seconds it takes to log a record.
+
+    :param logger: the logger to use.
+    :type logger: logbook.Logger
+    :param records: how many records to average.
+    :type records: int
+
+    :rtype: float
+    """
+    stderr = sys.stderr
+    sys.stderr = open(os.devnull, "w")
+    try:
+        start = default_timer()
+        for number in range(records):
+            logger.debug("benchmark record %s" % (number,))
+        return (default_timer() - start) / records
+    finally:
+        sys.stderr.close()
+        sys.stderr = stderr
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Log records benchmark")
+    parser.add_argument("--records", type=int, default=2000,
+                        help="number of records timed for each step")
+    args = parser.parse_args()
+
+    flags.DEBUG = True
+    receiver = Receiver()
+    receiver.start()
+
+    try:
+        print "%8s %10s %12s" % ("modules", "handlers", "per record")
+        modules = 0
+        for count in MODULE_COUNTS:
+            logger = import_modules(modules, count - modules)
+            modules = count
+            per_record = bench_records(logger, args.records)
+            handlers = len(list(
+                logbook.Handler.stack_manager.iter_context_objects()))
+            print "%8s %10s %10.1fus" % (count, handlers, per_record * 1e6)
+    finally:
+        receiver.stop()
+        shutil.rmtree(_CONFIG_HOME, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+# logfilter.py
+# Copyright (C) 2015 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Filtering of the records shown in the log window.
+"""
+import logbook
+
+# the levels that can be shown or hidden in the log window
+LEVELS = (logbook.DEBUG, logbook.INFO, logbook.WARNING, logbook.ERROR,
+          logbook.CRITICAL)
+
+
+def get_display_level(level):
+    """
+    Return the level of LEVELS a record of the given level is shown with,
+    the other levels of logbook are shown with the level below them.
+
+    :param level: the level of a record.
+    :type level: int
+
+    :rtype: int
+    """
+    display_level = LEVELS[0]
+    for known in LEVELS:
+        if known <= level:
+            display_level = known
+    return display_level
+
+
+class IndexedRecord(object):
+    """
+    A log record with what filtering needs computed in advance.
+    """
+
+    __slots__ = ("record", "level", "text", "lowered",
+                 "generation", "accepted")
+
+    def __init__(self, record):
+        """
+        Constructor for the indexed record.
+
+        :param record: the record, with its formatted message in msg.
+        :type record: logbook.LogRecord
+        """
+        self.record = record
+        self.level = get_display_level(record.level)
+        self.text = record.msg
+        self.lowered = self.text.lower()
+
+        # the last filter that was checked and its result, see LogFilter
+        self.generation = -1
+        self.accepted = True
+
+
+class LogFilter(object):
+    """
+    Decides which records are shown, by level and by a text they contain.
+
+    When the filter only gets stricter (more text typed at the end, fewer
+    levels) the records it rejected before are rejected right away, only
+    the ones it accepted are searched again.
+    """
+
+    def __init__(self):
+        self._text = u""
+        self._case_insensitive = True
+        self._levels = frozenset(LEVELS)
+
+        # every filter has a generation, the filters since _chain_start
+        # were each stricter than the one before
+        self._generation = 0
+        self._chain_start = 0
+
+    def set(self, text, case_insensitive, levels):
+        """
+        Change the filter.
+
+        :param text: the text the records have to contain.
+        :type text: unicode
+        :param case_insensitive: whether the case of the text matters.
+        :type case_insensitive: bool
+        :param levels: the levels to show, of LEVELS.
+        :type levels: iterable of int
+
+        :returns: whether the filter changed.
+        :rtype: bool
+        """
+        if case_insensitive:
+            text = text.lower()
+        levels = frozenset(levels)
+        if (text == self._text and levels == self._levels and
+                case_insensitive == self._case_insensitive):
+            return False
+
+        stricter = (case_insensitive == self._case_insensitive and
+                    text.startswith(self._text) and
+                    levels <= self._levels)
+
+        self._generation += 1
+        if not stricter:
+            self._chain_start = self._generation
+        self._text = text
+        self._case_insensitive = case_insensitive
+        self._levels = levels
+        return True
+
+    def accepts(self, entry):
+        """
+        Return whether a record is shown.
+
+        :param entry: the record.
+        :type entry: IndexedRecord
+
+        :rtype: bool
+        """
+        generation = self._generation
+        if entry.generation == generation:
+            return entry.accepted
+        if entry.generation >= self._chain_start and not entry.accepted:
+            # rejected by a filter that was less strict than this one
+            accepted = False
+        elif entry.level not in self._levels:
+            accepted = False
+        elif self._case_insensitive:
+            accepted = self._text in entry.lowered
+        else:
+            accepted = self._text in entry.text
+        entry.generation = generation
+        entry.accepted = accepted
+        return accepted
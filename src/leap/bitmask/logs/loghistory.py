@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+# loghistory.py
+# Copyright (C) 2015 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+The history of log records shown in the log window.
+"""
+import threading
+
+from bisect import bisect_right
+from collections import namedtuple
+
+# A record added to the history. To follow the history, the oldest `evicted`
+# records are dropped and then `record` is inserted at `row`, which leaves
+# `count` records. `sequence` numbers the changes of the history.
+LogInsertion = namedtuple(
+    "LogInsertion", ["sequence", "row", "evicted", "count", "record"])
+
+
+class LogHistory(object):
+    """
+    A bounded history of log records, sorted by time.
+
+    The records sent over zmq may arrive out of order, they are inserted at
+    their place. When the history is full the oldest records are dropped,
+    like in a ring buffer.
+
+    It is thread-safe: the records are added by the zmq receiver thread and
+    read by the GUI.
+    """
+
+    # the records kept
+    MAX_RECORDS = 20000
+
+    # what a record takes in memory, besides its message
+    RECORD_OVERHEAD = 1024
+
+    def __init__(self, max_records=MAX_RECORDS, max_bytes=None):
+        """
+        Constructor for the history.
+
+        :param max_records: the number of records kept.
+        :type max_records: int
+        :param max_bytes: an estimate of the memory the records can take,
+                          no limit if None.
+        :type max_bytes: int or None
+        """
+        self._max_records = max_records
+        self._max_bytes = max_bytes
+
+        # parallel lists; the first `_first` entries were dropped already,
+        # they are deleted in one go once they are many
+        self._keys = []
+        self._records = []
+        self._sizes = []
+        self._first = 0
+
+        self._bytes = 0
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._records) - self._first
+
+    def _get_size(self, record):
+        """
+        Return the estimated memory that a record takes.
+
+        :rtype: int
+        """
+        return len(record.msg) + self.RECORD_OVERHEAD
+
+    def _is_full(self, size):
+        """
+        Return whether a record of the given size doesn't fit.
+
+        :rtype: bool
+        """
+        if len(self) >= self._max_records:
+            return True
+        if self._max_bytes is not None:
+            return self._bytes + size > self._max_bytes
+        return False
+
+    def _evict(self):
+        """
+        Drop the oldest record.
+        """
+        first = self._first
+        self._bytes -= self._sizes[first]
+        self._records[first] = None
+        self._first = first + 1
+        if self._first > len(self._records) // 2:
+            del self._keys[:self._first]
+            del self._records[:self._first]
+            del self._sizes[:self._first]
+            self._first = 0
+
+    def add(self, record):
+        """
+        Add a record to the history, at its place by time.
+
+        :param record: the record to add.
+        :type record: logbook.LogRecord
+
+        :returns: where the record was inserted, or None if it is older
+                  than all the history and there is no room for it.
+        :rtype: LogInsertion or None
+        """
+        size = self._get_size(record)
+        with self._lock:
+            # the arrival order breaks the ties
+            key = (record.time, self._sequence)
+            first = self._first
+            if (self._is_full(size) and len(self) and
+                    key < self._keys[first]):
+                return None
+
+            evicted = 0
+            while len(self) and self._is_full(size):
+                self._evict()
+                evicted += 1
+
+            first = self._first
+            index = bisect_right(self._keys, key, first)
+            self._keys.insert(index, key)
+            self._records.insert(index, record)
+            self._sizes.insert(index, size)
+            self._bytes += size
+            self._sequence += 1
+
+            first = self._first
+            return LogInsertion(self._sequence, index - first, evicted,
+                                len(self), record)
+
+    def snapshot(self):
+        """
+        Return the records in the history, with the number of the last
+        change they include. The insertions with a lower or equal sequence
+        are already in the list.
+
+        :rtype: tuple(int, list of logbook.LogRecord)
+        """
+        with self._lock:
+            return self._sequence, self._records[self._first:]
+
+    def get_records(self):
+        """
+        Return the records in the history.
+
+        :rtype: list of logbook.LogRecord
+        """
+        return self.snapshot()[1]
@@ -18,65 +18,107 @@
 A thread-safe zmq handler for LogBook.
 """
 import json
+import os
 import threading
+import time
 
-from logbook.queues import ZeroMQHandler
-from logbook import NOTSET
+from collections import deque
+from datetime import datetime
+
+from logbook import Handler, LogRecord, NOTSET
+from logbook.helpers import format_iso8601, to_safe_json
+from logbook.queues import ZeroMQSubscriber
 
 import zmq
 
 
-class SafeZMQHandler(ZeroMQHandler):
+def _json_default(obj):
+    """
+    Convert what json can't, like to_safe_json does.
+    """
+    if isinstance(obj, datetime):
+        return format_iso8601(obj)
+    # to_safe_json drops the values it doesn't know
+    return None
+
+
+def serialize_record(data):
+    """
+    Return the JSON of an exported record.
+
+    :param data: the record, as returned by LogRecord.to_dict
+    :type data: dict
+
+    :rtype: str
+    """
+    try:
+        return json.dumps(data, default=_json_default,
+                          separators=(',', ':'))
+    except (TypeError, ValueError):
+        # not utf-8 strings, or keys that are not strings
+        return json.dumps(to_safe_json(data), separators=(',', ':'))
+
+
+class SafeZMQHandler(Handler):
     """
     A ZMQ log handler for LogBook that is thread-safe.
 
-    This log handler makes use of the existing zmq handler and if the user
-    tries to log something from a different thread than the one used to
-    create the handler a new socket is created for that thread.
+    The records are queued by the threads that log them and sent by a
+    single background thread, which owns the only socket. The records
+    queued meanwhile are sent together, as the frames of one multipart
+    message, see BatchZMQSubscriber.
+
+    When nobody receives the records (the log window is not open), the
+    queue is bounded to MAX_QUEUED records and the ones that don't fit are
+    dropped, logging never blocks.
 
     Note: In ZMQ, Contexts are threadsafe objects, but Sockets are not.
     """
 
+    # the records kept while they can't be sent
+    MAX_QUEUED = 10000
+
+    # the records sent in one message
+    BATCH_SIZE = 500
+
+    # seconds the sender waits to gather a batch once a record arrives
+    BATCH_DELAY = 0.05
+
+    # milliseconds the socket keeps trying to deliver what was sent when
+    # the handler is closed
+    CLOSE_LINGER = 1000
+
     def __init__(self, uri=None, level=NOTSET, filter=None, bubble=False,
                  context=None, multi=False):
         """
-        Safe zmq handler constructor that calls the ZeroMQHandler constructor
-        and does some extra initializations.
-        """
-        # The current `SafeZMQHandler` uses the `ZeroMQHandler` constructor
-        # which creates a socket each time.
-        # The purpose of the `self._sockets` attribute is to prevent cases in
-        # which we use the same logger in different threads. For instance when
-        # we (in the same file) `deferToThread` a method/function, we are using
-        # the same logger/socket without calling get_logger again.
-        # If we want to reuse the socket, we need to rewrite this constructor
-        # instead of calling the ZeroMQHandler's one.
-        # The best approach may be to inherit directly from `logbook.Handler`.
-
-        args = (self, uri, level, filter, bubble, context, multi)
-        ZeroMQHandler.__init__(*args)
+        Safe zmq handler constructor.
 
-        current_id = self._get_caller_id()
-        # we store the socket created on the parent
-        self._sockets = {current_id: self.socket}
+        :param uri: where to send the records.
+        :type uri: str
+        :param context: the zmq context, a new one by default.
+        :type context: zmq.Context
+        :param multi: whether to connect a PUSH socket, instead of binding
+                      a PUB one.
+        :type multi: bool
 
-        # store the settings for new socket creation
-        self._multi = multi
+        The rest of the parameters are those of logbook.Handler.
+        """
+        Handler.__init__(self, level, filter, bubble)
+        self.context = context or zmq.Context()
         self._uri = uri
+        self._multi = multi
 
-    def _get_caller_id(self):
-        """
-        Return an id for the caller that depends on the current thread.
-        Thanks to this we can detect if we are running in a thread different
-        than the one who created the socket and create a new one for it.
+        # appending to and popping from a deque are atomic, the threads that
+        # log don't take any lock
+        self._queue = deque(maxlen=self.MAX_QUEUED)
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._sender = None
+        self._sender_pid = None
+        self._sender_lock = threading.Lock()
 
-        :rtype: int
-        """
-        # NOTE it makes no sense to use multiprocessing id since the sockets
-        # list can't/shouldn't be shared between processes. We only use
-        # thread id. The user needs to make sure that the handler is created
-        # inside each process.
-        return threading.current_thread().ident
+        #: the number of records that could not be sent
+        self.dropped = 0
 
     def _get_new_socket(self):
         """
@@ -89,6 +131,9 @@ class SafeZMQHandler(ZeroMQHandler):
 
         if self._multi:
             socket = self.context.socket(zmq.PUSH)
+            # don't queue the records for a subscriber that isn't there
+            socket.setsockopt(zmq.IMMEDIATE, 1)
+            socket.setsockopt(zmq.SNDHWM, 10)
             if self._uri is not None:
                 socket.connect(self._uri)
         else:
@@ -98,34 +143,145 @@ class SafeZMQHandler(ZeroMQHandler):
 
         return socket
 
+    def _ensure_sender(self):
+        """
+        Start the sender thread, if it isn't running in this process.
+        """
+        pid = os.getpid()
+        if self._sender is not None and self._sender_pid == pid:
+            return
+        with self._sender_lock:
+            if self._sender is not None and self._sender_pid == pid:
+                return
+            self._stopping = False
+            sender = threading.Thread(target=self._send_loop,
+                                      name="SafeZMQHandler")
+            sender.daemon = True
+            sender.start()
+            self._sender = sender
+            self._sender_pid = pid
+
+    def export_record(self, record):
+        """
+        Export the record into a dictionary, frozen so it can be serialized
+        in another thread.
+
+        :rtype: dict
+        """
+        return record.to_dict()
+
     def emit(self, record):
         """
-        Emit the given `record` through the socket.
+        Queue the given `record`, to be sent by the background thread.
 
         :param record: the record to emit
         :type record: Logbook.LogRecord
         """
-        current_id = self._get_caller_id()
-        socket = None
+        self._ensure_sender()
+        queue = self._queue
+        if len(queue) >= self.MAX_QUEUED:
+            # the deque drops the oldest one
+            self.dropped += 1
+        queue.append(self.export_record(record))
+        # always, the queue may have been drained since we looked at it
+        self._wakeup.set()
 
-        if current_id in self._sockets:
-            socket = self._sockets[current_id]
-        else:
-            # TODO: create new socket
-            socket = self._get_new_socket()
-            self._sockets[current_id] = socket
+    def _send_loop(self):
+        """
+        Send the queued records until the handler is closed.
+        """
+        socket = self._get_new_socket()
+        try:
+            while not self._stopping:
+                self._wakeup.wait()
+                self._wakeup.clear()
+                if not self._stopping:
+                    time.sleep(self.BATCH_DELAY)
+                self._send_queued(socket)
+            # what was queued while the last batch was sent
+            self._send_queued(socket)
+        except Exception:
+            # the thread is a daemon, if it is still running when the
+            # interpreter shuts down the modules it uses are torn down
+            # under it. There is nobody left to tell, it just ends.
+            self.dropped += len(self._queue)
+        finally:
+            try:
+                socket.close(self.CLOSE_LINGER)
+            except Exception:
+                pass
 
-        socket.send(json.dumps(self.export_record(record)).encode("utf-8"))
+    def _send_queued(self, socket):
+        """
+        Send the queued records, in batches.
+
+        :param socket: the socket of the sender thread.
+        :type socket: zmq.Socket
+        """
+        queue = self._queue
+        while queue:
+            frames = []
+            try:
+                while len(frames) < self.BATCH_SIZE:
+                    frames.append(serialize_record(queue.popleft()))
+            except IndexError:
+                pass
+            try:
+                socket.send_multipart(frames, zmq.NOBLOCK)
+            except zmq.Again:
+                # nobody is receiving
+                self.dropped += len(frames)
+            except zmq.ZMQError:
+                self.dropped += len(frames)
 
     def close(self, linger=-1):
         """
-        Close all the sockets and linger `linger` time.
+        Send what is queued and stop the sender thread.
 
         This reimplements the ZeroMQHandler.close method that is used by
         context methods.
 
-        :param linger: time to linger, -1 to not to.
+        :param linger: seconds to wait for the sender, -1 to wait until it
+                       is done.
         :type linger: int
         """
-        for socket in self._sockets.values():
-            socket.close(linger)
+        sender = self._sender
+        if sender is None or self._sender_pid != os.getpid():
+            return
+        self._stopping = True
+        self._wakeup.set()
+        sender.join(None if linger < 0 else linger)
+        self._sender = None
+
+
+class BatchZMQSubscriber(ZeroMQSubscriber):
+    """
+    A ZeroMQSubscriber for the batches of records of the SafeZMQHandler.
+    Each frame of a message is a record, they are returned one at a time.
+    """
+
+    def __init__(self, *args, **kwargs):
+        ZeroMQSubscriber.__init__(self, *args, **kwargs)
+        self._frames = deque()
+
+    def recv(self, timeout=None):
+        """
+        Receive a single record. Timeout of 0 means nonblocking, `None`
+        means blocking and otherwise it's a timeout in seconds after which
+        the function just returns with `None`.
+
+        :rtype: LogRecord or None
+        """
+        if not self._frames:
+            if timeout is None:
+                frames = self.socket.recv_multipart()
+            else:
+                if timeout and not zmq.select([self.socket], [], [],
+                                              timeout)[0]:
+                    return None
+                try:
+                    frames = self.socket.recv_multipart(zmq.NOBLOCK)
+                except zmq.Again:
+                    return None
+            self._frames.extend(frames)
+        return LogRecord.from_dict(json.loads(self._frames.popleft()))
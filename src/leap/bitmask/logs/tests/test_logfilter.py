@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+# test_logfilter.py
+# Copyright (C) 2015 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the filter of the log window.
+"""
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+import logbook
+
+from leap.bitmask.logs.logfilter import (
+    LEVELS, IndexedRecord, LogFilter, get_display_level)
+from leap.common.testing.basetest import BaseLeapTest
+
+
+def make_entry(level, msg):
+    record = logbook.LogRecord("test", level, msg)
+    record.msg = msg
+    return IndexedRecord(record)
+
+
+class CountingEntry(object):
+    """
+    An IndexedRecord that counts the case insensitive searches of its text.
+    """
+
+    def __init__(self, entry):
+        self._entry = entry
+        self.searches = 0
+
+    def __getattr__(self, name):
+        if name == "lowered":
+            self.searches += 1
+        return getattr(self._entry, name)
+
+    def __setattr__(self, name, value):
+        if name in ("generation", "accepted"):
+            setattr(self._entry, name, value)
+        else:
+            object.__setattr__(self, name, value)
+
+
+class LogFilterTest(BaseLeapTest):
+
+    def setUp(self):
+        self.entries = [
+            make_entry(logbook.DEBUG, u"Connecting to the Provider"),
+            make_entry(logbook.INFO, u"Provider bootstrapped"),
+            make_entry(logbook.WARNING, u"Slow provider"),
+            make_entry(logbook.ERROR, u"Cannot connect"),
+            make_entry(logbook.NOTICE, u"Notice: connected"),
+        ]
+        self.filter = LogFilter()
+
+    def tearDown(self):
+        pass
+
+    def _shown(self):
+        return [entry.text for entry in self.entries
+                if self.filter.accepts(entry)]
+
+    def test_display_levels(self):
+        self.assertEqual(get_display_level(logbook.NOTICE), logbook.INFO)
+        self.assertEqual(get_display_level(logbook.TRACE), logbook.DEBUG)
+        self.assertEqual(get_display_level(logbook.CRITICAL),
+                         logbook.CRITICAL)
+
+    def test_text_and_case(self):
+        self.assertEqual(len(self._shown()), 5)
+
+        self.assertTrue(self.filter.set(u"PROVIDER", True, LEVELS))
+        self.assertEqual(self._shown(), [u"Connecting to the Provider",
+                                         u"Provider bootstrapped",
+                                         u"Slow provider"])
+
+        self.assertTrue(self.filter.set(u"Provider", False, LEVELS))
+        self.assertEqual(self._shown(), [u"Connecting to the Provider",
+                                         u"Provider bootstrapped"])
+        self.assertFalse(self.filter.set(u"Provider", False, LEVELS))
+
+    def test_levels(self):
+        self.filter.set(u"", True, [logbook.INFO, logbook.ERROR])
+        self.assertEqual(self._shown(), [u"Provider bootstrapped",
+                                         u"Cannot connect",
+                                         u"Notice: connected"])
+
+        # showing more levels again
+        self.filter.set(u"", True, LEVELS)
+        self.assertEqual(len(self._shown()), 5)
+
+    def test_stricter_filter_skips_rejected_records(self):
+        self.entries = [CountingEntry(entry) for entry in self.entries]
+        self.filter.set(u"ot", True, LEVELS)
+        self.assertEqual(self._shown(), [u"Provider bootstrapped",
+                                         u"Cannot connect",
+                                         u"Notice: connected"])
+        self.assertEqual(sum(entry.searches for entry in self.entries), 5)
+
+        # typing more text only searches the ones shown
+        self.filter.set(u"ots", True, LEVELS)
+        self.assertEqual(self._shown(), [u"Provider bootstrapped"])
+        self.assertEqual(sum(entry.searches for entry in self.entries), 8)
+
+        # asking again doesn't search
+        self._shown()
+        self.assertEqual(sum(entry.searches for entry in self.entries), 8)
+
+        # deleting text searches all of them again
+        self.filter.set(u"o", True, LEVELS)
+        self.assertEqual(len(self._shown()), 5)
+        self.assertEqual(sum(entry.searches for entry in self.entries), 13)
+
+
+if __name__ == "__main__":
+    unittest.main()
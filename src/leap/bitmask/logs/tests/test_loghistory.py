@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+# test_loghistory.py
+# Copyright (C) 2015 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the log history.
+"""
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from datetime import datetime, timedelta
+
+import logbook
+
+from leap.bitmask.logs.loghistory import LogHistory
+from leap.common.testing.basetest import BaseLeapTest
+
+START = datetime(2015, 1, 1)
+
+
+def make_record(second, msg=None):
+    record = logbook.LogRecord("test", logbook.INFO, msg or str(second))
+    record.time = START + timedelta(seconds=second)
+    return record
+
+
+def replay(rows, insertion):
+    """
+    Apply an insertion to a list of rows, like the log window does.
+    """
+    del rows[:insertion.evicted]
+    rows.insert(insertion.row, insertion.record)
+    return rows
+
+
+class LogHistoryTest(BaseLeapTest):
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def _messages(self, history):
+        return [record.msg for record in history.get_records()]
+
+    def test_late_records_are_inserted_at_their_place(self):
+        history = LogHistory()
+        rows = []
+        for second in (1, 2, 5, 3, 4, 0, 6):
+            insertion = history.add(make_record(second))
+            replay(rows, insertion)
+            self.assertEqual(insertion.count, len(rows))
+
+        self.assertEqual(self._messages(history),
+                         ["0", "1", "2", "3", "4", "5", "6"])
+        self.assertEqual(rows, history.get_records())
+
+    def test_same_time_keeps_arrival_order(self):
+        history = LogHistory()
+        for msg in ("a", "b", "c"):
+            history.add(make_record(1, msg))
+        self.assertEqual(self._messages(history), ["a", "b", "c"])
+
+    def test_oldest_records_are_dropped(self):
+        history = LogHistory(max_records=10)
+        rows = []
+        for second in range(100):
+            replay(rows, history.add(make_record(second)))
+        # a late one
+        replay(rows, history.add(make_record(95.5)))
+
+        self.assertEqual(len(history), 10)
+        self.assertEqual(self._messages(history),
+                         [str(second) for second in range(91, 96)] +
+                         ["95.5"] +
+                         [str(second) for second in range(96, 100)])
+        self.assertEqual(rows, history.get_records())
+
+        # too old to be kept
+        self.assertEqual(history.add(make_record(3)), None)
+        self.assertEqual(len(history), 10)
+
+    def test_memory_budget(self):
+        overhead = LogHistory.RECORD_OVERHEAD
+        history = LogHistory(max_bytes=(overhead + 10) * 5)
+        for second in range(20):
+            history.add(make_record(second, "%010d" % second))
+        self.assertEqual(len(history), 5)
+
+        history.add(make_record(20, "x" * 30))
+        self.assertEqual(len(history), 4)
+
+    def test_snapshot_sequence(self):
+        history = LogHistory()
+        first = history.add(make_record(1))
+        sequence, records = history.snapshot()
+        last = history.add(make_record(2))
+
+        self.assertEqual(len(records), 1)
+        self.assertTrue(first.sequence <= sequence < last.sequence)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+# test_safezmqhandler.py
+# Copyright (C) 2015 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the zmq log handler.
+"""
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+import threading
+import time
+
+import logbook
+import zmq
+
+from leap.bitmask.logs.safezmqhandler import (
+    BatchZMQSubscriber, SafeZMQHandler)
+from leap.common.testing.basetest import BaseLeapTest
+
+
+class SafeZMQHandlerTest(BaseLeapTest):
+
+    def setUp(self):
+        self.context = zmq.Context()
+        self.subscriber = BatchZMQSubscriber(
+            'tcp://127.0.0.1:*', context=self.context, multi=True)
+        self.uri = self.subscriber.socket.getsockopt(zmq.LAST_ENDPOINT)
+        self.logger = logbook.Logger("test")
+
+    def tearDown(self):
+        self.subscriber.close()
+        self.context.term()
+
+    def _receive(self, count):
+        records = []
+        while len(records) < count:
+            record = self.subscriber.recv(timeout=5)
+            self.assertTrue(record is not None)
+            records.append(record)
+        return records
+
+    def test_records_from_many_threads_are_received(self):
+        handler = SafeZMQHandler(self.uri, context=self.context, multi=True)
+
+        def log(thread):
+            with handler.applicationbound():
+                for number in range(100):
+                    self.logger.info("thread %s record %s" % (thread, number))
+
+        threads = [threading.Thread(target=log, args=(thread,))
+                   for thread in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        records = self._receive(400)
+        handler.close()
+        self.assertEqual(handler.dropped, 0)
+        for thread in range(4):
+            messages = [record.message for record in records
+                        if record.message.startswith("thread %s " % thread)]
+            self.assertEqual(
+                messages,
+                ["thread %s record %s" % (thread, number)
+                 for number in range(100)])
+
+    def test_records_are_sent_in_batches(self):
+        handler = SafeZMQHandler(self.uri, context=self.context, multi=True)
+        with handler.applicationbound():
+            for number in range(10):
+                self.logger.warning("record %s" % (number,))
+
+        frames = self.subscriber.socket.recv_multipart()
+        handler.close()
+        self.assertEqual(len(frames), 10)
+
+    def test_unserializable_values(self):
+        handler = SafeZMQHandler(self.uri, context=self.context, multi=True)
+        with handler.applicationbound():
+            self.logger.info("bytes {0}", "\xff")
+            self.logger.info("objects", extra={"key": object()})
+
+        records = self._receive(2)
+        handler.close()
+        self.assertEqual(records[1].message, "objects")
+
+    def test_logging_does_not_block_without_subscriber(self):
+        self.subscriber.close()
+        handler = SafeZMQHandler('tcp://127.0.0.1:1', context=self.context,
+                                 multi=True)
+
+        start = time.time()
+        with handler.applicationbound():
+            for number in range(SafeZMQHandler.MAX_QUEUED + 1000):
+                self.logger.info("record %s" % (number,))
+        handler.close()
+
+        self.assertTrue(time.time() - start < 10)
+        self.assertTrue(handler.dropped > 0)
+
+    def test_records_queued_behind_a_drained_queue_are_sent(self):
+        handler = SafeZMQHandler(self.uri, context=self.context, multi=True)
+        try:
+            with handler.applicationbound():
+                self.logger.info("first")
+                self._receive(1)
+
+                # a thread saw this record queued, then the sender drained
+                # the queue and went back to wait before the thread appended
+                # its own
+                stale = logbook.LogRecord("test", logbook.INFO, "stale")
+                handler._queue.append(handler.export_record(stale))
+                self.logger.info("second")
+
+                records = self._receive(2)
+        finally:
+            handler.close()
+        self.assertEqual([record.message for record in records],
+                         ["stale", "second"])
+
+    def test_close_sends_the_queued_records(self):
+        handler = SafeZMQHandler(self.uri, context=self.context, multi=True)
+        with handler.applicationbound():
+            for number in range(50):
+                self.logger.info("record %s" % (number,))
+        handler.close()
+
+        records = self._receive(50)
+        self.assertEqual(records[-1].message, "record 49")
+
+    def test_sender_ends_quietly_at_teardown(self):
+        class TornDownSocket(object):
+            # what is left of the socket when the interpreter shuts down
+
+            def send_multipart(self, frames, flags=0):
+                raise TypeError("'NoneType' object is not callable")
+
+            def close(self, linger=None):
+                raise TypeError("'NoneType' object is not callable")
+
+        handler = SafeZMQHandler(self.uri, context=self.context, multi=True)
+        handler._get_new_socket = TornDownSocket
+        handler._queue.append({"msg": "record"})
+        handler._stopping = True
+
+        # no exception escapes the thread
+        handler._send_loop()
+        self.assertFalse(handler._queue)
+
+
+if __name__ == "__main__":
+    unittest.main()
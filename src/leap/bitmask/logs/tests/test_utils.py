@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+# test_utils.py
+# Copyright (C) 2015 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the log utilities.
+"""
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+import logbook
+
+from mock import patch
+
+from leap.bitmask.config import flags
+from leap.bitmask.logs import utils
+from leap.common.testing.basetest import BaseLeapTest
+
+
+def get_handlers():
+    return list(logbook.Handler.stack_manager.iter_context_objects())
+
+
+class GetLoggerTest(BaseLeapTest):
+
+    def setUp(self):
+        self._debug = flags.DEBUG
+
+    def tearDown(self):
+        flags.DEBUG = self._debug
+
+    def test_handlers_are_set_up_once(self):
+        utils.get_logger()
+        handlers = get_handlers()
+
+        for number in range(10):
+            eval("get_logger()", {"__name__": "leap.test%s" % (number,),
+                                  "get_logger": utils.get_logger})
+        self.assertEqual(get_handlers(), handlers)
+
+    def test_logger_of_the_module(self):
+        logger = utils.get_logger()
+        self.assertEqual(logger.name, __name__)
+        self.assertTrue(utils.get_logger() is logger)
+
+    def test_level_follows_the_debug_flag(self):
+        flags.DEBUG = False
+        utils.get_logger()
+        self.assertEqual(utils._pipeline.stream_handler.level,
+                         logbook.WARNING)
+        flags.DEBUG = True
+        utils.get_logger()
+        self.assertEqual(utils._pipeline.stream_handler.level,
+                         logbook.NOTSET)
+        self.assertEqual(utils._pipeline.zmq_handler.level, logbook.NOTSET)
+
+    def test_zmq_handler_is_closed_at_exit(self):
+        with patch.object(utils.atexit, "register") as register:
+            pipeline = utils._LogPipeline()
+            pipeline.pop()
+        register.assert_called_once_with(pipeline.close)
+
+        with patch.object(pipeline.zmq_handler, "close") as close:
+            pipeline.close()
+            close.assert_called_once_with(pipeline.CLOSE_TIMEOUT)
+
+
+if __name__ == "__main__":
+    unittest.main()
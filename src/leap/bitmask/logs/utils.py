@@ -18,13 +18,17 @@
 Logs utilities
 """
 
+import atexit
 import os
 import sys
+import threading
 
 from leap.bitmask.config import flags
 from leap.bitmask.logs import LOG_FORMAT
 from leap.bitmask.logs.log_silencer import SelectiveSilencerFilter
-from leap.bitmask.logs.safezmqhandler import SafeZMQHandler
+from leap.bitmask.logs.loghistory import LogHistory
+from leap.bitmask.logs.safezmqhandler import (
+    BatchZMQSubscriber, SafeZMQHandler)
 # from leap.bitmask.logs.streamtologger import StreamToLogger
 from leap.bitmask.platform_init import IS_WIN
 from leap.bitmask.util import get_path_prefix
@@ -34,55 +38,117 @@ from PySide import QtCore
 
 import logbook
 from logbook.more import ColorizedStderrHandler
-from logbook.queues import ZeroMQSubscriber
 
 
-def get_logger(perform_rollover=False):
+class _LogPipeline(object):
     """
-    Push to the app stack the needed handlers and return a Logger object.
-
-    :rtype: logbook.Logger
+    The handlers every log record goes through, set up once per process.
     """
-    # NOTE: make sure that the folder exists, the logger is created before
-    # saving settings on the first run.
-    _base = os.path.join(get_path_prefix(), "leap")
-    mkdir_p(_base)
-    bitmask_log_file = os.path.join(_base, 'bitmask.log')
 
-    level = logbook.WARNING
-    if flags.DEBUG:
-        level = logbook.NOTSET
+    # seconds to wait at exit for the zmq handler to send its records
+    CLOSE_TIMEOUT = 2
+
+    def __init__(self):
+        # NOTE: make sure that the folder exists, the logger is created before
+        # saving settings on the first run.
+        _base = os.path.join(get_path_prefix(), "leap")
+        mkdir_p(_base)
+        bitmask_log_file = os.path.join(_base, 'bitmask.log')
+
+        # the handlers of a forked process can't be used, see get_logger
+        self.pid = os.getpid()
+
+        # This handler consumes logs not handled by the others
+        null_handler = logbook.NullHandler()
+
+        silencer = SelectiveSilencerFilter()
+
+        self.zmq_handler = SafeZMQHandler(
+            'tcp://127.0.0.1:5000', multi=True, filter=silencer.filter)
+
+        self.file_handler = logbook.RotatingFileHandler(
+            bitmask_log_file, format_string=LOG_FORMAT, bubble=True,
+            filter=silencer.filter, max_size=sys.maxint)
+
+        # don't use simple stream, go for colored log handler instead
+        # stream_handler = logbook.StreamHandler(sys.stdout,
+        #                                        format_string=LOG_FORMAT,
+        #                                        bubble=True)
+        self.stream_handler = ColorizedStderrHandler(
+            format_string=LOG_FORMAT, bubble=True, filter=silencer.filter)
+
+        self.handlers = (null_handler, self.zmq_handler, self.file_handler,
+                         self.stream_handler)
+        for handler in self.handlers:
+            handler.push_application()
+
+        # the records still queued in the zmq handler are sent before exiting
+        atexit.register(self.close)
+
+    def set_level(self, level):
+        """
+        Set the level of the zmq and the stream handlers, the log file gets
+        everything.
+
+        :param level: the logbook level.
+        :type level: int
+        """
+        self.zmq_handler.level = level
+        self.stream_handler.level = level
+
+    def pop(self):
+        """
+        Remove the handlers from the application stack.
+        """
+        for handler in reversed(self.handlers):
+            handler.pop_application()
 
-    # This handler consumes logs not handled by the others
-    null_handler = logbook.NullHandler()
-    null_handler.push_application()
+    def close(self):
+        """
+        Send what the zmq handler has queued and stop its thread, in the
+        process that set up the handlers.
+        """
+        if os.getpid() == self.pid:
+            self.zmq_handler.close(self.CLOSE_TIMEOUT)
 
-    silencer = SelectiveSilencerFilter()
 
-    zmq_handler = SafeZMQHandler('tcp://127.0.0.1:5000', multi=True,
-                                 level=level, filter=silencer.filter)
-    zmq_handler.push_application()
+_pipeline = None
+_pipeline_lock = threading.Lock()
+_loggers = {}
 
-    file_handler = logbook.RotatingFileHandler(
-        bitmask_log_file, format_string=LOG_FORMAT, bubble=True,
-        filter=silencer.filter, max_size=sys.maxint)
 
-    if perform_rollover:
-        file_handler.perform_rollover()
+def get_logger(perform_rollover=False):
+    """
+    Return a Logger object for the calling module.
 
-    file_handler.push_application()
+    The log handlers are set up by the first call in the process, the
+    following ones only update their level from flags.DEBUG.
 
-    # don't use simple stream, go for colored log handler instead
-    # stream_handler = logbook.StreamHandler(sys.stdout,
-    #                                        format_string=LOG_FORMAT,
-    #                                        bubble=True)
-    # stream_handler.push_application()
-    stream_handler = ColorizedStderrHandler(
-        level=level, format_string=LOG_FORMAT, bubble=True,
-        filter=silencer.filter)
-    stream_handler.push_application()
+    :param perform_rollover: whether to rotate the log file.
+    :type perform_rollover: bool
 
-    logger = logbook.Logger('leap')
+    :rtype: logbook.Logger
+    """
+    global _pipeline
+
+    level = logbook.WARNING
+    if flags.DEBUG:
+        level = logbook.NOTSET
+
+    with _pipeline_lock:
+        if _pipeline is None or _pipeline.pid != os.getpid():
+            # a process forked from another one sets up its own handlers
+            if _pipeline is not None:
+                _pipeline.pop()
+            _pipeline = _LogPipeline()
+        _pipeline.set_level(level)
+        if perform_rollover:
+            _pipeline.file_handler.perform_rollover()
+
+        name = sys._getframe(1).f_globals.get('__name__', 'leap')
+        logger = _loggers.get(name)
+        if logger is None:
+            logger = _loggers[name] = logbook.Logger(name)
 
     return logger
 
@@ -144,13 +210,24 @@ class QtLogHandler(logbook.Handler, logbook.StringFormatterHandlerMixin):
             QtCore.QObject.emit(self, QtCore.SIGNAL('new_log(PyObject)'), data)
 
     def __init__(self, level=logbook.NOTSET, format_string=None,
-                 encoding=None, filter=None, bubble=False):
+                 encoding=None, filter=None, bubble=False,
+                 max_records=LogHistory.MAX_RECORDS, max_bytes=None):
+        """
+        Constructor for the Qt log handler.
 
+        :param max_records: the number of records kept in the history.
+        :type max_records: int
+        :param max_bytes: an estimate of the memory the history can take, no
+                          limit if None.
+        :type max_bytes: int or None
+
+        The rest of the parameters are those of logbook.Handler.
+        """
         logbook.Handler.__init__(self, level, filter, bubble)
         logbook.StringFormatterHandlerMixin.__init__(self, format_string)
 
         self.qt = self._QtSignaler()
-        self.logs = []
+        self.history = LogHistory(max_records, max_bytes)
 
     def __enter__(self):
         return logbook.Handler.__enter__(self)
@@ -160,28 +237,19 @@ class QtLogHandler(logbook.Handler, logbook.StringFormatterHandlerMixin):
 
     def emit(self, record):
         """
-        Emit the specified logging record using a Qt Signal.
-        Also add it to the history in order to be able to access it later.
+        Add the record to the history and emit where it was inserted using a
+        Qt Signal.
+
+        Logs transmitted over zmq may arrive unsorted, the late ones are
+        inserted at their place in the history, see LogHistory.add.
 
         :param record: the record to emit
         :type record: logbook.LogRecord
         """
-        global _LOGS_HISTORY
         record.msg = self.format(record)
-        # NOTE: not optimal approach, we may want to look at
-        # bisect.insort with a custom approach to use key or
-        # http://code.activestate.com/recipes/577197-sortedcollection/
-        # Sort logs on arrival, logs transmitted over zmq may arrive unsorted.
-        self.logs.append(record)
-        self.logs = sorted(self.logs, key=lambda r: r.time)
-
-        # XXX: emitting the record on arrival does not allow us to sort here so
-        # in the GUI the logs may arrive with with some time sort problem.
-        # We should implement a sort-on-arrive for the log window.
-        # Maybe we should switch to a tablewidget item that sort automatically
-        # by timestamp.
-        # As a user workaround you can close/open the log window
-        self.qt.emit(record)
+        insertion = self.history.add(record)
+        if insertion is not None:
+            self.qt.emit(insertion)
 
 
 class _LogController(object):
@@ -196,7 +264,8 @@ class _LogController(object):
         Run in the background the log receiver.
         """
         if self._logbook_controller is None:
-            subscriber = ZeroMQSubscriber('tcp://127.0.0.1:5000', multi=True)
+            subscriber = BatchZMQSubscriber('tcp://127.0.0.1:5000',
+                                            multi=True)
             self._logbook_controller = subscriber.dispatch_in_background(
                 self._qt_handler)
 
@@ -213,7 +282,16 @@ class _LogController(object):
             self._logbook_controller = None
 
     def get_logs(self):
-        return self._qt_handler.logs
+        return self._qt_handler.history.get_records()
+
+    def get_history(self):
+        """
+        Return the history of logs, to follow it along with the insertions
+        emitted by `new_log`.
+
+        :rtype: LogHistory
+        """
+        return self._qt_handler.history
 
 # use a global variable to store received logs through different opened
 # instances of the log window as well as to containing the logbook background
@@ -17,24 +17,26 @@
 """
 Provider bootstrapping
 """
-import socket
 import os
 import sys
+import time
 
 import requests
 
 from leap.bitmask import provider
 from leap.bitmask import util
+from leap.bitmask.backend.settings import Settings
 from leap.bitmask.config import flags
 from leap.bitmask.config.providerconfig import ProviderConfig, MissingCACert
+from leap.bitmask.crypto.certstore import get_cert_store
 from leap.bitmask.logs.utils import get_logger
 from leap.bitmask.provider import get_provider_path
 from leap.bitmask.provider.pinned import PinnedProviders
 from leap.bitmask.services.abstractbootstrapper import AbstractBootstrapper
-from leap.bitmask.util.constants import REQUEST_TIMEOUT
+from leap.bitmask.util import retry
 from leap.bitmask.util.request_helpers import get_content
+from leap.bitmask.util.resolver import get_resolver
 from leap.common import ca_bundle
-from leap.common.certs import get_digest
 from leap.common.check import leap_assert, leap_assert_type, leap_check
 from leap.common.files import check_and_fix_urw_only, get_mtime, mkdir_p
 
@@ -72,6 +74,10 @@ class ProviderBootstrapper(AbstractBootstrapper):
 
     MIN_CLIENT_VERSION = 'x-minimum-client-version'
 
+    # Groups of checks whose success we remember, see `is_verified`.
+    STAGE_SELECT = "select"
+    STAGE_SETUP = "setup"
+
     def __init__(self, signaler=None, bypass_checks=False):
         """
         Constructor for provider bootstrapper object
@@ -89,6 +95,7 @@ class ProviderBootstrapper(AbstractBootstrapper):
         self._domain = None
         self._provider_config = None
         self._download_if_needed = False
+        self._settings = Settings()
         if signaler is not None:
             self._cancel_signal = signaler.prov_cancelled_setup
 
@@ -123,7 +130,9 @@ class ProviderBootstrapper(AbstractBootstrapper):
         # system to work
         # err --- but we can do it after a failure, to diagnose what went
         # wrong. Right now we're just adding connection overhead. -- kali
-        socket.gethostbyname(self._domain.encode('idna'))
+        # The answer is cached, so later lookups for the same domain are
+        # free, and a broken resolver fails after a deadline.
+        get_resolver().blocking_resolve(self._domain)
 
     def _check_https(self, *args):
         """
@@ -144,8 +153,7 @@ class ProviderBootstrapper(AbstractBootstrapper):
 
         try:
             uri = "https://{0}".format(self._domain.encode('idna'))
-            res = self._session.get(uri, verify=verify,
-                                    timeout=REQUEST_TIMEOUT)
+            res = retry.request(self._session, "GET", uri, verify=verify)
             res.raise_for_status()
         except requests.exceptions.SSLError as exc:
             self._err_msg = self.tr("Provider certificate could "
@@ -208,8 +216,8 @@ class ProviderBootstrapper(AbstractBootstrapper):
         logger.debug("Requesting for provider.json... "
                      "uri: {0}, verify: {1}, headers: {2}".format(
                          uri, verify, headers))
-        res = self._session.get(uri.encode('idna'), verify=verify,
-                                headers=headers, timeout=REQUEST_TIMEOUT)
+        res = retry.request(self._session, "GET", uri.encode('idna'),
+                            verify=verify, headers=headers)
         res.raise_for_status()
         logger.debug("Request status code: {0}".format(res.status_code))
 
@@ -254,7 +262,94 @@ class ProviderBootstrapper(AbstractBootstrapper):
                             self._signaler.prov_unsupported_api)
                     raise UnsupportedProviderAPI(error)
 
-    def run_provider_select_checks(self, domain, download_if_needed=False):
+    def _get_stage_signals(self, stage):
+        """
+        Return the signals emitted by the checks of a stage, in order.
+
+        :param stage: STAGE_SELECT or STAGE_SETUP
+        :type stage: str
+        :rtype: list
+        """
+        if self._signaler is None:
+            return [None, None, None]
+
+        if stage == self.STAGE_SELECT:
+            return [self._signaler.prov_name_resolution,
+                    self._signaler.prov_https_connection,
+                    self._signaler.prov_download_provider_info]
+        return [self._signaler.prov_download_ca_cert,
+                self._signaler.prov_check_ca_fingerprint,
+                self._signaler.prov_check_api_certificate]
+
+    def is_verified(self, domain, stage):
+        """
+        Return True if the checks of the given stage passed for this
+        provider less than the configured TTL ago and the data they
+        verified is still on disk.
+
+        :param domain: domain of the provider
+        :type domain: unicode
+        :param stage: STAGE_SELECT or STAGE_SETUP
+        :type stage: str
+        :rtype: bool
+        """
+        domain = ProviderConfig.sanitize_path_component(domain)
+        ttl = self._settings.get_provider_verified_ttl(domain)
+        verified = self._settings.get_provider_verified(domain, stage)
+        if verified is None or not (0 <= time.time() - verified < ttl):
+            return False
+
+        provider_config = ProviderConfig.get_provider_config(domain)
+        if provider_config is None:
+            return False
+        if stage == self.STAGE_SETUP:
+            return os.path.isfile(
+                provider_config.get_ca_cert_path(about_to_download=True))
+        return True
+
+    def notify_verified(self, stage):
+        """
+        Emit the success signals of every check of the given stage, as if
+        they had just passed.
+
+        :param stage: STAGE_SELECT or STAGE_SETUP
+        :type stage: str
+        """
+        for signal in self._get_stage_signals(stage):
+            self._gui_notify(None, signal=signal)
+
+    def _set_verified(self, domain, stage, verified):
+        """
+        Remember whether the checks of a stage passed for a provider.
+        We don't trust the checks that were bypassed.
+        """
+        if not domain or (verified and self._bypass_checks):
+            return
+        timestamp = time.time() if verified else None
+        try:
+            self._settings.set_provider_verified(domain, stage, timestamp)
+        except IOError as e:
+            # we'll just run every check next time
+            logger.warning("Could not save the provider checks: %r" % (e,))
+
+    def _mark_select_verified(self, *args):
+        self._set_verified(self._domain, self.STAGE_SELECT, True)
+
+    def _get_config_domain(self):
+        """
+        Return the domain of the provider config, if it is loaded.
+
+        :rtype: unicode or None
+        """
+        if not self._provider_config.loaded():
+            return None
+        return self._provider_config.get_domain()
+
+    def _mark_setup_verified(self, *args):
+        self._set_verified(self._get_config_domain(), self.STAGE_SETUP, True)
+
+    def run_provider_select_checks(self, domain, download_if_needed=False,
+                                   notify_success=True):
         """
         Populates the check queue.
 
@@ -264,27 +359,26 @@ class ProviderBootstrapper(AbstractBootstrapper):
         :param download_if_needed: if True, makes the checks do not
                                    overwrite already downloaded data
         :type download_if_needed: bool
+        :param notify_success: if False, only failures are signaled.
+        :type notify_success: bool
         """
         leap_assert(domain and len(domain) > 0, "We need a domain!")
 
         self._domain = ProviderConfig.sanitize_path_component(domain)
         self._download_if_needed = download_if_needed
+        self._set_verified(self._domain, self.STAGE_SELECT, False)
 
-        name_resolution = None
-        https_connection = None
-        down_provider_info = None
-        if self._signaler is not None:
-            name_resolution = self._signaler.prov_name_resolution
-            https_connection = self._signaler.prov_https_connection
-            down_provider_info = self._signaler.prov_download_provider_info
+        name_resolution, https_connection, down_provider_info = \
+            self._get_stage_signals(self.STAGE_SELECT)
 
         cb_chain = [
             (self._check_name_resolution, name_resolution),
             (self._check_https, https_connection),
-            (self._download_provider_info, down_provider_info)
+            (self._download_provider_info, down_provider_info),
+            (self._mark_select_verified, None)
         ]
 
-        return self.addCallbackChain(cb_chain)
+        return self.addCallbackChain(cb_chain, notify_success)
 
     def _should_proceed_cert(self):
         """
@@ -319,9 +413,9 @@ class ProviderBootstrapper(AbstractBootstrapper):
                 .get_ca_cert_path(about_to_download=True))
             return
 
-        res = self._session.get(self._provider_config.get_ca_cert_uri(),
-                                verify=self.verify,
-                                timeout=REQUEST_TIMEOUT)
+        res = retry.request(self._session, "GET",
+                            self._provider_config.get_ca_cert_uri(),
+                            verify=self.verify)
         res.raise_for_status()
 
         cert_path = self._provider_config.get_ca_cert_path(
@@ -330,6 +424,7 @@ class ProviderBootstrapper(AbstractBootstrapper):
         mkdir_p(cert_dir)
         with open(cert_path, "w") as f:
             f.write(res.content)
+        get_cert_store().invalidate(cert_path)
 
         check_and_fix_urw_only(cert_path)
 
@@ -355,12 +450,10 @@ class ProviderBootstrapper(AbstractBootstrapper):
 
         method = parts[0].strip()
         fingerprint = parts[1].strip()
-        cert_data = None
-        with open(self._provider_config.get_ca_cert_path()) as f:
-            cert_data = f.read()
+        digest = get_cert_store().get_digest(
+            self._provider_config.get_ca_cert_path(), method)
 
-        leap_assert(len(cert_data) > 0, "Could not read certificate data")
-        digest = get_digest(cert_data, method)
+        leap_assert(digest is not None, "Could not read certificate data")
 
         error_msg = "Downloaded certificate has a different fingerprint!"
         leap_check(digest == fingerprint, error_msg, WrongFingerprint)
@@ -384,13 +477,43 @@ class ProviderBootstrapper(AbstractBootstrapper):
                                    self._provider_config.get_api_version())
         ca_cert_path = self._provider_config.get_ca_cert_path()
         ca_cert_path = ca_cert_path.encode(sys.getfilesystemencoding())
-        res = self._session.get(test_uri, verify=ca_cert_path,
-                                timeout=REQUEST_TIMEOUT)
+        res = retry.request(self._session, "GET", test_uri,
+                            verify=ca_cert_path)
         res.raise_for_status()
 
+    def refresh_provider(self, domain):
+        """
+        Download the provider definition if it was modified, and the CA
+        cert if we don't have it yet, without emitting any signal.
+
+        This is blocking, and meant to be run in a thread by the
+        background refresher.
+
+        :param domain: domain of the provider to refresh
+        :type domain: unicode
+
+        :returns: the refreshed provider configuration
+        :rtype: ProviderConfig
+        """
+        leap_assert(domain and len(domain) > 0, "We need a domain!")
+
+        self._domain = ProviderConfig.sanitize_path_component(domain)
+        self._download_if_needed = True
+        self._download_provider_info()
+
+        self._provider_config = ProviderConfig.get_provider_config(
+            self._domain)
+        leap_check(self._provider_config is not None,
+                   "Could not load the refreshed provider config")
+
+        self._download_ca_cert()
+        self._check_ca_fingerprint()
+        return self._provider_config
+
     def run_provider_setup_checks(self,
                                   provider_config,
-                                  download_if_needed=False):
+                                  download_if_needed=False,
+                                  notify_success=True):
         """
         Starts the checks needed for a new provider setup.
 
@@ -400,25 +523,24 @@ class ProviderBootstrapper(AbstractBootstrapper):
         :param download_if_needed: if True, makes the checks do not
                                    overwrite already downloaded data.
         :type download_if_needed: bool
+        :param notify_success: if False, only failures are signaled.
+        :type notify_success: bool
         """
         leap_assert(provider_config, "We need a provider config!")
         leap_assert_type(provider_config, ProviderConfig)
 
         self._provider_config = provider_config
         self._download_if_needed = download_if_needed
+        self._set_verified(self._get_config_domain(), self.STAGE_SETUP, False)
 
-        download_ca_cert = None
-        check_ca_fingerprint = None
-        check_api_certificate = None
-        if self._signaler is not None:
-            download_ca_cert = self._signaler.prov_download_ca_cert
-            check_ca_fingerprint = self._signaler.prov_check_ca_fingerprint
-            check_api_certificate = self._signaler.prov_check_api_certificate
+        download_ca_cert, check_ca_fingerprint, check_api_certificate = \
+            self._get_stage_signals(self.STAGE_SETUP)
 
         cb_chain = [
             (self._download_ca_cert, download_ca_cert),
             (self._check_ca_fingerprint, check_ca_fingerprint),
-            (self._check_api_certificate, check_api_certificate)
+            (self._check_api_certificate, check_api_certificate),
+            (self._mark_setup_verified, None)
         ]
 
-        return self.addCallbackChain(cb_chain)
+        return self.addCallbackChain(cb_chain, notify_success)
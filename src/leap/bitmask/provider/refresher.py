@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+# refresher.py
+# Copyright (C) 2015 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Background refresh of the definitions of the configured providers.
+"""
+import os
+import random
+
+import requests
+
+from requests.exceptions import ConnectionError, Timeout
+
+from twisted.internet import defer, reactor, threads
+
+from leap.bitmask.config import flags
+from leap.bitmask.config.leapsettings import LeapSettings
+from leap.bitmask.logs.utils import get_logger
+from leap.bitmask.provider import get_provider_path
+from leap.bitmask.provider.providerbootstrapper import ProviderBootstrapper
+from leap.bitmask.services import download_service_config, EIP_SERVICE
+from leap.bitmask.services.eip.eipconfig import EIPConfig, get_eipconfig_path
+from leap.bitmask.util import get_path_prefix
+
+logger = get_logger()
+
+
+class ProviderRefresher(object):
+    """
+    Periodically downloads provider.json, the CA certificate (if missing)
+    and eip-service.json for every configured provider, so login and
+    connect find fresh data on disk.
+
+    Providers are refreshed concurrently, but only a few at a time. The
+    schedule is jittered, it backs off while we are offline and it waits
+    while the backend is busy with user requests.
+
+    Signals:
+        prov_refreshed -> list of domains whose files changed
+    """
+
+    # Seconds between rounds.
+    INTERVAL = 6 * 60 * 60
+    # Seconds before the first round, the startup is busy enough.
+    INITIAL_DELAY = 5 * 60
+    # Max seconds between rounds while we keep failing to connect.
+    MAX_INTERVAL = 24 * 60 * 60
+    # Seconds to wait before trying again if the backend is busy.
+    BUSY_DELAY = 60
+    # The delays are randomized by +/- this fraction.
+    JITTER = 0.1
+    # Max number of providers refreshed at the same time.
+    MAX_CONCURRENT = 2
+
+    def __init__(self, signaler=None, is_busy=None, clock=None):
+        """
+        Constructor for the provider refresher.
+
+        :param signaler: Object in charge of handling communication
+                         back to the frontend
+        :type signaler: Signaler
+        :param is_busy: callable that returns True if the backend is
+                        doing something on behalf of the user.
+        :type is_busy: callable
+        :param clock: provider of callLater, used for testing.
+        :type clock: twisted.internet.interfaces.IReactorTime
+        """
+        if clock is None:
+            clock = reactor
+        if is_busy is None:
+            is_busy = lambda: False
+
+        self._signaler = signaler
+        self._is_busy = is_busy
+        self._clock = clock
+        self._semaphore = defer.DeferredSemaphore(self.MAX_CONCURRENT)
+        self._interval = self.INTERVAL
+        self._delayed_call = None
+        self._running = None
+        self._last_refresh = {}
+
+    def start(self):
+        """
+        Schedule the background refresh.
+        """
+        self._schedule(self.INITIAL_DELAY)
+
+    def stop(self):
+        """
+        Stop refreshing. A round in progress finishes on its own.
+        """
+        if self._delayed_call is not None and self._delayed_call.active():
+            self._delayed_call.cancel()
+        self._delayed_call = None
+
+    def get_last_refresh(self, domain):
+        """
+        Return when the given provider was last refreshed successfully.
+
+        :param domain: the provider domain
+        :type domain: str
+        :returns: a timestamp, or None if it was never refreshed.
+        :rtype: float or None
+        """
+        return self._last_refresh.get(domain)
+
+    def _schedule(self, delay):
+        self.stop()
+        delay *= random.uniform(1 - self.JITTER, 1 + self.JITTER)
+        self._delayed_call = self._clock.callLater(delay, self._tick)
+
+    def _tick(self):
+        self._delayed_call = None
+
+        if flags.OFFLINE or self._is_busy():
+            self._schedule(self.BUSY_DELAY)
+            return
+
+        d = self.refresh_all()
+        d.addCallback(lambda _: self._schedule(self._interval))
+
+    def refresh_all(self):
+        """
+        Refresh all the configured providers.
+
+        :returns: a deferred that fires with the list of changed domains
+                  once every provider has been processed.
+        :rtype: twisted.internet.defer.Deferred
+        """
+        if self._running is not None:
+            return self._running
+
+        domains = LeapSettings().get_configured_providers()
+        deferreds = [self._semaphore.run(self._refresh, domain)
+                     for domain in domains]
+
+        d = defer.DeferredList(deferreds, consumeErrors=True)
+        self._running = d
+        d.addCallback(self._round_done, domains)
+        return d
+
+    def _refresh(self, domain):
+        # the bootstrapper is a QObject, create it in the reactor thread.
+        bootstrapper = ProviderBootstrapper()
+        return threads.deferToThread(self._refresh_provider,
+                                     bootstrapper, domain)
+
+    def _round_done(self, results, domains):
+        """
+        Adapt the interval and signal the changes, if any.
+
+        :param results: the results of the refresh of each provider.
+        :type results: list of tuple(bool, object)
+        :param domains: the refreshed domains, in the same order.
+        :type domains: list of str
+        """
+        self._running = None
+
+        changed = []
+        offline = len(results) > 0
+        for domain, (ok, result) in zip(domains, results):
+            if ok:
+                offline = False
+                self._last_refresh[domain] = self._clock.seconds()
+                if result:
+                    changed.append(domain)
+            elif result.check(ConnectionError, Timeout):
+                logger.debug("Could not refresh %s, offline?" % (domain,))
+            else:
+                offline = False
+                logger.warning("Error refreshing provider %s: %r" %
+                               (domain, result.value))
+
+        if offline:
+            self._interval = min(self._interval * 2, self.MAX_INTERVAL)
+            logger.debug("Seems we are offline, next provider refresh in "
+                         "%s seconds." % (self._interval,))
+        else:
+            self._interval = self.INTERVAL
+
+        if changed and self._signaler is not None:
+            self._signaler.signal(self._signaler.prov_refreshed, changed)
+
+        return changed
+
+    def _get_paths(self, domain):
+        """
+        Return the paths of the files we refresh for a provider.
+
+        :param domain: the provider domain
+        :type domain: str
+        :rtype: list of str
+        """
+        prefix = get_path_prefix()
+        return [
+            os.path.join(prefix, get_provider_path(domain)),
+            os.path.join(prefix, "leap", "providers", domain,
+                         "keys", "ca", "cacert.pem"),
+            get_eipconfig_path(domain, relative=False),
+        ]
+
+    def _snapshot(self, domain):
+        """
+        Return the modification times of the refreshed files.
+
+        :param domain: the provider domain
+        :type domain: str
+        :rtype: list of float or None
+        """
+        snapshot = []
+        for path in self._get_paths(domain):
+            try:
+                snapshot.append(os.path.getmtime(path))
+            except OSError:
+                snapshot.append(None)
+        return snapshot
+
+    def _refresh_provider(self, bootstrapper, domain):
+        """
+        Refresh the files of a provider. This is blocking.
+
+        :param bootstrapper: the bootstrapper to download with.
+        :type bootstrapper: ProviderBootstrapper
+        :param domain: the provider domain
+        :type domain: str
+
+        :returns: whether any of the files changed.
+        :rtype: bool
+        """
+        logger.debug("Refreshing provider %s in the background" % (domain,))
+        before = self._snapshot(domain)
+
+        provider_config = bootstrapper.refresh_provider(domain)
+
+        if EIP_SERVICE in provider_config.get_services():
+            # The eip-service.json is public, we don't send the credentials
+            # since we might not be logged in this provider.
+            download_service_config(provider_config, EIPConfig(),
+                                    requests.session(),
+                                    download_if_needed=True,
+                                    anonymous=True)
+
+        return self._snapshot(domain) != before
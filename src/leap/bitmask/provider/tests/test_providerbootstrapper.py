@@ -43,6 +43,7 @@ from leap.bitmask.crypto.tests import fake_provider
 from leap.bitmask.provider.providerbootstrapper import ProviderBootstrapper
 from leap.bitmask.provider.providerbootstrapper import UnsupportedProviderAPI
 from leap.bitmask.provider.providerbootstrapper import WrongFingerprint
+from leap.bitmask.util import retry
 from leap.common.files import mkdir_p
 from leap.common.testing.basetest import BaseLeapTest
 from leap.common.testing.https_server import where
@@ -50,6 +51,7 @@ from leap.common.testing.https_server import where
 
 class ProviderBootstrapperTest(BaseLeapTest):
     def setUp(self):
+        retry.reset_breakers()
         self.pb = ProviderBootstrapper()
 
     def tearDown(self):
@@ -97,6 +99,50 @@ class ProviderBootstrapperTest(BaseLeapTest):
         d.addCallback(check)
         return d
 
+    def test_is_verified(self):
+        self.pb._settings = mock.MagicMock()
+        self.pb._settings.get_provider_verified_ttl.return_value = 60
+        provider_config = mock.MagicMock()
+        provider_config.get_ca_cert_path.return_value = "/nonexistent"
+
+        with mock.patch.object(ProviderConfig, "get_provider_config",
+                               return_value=provider_config):
+            self.pb._settings.get_provider_verified.return_value = None
+            self.assertFalse(self.pb.is_verified(
+                "somedomain", self.pb.STAGE_SELECT))
+
+            self.pb._settings.get_provider_verified.return_value = \
+                time.time() - 120
+            self.assertFalse(self.pb.is_verified(
+                "somedomain", self.pb.STAGE_SELECT))
+
+            self.pb._settings.get_provider_verified.return_value = \
+                time.time() - 30
+            self.assertTrue(self.pb.is_verified(
+                "somedomain", self.pb.STAGE_SELECT))
+
+            # the ca cert is gone, it has to be downloaded again
+            self.assertFalse(self.pb.is_verified(
+                "somedomain", self.pb.STAGE_SETUP))
+
+    @deferred()
+    def test_run_provider_select_checks_marks_verified(self):
+        self.pb._settings = mock.MagicMock()
+        self.pb._check_name_resolution = mock.MagicMock()
+        self.pb._check_https = mock.MagicMock()
+        self.pb._download_provider_info = mock.MagicMock()
+
+        d = self.pb.run_provider_select_checks("somedomain")
+
+        def check(*args):
+            calls = self.pb._settings.set_provider_verified.call_args_list
+            self.assertEqual(len(calls), 2)
+            # invalidated at the start, marked at the end
+            self.assertIsNone(calls[0][0][2])
+            self.assertIsNotNone(calls[1][0][2])
+        d.addCallback(check)
+        return d
+
     def test_should_proceed_cert(self):
         self.pb._provider_config = mock.Mock()
         self.pb._provider_config.get_ca_cert_path = mock.MagicMock(
@@ -307,6 +353,7 @@ class ProviderBootstrapperActiveTest(unittest.TestCase):
         cls.https_port = get_port(https)
 
     def setUp(self):
+        retry.reset_breakers()
         self.pb = ProviderBootstrapper()
 
         # At certain points we are going to be replacing these methods
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+# test_refresher.py
+# Copyright (C) 2015 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the background provider refresher.
+"""
+import mock
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from requests.exceptions import ConnectionError
+from twisted.internet import defer, task
+from twisted.python.failure import Failure
+
+from leap.bitmask.provider.refresher import ProviderRefresher
+from leap.common.testing.basetest import BaseLeapTest
+
+
+class ProviderRefresherTest(BaseLeapTest):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.signaler = mock.Mock()
+        self.refresher = ProviderRefresher(self.signaler, clock=self.clock)
+
+    def tearDown(self):
+        self.refresher.stop()
+
+    def test_changed_providers_are_signaled(self):
+        results = [(True, True), (True, False)]
+        changed = self.refresher._round_done(
+            results, ["one.test", "two.test"])
+
+        self.assertEqual(changed, ["one.test"])
+        self.signaler.signal.assert_called_once_with(
+            self.signaler.prov_refreshed, ["one.test"])
+        self.assertEqual(self.refresher.get_last_refresh("two.test"), 0)
+
+    def test_backs_off_while_offline(self):
+        offline = [(False, Failure(ConnectionError()))]
+        self.refresher._round_done(offline, ["one.test"])
+        self.assertEqual(self.refresher._interval,
+                         ProviderRefresher.INTERVAL * 2)
+
+        for _ in range(10):
+            self.refresher._round_done(offline, ["one.test"])
+        self.assertEqual(self.refresher._interval,
+                         ProviderRefresher.MAX_INTERVAL)
+
+        self.refresher._round_done([(True, False)], ["one.test"])
+        self.assertEqual(self.refresher._interval,
+                         ProviderRefresher.INTERVAL)
+        self.assertFalse(self.signaler.signal.called)
+
+    def test_waits_while_busy(self):
+        busy = [True]
+        refresher = ProviderRefresher(is_busy=lambda: busy[0],
+                                      clock=self.clock)
+        refresher.refresh_all = mock.Mock(return_value=defer.succeed([]))
+        refresher.start()
+
+        self.clock.advance(ProviderRefresher.INITIAL_DELAY * 2)
+        self.assertFalse(refresher.refresh_all.called)
+
+        busy[0] = False
+        self.clock.advance(ProviderRefresher.BUSY_DELAY * 2)
+        self.assertTrue(refresher.refresh_all.called)
+        refresher.stop()
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -19,13 +19,14 @@ Services module.
 """
 import os
 import sys
+import time
 
 from PySide import QtCore
 
 from leap.bitmask.config import flags
 from leap.bitmask.crypto.srpauth import SRPAuth
 from leap.bitmask.logs.utils import get_logger
-from leap.bitmask.util.constants import REQUEST_TIMEOUT
+from leap.bitmask.util import retry
 from leap.bitmask.util.privilege_policies import is_missing_policy_permissions
 from leap.bitmask.util.request_helpers import get_content
 from leap.bitmask import util
@@ -41,6 +42,14 @@ EIP_SERVICE = u"openvpn"
 MX_SERVICE = u"mx"
 DEPLOYED = [EIP_SERVICE, MX_SERVICE]
 
+# Seconds a service config we just downloaded or checked is considered up
+# to date, so the bootstrappers don't ask again for what the post login
+# warm up has just fetched.
+FRESH_CONFIG_TIME = 60
+
+# service config path -> time it was last downloaded or checked
+_config_checked = {}
+
 
 def get_service_display_name(service):
     """
@@ -90,7 +99,8 @@ def get_supported(services):
 
 def download_service_config(provider_config, service_config,
                             session,
-                            download_if_needed=True):
+                            download_if_needed=True,
+                            anonymous=False):
     """
     Downloads config for a given service.
 
@@ -104,20 +114,32 @@ def download_service_config(provider_config, service_config,
                     (currently we're using requests only, but it can be
                     anything that implements that interface)
     :type session: requests.sessions.Session
+
+    :param anonymous: if True, do not send the credentials of the current
+                      session. Use it when downloading configs for a
+                      provider other than the one we are logged in.
+    :type anonymous: bool
     """
     service_name = service_config.name
     service_json = "{0}-service.json".format(service_name)
+    service_path = ("leap", "providers", provider_config.get_domain(),
+                    service_json)
+    full_path = os.path.join(util.get_path_prefix(), *service_path)
     headers = {}
-    mtime = get_mtime(os.path.join(util.get_path_prefix(),
-                                   "leap", "providers",
-                                   provider_config.get_domain(),
-                                   service_json))
+    mtime = get_mtime(full_path)
+
+    api_version = provider_config.get_api_version()
 
     if download_if_needed and mtime:
+        checked = _config_checked.get(full_path, 0)
+        if time.time() - checked < FRESH_CONFIG_TIME:
+            logger.debug("{0} definition was just checked".format(
+                service_name.upper()))
+            service_config.set_api_version(api_version)
+            service_config.load(os.path.join(*service_path))
+            return
         headers['if-modified-since'] = mtime
 
-    api_version = provider_config.get_api_version()
-
     config_uri = "%s/%s/config/%s-service.json" % (
         provider_config.get_api_uri(),
         api_version,
@@ -126,10 +148,13 @@ def download_service_config(provider_config, service_config,
         service_name.upper(),
         config_uri))
 
-    # XXX make and use @with_srp_auth decorator
-    srp_auth = SRPAuth(provider_config)
-    session_id = srp_auth.get_session_id()
-    token = srp_auth.get_token()
+    session_id = None
+    token = None
+    if not anonymous:
+        # XXX make and use @with_srp_auth decorator
+        srp_auth = SRPAuth(provider_config)
+        session_id = srp_auth.get_session_id()
+        token = srp_auth.get_token()
     cookies = None
     if session_id is not None:
         cookies = {"_session_id": session_id}
@@ -142,18 +167,15 @@ def download_service_config(provider_config, service_config,
     if verify:
         verify = verify.encode(sys.getfilesystemencoding())
 
-    res = session.get(config_uri,
-                      verify=verify,
-                      headers=headers,
-                      timeout=REQUEST_TIMEOUT,
-                      cookies=cookies)
+    res = retry.request(session, "GET", config_uri,
+                        verify=verify,
+                        headers=headers,
+                        cookies=cookies)
     res.raise_for_status()
 
     service_config.set_api_version(api_version)
 
     # Not modified
-    service_path = ("leap", "providers", provider_config.get_domain(),
-                    service_json)
     if res.status_code == 304:
         logger.debug(
             "{0} definition has not been modified".format(
@@ -163,6 +185,7 @@ def download_service_config(provider_config, service_config,
         service_definition, mtime = get_content(res)
         service_config.load(data=service_definition, mtime=mtime)
         service_config.save(service_path)
+    _config_checked[full_path] = time.time()
 
 
 class ServiceConfig(BaseConfig):
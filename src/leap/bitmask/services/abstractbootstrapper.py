@@ -165,7 +165,7 @@ class AbstractBootstrapper(QtCore.QObject):
     def _callback_threader(self, cb, res, *args, **kwargs):
         return threads.deferToThread(cb, res, *args, **kwargs)
 
-    def addCallbackChain(self, callbacks):
+    def addCallbackChain(self, callbacks, notify_success=True):
         """
         Creates a callback/errback chain on another thread using
         deferToThread and adds the _gui_errback to the end to notify
@@ -174,6 +174,9 @@ class AbstractBootstrapper(QtCore.QObject):
         :param callbacks: List of tuples of callbacks and the signal
                           associated to that callback
         :type callbacks: list(tuple(func, func))
+        :param notify_success: if False, the signals are only emitted
+                               when a callback fails.
+        :type notify_success: bool
 
         :returns: the defer with the callback chain
         :rtype: deferred
@@ -190,6 +193,7 @@ class AbstractBootstrapper(QtCore.QObject):
             else:
                 d.addCallback(partial(self._callback_threader, cb))
             d.addErrback(self._errback, signal=sig)
-            d.addCallback(self._gui_notify, signal=sig)
+            if notify_success:
+                d.addCallback(self._gui_notify, signal=sig)
         d.addErrback(self._gui_errback)
         return d
@@ -21,11 +21,11 @@ import os
 
 from leap.bitmask.config.providerconfig import ProviderConfig
 from leap.bitmask.crypto.certs import download_client_cert
+from leap.bitmask.crypto.certstore import get_cert_store
 from leap.bitmask.logs.utils import get_logger
 from leap.bitmask.services import download_service_config
 from leap.bitmask.services.abstractbootstrapper import AbstractBootstrapper
 from leap.bitmask.services.eip.eipconfig import EIPConfig
-from leap.common import certs as leap_certs
 from leap.common.check import leap_assert, leap_assert_type
 from leap.common.files import check_and_fix_urw_only
 
@@ -88,7 +88,7 @@ class EIPBootstrapper(AbstractBootstrapper):
 
         # For re-download if something is wrong with the cert
         self._download_if_needed = self._download_if_needed and \
-            not leap_certs.should_redownload(client_cert_path)
+            not get_cert_store().should_redownload(client_cert_path)
 
         if self._download_if_needed and \
                 os.path.isfile(client_cert_path):
@@ -42,9 +42,13 @@ from leap.bitmask.config.providerconfig import ProviderConfig
 from leap.bitmask.crypto.tests import fake_provider
 from leap.bitmask.crypto.srpauth import SRPAuth
 from leap.bitmask import util
+from leap.bitmask.util import retry
 from leap.common.testing.basetest import BaseLeapTest
 from leap.common.files import mkdir_p
 
+SHOULD_REDOWNLOAD = \
+    'leap.bitmask.crypto.certstore.CertStore.should_redownload'
+
 
 class EIPBootstrapperActiveTest(BaseLeapTest):
     @classmethod
@@ -60,6 +64,7 @@ class EIPBootstrapperActiveTest(BaseLeapTest):
         cls.https_port = get_port(https)
 
     def setUp(self):
+        retry.reset_breakers()
         self.eb = EIPBootstrapper()
         self.old_pp = util.get_path_prefix
         self.old_save = EIPConfig.save
@@ -213,7 +218,7 @@ class EIPBootstrapperActiveTest(BaseLeapTest):
         cert_path, old_cert_content = self._download_certificate_test_template(
             True, True)
 
-        with mock.patch('leap.common.certs.should_redownload',
+        with mock.patch(SHOULD_REDOWNLOAD,
                         new_callable=mock.MagicMock,
                         return_value=False):
             self.eb._download_client_certificates()
@@ -226,7 +231,7 @@ class EIPBootstrapperActiveTest(BaseLeapTest):
             True, True)
 
         def wrapper(*args):
-            with mock.patch('leap.common.certs.should_redownload',
+            with mock.patch(SHOULD_REDOWNLOAD,
                             new_callable=mock.MagicMock,
                             return_value=True):
                 with mock.patch('leap.common.certs.is_valid_pemfile',
@@ -248,7 +253,7 @@ class EIPBootstrapperActiveTest(BaseLeapTest):
             True, False)
 
         def wrapper(*args):
-            with mock.patch('leap.common.certs.should_redownload',
+            with mock.patch(SHOULD_REDOWNLOAD,
                             new_callable=mock.MagicMock,
                             return_value=False):
                 with mock.patch('leap.common.certs.is_valid_pemfile',
@@ -269,7 +274,7 @@ class EIPBootstrapperActiveTest(BaseLeapTest):
             True, True)
 
         def wrapper(*args):
-            with mock.patch('leap.common.certs.should_redownload',
+            with mock.patch(SHOULD_REDOWNLOAD,
                             new_callable=mock.MagicMock,
                             return_value=True):
                 with mock.patch('leap.common.certs.is_valid_pemfile',
@@ -291,7 +296,7 @@ class EIPBootstrapperActiveTest(BaseLeapTest):
             False, False)
 
         def wrapper(*args):
-            with mock.patch('leap.common.certs.should_redownload',
+            with mock.patch(SHOULD_REDOWNLOAD,
                             new_callable=mock.MagicMock,
                             return_value=True):
                 with mock.patch('leap.common.certs.is_valid_pemfile',
@@ -316,7 +321,7 @@ class EIPBootstrapperActiveTest(BaseLeapTest):
             return Response()
 
         def wrapper(*args):
-            with mock.patch('leap.common.certs.should_redownload',
+            with mock.patch(SHOULD_REDOWNLOAD,
                             new_callable=mock.MagicMock,
                             return_value=False):
                 with mock.patch('leap.common.certs.is_valid_pemfile',
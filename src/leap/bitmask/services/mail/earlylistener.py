@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+# earlylistener.py
+# Copyright (C) 2015 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Accepts the connections to a service that is not ready yet.
+
+The mail clients connect to IMAP as soon as bitmask starts, but the IMAP
+service can only start once the soledad database is open. The early
+listener takes the port meanwhile and holds the connections, they get
+their answer from the real service when it is ready.
+"""
+from twisted.internet import defer, reactor
+from twisted.internet.error import CannotListenError
+from twisted.internet.protocol import Factory, Protocol
+
+from leap.bitmask.logs.utils import get_logger
+
+logger = get_logger()
+
+
+class HeldConnection(Protocol):
+    """
+    A connection waiting for the real service. What the client sends
+    meanwhile is kept and given to the real protocol, and once it has one
+    everything is passed through to it.
+    """
+
+    def __init__(self):
+        self._buffer = []
+        self._protocol = None
+
+    def connectionMade(self):
+        self.factory.held.append(self)
+
+    def dataReceived(self, data):
+        if self._protocol is None:
+            self._buffer.append(data)
+        else:
+            self._protocol.dataReceived(data)
+
+    def connectionLost(self, reason):
+        if self in self.factory.held:
+            self.factory.held.remove(self)
+        if self._protocol is not None:
+            self._protocol.connectionLost(reason)
+
+    def hand_over(self, factory):
+        """
+        Give the connection to a protocol built by the real factory.
+
+        :param factory: the factory of the real service.
+        :type factory: twisted.internet.protocol.Factory
+        """
+        protocol = factory.buildProtocol(self.transport.getPeer())
+        if protocol is None:
+            self.transport.loseConnection()
+            return
+        self._protocol = protocol
+        protocol.makeConnection(self.transport)
+        buffered, self._buffer = self._buffer, []
+        for data in buffered:
+            protocol.dataReceived(data)
+
+
+class HoldingFactory(Factory):
+    """
+    Builds HeldConnections and keeps track of them.
+    """
+    protocol = HeldConnection
+
+    def __init__(self):
+        self.held = []
+
+
+class EarlyListener(object):
+    """
+    Listens on the port of a service before the service starts.
+
+    When the service is ready, stop_listening frees the port for it and
+    hand_over gives it the connections accepted meanwhile. If that doesn't
+    happen within HOLD_TIMEOUT seconds, the listener gives up and closes
+    the connections.
+    """
+
+    HOLD_TIMEOUT = 300
+
+    def __init__(self, port, interface="localhost", clock=reactor):
+        """
+        Constructor for the early listener.
+
+        :param port: the port of the service.
+        :type port: int
+        :param interface: the interface to listen on.
+        :type interface: str
+        :param clock: used to listen and for the timeout, used for testing.
+        :type clock: IReactorTCP and IReactorTime provider
+        """
+        self._port_number = port
+        self._interface = interface
+        self._clock = clock
+        self._factory = HoldingFactory()
+        self._port = None
+        self._timeout_call = None
+
+    @property
+    def held(self):
+        """
+        The number of connections waiting for the service.
+
+        :rtype: int
+        """
+        return len(self._factory.held)
+
+    @property
+    def port(self):
+        """
+        The port we listen on, or None if we are not listening.
+
+        :rtype: twisted.internet.interfaces.IListeningPort or None
+        """
+        return self._port
+
+    def start(self):
+        """
+        Start listening.
+
+        :returns: whether we could listen on the port.
+        :rtype: bool
+        """
+        try:
+            self._port = self._clock.listenTCP(
+                self._port_number, self._factory, interface=self._interface)
+        except CannotListenError as e:
+            logger.warning("Cannot listen early on %s: %r" %
+                           (self._port_number, e))
+            return False
+        self._timeout_call = self._clock.callLater(self.HOLD_TIMEOUT,
+                                                   self.stop)
+        logger.debug("Holding the connections to %s until the service is "
+                     "ready." % (self._port_number,))
+        return True
+
+    def _cancel_timeout(self):
+        if self._timeout_call is not None and self._timeout_call.active():
+            self._timeout_call.cancel()
+        self._timeout_call = None
+
+    def stop_listening(self):
+        """
+        Stop accepting connections, so the service can listen on the port.
+        The connections already accepted are kept.
+
+        :returns: a deferred that fires when the port is free.
+        :rtype: Deferred
+        """
+        port, self._port = self._port, None
+        if port is None:
+            return defer.succeed(None)
+        return defer.maybeDeferred(port.stopListening)
+
+    def hand_over(self, factory):
+        """
+        Give the connections accepted so far to the real service.
+
+        :param factory: the factory of the real service, None if it could
+                        not start.
+        :type factory: twisted.internet.protocol.Factory or None
+        """
+        self._cancel_timeout()
+        held, self._factory.held = self._factory.held, []
+        if held and factory is not None:
+            logger.debug("Handing over %s held connections." % (len(held),))
+        for connection in held:
+            if factory is None:
+                connection.transport.loseConnection()
+            else:
+                connection.hand_over(factory)
+
+    def stop(self):
+        """
+        Stop listening and close the connections accepted meanwhile.
+
+        :returns: a deferred that fires when the port is free.
+        :rtype: Deferred
+        """
+        d = self.stop_listening()
+        self.hand_over(None)
+        return d
@@ -0,0 +1,430 @@
+# -*- coding: utf-8 -*-
+# exporter.py
+# Copyright (C) 2015 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Streaming export of the mailboxes to mbox files or a Maildir.
+
+The messages of a mailbox are read in UID order, a few of them at the same
+time, and written as they arrive, so the memory used doesn't depend on the
+size of the mailbox. A checkpoint records how far each mailbox got, an
+interrupted export can be run again and it continues from there. A
+mailbox exported completely continues from there too, an export run again
+only adds the messages that arrived since.
+"""
+import json
+import os
+import re
+import time
+
+from collections import deque, namedtuple
+from email.utils import mktime_tz, parsedate_tz
+
+from twisted.internet import defer
+
+from leap.bitmask.logs.utils import get_logger
+from leap.bitmask.services.mail.maildir import (
+    INBOX, MAILBOX_SEPARATOR, MAILDIR_FLAGS, MAILDIR_INFO)
+from leap.common.files import mkdir_p
+
+logger = get_logger()
+
+ExportedMessage = namedtuple("ExportedMessage", ["raw", "flags", "date"])
+
+MAILDIR_FORMAT = "maildir"
+MBOX_FORMAT = "mbox"
+
+# the mbox Status and X-Status headers, as mutt writes them
+MBOX_STATUS_FLAGS = {"\\Seen": "R"}
+MBOX_X_STATUS_FLAGS = {
+    "\\Answered": "A",
+    "\\Deleted": "D",
+    "\\Draft": "T",
+    "\\Flagged": "F",
+}
+
+_FROM_LINE_RE = re.compile(r"^(>*From )", re.MULTILINE)
+
+
+class MboxExistsError(Exception):
+    message = "The mbox file exists and it isn't from this export"
+
+
+def get_timestamp(date):
+    """
+    Return the timestamp of an RFC 2822 date, or now if it can't be parsed.
+
+    :param date: the internal date of a message.
+    :type date: str or None
+
+    :rtype: int
+    """
+    parsed = parsedate_tz(date) if date else None
+    if parsed is None:
+        return int(time.time())
+    return int(mktime_tz(parsed))
+
+
+def _to_unix(raw):
+    """
+    Return a message with LF line endings, ending with one.
+    """
+    raw = raw.replace("\r\n", "\n")
+    if not raw.endswith("\n"):
+        raw += "\n"
+    return raw
+
+
+class MaildirWriter(object):
+    """
+    Writes the messages of a mailbox to a Maildir. The INBOX goes to the
+    root of the Maildir and the rest to Maildir++ subfolders.
+
+    The filenames are made from the mailbox and the UID, a message written
+    again after an interrupted export replaces the previous copy.
+    """
+
+    def __init__(self, path, mbox_name, mbox_uuid):
+        """
+        Constructor for the Maildir writer.
+
+        :param path: the root of the Maildir.
+        :type path: str
+        :param mbox_name: the name of the mailbox.
+        :type mbox_name: str
+        :param mbox_uuid: the uuid of the mailbox.
+        :type mbox_uuid: str
+        """
+        self._mbox_uuid = mbox_uuid
+        self._path = os.path.join(path, self.get_folder(mbox_name))
+        for sub in ("cur", "new", "tmp"):
+            mkdir_p(os.path.join(self._path, sub))
+
+    @staticmethod
+    def get_folder(mbox_name):
+        """
+        Return the Maildir++ folder of a mailbox.
+
+        :rtype: str
+        """
+        if mbox_name.upper() == INBOX:
+            return ""
+        names = mbox_name.split(MAILBOX_SEPARATOR)
+        return "." + ".".join(name.replace(".", "_") for name in names)
+
+    def get_position(self):
+        """
+        The Maildir has no position to record, a message is complete once
+        it is in cur.
+        """
+        return None
+
+    def resume(self, position):
+        pass
+
+    def write(self, uid, message):
+        """
+        Write a message.
+
+        :param uid: the UID of the message.
+        :type uid: int
+        :param message: the message.
+        :type message: ExportedMessage
+        """
+        timestamp = get_timestamp(message.date)
+        flags = set(message.flags)
+        info = "".join(sorted(c for c, flag in MAILDIR_FLAGS.items()
+                              if flag in flags))
+        name = "%d.%s_%d.bitmask" % (timestamp, self._mbox_uuid, uid)
+
+        tmp_path = os.path.join(self._path, "tmp", name)
+        with open(tmp_path, "w") as f:
+            f.write(_to_unix(message.raw))
+        os.utime(tmp_path, (timestamp, timestamp))
+        os.rename(tmp_path, os.path.join(self._path, "cur",
+                                         name + MAILDIR_INFO + info))
+
+    def close(self):
+        pass
+
+
+class MboxWriter(object):
+    """
+    Writes the messages of a mailbox to an mboxrd file, with the flags in
+    the Status and X-Status headers. The file of a mailbox Lists/Leap is
+    Lists/Leap.mbox.
+    """
+
+    def __init__(self, path, mbox_name, mbox_uuid):
+        """
+        Constructor for the mbox writer.
+
+        :param path: the directory of the mbox files.
+        :type path: str
+        :param mbox_name: the name of the mailbox.
+        :type mbox_name: str
+        :param mbox_uuid: the uuid of the mailbox.
+        :type mbox_uuid: str
+        """
+        self._path = os.path.join(
+            path, *mbox_name.split(MAILBOX_SEPARATOR)) + ".mbox"
+        mkdir_p(os.path.dirname(self._path))
+        self._file = open(self._path, "ab")
+
+    def get_position(self):
+        """
+        Return the size of the file with everything written so far.
+
+        :rtype: int
+        """
+        self._file.flush()
+        return os.fstat(self._file.fileno()).st_size
+
+    def resume(self, position):
+        """
+        Drop what was written after a position, the messages after it are
+        written again.
+
+        :param position: a position returned by get_position, None to start
+                         a new file.
+        :type position: int or None
+
+        :raises MboxExistsError: if there is no position and the file isn't
+                                 empty, or the file is shorter than the
+                                 position: it is not ours to overwrite.
+        """
+        size = self.get_position()
+        if position is None:
+            position = 0
+            if size > 0:
+                raise MboxExistsError(
+                    "%s already exists, move it away or export to another "
+                    "directory" % (self._path,))
+        elif position > size:
+            raise MboxExistsError(
+                "%s changed since the last export, move it away or export "
+                "to another directory" % (self._path,))
+        self._file.truncate(position)
+
+    def write(self, uid, message):
+        """
+        Write a message.
+
+        :param uid: the UID of the message.
+        :type uid: int
+        :param message: the message.
+        :type message: ExportedMessage
+        """
+        timestamp = get_timestamp(message.date)
+        status = "".join(sorted(MBOX_STATUS_FLAGS[f] for f in message.flags
+                                if f in MBOX_STATUS_FLAGS))
+        x_status = "".join(sorted(MBOX_X_STATUS_FLAGS[f]
+                                  for f in message.flags
+                                  if f in MBOX_X_STATUS_FLAGS))
+
+        chunks = ["From MAILER-DAEMON %s\n" % (
+            time.asctime(time.gmtime(timestamp)),)]
+        chunks.append("Status: %sO\n" % (status,))
+        if x_status:
+            chunks.append("X-Status: %s\n" % (x_status,))
+        chunks.append(_FROM_LINE_RE.sub(r">\1", _to_unix(message.raw)))
+        chunks.append("\n")
+        self._file.write("".join(chunks))
+
+    def close(self):
+        self._file.close()
+
+
+WRITERS = {
+    MAILDIR_FORMAT: MaildirWriter,
+    MBOX_FORMAT: MboxWriter,
+}
+
+
+class ExportCheckpoint(object):
+    """
+    How far the export of each mailbox got: the last UID written, the
+    writer position after it and whether the mailbox is done. A mailbox is
+    done up to that UID, the messages that arrive later get higher UIDs.
+    """
+
+    UID_KEY = "uid"
+    POSITION_KEY = "position"
+    DONE_KEY = "done"
+
+    def __init__(self, path=None):
+        """
+        Constructor for the export checkpoint.
+
+        :param path: where to keep the checkpoint, None to keep it only in
+                     memory.
+        :type path: str or None
+        """
+        self._path = path
+        self._mailboxes = {}
+        if path is not None and os.path.isfile(path):
+            try:
+                with open(path) as f:
+                    mailboxes = json.load(f)
+                if isinstance(mailboxes, dict):
+                    self._mailboxes = mailboxes
+            except (IOError, ValueError) as e:
+                logger.warning("Ignoring the export checkpoint: %r" % (e,))
+
+    def get(self, mbox_name):
+        """
+        Return the checkpoint of a mailbox.
+
+        :rtype: dict
+        """
+        return dict(self._mailboxes.get(mbox_name) or {
+            self.UID_KEY: 0,
+            self.POSITION_KEY: None,
+            self.DONE_KEY: False,
+        })
+
+    def set(self, mbox_name, uid, position, done=False):
+        """
+        Record and save the progress of a mailbox.
+
+        :param mbox_name: the name of the mailbox.
+        :type mbox_name: str
+        :param uid: the last UID written.
+        :type uid: int
+        :param position: the writer position after it.
+        :type position: int or None
+        :param done: whether all the mailbox was written.
+        :type done: bool
+        """
+        self._mailboxes[mbox_name] = {
+            self.UID_KEY: uid,
+            self.POSITION_KEY: position,
+            self.DONE_KEY: done,
+        }
+        if self._path is None:
+            return
+        try:
+            mkdir_p(os.path.dirname(self._path))
+            with open(self._path, "w") as f:
+                json.dump(self._mailboxes, f)
+        except (IOError, OSError) as e:
+            logger.warning("Could not save the export checkpoint: %r" % (e,))
+
+
+class MailboxExporter(object):
+    """
+    Exports a mailbox, fetching at most `concurrency` messages at the same
+    time and writing them in UID order.
+    """
+
+    CONCURRENCY = 4
+
+    # messages written between checkpoints
+    CHECKPOINT_EVERY = 100
+
+    def __init__(self, mbox_name, uids, fetch, writer, checkpoint,
+                 concurrency=CONCURRENCY, clock=time.time):
+        """
+        Constructor for the mailbox exporter.
+
+        :param mbox_name: the name of the mailbox.
+        :type mbox_name: str
+        :param uids: the UIDs after the checkpoint, in order. Its next
+                     method returns a deferred with the next UID, or None at
+                     the end.
+        :type uids: leap.bitmask.services.mail.uidrepair.PagedQuery
+        :param fetch: returns a deferred with the ExportedMessage of a UID,
+                      or None if the message is gone.
+        :type fetch: callable
+        :param writer: writes the messages.
+        :type writer: MaildirWriter or MboxWriter
+        :param checkpoint: where the progress is recorded.
+        :type checkpoint: ExportCheckpoint
+        :param concurrency: how many messages are fetched at the same time.
+        :type concurrency: int
+        :param clock: returns the current time, used for testing.
+        :type clock: callable
+        """
+        self._mbox_name = mbox_name
+        self._uids = uids
+        self._fetch = fetch
+        self._writer = writer
+        self._checkpoint = checkpoint
+        self._concurrency = max(1, concurrency)
+        self._clock = clock
+
+    @defer.inlineCallbacks
+    def run(self):
+        """
+        Export the mailbox.
+
+        :returns: a deferred that fires with the stats: exported and missing
+                  messages, seconds and rate (messages per second).
+        :rtype: Deferred
+        """
+        started = self._clock()
+        last = self._checkpoint.get(self._mbox_name)
+        written_uid = last[ExportCheckpoint.UID_KEY]
+        try:
+            self._writer.resume(last[ExportCheckpoint.POSITION_KEY])
+        except Exception:
+            self._writer.close()
+            raise
+        # from now on what is written belongs to this export, even if it is
+        # interrupted before the first checkpoint
+        self._checkpoint.set(self._mbox_name, written_uid,
+                             self._writer.get_position())
+        stats = {"exported": 0, "missing": 0}
+        since_checkpoint = 0
+        pending = deque()
+
+        try:
+            uid = yield self._uids.next()
+            while uid is not None or pending:
+                while uid is not None and len(pending) < self._concurrency:
+                    pending.append(
+                        (uid, defer.maybeDeferred(self._fetch, uid)))
+                    uid = yield self._uids.next()
+
+                next_uid, d = pending.popleft()
+                message = yield d
+                if message is None:
+                    stats["missing"] += 1
+                else:
+                    self._writer.write(next_uid, message)
+                    stats["exported"] += 1
+                written_uid = next_uid
+
+                since_checkpoint += 1
+                if since_checkpoint >= self.CHECKPOINT_EVERY:
+                    since_checkpoint = 0
+                    self._checkpoint.set(self._mbox_name, written_uid,
+                                         self._writer.get_position())
+        except Exception:
+            # the last checkpoint is left as it is, what was written after
+            # it is written again when resuming
+            for _, d in pending:
+                d.addErrback(lambda _: None)
+            self._writer.close()
+            raise
+
+        self._checkpoint.set(self._mbox_name, written_uid,
+                             self._writer.get_position(), done=True)
+        self._writer.close()
+
+        seconds = max(self._clock() - started, 0)
+        stats["seconds"] = seconds
+        stats["rate"] = stats["exported"] / seconds if seconds > 0 else 0.0
+        defer.returnValue(stats)
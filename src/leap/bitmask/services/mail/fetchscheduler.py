@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+# fetchscheduler.py
+# Copyright (C) 2015 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Scheduling of the incoming mail fetches.
+"""
+from twisted.internet import defer, reactor
+from twisted.python.failure import Failure
+
+from leap.bitmask.logs.utils import get_logger
+
+logger = get_logger()
+
+
+class FetchScheduler(object):
+    """
+    Fetches the incoming mail when there may be new mail: when soledad
+    finished a sync, or when a mail client is doing something.
+
+    A timer is kept as a fallback. Its interval grows while the fetches find
+    nothing, and goes back to the base interval when mail arrives. Recent
+    client activity keeps it at most at the base interval.
+
+    The fetches requested while another one is running are coalesced into a
+    single fetch after it.
+
+    The fetches only read the local database, they never sync soledad. When
+    a fetch needs fresh mail (the timer, a client, request_fetch) it asks
+    for a soledad sync instead, and the end of the sync triggers the fetch.
+    """
+
+    MAX_INTERVAL = 900
+
+    # how the interval grows after a fetch without new mail
+    SLOW_DOWN = 2
+
+    # seconds a client is considered active after some activity
+    ACTIVITY_WINDOW = 300
+
+    # minimum seconds between the fetches triggered by client activity
+    ACTIVITY_GAP = 60
+
+    # seconds to wait for the end of a requested sync to be notified, once
+    # the sync is done, before fetching anyway
+    SYNC_NOTIFY_TIMEOUT = 30
+
+    def __init__(self, fetch, base_interval=60, clock=reactor,
+                 request_sync=None):
+        """
+        Constructor for the fetch scheduler.
+
+        :param fetch: fetches the mail from the local database. It returns
+                      a deferred that fires with the number of new messages.
+        :type fetch: callable
+        :param base_interval: seconds between fetches when mail arrives,
+                              usually the mail check period.
+        :type base_interval: int
+        :param clock: schedules the fetches, used for testing.
+        :type clock: twisted.internet.interfaces.IReactorTime
+        :param request_sync: requests a soledad sync, see
+                             SyncScheduler.request_sync. It returns a
+                             deferred that fires when the sync is done, or
+                             None if soledad isn't syncing, then the fetch
+                             is done without it.
+        :type request_sync: callable or None
+        """
+        self._fetch_mail = fetch
+        self._request_sync = request_sync
+        self._base_interval = base_interval
+        self._interval = base_interval
+        self._clock = clock
+
+        self._delayed_call = None
+        self._running = False
+        # a fetch, or the sync before it, is running
+        self._fetching = False
+        self._waiting_sync = False
+        self._sync_timeout = None
+        # None when no fetch is pending, else whether it needs a sync first
+        self._pending = None
+        self._waiters = []
+        self._last_activity = None
+        self._last_activity_fetch = None
+
+    def _now(self):
+        return self._clock.seconds()
+
+    def start(self):
+        """
+        Start fetching, the first fetch is done right away.
+        """
+        if self._running:
+            return
+        self._running = True
+        self._request(True)
+
+    def stop(self):
+        """
+        Stop fetching. An ongoing fetch is not cancelled.
+        """
+        self._running = False
+        self._cancel_delayed_call()
+        self._cancel_sync_timeout()
+
+    def _cancel_delayed_call(self):
+        if self._delayed_call is not None and self._delayed_call.active():
+            self._delayed_call.cancel()
+        self._delayed_call = None
+
+    def get_interval(self):
+        """
+        Return the seconds to wait until the next fetch, as it stands now.
+
+        :rtype: float
+        """
+        interval = self._interval
+        if (self._last_activity is not None and
+                self._now() - self._last_activity < self.ACTIVITY_WINDOW):
+            interval = min(interval, self._base_interval)
+        return interval
+
+    def _schedule(self, interval=None):
+        """
+        Schedule the next fetch.
+
+        :param interval: seconds until the fetch, by default the current
+                         interval.
+        :type interval: float or None
+        """
+        self._cancel_delayed_call()
+        if not self._running:
+            return
+        if interval is None:
+            interval = self.get_interval()
+        self._delayed_call = self._clock.callLater(
+            interval, self._request, True)
+
+    def get_next_fetch_time(self):
+        """
+        Return when the next fetch is scheduled, or None if it isn't.
+
+        :rtype: float or None
+        """
+        if self._delayed_call is None or not self._delayed_call.active():
+            return None
+        return self._delayed_call.getTime()
+
+    def notify_synced(self):
+        """
+        Let the scheduler know soledad finished a sync, the incoming mail it
+        brought is fetched. It covers the fetches waiting for a sync.
+        """
+        if self._waiting_sync:
+            self._end_sync_wait()
+        else:
+            self._request(False)
+
+    def notify_activity(self):
+        """
+        Let the scheduler know a mail client is doing something. It fetches
+        the mail, at most once every ACTIVITY_GAP seconds.
+        """
+        now = self._now()
+        self._last_activity = now
+        if (self._last_activity_fetch is None or
+                now - self._last_activity_fetch >= self.ACTIVITY_GAP):
+            self._last_activity_fetch = now
+            self._request(True)
+            return
+        next_fetch = self.get_next_fetch_time()
+        if next_fetch is not None and next_fetch - now > self.get_interval():
+            self._schedule()
+
+    def request_fetch(self):
+        """
+        Fetch now, or right after the ongoing fetch if there is one.
+
+        :returns: a deferred that fires when the requested fetch is done.
+        :rtype: twisted.internet.defer.Deferred
+        """
+        d = defer.Deferred()
+        self._waiters.append(d)
+        self._request(True)
+        return d
+
+    def _request(self, sync):
+        """
+        Fetch now or after the ongoing fetch.
+
+        :param sync: whether soledad has to be synced first.
+        :type sync: bool
+        """
+        self._pending = bool(self._pending) or sync
+        if not self._fetching:
+            self._fetch()
+
+    def _fetch(self):
+        """
+        Run the pending fetch, or the sync it needs first.
+        """
+        self._cancel_delayed_call()
+        sync, self._pending = self._pending, None
+        if sync and self._sync_first():
+            return
+
+        self._fetching = True
+        waiters, self._waiters = self._waiters, []
+        d = defer.maybeDeferred(self._fetch_mail)
+        d.addCallbacks(self._fetch_done, self._fetch_failed)
+        d.addBoth(self._fire_waiters, waiters)
+        d.addBoth(self._after_fetch)
+
+    def _sync_first(self):
+        """
+        Request a soledad sync, the fetch is done once it is notified.
+
+        :returns: whether a sync was requested.
+        :rtype: bool
+        """
+        if self._request_sync is None:
+            return False
+        d = self._request_sync()
+        if d is None:
+            return False
+        self._fetching = True
+        self._waiting_sync = True
+        d.addCallbacks(self._requested_sync_done,
+                       self._requested_sync_failed)
+        return True
+
+    def _requested_sync_done(self, _):
+        if self._waiting_sync:
+            # notify_synced should follow, this is in case it doesn't
+            self._cancel_sync_timeout()
+            self._sync_timeout = self._clock.callLater(
+                self.SYNC_NOTIFY_TIMEOUT, self._end_sync_wait)
+
+    def _requested_sync_failed(self, failure):
+        # the sync errors are logged by the soledad syncer, the mail that is
+        # already in the local database is fetched anyway
+        if self._waiting_sync:
+            self._end_sync_wait()
+
+    def _cancel_sync_timeout(self):
+        if self._sync_timeout is not None and self._sync_timeout.active():
+            self._sync_timeout.cancel()
+        self._sync_timeout = None
+
+    def _end_sync_wait(self):
+        """
+        Fetch the mail after the sync that was requested, the fetches
+        requested meanwhile included.
+        """
+        self._cancel_sync_timeout()
+        self._waiting_sync = False
+        self._fetching = False
+        self._pending = False
+        self._fetch()
+
+    def _fetch_done(self, new_mail):
+        if new_mail:
+            self._interval = self._base_interval
+        else:
+            self._interval = min(self.MAX_INTERVAL,
+                                 self._interval * self.SLOW_DOWN)
+        logger.debug("Incoming mail fetched, %s new messages, next fetch in "
+                     "%.0f seconds." % (new_mail, self.get_interval()))
+        return new_mail
+
+    def _fetch_failed(self, failure):
+        logger.warning("Incoming mail fetch failed: %r" % (failure.value,))
+        return failure
+
+    def _fire_waiters(self, result, waiters):
+        for d in waiters:
+            if not d.called:
+                if isinstance(result, Failure):
+                    d.errback(result)
+                else:
+                    d.callback(result)
+        # the errors were logged and handed to the waiters
+        return None
+
+    def _after_fetch(self, _):
+        self._fetching = False
+        if self._pending is not None:
+            # the fetches requested meanwhile, all in one
+            self._fetch()
+        else:
+            self._schedule()
@@ -21,9 +21,16 @@ import os
 import sys
 
 from leap.bitmask.logs.utils import get_logger
+from leap.bitmask.services.mail.fetchscheduler import FetchScheduler
+from leap.common.events import catalog
+from leap.common.events import register as leap_register
+from leap.common.events import unregister as leap_unregister
 from leap.mail.constants import INBOX_NAME
 from leap.mail.imap.service import imap
+from leap.mail.imap.service.imap import IMAP_PORT, LeapIMAPFactory
 from leap.mail.incoming.service import IncomingMail, INCOMING_CHECK_PERIOD
+from twisted.application.service import Service
+from twisted.internet import defer, reactor
 from twisted.python import log
 
 logger = get_logger()
@@ -37,6 +44,9 @@ def get_mail_check_period():
     """
     Tries to get the value of the environment variable for
     overriding the period for incoming mail fetch.
+
+    The incoming mail is fetched when soledad syncs and when a mail client
+    is active, the period is the base interval of the fallback fetches.
     """
     period = None
     period_str = os.environ.get(INCOMING_CHECK_PERIOD_ENV, None)
@@ -73,19 +83,152 @@ def start_imap_service(*args, **kwargs):
     return imap.run_service(*args, **kwargs)
 
 
-def start_incoming_mail_service(keymanager, soledad, imap_factory, userid):
+def build_imap_factory(soledad, userid):
+    """
+    Build the factory of the IMAP service, without listening. The account
+    is opened by the factory.
+
+    :param soledad: the soledad instance of the account.
+    :type soledad: Soledad
+    :param userid: user id, in the form "user@provider"
+    :type userid: str
+
+    :rtype: LeapIMAPFactory
+    """
+    logger.debug('Building the imap service')
+    return LeapIMAPFactory(soledad.uuid, userid, soledad)
+
+
+def watch_imap_activity(imap_factory, callback):
+    """
+    Call a callback with each command the IMAP clients send, IDLE
+    included.
+
+    It has to be called before the factory builds any connection.
+
+    :param imap_factory: the factory of the IMAP service.
+    :type imap_factory: LeapIMAPFactory
+    :param callback: called with the name of the command.
+    :type callback: callable
+    """
+    server = imap_factory.protocol
+
+    class ActivityIMAPServer(server):
+
+        def dispatchCommand(self, tag, cmd, rest, uid=None):
+            try:
+                callback(cmd)
+            except Exception as e:
+                logger.error("Error notifying IMAP activity: %r" % (e,))
+            return server.dispatchCommand(self, tag, cmd, rest, uid)
+
+    imap_factory.protocol = ActivityIMAPServer
+
+
+class ScheduledIncomingMail(IncomingMail):
+    """
+    Incoming mail fetched when soledad finishes a sync or a mail client is
+    active, instead of every check period. See FetchScheduler.
+
+    It never syncs soledad itself, that is left to the background syncs of
+    soledad: when it needs fresh mail it requests one of those syncs, and
+    processes the documents it brought when it ends.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """
+        Constructor for the incoming mail service.
+
+        :param request_sync: requests a soledad sync, see
+                             FetchScheduler. Without it the mail is only
+                             fetched after the syncs soledad does on its own.
+        :type request_sync: callable or None
+
+        The rest of the parameters are those of IncomingMail.
+        """
+        request_sync = kwargs.pop("request_sync", None)
+        IncomingMail.__init__(self, *args, **kwargs)
+        self._scheduler = FetchScheduler(
+            self._fetch_mail, base_interval=self._check_period,
+            request_sync=request_sync)
+        self._events_uid = "bitmask.mail.incoming.%s" % (id(self),)
+
+    def startService(self):
+        """
+        Start fetching mail, the first fetch is done right away.
+        """
+        Service.startService(self)
+        leap_register(event=catalog.SOLEDAD_DONE_DATA_SYNC,
+                      callback=self._handle_synced,
+                      uid=self._events_uid)
+        self._scheduler.start()
+
+    def stopService(self):
+        """
+        Stop fetching mail.
+        """
+        leap_unregister(event=catalog.SOLEDAD_DONE_DATA_SYNC,
+                        uid=self._events_uid)
+        self._scheduler.stop()
+        Service.stopService(self)
+
+    def fetch(self):
+        """
+        Fetch the incoming mail now, or right after the ongoing fetch.
+
+        :returns: a deferred that fires with the number of new messages.
+        :rtype: Deferred
+        """
+        return self._scheduler.request_fetch()
+
+    def notify_activity(self):
+        """
+        Let the fetcher know a mail client is doing something. It has to be
+        called from the reactor thread.
+        """
+        self._scheduler.notify_activity()
+
+    def _handle_synced(self, event, *content):
+        """
+        Callback for the end of the soledad syncs, it can be called from
+        another thread.
+        """
+        reactor.callFromThread(self._scheduler.notify_synced)
+
+    def _fetch_mail(self):
+        """
+        Fetch the incoming mail that is in the local database.
+
+        :returns: a deferred that fires with the number of new messages.
+        :rtype: Deferred
+        """
+        d = IncomingMail.fetch(self)
+        d.addCallback(lambda doclist: len(doclist) if doclist else 0)
+        return d
+
+    def _sync_soledad(self):
+        # the syncs are requested through the scheduler
+        return defer.succeed(None)
+
+
+def start_incoming_mail_service(keymanager, soledad, imap_factory, userid,
+                                request_sync=None):
     """
     Initalizes and starts the incomming mail service.
 
+    :param request_sync: requests a soledad sync, see ScheduledIncomingMail.
+    :type request_sync: callable or None
+
     :returns: a Deferred that will be fired with the IncomingMail instance
     """
     def setUpIncomingMail(inbox):
-        incoming_mail = IncomingMail(
+        incoming_mail = ScheduledIncomingMail(
             keymanager,
             soledad,
             inbox.collection,
             userid,
-            check_period=get_mail_check_period())
+            check_period=get_mail_check_period(),
+            request_sync=request_sync)
         return incoming_mail
 
     # XXX: do I really need to know here how to get a mailbox??
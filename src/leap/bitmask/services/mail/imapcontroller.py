@@ -17,8 +17,15 @@
 """
 IMAP service controller.
 """
+from twisted.internet import defer, reactor
+from twisted.python.failure import Failure
+
 from leap.bitmask.logs.utils import get_logger
 from leap.bitmask.services.mail import imap
+from leap.bitmask.services.mail.earlylistener import EarlyListener
+from leap.bitmask.services.mail.ondemand import (
+    OnDemandService, get_mail_interface)
+from leap.common.events import catalog, emit_async
 
 logger = get_logger()
 
@@ -28,7 +35,7 @@ class IMAPController(object):
     IMAP Controller.
     """
 
-    def __init__(self, soledad, keymanager):
+    def __init__(self, soledad, keymanager, request_sync=None):
         """
         Initialize IMAP variables.
 
@@ -38,9 +45,13 @@ class IMAPController(object):
         :param keymanager: a transparent proxy that eventually will point to a
                            Keymanager Instance.
         :type keymanager: zope.proxy.ProxyBase
+        :param request_sync: requests a soledad sync for the incoming mail,
+                             see imap.ScheduledIncomingMail.
+        :type request_sync: callable or None
         """
         self._soledad = soledad
         self._keymanager = keymanager
+        self._request_sync = request_sync
 
         # XXX: this should live in its own controller
         # or, better, just be managed by a composite Mail Service in
@@ -49,6 +60,56 @@ class IMAPController(object):
         self.imap_factory = None
         self.incoming_mail_service = None
 
+        self._early_listener = None
+        self._on_demand = None
+
+    def start_early_listener(self):
+        """
+        Start accepting IMAP connections before the service can start, they
+        are answered once it does. It has to be called from the reactor
+        thread.
+        """
+        if (self._early_listener is not None or self.imap_port is not None or
+                self._on_demand is not None):
+            return
+        listener = EarlyListener(imap.IMAP_PORT,
+                                 interface=get_mail_interface())
+        if listener.start():
+            self._early_listener = listener
+
+    def release_early_listener(self):
+        """
+        Free the IMAP port for the service, keeping the connections accepted
+        early. It has to be called from the reactor thread.
+
+        :returns: a deferred that fires when the port is free.
+        :rtype: Deferred
+        """
+        if self._early_listener is None:
+            return defer.succeed(None)
+        return self._early_listener.stop_listening()
+
+    def hand_over_early_connections(self, result):
+        """
+        Give the connections accepted early to the IMAP service, or close
+        them if it couldn't start. It has to be called from the reactor
+        thread.
+
+        :param result: the result of starting the service.
+        :type result: object or Failure
+
+        :returns: the result, untouched.
+        """
+        listener, self._early_listener = self._early_listener, None
+        if listener is not None:
+            factory = self.imap_factory
+            if self._on_demand is not None:
+                factory = self._on_demand.factory
+            if isinstance(result, Failure):
+                factory = None
+            listener.hand_over(factory)
+        return result
+
     def start_imap_service(self, userid, offline=False):
         """
         Start IMAP service.
@@ -63,28 +124,36 @@ class IMAPController(object):
         self.imap_port, self.imap_factory = imap.start_imap_service(
             self._soledad,
             userid=userid)
+        imap.watch_imap_activity(self.imap_factory, self._imap_activity)
+
+        if offline is False:
+            self._start_incoming_mail_service(userid)
+
+    def _start_incoming_mail_service(self, userid):
+        """
+        Start fetching the incoming mail into the account of the IMAP
+        factory.
+        """
+        factory = self.imap_factory
 
         def start_and_assign_incoming_service(incoming_mail):
-            # this returns a deferred that will be called when the looping call
-            # is stopped, we could add any shutdown/cleanup callback to that
-            # deferred, but unused by the moment.
+            if self.imap_factory is not factory:
+                # the service was stopped meanwhile
+                return
             incoming_mail.startService()
             self.incoming_mail_service = incoming_mail
             return incoming_mail
 
-        if offline is False:
-            d = imap.start_incoming_mail_service(
-                self._keymanager,
-                self._soledad,
-                self.imap_factory,
-                userid)
-            d.addCallback(start_and_assign_incoming_service)
-            d.addErrback(lambda f: logger.error(f.printTraceback()))
+        d = imap.start_incoming_mail_service(
+            self._keymanager,
+            self._soledad,
+            factory,
+            userid,
+            request_sync=self._request_sync)
+        d.addCallback(start_and_assign_incoming_service)
+        d.addErrback(lambda f: logger.error(f.printTraceback()))
 
-    def stop_imap_service(self):
-        """
-        Stop IMAP service (fetcher, factory and port).
-        """
+    def _stop_incoming_mail_service(self):
         if self.incoming_mail_service is not None:
             # Stop the loop call in the fetcher
 
@@ -94,6 +163,61 @@ class IMAPController(object):
             self.incoming_mail_service.stopService()
             self.incoming_mail_service = None
 
+    def start_imap_on_demand(self, userid, offline=False, idle_timeout=None):
+        """
+        Listen on the IMAP port, and start the IMAP service when a client
+        connects. It is stopped after idle_timeout seconds without clients.
+        It has to be called from the reactor thread.
+
+        :param userid: user id, in the form "user@provider"
+        :type userid: str
+        :param offline: whether imap should start in offline mode or not.
+        :type offline: bool
+        :param idle_timeout: seconds without clients before stopping the
+                             service, by default OnDemandService.IDLE_TIMEOUT
+        :type idle_timeout: int or None
+        """
+        logger.debug('Starting imap service on demand')
+        if idle_timeout is None:
+            idle_timeout = OnDemandService.IDLE_TIMEOUT
+
+        def start():
+            self.imap_factory = imap.build_imap_factory(self._soledad, userid)
+            imap.watch_imap_activity(self.imap_factory, self._imap_activity)
+            if offline is False:
+                self._start_incoming_mail_service(userid)
+            return self.imap_factory
+
+        on_demand = OnDemandService(
+            imap.IMAP_PORT, start, self._stop_imap_factory,
+            interface=get_mail_interface(), idle_timeout=idle_timeout)
+        if not on_demand.listen():
+            emit_async(catalog.IMAP_SERVICE_FAILED_TO_START,
+                       str(imap.IMAP_PORT))
+            return
+        self._on_demand = on_demand
+        emit_async(catalog.IMAP_SERVICE_STARTED, str(imap.IMAP_PORT))
+
+    def _stop_imap_factory(self, factory):
+        """
+        Stop the IMAP service started on demand, closing its account.
+        """
+        self._stop_incoming_mail_service()
+        self.imap_factory = None
+        factory.doStop()
+
+    def stop_imap_service(self):
+        """
+        Stop IMAP service (fetcher, factory and port).
+        """
+        if self._on_demand is not None:
+            # it lives in the reactor thread
+            reactor.callFromThread(self._on_demand.stop)
+            self._on_demand = None
+            return
+
+        self._stop_incoming_mail_service()
+
         if self.imap_port is not None:
             # Stop listening on the IMAP port
             self.imap_port.stopListening()
@@ -103,8 +227,20 @@ class IMAPController(object):
 
     def fetch_incoming_mail(self):
         """
-        Fetch incoming mail.
+        Fetch incoming mail. If a fetch is running, a single one is done
+        after it for all the requests meanwhile.
         """
         if self.incoming_mail_service is not None:
             logger.debug('Client connected, fetching mail...')
             self.incoming_mail_service.fetch()
+
+    def _imap_activity(self, command):
+        """
+        Callback for the commands of the IMAP clients, the activity brings
+        the next fetch closer.
+
+        :param command: the name of the command.
+        :type command: str
+        """
+        if self.incoming_mail_service is not None:
+            self.incoming_mail_service.notify_activity()
@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+# mailbench.py
+# Copyright (C) 2015 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Benchmark of the mail plumbing on a synthetic workload.
+
+It generates a Maildir, opens a local-only soledad the way the plumber does
+(initialize_soledad) and measures:
+
+- import: the maildir import of the plumber.
+- repair: the UID repair of every mailbox, after removing a part of the
+  UID table.
+- incoming: the processing of incoming mail documents into the INBOX. The
+  OpenPGP decryption is left out, the documents hold the message in clear.
+
+For each one it reports the messages per second, the peak RSS of the
+process so far and the size of the database. The results are written as
+JSON, to compare them between runs.
+
+Usage: python -m leap.bitmask.services.mail.mailbench [options]
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from timeit import default_timer
+
+from twisted.internet import defer, task
+
+from leap.bitmask import __version__ as VERSION
+from leap.bitmask.services.mail import plumber
+from leap.bitmask.services.mail.maildir import ImportJournal, MaildirImporter
+from leap.bitmask.services.mail.uidrepair import get_table_name
+from leap.bitmask.services.mail.workload import generate_maildir
+
+from leap.mail.adaptors import soledad_indexes as fields
+from leap.mail.incoming.service import IncomingMail
+from leap.soledad.common.crypto import ENC_JSON_KEY, ENC_SCHEME_KEY
+
+try:
+    import resource
+except ImportError:
+    # not on windows
+    resource = None
+
+USERID = "benchmark@example.org"
+UUID = "benchmark"
+PASSPHRASE = u"benchmark passphrase"
+
+
+def get_peak_rss():
+    """
+    Return the peak resident memory of the process, in KiB, or None where
+    it can't be known.
+
+    :rtype: int or None
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        # bytes there
+        peak /= 1024
+    return peak
+
+
+def get_db_size(path):
+    """
+    Return the size of the database, in bytes.
+
+    :rtype: int
+    """
+    return os.path.getsize(path) if os.path.isfile(path) else 0
+
+
+class PlaintextKeyManager(object):
+    """
+    Stands for the keymanager in the incoming mail benchmark, the documents
+    are not encrypted.
+    """
+
+    def decrypt(self, data, address, ktype, **kwargs):
+        return defer.succeed((data, None))
+
+
+class LocalIncomingMail(IncomingMail):
+    """
+    Incoming mail on a local-only soledad, there is no server to sync with.
+    """
+
+    def _sync_soledad(self):
+        return defer.succeed(None)
+
+
+class MailBenchmark(object):
+    """
+    Runs the benchmarks on a workload, in a working directory.
+    """
+
+    def __init__(self, workdir, args):
+        """
+        Constructor for the mail benchmark.
+
+        :param workdir: where the maildir and the database go.
+        :type workdir: str
+        :param args: the command line options.
+        :type args: argparse.Namespace
+        """
+        self._workdir = workdir
+        self._args = args
+        self._maildir = os.path.join(workdir, "Maildir")
+        self._localdb = os.path.join(workdir, "benchmark.db")
+        self._plumber = None
+        self.results = {}
+
+    def _record(self, name, messages, seconds, **extra):
+        result = {
+            "messages": messages,
+            "seconds": seconds,
+            "msgs_per_sec": messages / seconds if seconds > 0 else None,
+            "peak_rss_kb": get_peak_rss(),
+            "db_bytes": get_db_size(self._localdb),
+        }
+        result.update(extra)
+        self.results[name] = result
+        print "%-10s %8s msgs %9.2fs %9.1f msgs/s" % (
+            name, messages, seconds, result["msgs_per_sec"] or 0)
+
+    def generate(self):
+        args = self._args
+        start = default_timer()
+        size = generate_maildir(
+            self._maildir, messages=args.messages, folders=args.folders,
+            size=args.size, attachments=args.attachments,
+            attachment_size=args.attachment_size, depth=args.depth,
+            seed=args.seed)
+        self._record("generate", args.messages, default_timer() - start,
+                     maildir_bytes=size)
+
+    def open_soledad(self):
+        soledad = plumber.initialize_soledad(
+            UUID, USERID, PASSPHRASE,
+            os.path.join(self._workdir, "secrets.json"), self._localdb,
+            self._workdir, self._workdir)
+        self._plumber = plumber.MBOXPlumber(
+            USERID, PASSPHRASE, mdir=self._maildir, soledad=soledad)
+        d = defer.Deferred()
+        self._plumber.acct.callWhenReady(lambda _: d.callback(None))
+        return d
+
+    @defer.inlineCallbacks
+    def bench_import(self):
+        importer = MaildirImporter(
+            self._maildir, self._plumber.import_mail,
+            journal=ImportJournal(), concurrency=self._args.concurrency)
+        start = default_timer()
+        stats = yield importer.run()
+        self._record("import", stats["imported"], default_timer() - start,
+                     failed=stats["failed"])
+
+    @defer.inlineCallbacks
+    def bench_repair(self):
+        account = self._plumber.acct.account
+        mailboxes = yield account.get_all_mailboxes()
+
+        # drop a part of every UID table, for the repair to put it back
+        damage = self._args.damage
+        every = max(1, int(round(1 / damage))) if damage > 0 else 0
+        for mbox in mailboxes:
+            if not every:
+                break
+            yield self._plumber.sol.raw_sqlcipher_operation(
+                "DELETE FROM %s WHERE uid %% %d = 0" % (
+                    get_table_name(mbox.uuid), every))
+
+        start = default_timer()
+        checked = repaired = 0
+        for mbox in mailboxes:
+            stats = yield self._plumber.repair_mbox_uids(mbox)
+            checked += stats["checked"]
+            repaired += stats["missing"] + stats["dangling"]
+        self._record("repair", checked, default_timer() - start,
+                     repaired=repaired)
+
+    @defer.inlineCallbacks
+    def bench_incoming(self):
+        args = self._args
+        soledad = self._plumber.sol
+        with open(self._first_message()) as f:
+            raw = f.read()
+        for index in range(args.incoming):
+            content = json.dumps({
+                fields.INCOMING_KEY: True,
+                IncomingMail.CONTENT_KEY: raw.replace(
+                    "Message 0", "Incoming %s" % (index,))})
+            yield soledad.create_doc({
+                ENC_SCHEME_KEY: "pubkey",
+                ENC_JSON_KEY: content,
+                fields.INCOMING_KEY: True,
+                fields.ERROR_DECRYPTING_KEY: False,
+            })
+
+        inbox = yield self._plumber.acct.account.get_collection_by_mailbox(
+            "INBOX")
+        incoming = LocalIncomingMail(PlaintextKeyManager(), soledad, inbox,
+                                     USERID)
+        start = default_timer()
+        yield incoming.fetch()
+        self._record("incoming", args.incoming, default_timer() - start)
+
+    def _first_message(self):
+        cur = os.path.join(self._maildir, "cur")
+        return os.path.join(cur, sorted(os.listdir(cur))[0])
+
+    @defer.inlineCallbacks
+    def run(self):
+        self.generate()
+        yield self.open_soledad()
+        yield self.bench_import()
+        yield self.bench_repair()
+        if self._args.incoming:
+            yield self.bench_incoming()
+        self._plumber.sol.close()
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="Mail plumbing benchmark")
+    parser.add_argument("--messages", type=int, default=500,
+                        help="number of messages in the maildir")
+    parser.add_argument("--folders", type=int, default=3,
+                        help="number of maildir folders, with the INBOX")
+    parser.add_argument("--size", type=int, default=2048,
+                        help="bytes of text of each message")
+    parser.add_argument("--attachments", type=int, default=0,
+                        help="attachments of each message")
+    parser.add_argument("--attachment-size", type=int, default=16384,
+                        help="bytes of each attachment")
+    parser.add_argument("--depth", type=int, default=1,
+                        help="nested multiparts of each message")
+    parser.add_argument("--concurrency", type=int,
+                        default=MaildirImporter.CONCURRENCY,
+                        help="messages imported at the same time")
+    parser.add_argument("--damage", type=float, default=0.1,
+                        help="part of the UID table removed before the "
+                             "repair")
+    parser.add_argument("--incoming", type=int, default=100,
+                        help="incoming messages to process, 0 to skip")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed of the synthetic messages")
+    parser.add_argument("--output", metavar="FILE",
+                        default="mailbench.json",
+                        help="where to write the JSON results")
+    parser.add_argument("--keep", action="store_true",
+                        help="keep the working directory")
+    return parser
+
+
+def main(reactor, args):
+    workdir = tempfile.mkdtemp(prefix="bitmask-mailbench-")
+    benchmark = MailBenchmark(workdir, args)
+
+    def report(_):
+        params = dict(vars(args))
+        params.pop("output")
+        params.pop("keep")
+        output = json.dumps({
+            "version": VERSION,
+            "timestamp": int(time.time()),
+            "params": params,
+            "results": benchmark.results,
+        }, indent=2, sort_keys=True)
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print "Results written to %s" % (args.output,)
+
+    def cleanup(result):
+        if args.keep:
+            print "Working directory: %s" % (workdir,)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+        return result
+
+    d = benchmark.run()
+    d.addCallback(report)
+    d.addBoth(cleanup)
+    return d
+
+
+if __name__ == "__main__":
+    task.react(main, [get_parser().parse_args()])
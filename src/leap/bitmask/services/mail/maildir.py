@@ -0,0 +1,383 @@
+# -*- coding: utf-8 -*-
+# maildir.py
+# Copyright (C) 2015 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Streaming import of Maildirs.
+
+The messages are found while walking the Maildir and only a few of them are
+saved at the same time, so the memory used doesn't depend on the size of
+the Maildir. The messages already imported are written to a journal, an
+interrupted import can be run again and it skips them, even if a mail
+client moved them from new to cur or changed their flags meanwhile.
+"""
+import os
+import time
+
+from collections import namedtuple
+from email.utils import formatdate
+
+from twisted.internet import defer
+
+from leap.bitmask.logs.utils import get_logger
+from leap.common.files import mkdir_p
+
+logger = get_logger()
+
+INBOX = "INBOX"
+
+# the mailbox hierarchy separator used by leap.mail
+MAILBOX_SEPARATOR = "/"
+
+# the flags in the info part of the maildir filenames, after ':2,'
+MAILDIR_FLAGS = {
+    "D": "\\Draft",
+    "F": "\\Flagged",
+    "R": "\\Answered",
+    "S": "\\Seen",
+    "T": "\\Deleted",
+}
+MAILDIR_INFO = ":2,"
+
+# the key of a message in the import journal doesn't change when the
+# message is moved from new to cur or its flags change
+MaildirMessage = namedtuple(
+    "MaildirMessage", ["path", "mailbox", "flags", "key"])
+
+
+def get_mailbox_name(folder, mbox_name=INBOX):
+    """
+    Return the mailbox a folder of a Maildir is imported to.
+
+    The root of the Maildir goes to mbox_name. The subfolders can be
+    Maildir++ ones (.Lists.Leap) or nested directories (Lists/Leap), both
+    map to the mailbox Lists/Leap. When importing to a mailbox other than
+    the INBOX, the subfolders go below it.
+
+    :param folder: the path of the folder, relative to the Maildir root.
+    :type folder: str
+    :param mbox_name: the mailbox the Maildir is imported to.
+    :type mbox_name: str
+
+    :rtype: str
+    """
+    names = []
+    for part in folder.split(os.sep):
+        if part in ("", os.curdir):
+            continue
+        if part.startswith("."):
+            names.extend(filter(None, part[1:].split(".")))
+        else:
+            names.append(part)
+
+    if not names:
+        return mbox_name
+    if mbox_name.upper() != INBOX:
+        names.insert(0, mbox_name)
+    return MAILBOX_SEPARATOR.join(names)
+
+
+def get_flags(filename, new=False):
+    """
+    Return the IMAP flags of a message from its maildir filename.
+
+    :param filename: the name of the message file.
+    :type filename: str
+    :param new: whether the message is in the new folder, those have no
+                flags yet.
+    :type new: bool
+
+    :rtype: tuple of str
+    """
+    if new or MAILDIR_INFO not in filename:
+        return tuple()
+    info = filename.rsplit(MAILDIR_INFO, 1)[1]
+    return tuple(MAILDIR_FLAGS[c] for c in sorted(set(info))
+                 if c in MAILDIR_FLAGS)
+
+
+def get_message_key(folder, filename):
+    """
+    Return the key of a message in the import journal: its folder and the
+    unique part of its filename, without the info.
+
+    :param folder: the path of the folder, relative to the Maildir root.
+    :type folder: str
+    :param filename: the name of the message file.
+    :type filename: str
+
+    :rtype: str
+    """
+    unique = filename.split(MAILDIR_INFO, 1)[0]
+    return os.path.normpath(os.path.join(folder, unique))
+
+
+def iter_maildir(path, mbox_name=INBOX):
+    """
+    Walk a Maildir and yield its messages as they are found.
+
+    Only the cur and new folders hold delivered messages, tmp is skipped.
+
+    :param path: the root of the Maildir.
+    :type path: str
+    :param mbox_name: the mailbox the root of the Maildir is imported to.
+    :type mbox_name: str
+
+    :returns: the messages, with their path relative to the Maildir root
+              and their key in the import journal.
+    :rtype: generator of MaildirMessage
+    """
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames.sort()
+        base = os.path.basename(dirpath)
+        if base == "tmp":
+            dirnames[:] = []
+            continue
+        if base not in ("cur", "new"):
+            continue
+
+        dirnames[:] = []
+        folder = os.path.relpath(os.path.dirname(dirpath), path)
+        mailbox = get_mailbox_name(folder, mbox_name)
+        new = base == "new"
+        for filename in sorted(filenames):
+            if filename.startswith("."):
+                continue
+            yield MaildirMessage(
+                os.path.relpath(os.path.join(dirpath, filename), path),
+                mailbox, get_flags(filename, new=new),
+                get_message_key(folder, filename))
+
+
+class ImportJournal(object):
+    """
+    The messages of a Maildir that were already imported, one key per
+    line, see get_message_key. A line is only written once the message is
+    in the database.
+    """
+
+    def __init__(self, path=None):
+        """
+        Constructor for the import journal.
+
+        :param path: where to keep the journal, None to keep it only in
+                     memory.
+        :type path: str or None
+        """
+        self._path = path
+        self._done = set()
+        self._file = None
+
+        if path is not None and os.path.isfile(path):
+            with open(path) as f:
+                for line in f:
+                    # a line without its end was written half
+                    if line.endswith("\n"):
+                        self._done.add(line[:-1])
+
+    def __contains__(self, key):
+        return key in self._done
+
+    def __len__(self):
+        return len(self._done)
+
+    def add(self, key):
+        """
+        Record that a message was imported.
+
+        :param key: the key of the message, see get_message_key.
+        :type key: str
+        """
+        self._done.add(key)
+        if self._path is None:
+            return
+        if self._file is None:
+            mkdir_p(os.path.dirname(self._path))
+            self._file = open(self._path, "a")
+        self._file.write(key + "\n")
+        self._file.flush()
+
+    def close(self):
+        """
+        Close the journal file.
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class MaildirImporter(object):
+    """
+    Imports the messages of a Maildir, saving at most `concurrency` of them
+    at the same time.
+    """
+
+    CONCURRENCY = 8
+
+    # seconds between progress reports
+    PROGRESS_SECONDS = 5
+
+    def __init__(self, path, save, mbox_name=INBOX, journal=None,
+                 concurrency=CONCURRENCY, progress=None, clock=time.time):
+        """
+        Constructor for the Maildir importer.
+
+        :param path: the root of the Maildir.
+        :type path: str
+        :param save: saves a message, called with the mailbox name, the raw
+                     message, its flags and its internal date. It returns a
+                     deferred that fires when the message is in the
+                     database.
+        :type save: callable
+        :param mbox_name: the mailbox the root of the Maildir goes to.
+        :type mbox_name: str
+        :param journal: the messages already imported.
+        :type journal: ImportJournal or None
+        :param concurrency: how many messages are saved at the same time.
+        :type concurrency: int
+        :param progress: called with the stats every PROGRESS_SECONDS and
+                         when the import ends.
+        :type progress: callable or None
+        :param clock: returns the current time, used for testing.
+        :type clock: callable
+        """
+        self._path = path
+        self._save = save
+        self._mbox_name = mbox_name
+        self._journal = journal if journal is not None else ImportJournal()
+        self._concurrency = max(1, concurrency)
+        self._progress = progress
+        self._clock = clock
+
+        self._messages = None
+        self._running = 0
+        self._filling = False
+        self._exhausted = False
+        self._deferred = None
+        self._started = None
+        self._last_report = None
+        self._stats = {"imported": 0, "skipped": 0, "failed": 0}
+
+    def get_stats(self):
+        """
+        Return the stats of the import so far: imported, skipped (already
+        in the journal) and failed messages, seconds and rate (imported
+        messages per second).
+
+        :rtype: dict
+        """
+        stats = dict(self._stats)
+        seconds = max(self._clock() - (self._started or self._clock()), 0)
+        stats["seconds"] = seconds
+        stats["rate"] = stats["imported"] / seconds if seconds > 0 else 0.0
+        return stats
+
+    def run(self):
+        """
+        Import the Maildir.
+
+        :returns: a deferred that fires with the stats when all the
+                  messages were processed.
+        :rtype: Deferred
+        """
+        self._deferred = defer.Deferred()
+        self._started = self._last_report = self._clock()
+        self._messages = iter_maildir(self._path, self._mbox_name)
+        self._fill()
+        return self._deferred
+
+    def _next_message(self):
+        """
+        Return the next message not imported yet, or None at the end.
+
+        :rtype: MaildirMessage or None
+        """
+        for message in self._messages:
+            if message.key in self._journal:
+                self._stats["skipped"] += 1
+                continue
+            return message
+        self._exhausted = True
+        return None
+
+    def _fill(self):
+        """
+        Start saving messages until the window is full.
+        """
+        # the saves that finish right away call us back, the outer call
+        # keeps going instead of nesting
+        if self._filling:
+            return
+        self._filling = True
+        try:
+            while self._running < self._concurrency and not self._exhausted:
+                message = self._next_message()
+                if message is not None:
+                    self._import(message)
+        finally:
+            self._filling = False
+
+        if self._exhausted and self._running == 0:
+            self._finish()
+
+    def _import(self, message):
+        """
+        Save a message in the database.
+
+        :param message: the message to import.
+        :type message: MaildirMessage
+        """
+        self._running += 1
+        full_path = os.path.join(self._path, message.path)
+        try:
+            with open(full_path) as f:
+                raw = f.read()
+            date = formatdate(os.path.getmtime(full_path))
+        except (IOError, OSError) as e:
+            d = defer.fail(e)
+        else:
+            d = defer.maybeDeferred(self._save, message.mailbox, raw,
+                                    message.flags, date)
+        d.addCallbacks(self._saved, self._save_failed,
+                       callbackArgs=(message,), errbackArgs=(message,))
+        d.addBoth(self._done)
+
+    def _saved(self, _, message):
+        self._journal.add(message.key)
+        self._stats["imported"] += 1
+
+    def _save_failed(self, failure, message):
+        self._stats["failed"] += 1
+        logger.error("Could not import %s: %r" %
+                     (message.path, failure.value))
+
+    def _done(self, _):
+        self._running -= 1
+        now = self._clock()
+        if now - self._last_report >= self.PROGRESS_SECONDS:
+            self._last_report = now
+            self._report()
+        self._fill()
+
+    def _report(self):
+        if self._progress is not None:
+            self._progress(self.get_stats())
+
+    def _finish(self):
+        if self._deferred is None or self._deferred.called:
+            return
+        self._journal.close()
+        self._report()
+        self._deferred.callback(self.get_stats())
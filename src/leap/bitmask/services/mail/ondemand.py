@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+# ondemand.py
+# Copyright (C) 2015 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Services started on demand, when a client connects.
+
+The port of the service is taken right away, but the service itself (its
+factory, the account behind it, its background tasks) is only built when
+the first client connects, and it is torn down after some time without
+clients. Many users never open a mail client, this way they don't pay for
+the mail services.
+"""
+import os
+
+from twisted.internet import defer, reactor
+from twisted.internet.error import CannotListenError
+
+from leap.bitmask.logs.utils import get_logger
+from leap.bitmask.services.mail.earlylistener import (
+    HeldConnection, HoldingFactory)
+
+logger = get_logger()
+
+
+def get_mail_interface():
+    """
+    Return the interface the mail services listen on.
+
+    :rtype: str
+    """
+    # same as leap.mail: on docker the services are used from the host
+    if os.environ.get("LEAP_DOCKERIZED"):
+        return ""
+    return "localhost"
+
+
+class ActivatingConnection(HeldConnection):
+    """
+    A connection to an on-demand service. It waits until the service is
+    running, and lets the service know when it comes and goes.
+    """
+
+    def connectionMade(self):
+        HeldConnection.connectionMade(self)
+        self.factory.service.connection_made(self)
+
+    def connectionLost(self, reason):
+        HeldConnection.connectionLost(self, reason)
+        self.factory.service.connection_lost(self)
+
+
+class ActivatingFactory(HoldingFactory):
+    """
+    Builds the ActivatingConnections of an on-demand service.
+    """
+    protocol = ActivatingConnection
+
+    def __init__(self, service):
+        HoldingFactory.__init__(self)
+        self.service = service
+
+
+class OnDemandService(object):
+    """
+    Listens on the port of a service, starts the service when a client
+    connects and stops it IDLE_TIMEOUT seconds after the last client left.
+
+    The service is started and stopped through two callables: start returns
+    the factory of the service, or a deferred with it, and stop takes that
+    factory and tears the service down.
+    """
+
+    IDLE_TIMEOUT = 600
+
+    def __init__(self, port, start, stop, interface="localhost",
+                 idle_timeout=IDLE_TIMEOUT, clock=reactor):
+        """
+        Constructor for the on-demand service.
+
+        :param port: the port of the service.
+        :type port: int
+        :param start: starts the service and returns its factory.
+        :type start: callable
+        :param stop: stops the service, given its factory.
+        :type stop: callable
+        :param interface: the interface to listen on.
+        :type interface: str
+        :param idle_timeout: seconds the service keeps running without
+                             clients.
+        :type idle_timeout: int
+        :param clock: used to listen and for the timeout, used for testing.
+        :type clock: IReactorTCP and IReactorTime provider
+        """
+        self._port_number = port
+        self._start = start
+        self._stop = stop
+        self._interface = interface
+        self._idle_timeout = idle_timeout
+        self._clock = clock
+
+        self._factory = ActivatingFactory(self)
+        self._port = None
+        self._service = None
+        self._starting = False
+        self._stopping = False
+        self._connections = set()
+        self._idle_call = None
+
+    @property
+    def port(self):
+        """
+        The port we listen on, or None if we are not listening.
+
+        :rtype: twisted.internet.interfaces.IListeningPort or None
+        """
+        return self._port
+
+    @property
+    def factory(self):
+        """
+        The factory the connections to the port go through. Connections
+        accepted elsewhere can be given to it.
+
+        :rtype: ActivatingFactory
+        """
+        return self._factory
+
+    @property
+    def service(self):
+        """
+        The factory of the running service, or None if it isn't running.
+
+        :rtype: twisted.internet.protocol.Factory or None
+        """
+        return self._service
+
+    def listen(self):
+        """
+        Start listening, the service is started with the first connection.
+
+        :returns: whether we could listen on the port.
+        :rtype: bool
+        """
+        try:
+            self._port = self._clock.listenTCP(
+                self._port_number, self._factory, interface=self._interface)
+        except CannotListenError as e:
+            logger.error("Cannot listen on %s: %r" % (self._port_number, e))
+            return False
+        logger.debug("Listening on %s, the service starts on the first "
+                     "connection." % (self._port_number,))
+        return True
+
+    def stop(self):
+        """
+        Stop listening, close the connections and stop the service if it is
+        running.
+
+        :returns: a deferred that fires when the port is free and the
+                  service stopped.
+        :rtype: Deferred
+        """
+        self._cancel_idle_call()
+        port, self._port = self._port, None
+        for connection in list(self._connections):
+            connection.transport.loseConnection()
+        d1 = defer.maybeDeferred(port.stopListening) if port else None
+        d2 = self._stop_service()
+        return defer.gatherResults([d for d in (d1, d2) if d is not None])
+
+    def connection_made(self, connection):
+        """
+        Called by the connections when they are made.
+        """
+        self._connections.add(connection)
+        self._cancel_idle_call()
+        if self._service is not None:
+            self._hand_over()
+        elif not (self._starting or self._stopping):
+            self._start_service()
+
+    def connection_lost(self, connection):
+        """
+        Called by the connections when they are closed.
+        """
+        self._connections.discard(connection)
+        if not self._connections and self._service is not None:
+            self._schedule_idle_call()
+
+    def _hand_over(self):
+        held, self._factory.held = self._factory.held, []
+        for connection in held:
+            connection.hand_over(self._service)
+
+    def _start_service(self):
+        logger.debug("A client connected to %s, starting the service." %
+                     (self._port_number,))
+        self._starting = True
+        d = defer.maybeDeferred(self._start)
+        d.addCallbacks(self._service_started, self._service_failed)
+
+    def _service_started(self, service):
+        self._starting = False
+        if self._port is None:
+            # stopped meanwhile
+            return self._stop(service)
+        self._service = service
+        self._hand_over()
+        if not self._connections:
+            self._schedule_idle_call()
+
+    def _service_failed(self, failure):
+        self._starting = False
+        logger.error("Could not start the service on %s: %r" %
+                     (self._port_number, failure.value))
+        held, self._factory.held = self._factory.held, []
+        for connection in held:
+            connection.transport.loseConnection()
+
+    def _cancel_idle_call(self):
+        if self._idle_call is not None and self._idle_call.active():
+            self._idle_call.cancel()
+        self._idle_call = None
+
+    def _schedule_idle_call(self):
+        self._cancel_idle_call()
+        self._idle_call = self._clock.callLater(self._idle_timeout,
+                                                self._stop_service)
+
+    def _stop_service(self):
+        """
+        Stop the service, if it is running.
+
+        :rtype: Deferred or None
+        """
+        self._idle_call = None
+        service, self._service = self._service, None
+        if service is None:
+            return None
+        logger.debug("Stopping the service on %s." % (self._port_number,))
+        self._stopping = True
+        d = defer.maybeDeferred(self._stop, service)
+        d.addErrback(lambda f: logger.error(
+            "Error stopping the service on %s: %r" % (
+                self._port_number, f.value)))
+        d.addBoth(self._service_stopped)
+        return d
+
+    def _service_stopped(self, _):
+        self._stopping = False
+        if self._factory.held and self._port is not None:
+            # clients came while it was stopping
+            self._start_service()
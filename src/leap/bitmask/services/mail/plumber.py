@@ -20,26 +20,38 @@ Utils for manipulating local mailboxes.
 # TODO --- this module has not yet catched up with 0.9.0
 
 import getpass
+import hashlib
 import logging
 import os
 
-from collections import defaultdict
+from cStringIO import StringIO
 from functools import partial
 
-from twisted.internet import defer
+from twisted.internet import defer, task
+from twisted.mail import imap4
 
 from leap.bitmask.backend.settings import Settings
 from leap.bitmask.config.providerconfig import ProviderConfig
 from leap.bitmask.logs.utils import get_logger
 from leap.bitmask.provider import get_provider_path
+from leap.bitmask.services.mail.exporter import (
+    ExportCheckpoint, ExportedMessage, MailboxExporter, MboxExistsError,
+    MAILDIR_FORMAT, MBOX_FORMAT, WRITERS)
+from leap.bitmask.services.mail.maildir import ImportJournal, MaildirImporter
+from leap.bitmask.services.mail.uidrepair import (
+    PagedQuery, UIDRepair, get_table_name)
 from leap.bitmask.services.soledad.soledadbootstrapper import get_db_paths
-from leap.bitmask.util import flatten, get_path_prefix
+from leap.bitmask.util import get_path_prefix
 
 from leap.mail.imap.account import IMAPAccount
+from leap.mail.imap.messages import IMAPMessage
 from leap.soledad.client import Soledad
 
 logger = get_logger()
 
+# how many mailboxes are repaired at the same time
+MAILBOX_REPAIR_CONCURRENCY = 4
+
 
 def initialize_soledad(uuid, email, passwd,
                        secrets, localdb,
@@ -96,7 +108,7 @@ class MBOXPlumber(object):
     that can be invoked when data migration in the client is needed.
     """
 
-    def __init__(self, userid, passwd, mdir=None):
+    def __init__(self, userid, passwd, mdir=None, soledad=None):
         """
         Initialize the plumber with all that's needed to authenticate
         against the provider.
@@ -107,6 +119,9 @@ class MBOXPlumber(object):
         :type passwd: basestring
         :param mdir: a path to a maildir to import
         :type mdir: str or None
+        :param soledad: an already initialized soledad to work on, instead
+                        of the one of the account. Used by the benchmarks.
+        :type soledad: Soledad or None
         """
         self.userid = userid
         self.passwd = passwd
@@ -115,6 +130,14 @@ class MBOXPlumber(object):
         self.mdir = mdir
         self.sol = None
         self._settings = Settings()
+        self._collections = {}
+        self._waiting_collections = {}
+
+        if soledad is not None:
+            self.uuid = soledad.uuid
+            self.sol = soledad
+            self.acct = IMAPAccount(self.userid, self.sol)
+            return
 
         provider_config_path = os.path.join(get_path_prefix(),
                                             get_provider_path(provider))
@@ -128,6 +151,9 @@ class MBOXPlumber(object):
         """
         Initialize local Soledad instance.
         """
+        if self.sol is not None:
+            return True
+
         self.uuid = self._settings.get_uuid(self.userid)
         if not self.uuid:
             print "Cannot get UUID from settings. Log in at least once."
@@ -147,136 +173,334 @@ class MBOXPlumber(object):
     # Account repairing
     #
 
-    def repair_account(self, *args):
+    def repair_account(self, dry_run=False,
+                       concurrency=MAILBOX_REPAIR_CONCURRENCY):
         """
         Repair mbox uids for all mboxes in this account.
+
+        :param dry_run: only show what would be repaired.
+        :type dry_run: bool
+        :param concurrency: how many mailboxes are repaired at the same
+                            time.
+        :type concurrency: int
         """
         init = self._init_local_soledad()
         if not init:
             return self.exit()
 
-        for mbox_name in self.acct.mailboxes:
-            self.repair_mbox_uids(mbox_name)
-        print "done."
-        self.exit()
-
-    def repair_mbox_uids(self, mbox_name):
+        semaphore = defer.DeferredSemaphore(max(1, concurrency))
+
+        def repair_all(mailboxes):
+            return defer.gatherResults([
+                semaphore.run(self.repair_mbox_uids, mbox, dry_run)
+                for mbox in mailboxes], consumeErrors=True)
+
+        def done(results):
+            changes = sum(stats["missing"] + stats["dangling"]
+                          for stats in results)
+            if dry_run:
+                print "done, %s uids would be repaired." % (changes,)
+            else:
+                print "done, %s uids repaired." % (changes,)
+
+        d = self.acct.callWhenReady(
+            lambda _: self.acct.account.get_all_mailboxes())
+        d.addCallback(repair_all)
+        d.addCallback(done)
+        d.addErrback(lambda failure: logger.error(
+            "Error repairing the account: %r" % (failure.value,)))
+        d.addCallback(self._cbExit)
+
+    def repair_mbox_uids(self, mbox, dry_run=False):
         """
-        Repair indexes for a given mbox.
-
-        :param mbox_name: mailbox to repair
-        :type mbox_name: basestring
+        Repair the UID table of a given mbox.
+
+        :param mbox: the mailbox to repair
+        :type mbox: leap.mail.adaptors.models.MailboxWrapper
+        :param dry_run: only show what would be repaired.
+        :type dry_run: bool
+        :return: a deferred that fires with the stats of the repair, see
+                 UIDRepair.run
+        :rtype: Deferred
         """
-        print
-        print "REPAIRING INDEXES FOR MAILBOX %s" % (mbox_name,)
-        print "----------------------------------------------"
-        mbox = self.acct.getMailbox(mbox_name)
-        len_mbox = mbox.getMessageCount()
-        print "There are %s messages" % (len_mbox,)
-
-        last_ok = True if mbox.last_uid == len_mbox else False
-        uids_iter = mbox.messages.all_msg_iter()
-        dupes = self._has_dupes(uids_iter)
-        if last_ok and not dupes:
-            print "Mbox does not need repair."
-            return
+        def show(stats):
+            print "%s: %s messages, %s missing uids, %s stale uids" % (
+                mbox.mbox, stats["checked"], stats["missing"],
+                stats["dangling"])
+            if dry_run:
+                for doc_id in stats["missing_ids"]:
+                    print "  + %s" % (doc_id,)
+                for doc_id in stats["dangling_ids"]:
+                    print "  - %s" % (doc_id,)
+            return stats
+
+        d = UIDRepair(self.sol, mbox.uuid, dry_run=dry_run).run()
+        d.addCallback(show)
+        return d
 
-        # XXX CHANGE? ----
-        msgs = mbox.messages.get_all()
-        for zindex, doc in enumerate(msgs):
-            mindex = zindex + 1
-            old_uid = doc.content['uid']
-            doc.content['uid'] = mindex
-            self.sol.put_doc(doc)
-            if mindex != old_uid:
-                print "%s -> %s (%s)" % (mindex, doc.content['uid'], old_uid)
-
-        old_last_uid = mbox.last_uid
-        mbox.last_uid = len_mbox
-        print "LAST UID: %s (%s)" % (mbox.last_uid, old_last_uid)
-
-    def _has_dupes(self, sequence):
+    #
+    # Maildir import
+    #
+
+    def _get_collection(self, mbox_name):
         """
-        Return True if the given sequence of ints has duplicates.
+        Return the message collection of a mailbox, creating the mailbox
+        and its parents if they don't exist.
+
+        :param mbox_name: the name of the mailbox.
+        :type mbox_name: str
 
-        :param sequence: a sequence of ints
-        :type sequence: sequence
-        :rtype: bool
+        :return: a deferred that fires with the MessageCollection.
+        :rtype: Deferred
         """
-        d = defaultdict(lambda: 0)
-        for uid in sequence:
-            d[uid] += 1
-            if d[uid] != 1:
-                return True
-        return False
+        if mbox_name in self._collections:
+            return defer.succeed(self._collections[mbox_name])
+
+        d = defer.Deferred()
+        waiting = self._waiting_collections.get(mbox_name)
+        if waiting is not None:
+            waiting.append(d)
+            return d
+        waiting = self._waiting_collections[mbox_name] = [d]
+
+        def got_collection(collection):
+            self._collections[mbox_name] = collection
+            del self._waiting_collections[mbox_name]
+            for waiter in waiting:
+                waiter.callback(collection)
+
+        def failed(failure):
+            del self._waiting_collections[mbox_name]
+            for waiter in waiting:
+                waiter.errback(failure)
+
+        create = self.acct.create(mbox_name)
+        create.addCallback(
+            lambda _: self.acct.account.get_collection_by_mailbox(mbox_name))
+        create.addCallbacks(got_collection, failed)
+        return d
 
-    #
-    # Maildir import
-    #
-    def import_mail(self, mail_filename):
+    def import_mail(self, mbox_name, mail_string, flags, date):
         """
         Import a single mail into a mailbox.
 
-        :param mbox: the Mailbox instance to save in.
-        :type mbox: SoledadMailbox
-        :param mail_filename: the filename to the mail file to save
-        :type mail_filename: basestring
-        :return: a deferred
+        :param mbox_name: the name of the mailbox to save in.
+        :type mbox_name: str
+        :param mail_string: the raw message.
+        :type mail_string: str
+        :param flags: the flags of the message.
+        :type flags: tuple of str
+        :param date: the internal date of the message.
+        :type date: str
+        :return: a deferred that fires when all the documents of the message
+                 are saved.
+        :rtype: Deferred
         """
-        def saved(_):
-            print "message added"
-
-        with open(mail_filename) as f:
-            mail_string = f.read()
-            # uid = self._mbox.getUIDNext()
-            # print "saving with UID: %s" % uid
-            d = self._mbox.messages.add_msg(
-                mail_string, notify_on_disk=True)
+        d = self._get_collection(mbox_name)
+        d.addCallback(lambda collection: collection.add_msg(
+            mail_string, flags=flags, date=date, notify_just_mdoc=False))
         return d
 
-    def import_maildir(self, mbox_name="INBOX"):
+    def _get_import_journal_path(self, mbox_name):
         """
-        Import all mails in a maildir.
+        Return the path of the journal of the import of our maildir into
+        a mailbox.
 
-        We will process all subfolders as beloging
-        to the same mailbox (cur, new, tmp).
+        :rtype: str
         """
-        # TODO parse hierarchical subfolders into
-        # inferior mailboxes.
+        key = "%s\0%s" % (os.path.abspath(self.mdir), mbox_name)
+        return os.path.join(
+            get_path_prefix(), "leap", "plumber", "%s-%s.journal" % (
+                self.uuid, hashlib.sha1(key).hexdigest()[:16]))
 
+    def import_maildir(self, mbox_name="INBOX",
+                       concurrency=MaildirImporter.CONCURRENCY):
+        """
+        Import all mails in a maildir.
+
+        The cur and new folders of the root go to mbox_name, and the
+        subfolders to mailboxes with the same names. The messages are
+        streamed from the disk, saving `concurrency` of them at the same
+        time. The import can be interrupted and run again, the messages
+        already imported are skipped.
+
+        :param mbox_name: the mailbox the root of the maildir goes to.
+        :type mbox_name: str
+        :param concurrency: how many messages are saved at the same time.
+        :type concurrency: int
+        """
         if not os.path.isdir(self.mdir):
             print "ERROR: maildir path does not exist."
-            return
+            return self.exit()
 
         init = self._init_local_soledad()
         if not init:
             return self.exit()
 
-        mbox = self.acct.getMailbox(mbox_name)
-        self._mbox = mbox
-        len_mbox = mbox.getMessageCount()
+        journal_path = self._get_import_journal_path(mbox_name)
+        journal = ImportJournal(journal_path)
+        if len(journal):
+            print "Resuming the import, %s mails already imported." % (
+                len(journal),)
+
+        def progress(stats):
+            print ("%(imported)s mails imported, %(skipped)s skipped, "
+                   "%(failed)s failed (%(rate).1f msgs/s)" % stats)
+
+        importer = MaildirImporter(
+            self.mdir, self.import_mail, mbox_name=mbox_name,
+            journal=journal, concurrency=concurrency, progress=progress)
+
+        def all_saved(stats):
+            if stats["failed"]:
+                print ("%s mails could not be imported, run the import again "
+                       "to retry them." % (stats["failed"],))
+            else:
+                print "all messages imported"
+            # importing the same maildir again only adds what is new
+            print "Import journal: %s" % (journal_path,)
+
+        d = self.acct.callWhenReady(lambda _: importer.run())
+        d.addCallback(all_saved)
+        d.addErrback(lambda failure: logger.error(
+            "Error importing the maildir: %r" % (failure.value,)))
+        d.addCallback(self._cbExit)
+
+    #
+    # Export
+    #
 
-        mail_files_g = flatten(
-            map(partial(os.path.join, f), files)
-            for f, _, files in os.walk(self.mdir))
+    def _fetch_message(self, collection, uid):
+        """
+        Return a message of a mailbox as it is served over IMAP.
+
+        :param collection: the collection of the mailbox.
+        :type collection: MessageCollection
+        :param uid: the UID of the message.
+        :type uid: int
+        :return: a deferred that fires with an ExportedMessage, or None if
+                 the message is gone.
+        :rtype: Deferred
+        """
+        def produce(imap_msg, message):
+            buf = StringIO()
+            producer = imap4.MessageProducer(imap_msg, buf, task.coiterate)
+            d = producer.beginProducing(None)
+            d.addCallback(lambda _: ExportedMessage(
+                buf.getvalue(), message.get_flags(),
+                message.get_internal_date()))
+            return d
+
+        def serialize(message):
+            if message is None:
+                return None
+            ready = defer.Deferred()
+            ready.addCallback(produce, message)
+            IMAPMessage(message, store=self.sol, d=ready)
+            return ready
+
+        d = collection.get_message_by_uid(uid, get_cdocs=True)
+        d.addCallback(serialize)
+        return d
 
-        # we only coerce the generator to give the
-        # len, but we could skip than and inform at the end.
-        mail_files = list(mail_files_g)
-        print "Got %s mails to import into %s (%s)" % (
-            len(mail_files), mbox_name, len_mbox)
+    @defer.inlineCallbacks
+    def _export_mailbox(self, mbox, path, export_format, checkpoint,
+                        concurrency):
+        """
+        Export a mailbox, from where the checkpoint says the last export
+        got: an interrupted export is resumed, and once a mailbox is done
+        only the messages that arrived since are exported.
 
-        def all_saved(_):
-            print "all messages imported"
+        :param mbox: the mailbox to export.
+        :type mbox: leap.mail.adaptors.models.MailboxWrapper
+        """
+        last = checkpoint.get(mbox.mbox)
+        indexer = self.acct.account.mbox_indexer
+        yield indexer.create_table(mbox.uuid)
+        collection = yield self.acct.account.get_collection_by_mailbox(
+            mbox.mbox)
+        uids = PagedQuery(
+            self.sol, "SELECT uid FROM %s WHERE uid > ? ORDER BY uid "
+            "LIMIT ?" % (get_table_name(mbox.uuid),),
+            last[ExportCheckpoint.UID_KEY], UIDRepair.BATCH_SIZE)
+        writer = WRITERS[export_format](path, mbox.mbox, mbox.uuid)
+
+        exporter = MailboxExporter(
+            mbox.mbox, uids, partial(self._fetch_message, collection),
+            writer, checkpoint, concurrency=concurrency)
+        stats = yield exporter.run()
+        stats["mailbox"] = mbox.mbox
+        print ("%(mailbox)s: %(exported)s messages exported, %(missing)s "
+               "missing (%(rate).1f msgs/s)" % stats)
+
+    def _export(self, path, export_format, concurrency):
+        """
+        Export all the mailboxes of the account, one after the other.
+
+        :param path: where to export them.
+        :type path: str
+        :param export_format: MAILDIR_FORMAT or MBOX_FORMAT.
+        :type export_format: str
+        :param concurrency: how many messages are fetched at the same time.
+        :type concurrency: int
+        """
+        init = self._init_local_soledad()
+        if not init:
+            return self.exit()
 
-        deferreds = []
-        for f_name in mail_files:
-            deferreds.append(self.import_mail(f_name))
-        print "deferreds: ", deferreds
+        key = "%s\0%s" % (os.path.abspath(path), export_format)
+        checkpoint = ExportCheckpoint(os.path.join(
+            get_path_prefix(), "leap", "plumber", "%s-%s.export" % (
+                self.uuid, hashlib.sha1(key).hexdigest()[:16])))
+
+        @defer.inlineCallbacks
+        def export_all(mailboxes):
+            for mbox in mailboxes:
+                yield self._export_mailbox(mbox, path, export_format,
+                                           checkpoint, concurrency)
+            print "all mailboxes exported to %s" % (path,)
+
+        d = self.acct.callWhenReady(
+            lambda _: self.acct.account.get_all_mailboxes())
+        d.addCallback(export_all)
+        d.addErrback(self._export_errback)
+        d.addCallback(self._cbExit)
+
+    def _export_errback(self, failure):
+        if failure.check(MboxExistsError):
+            print "Not exporting: %s" % (failure.value,)
+        else:
+            logger.error("Error exporting the account, run the export "
+                         "again to resume it: %r" % (failure.value,))
+
+    def export_maildir(self, path, concurrency=MailboxExporter.CONCURRENCY):
+        """
+        Export all the mailboxes to a maildir, the INBOX in its root and
+        the rest in Maildir++ subfolders. An interrupted export continues
+        where it was left when run again, and an export run again to the
+        same path adds the new messages.
+
+        :param path: the root of the maildir.
+        :type path: str
+        :param concurrency: how many messages are fetched at the same time.
+        :type concurrency: int
+        """
+        self._export(path, MAILDIR_FORMAT, concurrency)
 
-        d1 = defer.gatherResults(deferreds, consumeErrors=False)
-        d1.addCallback(all_saved)
-        d1.addCallback(self._cbExit)
+    def export_mbox(self, path, concurrency=MailboxExporter.CONCURRENCY):
+        """
+        Export all the mailboxes to mbox files, one per mailbox. An
+        interrupted export continues where it was left when run again, and
+        an export run again to the same path adds the new messages. The mbox
+        files that exist and are not from an export to that path are not
+        overwritten.
+
+        :param path: the directory of the mbox files.
+        :type path: str
+        :param concurrency: how many messages are fetched at the same time.
+        :type concurrency: int
+        """
+        self._export(path, MBOX_FORMAT, concurrency)
 
     def _cbExit(self, ignored):
         return self.exit()
@@ -292,33 +516,61 @@ class MBOXPlumber(object):
         return
 
 
-def repair_account(userid):
+def repair_account(userid, dry_run=False):
     """
     Start repair process for a given account.
 
     :param userid: the user id (email-like)
+    :param dry_run: only show what would be repaired
     """
     from twisted.internet import reactor
     passwd = unicode(getpass.getpass("Passphrase: "))
 
     # go mario!
     plumber = MBOXPlumber(userid, passwd)
-    reactor.callLater(1, plumber.repair_account)
+    reactor.callLater(1, plumber.repair_account, dry_run=dry_run)
     reactor.run()
 
 
-def import_maildir(userid, maildir_path):
+def import_maildir(userid, maildir_path, mbox_name="INBOX",
+                   concurrency=MaildirImporter.CONCURRENCY):
     """
     Start import-maildir process for a given account.
 
     :param userid: the user id (email-like)
+    :param maildir_path: the path to the maildir to import
+    :param mbox_name: the mailbox the root of the maildir goes to
+    :param concurrency: how many messages are saved at the same time
     """
     from twisted.internet import reactor
     passwd = unicode(getpass.getpass("Passphrase: "))
 
     # go mario!
     plumber = MBOXPlumber(userid, passwd, mdir=maildir_path)
-    reactor.callLater(1, plumber.import_maildir)
+    reactor.callLater(1, plumber.import_maildir, mbox_name=mbox_name,
+                      concurrency=concurrency)
+    reactor.run()
+
+
+def export_account(userid, path, export_format=MAILDIR_FORMAT,
+                   concurrency=MailboxExporter.CONCURRENCY):
+    """
+    Start export process for a given account.
+
+    :param userid: the user id (email-like)
+    :param path: where to export the mailboxes
+    :param export_format: maildir or mbox
+    :param concurrency: how many messages are fetched at the same time
+    """
+    from twisted.internet import reactor
+    passwd = unicode(getpass.getpass("Passphrase: "))
+
+    plumber = MBOXPlumber(userid, passwd)
+    if export_format == MBOX_FORMAT:
+        export = plumber.export_mbox
+    else:
+        export = plumber.export_maildir
+    reactor.callLater(1, export, path, concurrency=concurrency)
     reactor.run()
 
 
@@ -327,12 +579,27 @@ if __name__ == "__main__":
 
     logging.basicConfig()
 
-    if len(sys.argv) != 3:
-        print "Usage: plumber [repair|import] <username>"
+    if len(sys.argv) < 3:
+        print "Usage: plumber repair <username> [--dry-run]"
+        print "       plumber import <username> <maildir> [<mailbox>]"
+        print "       plumber export <username> <path> [maildir|mbox]"
+        print "         (run again to resume it or to add the new messages)"
         sys.exit(1)
 
     # this would be better with a dict if it grows
     if sys.argv[1] == "repair":
-        repair_account(sys.argv[2])
+        repair_account(sys.argv[2], dry_run="--dry-run" in sys.argv[3:])
     if sys.argv[1] == "import":
-        print "Not implemented yet."
+        if len(sys.argv) < 4:
+            print "Missing the maildir to import."
+            sys.exit(1)
+        import_maildir(sys.argv[2], sys.argv[3], *sys.argv[4:5])
+    if sys.argv[1] == "export":
+        if len(sys.argv) < 4:
+            print "Missing where to export."
+            sys.exit(1)
+        export_format = sys.argv[4] if len(sys.argv) > 4 else MAILDIR_FORMAT
+        if export_format not in WRITERS:
+            print "Unknown format %s." % (export_format,)
+            sys.exit(1)
+        export_account(sys.argv[2], sys.argv[3], export_format)
@@ -21,21 +21,28 @@ import os
 import warnings
 
 from requests.exceptions import HTTPError
+from twisted.internet import reactor
 
+from leap.bitmask.config import flags
 from leap.bitmask.config.providerconfig import ProviderConfig
 from leap.bitmask.crypto.certs import download_client_cert
+from leap.bitmask.crypto.certstore import get_cert_store
 from leap.bitmask.logs.utils import get_logger
 from leap.bitmask.services import download_service_config
 from leap.bitmask.services.abstractbootstrapper import AbstractBootstrapper
+from leap.bitmask.services.mail.ondemand import (
+    OnDemandService, get_mail_interface)
 from leap.bitmask.services.mail.smtpconfig import SMTPConfig
 from leap.bitmask.util import is_file
 
-from leap.common import certs as leap_certs
 from leap.common.check import leap_assert
+from leap.common.events import catalog, emit_async
 from leap.common.files import check_and_fix_urw_only
 
 logger = get_logger()
 
+SMTP_PORT = 2013
+
 
 class NoSMTPHosts(Exception):
     """This is raised when there is no SMTP host to use."""
@@ -63,6 +70,7 @@ class SMTPBootstrapper(AbstractBootstrapper):
 
         self._smtp_service = None
         self._smtp_port = None
+        self._on_demand = None
 
     def _download_config_and_cert(self):
         """
@@ -96,7 +104,7 @@ class SMTPBootstrapper(AbstractBootstrapper):
             # For re-download if something is wrong with the cert
             self._download_if_needed = (
                 self._download_if_needed and
-                not leap_certs.should_redownload(client_cert_path))
+                not get_cert_store().should_redownload(client_cert_path))
 
             if self._download_if_needed and os.path.isfile(client_cert_path):
                 check_and_fix_urw_only(client_cert_path)
@@ -138,10 +146,14 @@ class SMTPBootstrapper(AbstractBootstrapper):
         client_cert_path = self._smtp_config.get_client_cert_path(
             self._userid, self._provider_config, about_to_download=True)
 
+        if flags.MAIL_ON_DEMAND:
+            self._start_smtp_on_demand(host, port, client_cert_path)
+            return
+
         from leap.mail.smtp import setup_smtp_gateway
 
         self._smtp_service, self._smtp_port = setup_smtp_gateway(
-            port=2013,
+            port=SMTP_PORT,
             userid=self._userid,
             keymanager=self._keymanager,
             smtp_host=host,
@@ -150,6 +162,50 @@ class SMTPBootstrapper(AbstractBootstrapper):
             smtp_key=client_cert_path,
             encrypted_only=False)
 
+    def _start_smtp_on_demand(self, host, port, client_cert_path):
+        """
+        Listen on the smtp port, and start the smtp gateway when a client
+        connects. It is stopped after some time without clients, see
+        flags.MAIL_IDLE_TIMEOUT.
+
+        :param host: the hostname of the remote SMTP server.
+        :type host: str
+        :param port: the port of the remote SMTP server.
+        :type port: int
+        :param client_cert_path: the client certificate and key.
+        :type client_cert_path: str
+        """
+        userid = self._userid
+        keymanager = self._keymanager
+
+        def start():
+            from leap.mail.outgoing.service import OutgoingMail
+            from leap.mail.smtp.gateway import SMTPFactory
+
+            logger.debug("Building the SMTP gateway.")
+            outgoing_mail = OutgoingMail(
+                userid, keymanager, client_cert_path, client_cert_path,
+                host, port)
+            return SMTPFactory(userid, keymanager, False, outgoing_mail)
+
+        def stop(factory):
+            factory.doStop()
+
+        on_demand = OnDemandService(
+            SMTP_PORT, start, stop, interface=get_mail_interface(),
+            idle_timeout=flags.MAIL_IDLE_TIMEOUT)
+        self._on_demand = on_demand
+
+        def listen():
+            if on_demand.listen():
+                emit_async(catalog.SMTP_SERVICE_STARTED, str(SMTP_PORT))
+            else:
+                emit_async(catalog.SMTP_SERVICE_FAILED_TO_START,
+                           str(SMTP_PORT))
+
+        # we are in a worker thread, the service lives in the reactor one
+        reactor.callFromThread(listen)
+
     def start_smtp_service(self, keymanager, userid, download_if_needed=False):
         """
         Starts the SMTP service.
@@ -189,7 +245,11 @@ class SMTPBootstrapper(AbstractBootstrapper):
         """
         Stops the smtp service (port and factory).
         """
-        if self._smtp_service is not None:
+        if self._on_demand is not None:
+            logger.debug('Stopping SMTP service.')
+            reactor.callFromThread(self._on_demand.stop)
+            self._on_demand = None
+        elif self._smtp_service is not None:
             logger.debug('Stopping SMTP service.')
             self._smtp_port.stopListening()
             self._smtp_service.doStop()
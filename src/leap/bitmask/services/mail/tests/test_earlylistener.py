@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+# test_earlylistener.py
+# Copyright (C) 2015 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the early listener.
+"""
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from nose.twistedtools import deferred, reactor
+from twisted.internet import defer, task
+from twisted.internet.protocol import ClientCreator, Factory, Protocol
+
+from leap.bitmask.services.mail.earlylistener import EarlyListener
+from leap.common.testing.basetest import BaseLeapTest
+
+GREETING = "* OK ready\r\n"
+
+
+class Greeter(Protocol):
+    """
+    Greets and echoes, like a tiny IMAP server.
+    """
+
+    def connectionMade(self):
+        self.transport.write(GREETING)
+
+    def dataReceived(self, data):
+        self.transport.write(data)
+
+
+class Client(Protocol):
+
+    def __init__(self):
+        self.received = ""
+        self.closed = defer.Deferred()
+
+    def dataReceived(self, data):
+        self.received += data
+
+    def connectionLost(self, reason):
+        self.closed.callback(None)
+
+
+def wait(seconds=0.1):
+    return task.deferLater(reactor, seconds, lambda: None)
+
+
+class EarlyListenerTest(BaseLeapTest):
+
+    def setUp(self):
+        self.listener = EarlyListener(0, interface="127.0.0.1",
+                                      clock=reactor)
+
+    def tearDown(self):
+        pass
+
+    def _connect(self):
+        port = self.listener.port.getHost().port
+        creator = ClientCreator(reactor, Client)
+        return creator.connectTCP("127.0.0.1", port)
+
+    @deferred(timeout=5)
+    @defer.inlineCallbacks
+    def test_hands_over_held_connections(self):
+        self.assertTrue(self.listener.start())
+        client = yield self._connect()
+        client.transport.write("a1 NOOP\r\n")
+        yield wait()
+
+        self.assertEqual(self.listener.held, 1)
+        self.assertEqual(client.received, "")
+
+        yield self.listener.stop_listening()
+        self.assertEqual(self.listener.port, None)
+        factory = Factory()
+        factory.protocol = Greeter
+        self.listener.hand_over(factory)
+        yield wait()
+
+        self.assertEqual(client.received, GREETING + "a1 NOOP\r\n")
+        client.transport.write("a2 LOGOUT\r\n")
+        yield wait()
+        self.assertTrue(client.received.endswith("a2 LOGOUT\r\n"))
+        client.transport.loseConnection()
+        yield client.closed
+
+    @deferred(timeout=5)
+    @defer.inlineCallbacks
+    def test_stop_closes_held_connections(self):
+        self.assertTrue(self.listener.start())
+        client = yield self._connect()
+        yield wait()
+
+        yield self.listener.stop()
+        yield client.closed
+        self.assertEqual(self.listener.held, 0)
+        self.assertEqual(client.received, "")
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+# test_exporter.py
+# Copyright (C) 2015 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the mailbox export.
+"""
+import mailbox
+import os
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from twisted.internet import defer
+
+from leap.bitmask.services.mail.exporter import (
+    ExportCheckpoint, ExportedMessage, MailboxExporter, MaildirWriter,
+    MboxExistsError, MboxWriter)
+from leap.bitmask.services.mail.maildir import iter_maildir
+from leap.common.testing.basetest import BaseLeapTest
+
+MBOX_UUID = "6ba7b810-9dad-11d1-80b4-00c04fd430c8"
+DATE = "Mon, 19 Oct 2015 10:00:00 +0000"
+
+
+class UIDs(object):
+    """
+    The UIDs after a checkpoint, like the paged query of the UID table.
+    """
+
+    def __init__(self, uids, start):
+        self._uids = [uid for uid in uids if uid > start]
+
+    def next(self):
+        return defer.succeed(self._uids.pop(0) if self._uids else None)
+
+
+def make_message(uid):
+    return ExportedMessage(
+        "Subject: %s\r\n\r\nFrom here\r\n" % (uid,), ("\\Seen",), DATE)
+
+
+class ExporterTestCase(BaseLeapTest):
+
+    def setUp(self):
+        self.path = os.path.join(self.tempdir, self.id())
+        self.checkpoint = ExportCheckpoint(
+            os.path.join(self.path, "checkpoint"))
+        self.fetching = []
+
+    def tearDown(self):
+        pass
+
+    def _fetch_later(self, uid):
+        d = defer.Deferred()
+        self.fetching.append((uid, d))
+        return d
+
+    def _export(self, writer, uids, fetch, checkpoint_every=None):
+        start = self.checkpoint.get("INBOX")[ExportCheckpoint.UID_KEY]
+        exporter = MailboxExporter("INBOX", UIDs(uids, start), fetch,
+                                   writer, self.checkpoint, concurrency=2)
+        if checkpoint_every is not None:
+            exporter.CHECKPOINT_EVERY = checkpoint_every
+        return exporter.run()
+
+    def test_in_order_with_window(self):
+        writer = MaildirWriter(os.path.join(self.path, "Maildir"), "INBOX",
+                               MBOX_UUID)
+        d = self._export(writer, [1, 2, 3], self._fetch_later)
+
+        self.assertEqual([uid for uid, _ in self.fetching], [1, 2])
+        # the second one arrives first, it waits for the first
+        self.fetching[1][1].callback(make_message(2))
+        self.assertEqual(len(self.fetching), 2)
+        self.fetching[0][1].callback(make_message(1))
+        self.assertEqual([uid for uid, _ in self.fetching], [1, 2, 3])
+        self.fetching[2][1].callback(None)
+
+        self.assertTrue(d.called)
+        messages = list(iter_maildir(os.path.join(self.path, "Maildir")))
+        self.assertEqual([m.flags for m in messages], [("\\Seen",)] * 2)
+        self.assertEqual(
+            self.checkpoint.get("INBOX"),
+            {"uid": 3, "position": None, "done": True})
+
+    def test_mbox_resume(self):
+        mbox_path = os.path.join(self.path, "INBOX.mbox")
+
+        def fail_on_three(uid):
+            if uid == 3:
+                raise RuntimeError("interrupted")
+            return make_message(uid)
+
+        d = self._export(MboxWriter(self.path, "INBOX", MBOX_UUID),
+                         [1, 2, 3, 4], fail_on_three, checkpoint_every=2)
+        errors = []
+        d.addErrback(errors.append)
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(self.checkpoint.get("INBOX")["uid"], 2)
+
+        # a half written message is dropped when resuming
+        with open(mbox_path, "a") as f:
+            f.write("From MAILER-DAEMON")
+        d = self._export(MboxWriter(self.path, "INBOX", MBOX_UUID),
+                         [1, 2, 3, 4], make_message)
+        self.assertTrue(d.called)
+
+        messages = list(mailbox.mbox(mbox_path))
+        self.assertEqual([m["Subject"] for m in messages],
+                         ["1", "2", "3", "4"])
+        self.assertEqual(messages[0].get_flags(), "RO")
+        # the mboxrd escaping, the mailbox module doesn't undo it
+        self.assertEqual(messages[0].get_payload(), ">From here\n")
+
+    def test_mbox_is_not_overwritten(self):
+        mbox_path = os.path.join(self.path, "INBOX.mbox")
+        os.makedirs(self.path)
+        with open(mbox_path, "w") as f:
+            f.write("From someone else\n")
+
+        d = self._export(MboxWriter(self.path, "INBOX", MBOX_UUID),
+                         [1, 2], make_message)
+        errors = []
+        d.addErrback(errors.append)
+        self.assertTrue(errors[0].check(MboxExistsError))
+        with open(mbox_path) as f:
+            self.assertEqual(f.read(), "From someone else\n")
+
+    def test_mbox_resume_before_the_first_checkpoint(self):
+        mbox_path = os.path.join(self.path, "INBOX.mbox")
+
+        def fail_on_two(uid):
+            if uid == 2:
+                raise RuntimeError("interrupted")
+            return make_message(uid)
+
+        d = self._export(MboxWriter(self.path, "INBOX", MBOX_UUID),
+                         [1, 2], fail_on_two)
+        d.addErrback(lambda _: None)
+        self.assertTrue(os.path.getsize(mbox_path) > 0)
+
+        d = self._export(MboxWriter(self.path, "INBOX", MBOX_UUID),
+                         [1, 2], make_message)
+        self.assertTrue(d.called)
+        self.assertEqual([m["Subject"] for m in mailbox.mbox(mbox_path)],
+                         ["1", "2"])
+
+    def test_done_mailbox_gets_the_new_messages(self):
+        mbox_path = os.path.join(self.path, "INBOX.mbox")
+        self._export(MboxWriter(self.path, "INBOX", MBOX_UUID),
+                     [1, 2], make_message)
+        self.assertTrue(self.checkpoint.get("INBOX")["done"])
+
+        results = []
+        d = self._export(MboxWriter(self.path, "INBOX", MBOX_UUID),
+                         [1, 2, 3], make_message)
+        d.addCallback(results.append)
+        self.assertEqual(results[0]["exported"], 1)
+        self.assertEqual([m["Subject"] for m in mailbox.mbox(mbox_path)],
+                         ["1", "2", "3"])
+
+
+if __name__ == "__main__":
+    unittest.main()
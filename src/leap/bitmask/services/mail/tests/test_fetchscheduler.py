@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+# test_fetchscheduler.py
+# Copyright (C) 2015 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the scheduling of the incoming mail fetches.
+"""
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from twisted.internet import defer, task
+
+from leap.bitmask.services.mail.fetchscheduler import FetchScheduler
+from leap.common.testing.basetest import BaseLeapTest
+
+BASE = 60
+
+
+class FakeFetcher(object):
+
+    def __init__(self):
+        self.fetches = []
+
+    def fetch(self):
+        d = defer.Deferred()
+        self.fetches.append(d)
+        return d
+
+    def finish(self, new_mail=0):
+        self.fetches[-1].callback(new_mail)
+
+
+class FetchSchedulerTest(BaseLeapTest):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.fetcher = FakeFetcher()
+        self.scheduler = FetchScheduler(
+            self.fetcher.fetch, base_interval=BASE, clock=self.clock)
+
+    def tearDown(self):
+        self.scheduler.stop()
+
+    def _start(self):
+        self.scheduler.start()
+        self.assertEqual(len(self.fetcher.fetches), 1)
+        self.fetcher.finish()
+
+    def test_backs_off_while_idle(self):
+        self._start()
+        self.assertEqual(self.scheduler.get_interval(),
+                         BASE * FetchScheduler.SLOW_DOWN)
+
+        for _ in range(10):
+            self.clock.advance(self.scheduler.get_interval())
+            self.fetcher.finish()
+        self.assertEqual(self.scheduler.get_interval(),
+                         FetchScheduler.MAX_INTERVAL)
+
+        self.clock.advance(FetchScheduler.MAX_INTERVAL)
+        self.fetcher.finish(new_mail=3)
+        self.assertEqual(self.scheduler.get_next_fetch_time(),
+                         self.clock.seconds() + BASE)
+
+    def test_sync_triggers_fetch(self):
+        self._start()
+        self.scheduler.notify_synced()
+        self.assertEqual(len(self.fetcher.fetches), 2)
+        self.assertEqual(self.scheduler.get_next_fetch_time(), None)
+
+    def test_activity_fetches_at_most_every_gap(self):
+        self._start()
+        self.scheduler.notify_activity()
+        self.assertEqual(len(self.fetcher.fetches), 2)
+        self.fetcher.finish()
+
+        # the interval stays at the base one while a client is active
+        self.clock.advance(1)
+        self.scheduler.notify_activity()
+        self.assertEqual(len(self.fetcher.fetches), 2)
+        self.assertEqual(self.scheduler.get_next_fetch_time(), BASE)
+
+        self.clock.advance(FetchScheduler.ACTIVITY_GAP)
+        self.fetcher.finish()
+        self.scheduler.notify_activity()
+        self.assertEqual(len(self.fetcher.fetches), 4)
+
+    def test_requests_are_coalesced(self):
+        self._start()
+        first = self.scheduler.request_fetch()
+        self.scheduler.notify_synced()
+        second = self.scheduler.request_fetch()
+        self.assertEqual(len(self.fetcher.fetches), 2)
+
+        self.fetcher.finish()
+        self.assertTrue(first.called)
+        self.assertFalse(second.called)
+        self.assertEqual(len(self.fetcher.fetches), 3)
+
+        self.fetcher.finish(new_mail=1)
+        self.assertTrue(second.called)
+        self.assertEqual(len(self.fetcher.fetches), 3)
+        self.assertNotEqual(self.scheduler.get_next_fetch_time(), None)
+
+    def test_failed_fetch_keeps_scheduling(self):
+        self._start()
+        d = self.scheduler.request_fetch()
+        failures = []
+        d.addErrback(failures.append)
+        self.fetcher.fetches[-1].errback(Exception("fetch failed"))
+
+        self.assertEqual(len(failures), 1)
+        self.assertNotEqual(self.scheduler.get_next_fetch_time(), None)
+
+    def test_stop(self):
+        self._start()
+        self.scheduler.stop()
+        self.clock.advance(FetchScheduler.MAX_INTERVAL)
+        self.assertEqual(len(self.fetcher.fetches), 1)
+
+
+class FakeSyncScheduler(object):
+
+    def __init__(self):
+        self.syncs = []
+        self.syncing = True
+
+    def request_sync(self):
+        if not self.syncing:
+            return None
+        d = defer.Deferred()
+        self.syncs.append(d)
+        return d
+
+
+class FetchSchedulerSyncTest(BaseLeapTest):
+    """
+    The fetches that need fresh mail request a soledad sync, and fetch when
+    it is notified.
+    """
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.fetcher = FakeFetcher()
+        self.syncs = FakeSyncScheduler()
+        self.scheduler = FetchScheduler(
+            self.fetcher.fetch, base_interval=BASE, clock=self.clock,
+            request_sync=self.syncs.request_sync)
+
+    def tearDown(self):
+        self.scheduler.stop()
+
+    def test_requests_a_sync_and_fetches_when_notified(self):
+        self.scheduler.start()
+        self.assertEqual(len(self.syncs.syncs), 1)
+        self.assertEqual(len(self.fetcher.fetches), 0)
+
+        # coalesced while waiting for the sync
+        d = self.scheduler.request_fetch()
+        self.scheduler.notify_activity()
+        self.assertEqual(len(self.syncs.syncs), 1)
+
+        self.syncs.syncs[0].callback(None)
+        self.assertEqual(len(self.fetcher.fetches), 0)
+        self.scheduler.notify_synced()
+        self.assertEqual(len(self.fetcher.fetches), 1)
+        self.fetcher.finish(new_mail=2)
+
+        self.assertTrue(d.called)
+        self.assertEqual(len(self.syncs.syncs), 1)
+        self.assertEqual(self.scheduler.get_next_fetch_time(),
+                         self.clock.seconds() + BASE)
+
+    def test_the_timer_requests_a_sync(self):
+        self.scheduler.start()
+        self.scheduler.notify_synced()
+        self.fetcher.finish()
+
+        self.clock.advance(self.scheduler.get_interval())
+        self.assertEqual(len(self.syncs.syncs), 2)
+        self.assertEqual(len(self.fetcher.fetches), 1)
+
+    def test_fetches_if_the_sync_is_not_notified(self):
+        self.scheduler.start()
+        self.syncs.syncs[0].callback(None)
+        self.clock.advance(FetchScheduler.SYNC_NOTIFY_TIMEOUT)
+        self.assertEqual(len(self.fetcher.fetches), 1)
+
+        # a late notification is another fetch
+        self.fetcher.finish()
+        self.scheduler.notify_synced()
+        self.assertEqual(len(self.fetcher.fetches), 2)
+
+    def test_fetches_if_the_sync_fails(self):
+        self.scheduler.start()
+        self.syncs.syncs[0].errback(Exception("sync failed"))
+        self.assertEqual(len(self.fetcher.fetches), 1)
+
+    def test_fetches_without_background_syncs(self):
+        self.syncs.syncing = False
+        self.scheduler.start()
+        self.assertEqual(len(self.syncs.syncs), 0)
+        self.assertEqual(len(self.fetcher.fetches), 1)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
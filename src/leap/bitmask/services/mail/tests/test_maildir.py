@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+# test_maildir.py
+# Copyright (C) 2015 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the Maildir import.
+"""
+import os
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from twisted.internet import defer
+
+from leap.bitmask.services.mail.maildir import (
+    ImportJournal, MaildirImporter, get_mailbox_name, iter_maildir)
+from leap.common.files import mkdir_p
+from leap.common.testing.basetest import BaseLeapTest
+
+
+class MaildirImporterTestCase(BaseLeapTest):
+
+    def setUp(self):
+        self.maildir = os.path.join(self.tempdir, self.id(), "Maildir")
+        self.journal_path = os.path.join(self.tempdir, self.id(), "journal")
+        self.saving = []
+
+    def tearDown(self):
+        pass
+
+    def _add_message(self, folder, name, body="Subject: test\r\n\r\ntest"):
+        path = os.path.join(self.maildir, folder)
+        mkdir_p(path)
+        with open(os.path.join(path, name), "w") as f:
+            f.write(body)
+
+    def _save_later(self, mailbox, raw, flags, date):
+        d = defer.Deferred()
+        self.saving.append((d, mailbox, flags))
+        return d
+
+    def test_mailbox_names(self):
+        self.assertEqual(get_mailbox_name("."), "INBOX")
+        self.assertEqual(get_mailbox_name(".Lists.Leap"), "Lists/Leap")
+        self.assertEqual(get_mailbox_name(os.path.join("Lists", "Leap")),
+                         "Lists/Leap")
+        self.assertEqual(get_mailbox_name(".Sent", "Archive"),
+                         "Archive/Sent")
+
+    def test_walk(self):
+        self._add_message("cur", "1:2,SR")
+        self._add_message("new", "2:2,S")
+        self._add_message("tmp", "3")
+        self._add_message(os.path.join(".Lists.Leap", "cur"), "4:2,F")
+
+        messages = list(iter_maildir(self.maildir))
+
+        self.assertEqual(
+            [(m.path, m.mailbox, m.flags) for m in messages],
+            [(os.path.join(".Lists.Leap", "cur", "4:2,F"), "Lists/Leap",
+              ("\\Flagged",)),
+             (os.path.join("cur", "1:2,SR"), "INBOX",
+              ("\\Answered", "\\Seen")),
+             (os.path.join("new", "2:2,S"), "INBOX", ())])
+
+    def test_concurrency_window(self):
+        for i in range(5):
+            self._add_message("cur", str(i))
+        importer = MaildirImporter(self.maildir, self._save_later,
+                                   concurrency=2)
+        d = importer.run()
+
+        self.assertEqual(len(self.saving), 2)
+        self.saving[0][0].callback(None)
+        self.assertEqual(len(self.saving), 3)
+        for waiting, _, _ in self.saving[1:]:
+            waiting.callback(None)
+        self.assertEqual(len(self.saving), 5)
+        self.saving[3][0].callback(None)
+        self.assertFalse(d.called)
+        self.saving[4][0].callback(None)
+
+        self.assertTrue(d.called)
+        self.assertEqual(importer.get_stats()["imported"], 5)
+
+    def test_resume_from_journal(self):
+        for i in range(4):
+            self._add_message("cur", str(i))
+
+        def save_or_fail(mailbox, raw, flags, date):
+            if len(saved) == 2:
+                raise RuntimeError("interrupted")
+            saved.append(raw)
+
+        saved = []
+        importer = MaildirImporter(self.maildir, save_or_fail,
+                                   journal=ImportJournal(self.journal_path))
+        importer.run()
+        stats = importer.get_stats()
+        self.assertEqual((stats["imported"], stats["failed"]), (2, 2))
+
+        importer = MaildirImporter(self.maildir, lambda *args: None,
+                                   journal=ImportJournal(self.journal_path))
+        importer.run()
+        stats = importer.get_stats()
+        self.assertEqual((stats["imported"], stats["skipped"]), (2, 2))
+        self.assertEqual(len(ImportJournal(self.journal_path)), 4)
+
+    def test_moved_messages_are_not_imported_again(self):
+        self._add_message("new", "1")
+        self._add_message("cur", "2:2,")
+        saved = []
+
+        def save(mailbox, raw, flags, date):
+            saved.append(flags)
+
+        importer = MaildirImporter(self.maildir, save,
+                                   journal=ImportJournal(self.journal_path))
+        importer.run()
+        self.assertEqual(len(saved), 2)
+
+        # a mail client saw the first one and flagged the second one
+        os.rename(os.path.join(self.maildir, "new", "1"),
+                  os.path.join(self.maildir, "cur", "1:2,S"))
+        os.rename(os.path.join(self.maildir, "cur", "2:2,"),
+                  os.path.join(self.maildir, "cur", "2:2,F"))
+        self._add_message("new", "3")
+
+        importer = MaildirImporter(self.maildir, save,
+                                   journal=ImportJournal(self.journal_path))
+        importer.run()
+        stats = importer.get_stats()
+        self.assertEqual((stats["imported"], stats["skipped"]), (1, 2))
+        self.assertEqual(len(saved), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# test_ondemand.py
+# Copyright (C) 2015 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the on-demand services.
+"""
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from nose.twistedtools import deferred, reactor
+from twisted.internet import defer, task
+from twisted.internet.protocol import ClientCreator, Factory
+
+from leap.bitmask.services.mail.ondemand import OnDemandService
+from leap.bitmask.services.mail.tests.test_earlylistener import (
+    GREETING, Client, Greeter, wait)
+from leap.common.testing.basetest import BaseLeapTest
+
+IDLE_TIMEOUT = 0.2
+
+
+class OnDemandServiceTest(BaseLeapTest):
+
+    def setUp(self):
+        self.started = []
+        self.stopped = []
+        self.service = OnDemandService(
+            0, self._start, self.stopped.append, interface="127.0.0.1",
+            idle_timeout=IDLE_TIMEOUT, clock=reactor)
+
+    def tearDown(self):
+        pass
+
+    def _start(self):
+        factory = Factory()
+        factory.protocol = Greeter
+        self.started.append(factory)
+        # like a service that takes a while to start
+        return task.deferLater(reactor, 0.05, lambda: factory)
+
+    @defer.inlineCallbacks
+    def _connect(self):
+        port = self.service.port.getHost().port
+        creator = ClientCreator(reactor, Client)
+        client = yield creator.connectTCP("127.0.0.1", port)
+        defer.returnValue(client)
+
+    @deferred(timeout=5)
+    @defer.inlineCallbacks
+    def test_started_on_connection_and_stopped_when_idle(self):
+        self.assertTrue(self.service.listen())
+        yield wait()
+        self.assertEqual(self.started, [])
+
+        client = yield self._connect()
+        client.transport.write("a1 NOOP\r\n")
+        yield wait()
+        self.assertEqual(len(self.started), 1)
+        self.assertEqual(client.received, GREETING + "a1 NOOP\r\n")
+
+        # a second client uses the same service
+        other = yield self._connect()
+        yield wait()
+        self.assertEqual(other.received, GREETING)
+        self.assertEqual(len(self.started), 1)
+
+        client.transport.loseConnection()
+        yield client.closed
+        yield wait(IDLE_TIMEOUT * 2)
+        self.assertEqual(self.stopped, [])
+
+        other.transport.loseConnection()
+        yield other.closed
+        yield wait(IDLE_TIMEOUT * 2)
+        self.assertEqual(self.stopped, self.started)
+        self.assertEqual(self.service.service, None)
+
+        # and started again for the next client
+        client = yield self._connect()
+        yield wait()
+        self.assertEqual(client.received, GREETING)
+        self.assertEqual(len(self.started), 2)
+
+        yield self.service.stop()
+        yield client.closed
+        self.assertEqual(self.stopped, self.started)
+        self.assertEqual(self.service.port, None)
+
+    @deferred(timeout=5)
+    @defer.inlineCallbacks
+    def test_failed_start_closes_connections(self):
+        self.service = OnDemandService(
+            0, lambda: defer.fail(Exception("broken")), self.stopped.append,
+            interface="127.0.0.1", clock=reactor)
+        self.assertTrue(self.service.listen())
+
+        client = yield self._connect()
+        yield client.closed
+        self.assertEqual(client.received, "")
+        yield self.service.stop()
+        self.assertEqual(self.stopped, [])
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+# test_uidrepair.py
+# Copyright (C) 2015 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the UID repair.
+"""
+import sqlite3
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from twisted.internet import defer
+
+from leap.bitmask.services.mail.uidrepair import UIDRepair, get_table_name
+from leap.common.testing.basetest import BaseLeapTest
+
+MBOX_UUID = "6ba7b810-9dad-11d1-80b4-00c04fd430c8"
+OTHER_UUID = "6ba7b811-9dad-11d1-80b4-00c04fd430c8"
+
+
+class SqliteStore(object):
+    """
+    The raw query methods of Soledad, on an in-memory sqlite database.
+    """
+
+    def __init__(self):
+        self.db = sqlite3.connect(":memory:")
+        self.db.execute("CREATE TABLE document ("
+                        "doc_id TEXT PRIMARY KEY, doc_rev TEXT, "
+                        "content TEXT)")
+        self.operations = 0
+
+    def raw_sqlcipher_query(self, sql, args=()):
+        return defer.succeed(self.db.execute(sql, args).fetchall())
+
+    def raw_sqlcipher_operation(self, sql, args=()):
+        self.operations += 1
+        self.db.execute(sql, args)
+        self.db.commit()
+        return defer.succeed(None)
+
+
+def meta_id(mbox_uuid, i):
+    return "M-%s-%040x" % (mbox_uuid.replace("-", "_"), i)
+
+
+class UIDRepairTestCase(BaseLeapTest):
+
+    def setUp(self):
+        self.store = SqliteStore()
+        self.table = get_table_name(MBOX_UUID)
+        self.store.db.execute(
+            "CREATE TABLE %s(uid INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "hash TEXT UNIQUE NOT NULL)" % (self.table,))
+
+    def tearDown(self):
+        pass
+
+    def _add_doc(self, doc_id, deleted=False):
+        self.store.db.execute(
+            "INSERT INTO document VALUES (?, '1', ?)",
+            (doc_id, None if deleted else "{}"))
+
+    def _index(self, doc_id):
+        self.store.db.execute(
+            "INSERT INTO %s (hash) VALUES (?)" % (self.table,), (doc_id,))
+
+    def _get_uids(self):
+        return self.store.db.execute(
+            "SELECT uid, hash FROM %s ORDER BY uid" % (self.table,)
+        ).fetchall()
+
+    def _run(self, **kwargs):
+        d = UIDRepair(self.store, MBOX_UUID, **kwargs).run()
+        result = []
+        d.addCallback(result.append)
+        return result[0]
+
+    def test_repair(self):
+        for i in range(10):
+            self._add_doc(meta_id(MBOX_UUID, i))
+            if i not in (3, 7):
+                self._index(meta_id(MBOX_UUID, i))
+        # a removed message and another mailbox
+        self._add_doc(meta_id(MBOX_UUID, 20), deleted=True)
+        self._index(meta_id(MBOX_UUID, 20))
+        self._add_doc(meta_id(OTHER_UUID, 1))
+
+        stats = self._run(batch_size=3)
+
+        self.assertEqual(stats["checked"], 10)
+        self.assertEqual((stats["missing"], stats["dangling"]), (2, 1))
+        # the ids are only kept for a dry run
+        self.assertNotIn("missing_ids", stats)
+        self.assertNotIn("dangling_ids", stats)
+        uids = self._get_uids()
+        self.assertEqual(sorted(doc_id for _, doc_id in uids),
+                         [meta_id(MBOX_UUID, i) for i in range(10)])
+        # the repaired messages are new to the clients
+        self.assertEqual([doc_id for _, doc_id in uids[-2:]],
+                         [meta_id(MBOX_UUID, 3), meta_id(MBOX_UUID, 7)])
+        self.assertTrue(uids[-2][0] > 9)
+
+    def test_dry_run(self):
+        self._add_doc(meta_id(MBOX_UUID, 1))
+        self._index(meta_id(MBOX_UUID, 2))
+
+        stats = self._run(dry_run=True)
+
+        self.assertEqual((stats["missing"], stats["dangling"]), (1, 1))
+        self.assertEqual(stats["missing_ids"], [meta_id(MBOX_UUID, 1)])
+        self.assertEqual(stats["dangling_ids"], [meta_id(MBOX_UUID, 2)])
+        self.assertEqual(self._get_uids(), [(1, meta_id(MBOX_UUID, 2))])
+        self.assertEqual(self.store.operations, 0)
+
+    def test_writes_only_changes(self):
+        for i in range(100):
+            self._add_doc(meta_id(MBOX_UUID, i))
+            self._index(meta_id(MBOX_UUID, i))
+
+        stats = self._run(batch_size=10)
+
+        self.assertEqual((stats["missing"], stats["dangling"]), (0, 0))
+        # only the create table if not exists
+        self.assertEqual(self.store.operations, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+# test_workload.py
+# Copyright (C) 2015 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the synthetic mail workloads.
+"""
+import email
+import os
+import random
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from leap.bitmask.services.mail.maildir import iter_maildir
+from leap.bitmask.services.mail.workload import (
+    generate_maildir, generate_message)
+from leap.common.testing.basetest import BaseLeapTest
+
+
+class WorkloadTestCase(BaseLeapTest):
+
+    def setUp(self):
+        self.path = os.path.join(self.tempdir, self.id())
+
+    def tearDown(self):
+        pass
+
+    def test_message_structure(self):
+        raw = generate_message(random.Random(0), 7, size=1000,
+                               attachments=2, attachment_size=100, depth=2)
+        msg = email.message_from_string(raw)
+
+        self.assertEqual(msg["Subject"], "Message 7")
+        parts = list(msg.walk())
+        self.assertEqual([part.get_content_type() for part in parts], [
+            "multipart/mixed", "multipart/mixed", "text/plain",
+            "application/octet-stream", "application/octet-stream"])
+        self.assertTrue(len(parts[2].get_payload()) >= 1000)
+        self.assertEqual(len(parts[3].get_payload(decode=True)), 100)
+
+    def test_maildir(self):
+        first = os.path.join(self.path, "first")
+        second = os.path.join(self.path, "second")
+        generate_maildir(first, messages=10, folders=3, seed=1)
+        generate_maildir(second, messages=10, folders=3, seed=1)
+
+        messages = list(iter_maildir(first))
+        self.assertEqual(len(messages), 10)
+        self.assertEqual(sorted(set(m.mailbox for m in messages)),
+                         ["Folder1", "Folder2", "INBOX"])
+        # the same seed gives the same maildir
+        for message in messages:
+            with open(os.path.join(first, message.path)) as f:
+                with open(os.path.join(second, message.path)) as g:
+                    self.assertEqual(f.read(), g.read())
+
+
+if __name__ == "__main__":
+    unittest.main()
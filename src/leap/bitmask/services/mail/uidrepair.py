@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+# uidrepair.py
+# Copyright (C) 2015 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Repair of the UID tables of the mailboxes.
+
+leap.mail gives UIDs to the messages of a mailbox with a local-only table,
+the uid is an autoincrement key and the hash is the id of the meta document
+of the message. The table can drift from the documents: a meta document
+that arrived by sync was not indexed, or a message was removed and its row
+was left behind. The repair compares both sides, streaming them in id
+order, and only writes the rows that differ: the missing messages get new
+UIDs, the UIDs of the messages that are gone are removed.
+
+Every id of the mailbox is read, so the time a repair takes still grows
+with the size of the mailbox. What doesn't is the memory, a page of ids at
+a time, and the writes, which grow with the number of changes only.
+"""
+from twisted.internet import defer
+
+from leap.bitmask.logs.utils import get_logger
+
+logger = get_logger()
+
+# these follow the leap.mail 0.4.0 schema
+UID_TABLE_PREFIX = "leapmail_uid_"
+META_DOC_ID_PREFIX = "M-%s-"
+
+
+def get_table_name(mbox_uuid):
+    """
+    Return the name of the UID table of a mailbox.
+
+    :param mbox_uuid: the uuid of the mailbox.
+    :type mbox_uuid: str
+
+    :rtype: str
+    """
+    return UID_TABLE_PREFIX + mbox_uuid.replace("-", "_")
+
+
+class PagedQuery(object):
+    """
+    Reads the values of a sorted column a page at a time, so only one page
+    is in memory.
+    """
+
+    def __init__(self, store, sql, start, page_size, *args):
+        """
+        Constructor for the paged query.
+
+        :param store: runs the queries, a Soledad instance.
+        :type store: Soledad
+        :param sql: the query, it selects a single column, takes the last
+                    value read, the extra args and the page size, and sorts
+                    by that column.
+        :type sql: str
+        :param start: a value lower than any result.
+        :type start: str
+        :param page_size: how many rows to read at once.
+        :type page_size: int
+        """
+        self._store = store
+        self._sql = sql
+        self._last = start
+        self._page_size = page_size
+        self._args = args
+        self._page = []
+        self._exhausted = False
+
+    @defer.inlineCallbacks
+    def next(self):
+        """
+        Return the next value, or None at the end.
+
+        :rtype: Deferred
+        """
+        if not self._page and not self._exhausted:
+            rows = yield self._store.raw_sqlcipher_query(
+                self._sql, (self._last,) + self._args + (self._page_size,))
+            rows = rows or []
+            self._exhausted = len(rows) < self._page_size
+            # pop from the end
+            self._page = [row[0] for row in reversed(rows)]
+        if not self._page:
+            defer.returnValue(None)
+        self._last = self._page.pop()
+        defer.returnValue(self._last)
+
+
+class UIDRepair(object):
+    """
+    Repairs the UID table of a mailbox.
+    """
+
+    # rows read and written at once, sqlite takes at most 999 parameters
+    BATCH_SIZE = 500
+
+    def __init__(self, store, mbox_uuid, batch_size=BATCH_SIZE,
+                 dry_run=False):
+        """
+        Constructor for the UID repair.
+
+        :param store: the local database, a Soledad instance.
+        :type store: Soledad
+        :param mbox_uuid: the uuid of the mailbox.
+        :type mbox_uuid: str
+        :param batch_size: rows read and written at once.
+        :type batch_size: int
+        :param dry_run: only find the differences, don't write them.
+        :type dry_run: bool
+        """
+        self._store = store
+        self._table = get_table_name(mbox_uuid)
+        self._prefix = META_DOC_ID_PREFIX % (mbox_uuid.replace("-", "_"),)
+        self._batch_size = batch_size
+        self._dry_run = dry_run
+
+        self._missing = []
+        self._dangling = []
+        self._stats = {"checked": 0, "missing": 0, "dangling": 0}
+        if dry_run:
+            # the differences are shown, not repaired
+            self._stats["missing_ids"] = []
+            self._stats["dangling_ids"] = []
+
+    def _table_exists(self):
+        d = self._store.raw_sqlcipher_query(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name=?",
+            (self._table,))
+        d.addCallback(bool)
+        return d
+
+    def _iter_meta_docs(self):
+        """
+        Return the ids of the meta documents of the mailbox, in order.
+
+        :rtype: PagedQuery
+        """
+        # the ids of the mailbox go from the prefix to the same prefix with
+        # its last character ('-') replaced by the next one ('.')
+        return PagedQuery(
+            self._store,
+            "SELECT doc_id FROM document WHERE doc_id > ? AND doc_id < ? "
+            "AND content IS NOT NULL ORDER BY doc_id LIMIT ?",
+            self._prefix, self._batch_size, self._prefix[:-1] + ".")
+
+    def _iter_indexed(self):
+        """
+        Return the meta document ids in the UID table, in order.
+
+        :rtype: PagedQuery
+        """
+        return PagedQuery(
+            self._store,
+            "SELECT hash FROM %s WHERE hash > ? ORDER BY hash LIMIT ?" % (
+                self._table,),
+            "", self._batch_size)
+
+    @defer.inlineCallbacks
+    def run(self):
+        """
+        Repair the table. It reads all the ids of the mailbox and of its
+        table, so it takes longer the bigger the mailbox is.
+
+        :returns: a deferred that fires with the stats: the meta documents
+                  checked, and the number of ids missing from the table and
+                  left in it without a document. With a dry run, the ids
+                  themselves are in missing_ids and dangling_ids.
+        :rtype: Deferred
+        """
+        if not self._dry_run:
+            yield self._store.raw_sqlcipher_operation(
+                "CREATE TABLE if not exists %s( "
+                "uid  INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "hash TEXT UNIQUE NOT NULL)" % (self._table,))
+            has_table = True
+        else:
+            has_table = yield self._table_exists()
+
+        docs = self._iter_meta_docs()
+        indexed = self._iter_indexed() if has_table else None
+
+        doc = yield docs.next()
+        row = (yield indexed.next()) if indexed is not None else None
+
+        # a merge of both sorted streams
+        while doc is not None or row is not None:
+            if row is None or (doc is not None and doc < row):
+                self._stats["checked"] += 1
+                yield self._add_missing(doc)
+                doc = yield docs.next()
+            elif doc is None or row < doc:
+                yield self._add_dangling(row)
+                row = yield indexed.next()
+            else:
+                self._stats["checked"] += 1
+                doc = yield docs.next()
+                row = yield indexed.next()
+
+        yield self._flush()
+        defer.returnValue(self._stats)
+
+    def _add_missing(self, doc_id):
+        self._stats["missing"] += 1
+        if self._dry_run:
+            self._stats["missing_ids"].append(doc_id)
+        self._missing.append(doc_id)
+        if len(self._missing) >= self._batch_size:
+            return self._flush()
+
+    def _add_dangling(self, doc_id):
+        self._stats["dangling"] += 1
+        if self._dry_run:
+            self._stats["dangling_ids"].append(doc_id)
+        self._dangling.append(doc_id)
+        if len(self._dangling) >= self._batch_size:
+            return self._flush()
+
+    @defer.inlineCallbacks
+    def _flush(self):
+        """
+        Write the pending changes, each kind in a single statement.
+        """
+        missing, self._missing = self._missing, []
+        dangling, self._dangling = self._dangling, []
+        if self._dry_run:
+            return
+
+        if dangling:
+            yield self._store.raw_sqlcipher_operation(
+                "DELETE FROM %s WHERE hash IN (%s)" % (
+                    self._table, ", ".join("?" * len(dangling))),
+                tuple(dangling))
+        if missing:
+            yield self._store.raw_sqlcipher_operation(
+                "INSERT INTO %s (hash) VALUES %s" % (
+                    self._table, ", ".join(["(?)"] * len(missing))),
+                tuple(missing))
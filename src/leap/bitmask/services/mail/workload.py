@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+# workload.py
+# Copyright (C) 2015 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Synthetic mail workloads, to measure the mail code without a real account.
+
+The messages are made from a seeded random generator, the same parameters
+always give the same Maildir.
+"""
+import os
+import random
+
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.utils import formatdate
+
+from leap.bitmask.services.mail.maildir import MAILDIR_INFO
+from leap.common.files import mkdir_p
+
+WORDS = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do "
+         "eiusmod tempor incididunt ut labore et dolore magna aliqua ut "
+         "enim ad minim veniam quis nostrud exercitation ullamco laboris "
+         "nisi aliquip ex ea commodo consequat").split()
+
+# the maildir flags of the messages, picked at random
+FLAG_SETS = ("S", "S", "S", "RS", "FS", "")
+
+# a fixed date, so the same parameters give the same messages
+BASE_TIMESTAMP = 1420070400
+
+
+def _text(rng, size):
+    """
+    Return about size bytes of random words, in lines.
+    """
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    lines = [" ".join(words[i:i + 12]) for i in range(0, len(words), 12)]
+    return "\n".join(lines) + "\n"
+
+
+def generate_message(rng, index, size=2048, attachments=0,
+                     attachment_size=16384, depth=1):
+    """
+    Return a synthetic message.
+
+    :param rng: the random generator.
+    :type rng: random.Random
+    :param index: the number of the message, used in its headers.
+    :type index: int
+    :param size: the size of the text of the message, in bytes.
+    :type size: int
+    :param attachments: the number of binary attachments.
+    :type attachments: int
+    :param attachment_size: the size of each attachment, in bytes.
+    :type attachment_size: int
+    :param depth: how many multiparts are nested, 0 for a plain text
+                  message. It is at least 1 when there are attachments.
+    :type depth: int
+
+    :rtype: str
+    """
+    body = MIMEText(_text(rng, size))
+    if attachments:
+        depth = max(depth, 1)
+
+    msg = body
+    for level in range(depth):
+        # a fixed boundary, email picks a random one
+        multipart = MIMEMultipart(
+            boundary="==benchmark.%s.%s==" % (index, level))
+        multipart.attach(msg)
+        if level == 0:
+            for number in range(attachments):
+                data = "".join(chr(rng.randint(0, 255))
+                               for _ in xrange(attachment_size))
+                attachment = MIMEApplication(data)
+                attachment.add_header(
+                    "Content-Disposition", "attachment",
+                    filename="attachment-%s.bin" % (number,))
+                multipart.attach(attachment)
+        msg = multipart
+
+    msg["From"] = "sender%s@example.org" % (index % 10,)
+    msg["To"] = "benchmark@example.org"
+    msg["Subject"] = "Message %s" % (index,)
+    msg["Date"] = formatdate(BASE_TIMESTAMP + index * 60)
+    msg["Message-ID"] = "<%s.benchmark@example.org>" % (index,)
+    return msg.as_string()
+
+
+def get_folder_names(folders):
+    """
+    Return the Maildir++ folders of a synthetic Maildir, the root first.
+
+    :param folders: the number of folders, counting the root.
+    :type folders: int
+
+    :rtype: list of str
+    """
+    return [""] + [".Folder%s" % (i,) for i in range(1, folders)]
+
+
+def generate_maildir(path, messages=100, folders=1, size=2048,
+                     attachments=0, attachment_size=16384, depth=1, seed=0):
+    """
+    Write a synthetic Maildir, with the messages spread over its folders.
+
+    :param path: the root of the Maildir.
+    :type path: str
+    :param messages: the number of messages.
+    :type messages: int
+    :param folders: the number of folders, counting the root (the INBOX).
+    :type folders: int
+    :param seed: the seed of the random generator.
+    :type seed: int
+
+    The rest of the parameters are those of generate_message.
+
+    :returns: the total size of the messages, in bytes.
+    :rtype: int
+    """
+    rng = random.Random(seed)
+    names = get_folder_names(max(1, folders))
+    for name in names:
+        for sub in ("cur", "new", "tmp"):
+            mkdir_p(os.path.join(path, name, sub))
+
+    total = 0
+    for index in range(messages):
+        raw = generate_message(rng, index, size=size,
+                               attachments=attachments,
+                               attachment_size=attachment_size, depth=depth)
+        folder = names[index % len(names)]
+        timestamp = BASE_TIMESTAMP + index * 60
+        filename = "%d.%d.benchmark%s%s" % (
+            timestamp, index, MAILDIR_INFO, rng.choice(FLAG_SETS))
+        message_path = os.path.join(path, folder, "cur", filename)
+        with open(message_path, "w") as f:
+            f.write(raw)
+        os.utime(message_path, (timestamp, timestamp))
+        total += len(raw)
+    return total
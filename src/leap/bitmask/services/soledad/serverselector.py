@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+# serverselector.py
+# Copyright (C) 2015 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Selection of the soledad server to sync against.
+
+The soledad-service.json of a provider can list several hosts. They are
+ranked by the time a TLS connection to each of them takes, measured from
+the network we are on, and by how they worked for us before. The
+bootstrapper and the syncer go down the ranking when a host fails.
+"""
+import json
+import os
+import socket
+import ssl
+import threading
+import time
+
+from leap.bitmask.logs.utils import get_logger
+from leap.bitmask.util import get_path_prefix
+from leap.bitmask.util.resolver import get_resolver
+from leap.common.files import mkdir_p
+
+logger = get_logger()
+
+
+def get_server_key(server):
+    """
+    Return the key we know a server by.
+
+    :param server: a host entry of the soledad-service.json
+    :type server: dict
+
+    :rtype: str
+    """
+    return "%s:%s" % (server["hostname"], server["port"])
+
+
+class ServerSelector(object):
+    """
+    Ranks the soledad servers and keeps the stats of each one of them.
+
+    The ranking of a set of servers is cached per network (the local
+    address we use to reach them) for CACHE_SECONDS, or until one of them
+    fails.
+    """
+
+    # seconds a ranking is good for
+    CACHE_SECONDS = 600
+
+    # max seconds we wait for a server to complete the TLS handshake
+    CONNECT_TIMEOUT = 5
+
+    # seconds added to the latency of a server that always fails
+    FAILURE_PENALTY = 2
+
+    # weight of the last measure in the smoothed latency
+    LATENCY_WEIGHT = 0.3
+
+    SUCCESSES_KEY = "successes"
+    FAILURES_KEY = "failures"
+    LATENCY_KEY = "latency"
+
+    def __init__(self, path=None, resolve=None, clock=time.time):
+        """
+        Constructor for the server selector.
+
+        :param path: where to keep the stats of the servers, None to keep
+                     them only in memory.
+        :type path: str or None
+        :param resolve: resolves a hostname to an address, blocking.
+                        Defaults to the shared resolver.
+        :type resolve: callable
+        :param clock: returns the current time, used for testing.
+        :type clock: callable
+        """
+        self._path = path
+        self._resolve = resolve
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._rankings = {}
+        self._stats = self._load()
+
+    def _load(self):
+        """
+        Return the stats saved on disk.
+
+        :rtype: dict
+        """
+        if self._path is None or not os.path.isfile(self._path):
+            return {}
+        try:
+            with open(self._path) as f:
+                stats = json.load(f)
+            if isinstance(stats, dict):
+                return stats
+        except (IOError, ValueError) as e:
+            logger.warning("Ignoring the soledad servers stats: %r" % (e,))
+        return {}
+
+    def _save(self):
+        """
+        Write the stats to disk. The lock must be held.
+        """
+        if self._path is None:
+            return
+        try:
+            mkdir_p(os.path.dirname(self._path))
+            with open(self._path, "w") as f:
+                json.dump(self._stats, f)
+        except (IOError, OSError) as e:
+            logger.warning("Could not save the soledad servers stats: %r" %
+                           (e,))
+
+    def _get_stats(self, key):
+        """
+        Return the stats of a server, creating them if needed. The lock
+        must be held.
+
+        :rtype: dict
+        """
+        stats = self._stats.get(key)
+        if not isinstance(stats, dict):
+            stats = self._stats[key] = {
+                self.SUCCESSES_KEY: 0,
+                self.FAILURES_KEY: 0,
+                self.LATENCY_KEY: None,
+            }
+        return stats
+
+    def get_stats(self, server):
+        """
+        Return a copy of the stats of a server: successes, failures and
+        the smoothed latency in seconds.
+
+        :param server: a host entry of the soledad-service.json
+        :type server: dict
+
+        :rtype: dict
+        """
+        with self._lock:
+            return dict(self._get_stats(get_server_key(server)))
+
+    def _resolve_host(self, hostname):
+        """
+        Return the address of a hostname.
+
+        :rtype: str
+        :raises socket.gaierror: if it can't be resolved.
+        """
+        resolve = self._resolve
+        if resolve is None:
+            resolve = get_resolver().blocking_resolve
+        return resolve(hostname)
+
+    def _get_network_id(self, address):
+        """
+        Return the local address we would use to reach address. It tells
+        apart the networks we are on without sending anything.
+
+        :rtype: str
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.connect((address, 9))
+            return sock.getsockname()[0]
+        except socket.error:
+            return "unknown"
+        finally:
+            sock.close()
+
+    def measure(self, server):
+        """
+        Return the seconds a TLS connection to the server takes.
+
+        The certificate is not checked here, this is only used to rank the
+        servers. Soledad checks it when it connects.
+
+        :param server: a host entry of the soledad-service.json
+        :type server: dict
+
+        :returns: the latency, or None if we couldn't connect.
+        :rtype: float or None
+        """
+        try:
+            address = self._resolve_host(server["hostname"])
+            start = self._clock()
+            sock = socket.create_connection(
+                (address, int(server["port"])), self.CONNECT_TIMEOUT)
+            try:
+                tls_sock = ssl.wrap_socket(sock)
+                tls_sock.close()
+            finally:
+                sock.close()
+            return self._clock() - start
+        except (socket.error, ssl.SSLError, ValueError, KeyError) as e:
+            logger.warning("Cannot connect to soledad server %s: %r" %
+                           (server.get("hostname"), e))
+            return None
+
+    def _measure_all(self, servers):
+        """
+        Measure the latency of the servers at the same time.
+
+        :returns: the latency of each server, None for the unreachable ones.
+        :rtype: list of float or None
+        """
+        latencies = [None] * len(servers)
+
+        def measure(index):
+            latencies[index] = self.measure(servers[index])
+
+        threads = [threading.Thread(target=measure, args=(index,))
+                   for index in range(len(servers))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join(self.CONNECT_TIMEOUT * 2)
+        return latencies
+
+    def _get_score(self, key, latency):
+        """
+        Return the score of a server, the lower the better. The lock must
+        be held.
+
+        :rtype: float
+        """
+        stats = self._get_stats(key)
+        successes = stats[self.SUCCESSES_KEY]
+        failures = stats[self.FAILURES_KEY]
+        failure_ratio = float(failures) / (successes + failures + 1)
+        return latency + self.FAILURE_PENALTY * failure_ratio
+
+    def rank(self, servers):
+        """
+        Return the servers ordered from the best to the worst.
+
+        The reachable servers come first, by their latency and failures,
+        and then the rest by what we know of them.
+
+        :param servers: the host entries of the soledad-service.json
+        :type servers: list of dict
+
+        :rtype: list of dict
+        """
+        servers = list(servers)
+        if len(servers) < 2:
+            return servers
+
+        try:
+            network = self._get_network_id(
+                self._resolve_host(servers[0]["hostname"]))
+        except socket.gaierror:
+            network = "unknown"
+        cache_key = (network, frozenset(map(get_server_key, servers)))
+
+        with self._lock:
+            cached = self._rankings.get(cache_key)
+            if (cached is not None and
+                    self._clock() - cached[0] < self.CACHE_SECONDS):
+                by_key = dict((get_server_key(s), s) for s in servers)
+                return [by_key[key] for key in cached[1]]
+
+        latencies = self._measure_all(servers)
+
+        with self._lock:
+            reachable = []
+            unreachable = []
+            for server, latency in zip(servers, latencies):
+                key = get_server_key(server)
+                if latency is None:
+                    known = self._get_stats(key)[self.LATENCY_KEY]
+                    if known is None:
+                        known = float("inf")
+                    unreachable.append((self._get_score(key, known), server))
+                else:
+                    self._update_latency(key, latency)
+                    reachable.append((self._get_score(key, latency), server))
+            self._save()
+
+            ranking = [server for score, server in
+                       sorted(reachable, key=lambda item: item[0]) +
+                       sorted(unreachable, key=lambda item: item[0])]
+            self._rankings[cache_key] = (
+                self._clock(), [get_server_key(s) for s in ranking])
+
+        logger.debug("Soledad servers ranking: %s" %
+                     (", ".join(map(get_server_key, ranking)),))
+        return ranking
+
+    def _update_latency(self, key, latency):
+        """
+        Add a latency measure to the stats of a server. The lock must be
+        held.
+        """
+        stats = self._get_stats(key)
+        old = stats[self.LATENCY_KEY]
+        if old is None:
+            stats[self.LATENCY_KEY] = latency
+        else:
+            stats[self.LATENCY_KEY] = (self.LATENCY_WEIGHT * latency +
+                                       (1 - self.LATENCY_WEIGHT) * old)
+
+    def record_success(self, server):
+        """
+        Record that a server worked.
+
+        :param server: a host entry of the soledad-service.json
+        :type server: dict
+        """
+        with self._lock:
+            self._get_stats(get_server_key(server))[self.SUCCESSES_KEY] += 1
+            self._save()
+
+    def record_failure(self, server):
+        """
+        Record that a server failed, the next ranking measures them again.
+
+        :param server: a host entry of the soledad-service.json
+        :type server: dict
+        """
+        key = get_server_key(server)
+        with self._lock:
+            self._get_stats(key)[self.FAILURES_KEY] += 1
+            self._save()
+            for cache_key in self._rankings.keys():
+                if key in cache_key[1]:
+                    del self._rankings[cache_key]
+
+
+_selector = None
+
+
+def get_server_selector():
+    """
+    Return the server selector shared by the whole backend.
+
+    :rtype: ServerSelector
+    """
+    global _selector
+    if _selector is None:
+        path = os.path.join(get_path_prefix(), "leap", "soledad",
+                            "servers.json")
+        _selector = ServerSelector(path)
+    return _selector
@@ -20,11 +20,12 @@ Soledad bootstrapping
 import os
 import socket
 import sys
+import time
 
 from sqlite3 import ProgrammingError as sqlite_ProgrammingError
 
 from u1db import errors as u1db_errors
-from twisted.internet import defer, reactor
+from twisted.internet import defer, reactor, threads
 from zope.proxy import sameProxiedObjects
 from pysqlcipher.dbapi2 import ProgrammingError as sqlcipher_ProgrammingError
 
@@ -34,12 +35,20 @@ from leap.bitmask.crypto.srpauth import SRPAuth
 from leap.bitmask.logs.utils import get_logger
 from leap.bitmask.services import download_service_config
 from leap.bitmask.services.abstractbootstrapper import AbstractBootstrapper
+from leap.bitmask.services.mail.imap import get_mail_check_period
+from leap.bitmask.services.soledad.serverselector import \
+    get_server_selector
 from leap.bitmask.services.soledad.soledadconfig import SoledadConfig
-from leap.bitmask.util import first, is_file, is_empty_file, make_address
+from leap.bitmask.services.soledad.syncprogress import SyncProgress
+from leap.bitmask.services.soledad.syncscheduler import SyncScheduler
+from leap.bitmask.util import is_file, is_empty_file, make_address
 from leap.bitmask.util import get_path_prefix
 from leap.bitmask.util import here
 from leap.bitmask.platform_init import IS_WIN, IS_MAC
 from leap.common.check import leap_assert, leap_assert_type, leap_check
+from leap.common.events import catalog
+from leap.common.events import register as leap_register
+from leap.common.events import unregister as leap_unregister
 from leap.common.files import which
 from leap.keymanager import KeyManager, openpgp
 from leap.keymanager.errors import KeyNotFound
@@ -124,6 +133,8 @@ class SoledadBootstrapper(AbstractBootstrapper):
 
         self._soledad = None
         self._keymanager = None
+        self._sync_scheduler = None
+        self._activity_uid = "bitmask.soledad.activity.%s" % (id(self),)
 
     @property
     def srpauth(self):
@@ -143,6 +154,10 @@ class SoledadBootstrapper(AbstractBootstrapper):
     def keymanager(self):
         return self._keymanager
 
+    @property
+    def sync_scheduler(self):
+        return self._sync_scheduler
+
     # initialization
 
     def load_offline_soledad(self, username, password, uuid):
@@ -202,25 +217,26 @@ class SoledadBootstrapper(AbstractBootstrapper):
 
         :param uuid: the uuid of the user, used in offline mode.
         :type uuid: unicode, or None.
-        :return: server_url, cert_file
+        :return: servers, cert_file. The servers are a list of (url,
+                 host entry) pairs, from the best to the worst.
         :rtype: tuple
         """
         if offline is True:
-            server_url = "http://localhost:9999/"
+            servers = [("http://localhost:9999/", None)]
             cert_file = ""
         else:
             if uuid is None:
                 uuid = self.srpauth.get_uuid()
-            server_url = self._pick_server(uuid)
+            servers = self._pick_servers(uuid)
             cert_file = self._provider_config.get_ca_cert_path()
 
-        return server_url, cert_file
+        return servers, cert_file
 
     def _do_soledad_init(self, uuid, secrets_path, local_db_path,
-                         server_url, cert_file, token, syncable):
+                         servers, cert_file, token, syncable):
         """
         Initialize soledad, retry if necessary and raise an exception if we
-        can't succeed.
+        can't succeed. If a server can't be reached, the next one is tried.
 
         :param uuid: user identifier
         :type uuid: str
@@ -228,24 +244,43 @@ class SoledadBootstrapper(AbstractBootstrapper):
         :type secrets_path: str
         :param local_db_path: path to local db file
         :type local_db_path: str
-        :param server_url: soledad server uri
-        :type server_url: str
+        :param servers: the soledad servers, as (url, host entry) pairs,
+                        from the best to the worst.
+        :type servers: list of tuple(str, dict)
         :param cert_file: path to the certificate of the ca used
                           to validate the SSL certificate used by the remote
                           soledad server.
         :type cert_file: str
         :param auth token: auth token
         :type auth_token: str
+
+        :returns: the servers left, the one in use first.
+        :rtype: list of tuple(str, dict)
         """
+        selector = get_server_selector()
         init_tries = 1
         while init_tries <= self.MAX_INIT_RETRIES:
+            server_url, server = servers[0]
             try:
                 logger.debug("Trying to init soledad....")
                 self._try_soledad_init(
                     uuid, secrets_path, local_db_path,
                     server_url, cert_file, token, syncable)
                 logger.debug("Soledad has been initialized.")
-                return
+                if syncable and server is not None:
+                    selector.record_success(server)
+                return servers
+            except (socket.timeout, socket.error) as exc:
+                init_tries += 1
+                if server is not None:
+                    selector.record_failure(server)
+                if len(servers) > 1:
+                    # fail over to the next server, and keep this one as
+                    # the last resort
+                    servers = servers[1:] + servers[:1]
+                    logger.warning("Cannot reach %s, trying %s" %
+                                   (server_url, servers[0][0]))
+                continue
             except Exception as exc:
                 init_tries += 1
                 msg = "Init failed, retrying... (retry {0} of {1})".format(
@@ -267,15 +302,17 @@ class SoledadBootstrapper(AbstractBootstrapper):
         :param offline: whether to instantiate soledad for offline use.
         :type offline: bool
 
-        :return: A Deferred which fires when soledad is sync, or which fails
-                 with SoledadInitError or SoledadSyncError
+        :return: A Deferred which fires when soledad is ready to be used,
+                 or which fails with SoledadInitError or SoledadSyncError.
+                 Soledad is ready once synced, or right away if the keys
+                 of the user are in the local database.
         :rtype: defer.Deferred
         """
         local_param = self._get_soledad_local_params(uuid, offline)
         remote_param = self._get_soledad_server_params(uuid, offline)
 
         secrets_path, local_db_path, token = local_param
-        server_url, cert_file = remote_param
+        servers, cert_file = remote_param
 
         if offline:
             return self._load_soledad_nosync(
@@ -283,14 +320,15 @@ class SoledadBootstrapper(AbstractBootstrapper):
 
         else:
             return self._load_soledad_online(uuid, secrets_path, local_db_path,
-                                             server_url, cert_file, token)
+                                             servers, cert_file, token)
 
     def _load_soledad_online(self, uuid, secrets_path, local_db_path,
-                             server_url, cert_file, token):
+                             servers, cert_file, token):
         syncable = True
         try:
-            self._do_soledad_init(uuid, secrets_path, local_db_path,
-                                  server_url, cert_file, token, syncable)
+            servers = self._do_soledad_init(uuid, secrets_path,
+                                            local_db_path, servers,
+                                            cert_file, token, syncable)
         except SoledadInitError as e:
             # re-raise the exceptions from try_init,
             # we're currently handling the retries from the
@@ -302,34 +340,191 @@ class SoledadBootstrapper(AbstractBootstrapper):
 
         address = make_address(
             self._user, self._provider_config.get_domain())
-        syncer = Syncer(self._soledad, self._signaler)
-
+        checkpoint_path = "%s.sync" % (os.path.splitext(local_db_path)[0],)
+        syncer = Syncer(self._soledad, self._signaler, checkpoint_path,
+                        servers)
+
+        # open soledad -> init keymanager -+-> local key? -> ready
+        #                                  |
+        #                                  +-> first sync -> keys -> ready
+        #                                                  -> background syncs
+        # with the private key already in the local database we are ready
+        # right away and the first sync goes on in the background.
         d = self._init_keymanager(address, token)
-        d.addCallback(lambda _: syncer.sync())
-        d.addErrback(self._soledad_sync_errback)
+        d.addCallback(lambda _: self._has_local_key(address))
+        d.addCallback(self._first_sync, syncer)
+        return d
+
+    def _has_local_key(self, address):
+        """
+        Check if the private key of the user is in the local database.
+
+        :param address: the address of the user.
+        :type address: str
+
+        :returns: a deferred that fires with whether the key is there.
+        :rtype: Deferred
+        """
+        def not_found(failure):
+            failure.trap(KeyNotFound)
+            return False
+
+        d = self._keymanager.get_key(
+            address, openpgp.OpenPGPKey, private=True, fetch_remote=False)
+        d.addCallbacks(lambda _: True, not_found)
+        return d
+
+    def _first_sync(self, has_local_key, syncer):
+        """
+        Run the first sync, and reconcile the keys with the synced database
+        when it finishes.
+
+        :param has_local_key: whether the private key is already in the
+                              local database.
+        :type has_local_key: bool
+        :param syncer: the syncer of the soledad instance.
+        :type syncer: Syncer
+
+        :returns: a deferred that fires when soledad is ready to be used,
+                  or None if it already is.
+        :rtype: Deferred or None
+        """
+        if has_local_key:
+            logger.debug("Private key found locally, syncing in the "
+                         "background.")
+            # before syncing, so the sync failures are not bootstrap
+            # failures
+            syncer.set_bootstrapped()
+
+        d = syncer.sync()
+        d.addCallbacks(self._first_sync_done, self._first_sync_errback,
+                       callbackArgs=(syncer, has_local_key),
+                       errbackArgs=(syncer, has_local_key))
+
+        if not has_local_key:
+            # we can't tell if the user has a key until the first sync
+            # brings the database from the server
+            return d
+        return None
+
+    def _first_sync_done(self, result, syncer, has_local_key):
+        """
+        Callback for the first sync, start the background syncs and
+        generate the keys of the user if the database doesn't have them.
+
+        :rtype: Deferred
+        """
+        self._start_sync_scheduler(None, syncer)
+        d = self._gen_key()
+        d.addErrback(self._gen_key_errback, has_local_key)
         return d
 
+    def _first_sync_errback(self, failure, syncer, has_local_key):
+        """
+        Errback for the first sync. If the bootstrap didn't wait for it,
+        the background syncs go on anyway unless the token is not valid.
+        """
+        if failure.check(InvalidAuthTokenError):
+            # in the case of an invalid token we have already turned off
+            # mail and warned the user
+            return None
+        if not has_local_key:
+            # the syncer already signaled the bootstrap failure
+            return failure
+        logger.error("The first soledad sync failed: %r" % (failure.value,))
+        self._start_sync_scheduler(None, syncer)
+
+    def _gen_key_errback(self, failure, has_local_key):
+        """
+        Errback for the keys set up after the first sync. It is a bootstrap
+        failure only if the bootstrap was waiting for the keys.
+        """
+        logger.error("Could not set up the keys of the user: %r" %
+                     (failure.value,))
+        if has_local_key:
+            return None
+        self._signaler.signal(self._signaler.soledad_bootstrap_failed)
+        return failure
+
+    def _start_sync_scheduler(self, result, syncer):
+        """
+        Keep syncing soledad in the background after the first sync.
+
+        :param syncer: the syncer used for the first sync.
+        :type syncer: Syncer
+        """
+        self.stop_sync_scheduler()
+        self._sync_scheduler = SyncScheduler(
+            syncer, base_interval=get_mail_check_period())
+        self._sync_scheduler.start()
+        leap_register(event=catalog.IMAP_CLIENT_LOGIN,
+                      callback=self._handle_mail_activity,
+                      uid=self._activity_uid)
+        return result
+
+    def _handle_mail_activity(self, event, *content):
+        """
+        Callback for the events that tell the user is using the mail, it
+        can be called from another thread.
+        """
+        scheduler = self._sync_scheduler
+        if scheduler is not None:
+            reactor.callFromThread(scheduler.notify_activity)
+
+    def stop_sync_scheduler(self):
+        """
+        Stop the background syncs, if they are running.
+        """
+        if self._sync_scheduler is not None:
+            leap_unregister(event=catalog.IMAP_CLIENT_LOGIN,
+                            uid=self._activity_uid)
+            self._sync_scheduler.stop()
+            self._sync_scheduler = None
+
     def _load_soledad_nosync(self, uuid, secrets_path, local_db_path,
                              cert_file, token):
+        """
+        Open soledad and the keymanager without syncing.
+
+        Opening soledad decrypts the secrets, running the KDF over the
+        password, so it is done in a worker thread to keep the reactor, and
+        the IMAP connections accepted meanwhile, going. The time each phase
+        takes is signaled once done.
+        """
         syncable = False
-        self._do_soledad_init(uuid, secrets_path, local_db_path,
-                              "", cert_file, token, syncable)
-        d = self._init_keymanager(self._address, token)
+        timings = {}
+        start = time.time()
+
+        def soledad_opened(_):
+            timings["soledad"] = time.time() - start
+            return self._init_keymanager(self._address, token)
+
+        def keymanager_ready(result):
+            timings["total"] = time.time() - start
+            timings["keymanager"] = timings["total"] - timings["soledad"]
+            logger.debug("Offline unlock done in %(total).2f seconds "
+                         "(soledad %(soledad).2f, keymanager "
+                         "%(keymanager).2f)" % timings)
+            self._signaler.signal(self._signaler.soledad_offline_timings,
+                                  timings)
+            return result
+
+        d = threads.deferToThread(
+            self._do_soledad_init, uuid, secrets_path, local_db_path,
+            [("", None)], cert_file, token, syncable)
+        d.addCallback(soledad_opened)
+        d.addCallback(keymanager_ready)
         return d
 
-    def _soledad_sync_errback(self, failure):
-        failure.trap(InvalidAuthTokenError)
-        # in the case of an invalid token we have already turned off mail and
-        # warned the user
-
-    def _pick_server(self, uuid):
+    def _pick_servers(self, uuid):
         """
-        Choose a soledad server to sync against.
+        Rank the soledad servers to sync against.
 
         :param uuid: the uuid for the user.
         :type uuid: unicode
-        :returns: the server url
-        :rtype: unicode
+        :returns: the (url, host entry) of each server, from the best to
+                  the worst.
+        :rtype: list of tuple(unicode, dict)
         """
         # TODO: Select server based on timezone (issue #3308)
         server_dict = self._soledad_config.get_hosts()
@@ -338,13 +533,18 @@ class SoledadBootstrapper(AbstractBootstrapper):
             # XXX raise more specific exception, and catch it properly!
             raise Exception("No soledad server found")
 
-        selected_server = server_dict[first(server_dict.keys())]
-        server_url = "https://%s:%s/user-%s" % (
-            selected_server["hostname"],
-            selected_server["port"],
-            uuid)
-        logger.debug("Using soledad server url: %s" % (server_url,))
-        return server_url
+        ranking = get_server_selector().rank(server_dict.values())
+
+        servers = []
+        for server in ranking:
+            server_url = "https://%s:%s/user-%s" % (
+                server["hostname"],
+                server["port"],
+                uuid)
+            servers.append((server_url, server))
+
+        logger.debug("Using soledad server url: %s" % (servers[0][0],))
+        return servers
 
     def _try_soledad_init(self, uuid, secrets_path, local_db_path,
                           server_url, cert_file, auth_token, syncable):
@@ -366,8 +566,6 @@ class SoledadBootstrapper(AbstractBootstrapper):
         :param auth token: auth token
         :type auth_token: str
         """
-        # TODO: If selected server fails, retry with another host
-        # (issue #3309)
         encoding = sys.getfilesystemencoding()
 
         try:
@@ -594,7 +792,6 @@ class SoledadBootstrapper(AbstractBootstrapper):
 
         # soledad config is ok, let's proceed to load and sync soledad
         d = self.load_and_sync_soledad(uuid)
-        d.addCallback(lambda _: self._gen_key())
         d.addCallback(lambda _: self._signaler.signal(signal_finished))
         return d
 
@@ -607,35 +804,174 @@ class Syncer(object):
     #      soledad
 
     MAX_SYNC_RETRIES = 10
-    WAIT_MAX_SECONDS = 600
 
-    def __init__(self, soledad, signaler):
+    # attempts of a sync, also counting the ones that made progress
+    MAX_SYNC_ATTEMPTS = 50
+
+    # seconds between the checks for a stalled sync
+    CHECK_INTERVAL = 10
+
+    def __init__(self, soledad, signaler, checkpoint_path=None,
+                 servers=None):
+        """
+        Constructor for the syncer.
+
+        :param soledad: the soledad instance to sync.
+        :type soledad: Soledad
+        :param signaler: Signaler object used to send notifications
+                         from the backend
+        :type signaler: Signaler
+        :param checkpoint_path: where to keep the progress of the sync, so
+                                an interrupted one can be resumed.
+        :type checkpoint_path: str or None
+        :param servers: the soledad servers to fail over to, as (url, host
+                        entry) pairs, the one soledad uses first.
+        :type servers: list of tuple(str, dict) or None
+        """
         self._tries = 0
+        self._attempts = 0
         self._soledad = soledad
         self._signaler = signaler
+        self._servers = list(servers or [])
+        self._progress = SyncProgress(checkpoint_path)
+        self._check_delayed_call = None
+        self._timed_out = False
+        self._events_uid = "bitmask.syncer.%s" % (id(self),)
+        self._last_stats = None
+        self._bootstrapped = False
+
+    def get_last_stats(self):
+        """
+        Return the stats of the last sync attempt, see
+        SyncProgress.finish_attempt.
+
+        :rtype: dict or None
+        """
+        return self._last_stats
+
+    def set_bootstrapped(self):
+        """
+        Let the syncer know the bootstrap doesn't wait for its syncs, so
+        their failures are not bootstrap failures.
+        """
+        self._bootstrapped = True
 
     def sync(self):
+        self._tries = 0
+        self._attempts = 0
         self._callback_deferred = defer.Deferred()
+        self._register_events()
+        self._callback_deferred.addBoth(self._unregister_events)
         self._try_sync()
         return self._callback_deferred
 
+    def _register_events(self):
+        """
+        Follow the progress of the sync through the soledad events.
+        """
+        leap_register(event=catalog.SOLEDAD_SYNC_RECEIVE_STATUS,
+                      callback=self._handle_status, uid=self._events_uid)
+        leap_register(event=catalog.SOLEDAD_SYNC_SEND_STATUS,
+                      callback=self._handle_status, uid=self._events_uid)
+
+    def _unregister_events(self, result):
+        leap_unregister(event=catalog.SOLEDAD_SYNC_RECEIVE_STATUS,
+                        uid=self._events_uid)
+        leap_unregister(event=catalog.SOLEDAD_SYNC_SEND_STATUS,
+                        uid=self._events_uid)
+        return result
+
+    def _handle_status(self, event, content):
+        """
+        Callback for the soledad sync status events, it can be called from
+        another thread.
+
+        :param event: the event that triggered the callback.
+        :type event: str
+        :param content: the counts of the sync attempt.
+        :type content: dict
+        """
+        try:
+            self._progress.update(received=content.get("received"),
+                                  sent=content.get("sent"),
+                                  total=content.get("total"))
+        except AttributeError:
+            logger.warning("Unexpected sync status: %r" % (content,))
+
     def _try_sync(self):
         logger.debug("BOOTSTRAPPER: trying to sync Soledad....")
+        self._attempts += 1
+        self._progress.start_attempt()
+        self._schedule_check()
         # pass defer_decryption=False to get inline decryption
         # for debugging.
-        self._timeout_delayed_call = reactor.callLater(self.WAIT_MAX_SECONDS,
-                                                       self._timeout)
         self._sync_deferred = self._soledad.sync(defer_decryption=True)
         self._sync_deferred.addCallbacks(self._success, self._error)
 
+    def _schedule_check(self):
+        self._check_delayed_call = reactor.callLater(self.CHECK_INTERVAL,
+                                                     self._check)
+
+    def _cancel_check(self):
+        if (self._check_delayed_call is not None and
+                self._check_delayed_call.active()):
+            self._check_delayed_call.cancel()
+        self._check_delayed_call = None
+
+    def _check(self):
+        """
+        Cancel the sync attempt if it stopped moving documents, keep
+        watching it otherwise.
+        """
+        if self._progress.is_stalled():
+            self._timeout()
+        else:
+            self._schedule_check()
+
+    def _finish_attempt(self, success):
+        """
+        Record the end of a sync attempt and signal its stats.
+
+        :returns: whether the attempt moved any document.
+        :rtype: bool
+        """
+        self._cancel_check()
+        made_progress = self._progress.made_progress()
+        stats = self._progress.finish_attempt(success)
+        self._last_stats = stats
+        logger.debug("Sync attempt %(attempt)s: %(received)s documents "
+                     "received and %(sent)s sent in %(seconds).1f seconds."
+                     % stats)
+        self._signaler.signal(self._signaler.soledad_sync_stats, stats)
+        return made_progress
+
+    def _fail_over(self):
+        """
+        Sync against the next server on the next attempt, if there is
+        another one.
+        """
+        if not self._servers:
+            return
+        server_url, server = self._servers[0]
+        if server is not None:
+            get_server_selector().record_failure(server)
+        if len(self._servers) > 1:
+            self._servers = self._servers[1:] + self._servers[:1]
+            logger.warning("Sync against %s failed, trying %s" %
+                           (server_url, self._servers[0][0]))
+            self._soledad.server_url = self._servers[0][0]
+
     def _success(self, result):
         logger.debug("Soledad has been synced!")
-        self._timeout_delayed_call.cancel()
+        self._finish_attempt(True)
+        self._bootstrapped = True
+        if self._servers and self._servers[0][1] is not None:
+            get_server_selector().record_success(self._servers[0][1])
         self._callback_deferred.callback(result)
         # so long, and thanks for all the fish
 
     def _error(self, failure):
-        self._timeout_delayed_call.cancel()
+        made_progress = self._finish_attempt(False)
         if failure.check(InvalidAuthTokenError):
             logger.error('Invalid auth token while trying to sync Soledad')
             self._signaler.signal(
@@ -645,30 +981,52 @@ class Syncer(object):
                            sqlcipher_ProgrammingError):
             logger.exception("%r" % (failure.value,))
             self._callback_deferred.fail(failure)
+        elif self._timed_out:
+            # we cancelled it, _timeout takes care of the retry
+            self._timed_out = False
         else:
             logger.error("%r" % (failure.value,))
-            self._retry()
+            if not made_progress:
+                self._fail_over()
+            self._retry(made_progress)
 
     def _timeout(self):
         # maybe it's my connection, but I'm getting
         # ssl handshake timeouts and read errors quite often.
-        # A particularly big sync is a disaster.
-        # This deserves further investigation, maybe the
-        # retry strategy can be pushed to u1db, or at least
-        # it's something worthy to talk about with the
-        # ubuntu folks.
+        # A sync that keeps moving documents is not cut anymore, we only
+        # give up on an attempt that stalled, and the next one goes on
+        # from where it was left.
+        logger.warning("The sync stalled for %s seconds." %
+                       (self._progress.get_stall_timeout(),))
+        made_progress = self._progress.made_progress()
+        self._timed_out = True
         self._sync_deferred.cancel()
-        self._retry()
+        if not made_progress:
+            self._fail_over()
+        self._retry(made_progress)
 
-    def _retry(self):
-        self._tries += 1
-        if self._tries < self.MAX_SYNC_RETRIES:
+    def _retry(self, made_progress):
+        """
+        Try to sync again. An attempt that moved documents before failing
+        doesn't count as a failed try, the next one resumes it, but no sync
+        gets more than MAX_SYNC_ATTEMPTS attempts.
+
+        :param made_progress: whether the failed attempt moved documents.
+        :type made_progress: bool
+        """
+        if not made_progress:
+            self._tries += 1
+        if (self._tries < self.MAX_SYNC_RETRIES and
+                self._attempts < self.MAX_SYNC_ATTEMPTS):
             msg = "Sync failed, retrying... (retry {0} of {1})".format(
                 self._tries, self.MAX_SYNC_RETRIES)
             logger.warning(msg)
             self._try_sync()
         else:
-            logger.error("Sync failed {0} times".format(self._tries))
-            self._signaler.signal(self._signaler.soledad_bootstrap_failed)
+            logger.error("Sync failed {0} times, after {1} attempts".format(
+                self._tries, self._attempts))
+            if not self._bootstrapped:
+                # only the first sync is part of the bootstrap
+                self._signaler.signal(self._signaler.soledad_bootstrap_failed)
             self._callback_deferred.errback(
                 SoledadSyncError("Too many retries"))
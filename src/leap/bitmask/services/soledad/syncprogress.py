@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+# syncprogress.py
+# Copyright (C) 2015 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Progress and checkpoints of the Soledad syncs.
+
+Soledad stores the documents it receives as they arrive, so an interrupted
+sync doesn't lose what it already transferred. The checkpoint keeps on disk
+how far the interrupted attempts got and how fast the documents were
+moving, so the next attempt (even after a restart) is known to be a
+continuation and gets a timeout that fits the connection.
+"""
+import json
+import os
+import threading
+import time
+
+from leap.bitmask.logs.utils import get_logger
+from leap.common.files import mkdir_p
+
+logger = get_logger()
+
+
+class SyncProgress(object):
+    """
+    Tracks the documents moved by each sync attempt, from the soledad sync
+    status events, and decides when an attempt is stalled.
+
+    An attempt is stalled when no document moved for a while. How long
+    depends on the transfer rate we saw: the time STALL_DOCS documents
+    take, between MIN_STALL_SECONDS and MAX_STALL_SECONDS. Until we know
+    the rate the longest wait is used.
+    """
+
+    MIN_STALL_SECONDS = 60
+    MAX_STALL_SECONDS = 600
+    STALL_DOCS = 50
+
+    # weight of the last attempt in the smoothed transfer rate
+    RATE_WEIGHT = 0.5
+
+    PENDING_KEY = "pending"
+    RECEIVED_KEY = "received"
+    SENT_KEY = "sent"
+    TOTAL_KEY = "total"
+    RATE_KEY = "rate"
+
+    def __init__(self, path=None, clock=time.time):
+        """
+        Constructor for the sync progress.
+
+        :param path: where to keep the checkpoint, None to not keep it.
+        :type path: str or None
+        :param clock: returns the current time, used for testing.
+        :type clock: callable
+        """
+        self._path = path
+        self._clock = clock
+        self._lock = threading.Lock()
+
+        self._checkpoint = self._load()
+        self._attempt = 0
+        self._started = None
+        self._last_progress = None
+        self._received = 0
+        self._sent = 0
+
+    def _load(self):
+        """
+        Return the checkpoint saved on disk, an empty one if there is none.
+
+        :rtype: dict
+        """
+        checkpoint = {
+            self.PENDING_KEY: False,
+            self.RECEIVED_KEY: 0,
+            self.SENT_KEY: 0,
+            self.TOTAL_KEY: None,
+            self.RATE_KEY: None,
+        }
+        if self._path is None or not os.path.isfile(self._path):
+            return checkpoint
+
+        try:
+            with open(self._path) as f:
+                saved = json.load(f)
+            for key in checkpoint:
+                if key in saved:
+                    checkpoint[key] = saved[key]
+        except (IOError, ValueError, TypeError) as e:
+            logger.warning("Ignoring the sync checkpoint: %r" % (e,))
+        return checkpoint
+
+    def _save(self):
+        """
+        Write the checkpoint to disk. The lock must be held.
+        """
+        if self._path is None:
+            return
+
+        # a checkpoint half written is ignored when loading it
+        try:
+            mkdir_p(os.path.dirname(self._path))
+            with open(self._path, "w") as f:
+                json.dump(self._checkpoint, f)
+        except (IOError, OSError) as e:
+            logger.warning("Could not save the sync checkpoint: %r" % (e,))
+
+    @property
+    def is_resuming(self):
+        """
+        Whether the current attempt continues an interrupted sync.
+
+        :rtype: bool
+        """
+        with self._lock:
+            return bool(self._checkpoint[self.PENDING_KEY])
+
+    def start_attempt(self):
+        """
+        Start tracking a new sync attempt.
+        """
+        with self._lock:
+            self._attempt += 1
+            self._started = self._last_progress = self._clock()
+            self._received = self._sent = 0
+            if self._checkpoint[self.PENDING_KEY]:
+                logger.debug(
+                    "Resuming the sync, %s documents received and %s sent "
+                    "so far." % (self._checkpoint[self.RECEIVED_KEY],
+                                 self._checkpoint[self.SENT_KEY]))
+            self._checkpoint[self.PENDING_KEY] = True
+            self._save()
+
+    def update(self, received=None, sent=None, total=None):
+        """
+        Record the progress of the current attempt, as reported by the
+        soledad sync status events. The counts are for the current attempt.
+
+        :param received: documents received so far.
+        :type received: int or None
+        :param sent: documents sent so far.
+        :type sent: int or None
+        :param total: documents to receive or send.
+        :type total: int or None
+        """
+        with self._lock:
+            moved = False
+            if received is not None and received > self._received:
+                self._received = received
+                moved = True
+            if sent is not None and sent > self._sent:
+                self._sent = sent
+                moved = True
+            if total is not None:
+                self._checkpoint[self.TOTAL_KEY] = total
+            if moved:
+                self._last_progress = self._clock()
+
+    def get_stall_timeout(self):
+        """
+        Return the seconds an attempt can go without moving any document.
+
+        :rtype: float
+        """
+        with self._lock:
+            return self._get_stall_timeout()
+
+    def _get_stall_timeout(self):
+        """
+        Return the stall timeout. The lock must be held.
+
+        :rtype: float
+        """
+        rate = self._checkpoint[self.RATE_KEY]
+        if not rate:
+            return self.MAX_STALL_SECONDS
+        return max(self.MIN_STALL_SECONDS,
+                   min(self.MAX_STALL_SECONDS, self.STALL_DOCS / rate))
+
+    def is_stalled(self):
+        """
+        Return whether the current attempt stopped moving documents.
+
+        :rtype: bool
+        """
+        with self._lock:
+            if self._last_progress is None:
+                return False
+            idle = self._clock() - self._last_progress
+            return idle >= self._get_stall_timeout()
+
+    def made_progress(self):
+        """
+        Return whether the current attempt moved any document.
+
+        :rtype: bool
+        """
+        with self._lock:
+            return self._received + self._sent > 0
+
+    def finish_attempt(self, success):
+        """
+        Stop tracking the current attempt and update the checkpoint.
+
+        :param success: whether the attempt finished the sync.
+        :type success: bool
+
+        :returns: the stats of the attempt: attempt, received, sent,
+                  seconds, rate (documents per second), resumed and
+                  success.
+        :rtype: dict
+        """
+        with self._lock:
+            checkpoint = self._checkpoint
+            seconds = max(self._clock() - (self._started or 0), 0)
+            docs = self._received + self._sent
+            rate = float(docs) / seconds if seconds > 0 else 0.0
+            resumed = (checkpoint[self.RECEIVED_KEY] +
+                       checkpoint[self.SENT_KEY]) > 0
+
+            if docs > 0:
+                old_rate = checkpoint[self.RATE_KEY]
+                if old_rate:
+                    rate_estimate = (self.RATE_WEIGHT * rate +
+                                     (1 - self.RATE_WEIGHT) * old_rate)
+                else:
+                    rate_estimate = rate
+                checkpoint[self.RATE_KEY] = rate_estimate
+
+            if success:
+                checkpoint[self.PENDING_KEY] = False
+                checkpoint[self.RECEIVED_KEY] = 0
+                checkpoint[self.SENT_KEY] = 0
+                checkpoint[self.TOTAL_KEY] = None
+            else:
+                checkpoint[self.RECEIVED_KEY] += self._received
+                checkpoint[self.SENT_KEY] += self._sent
+            self._save()
+
+            self._started = self._last_progress = None
+            return {
+                "attempt": self._attempt,
+                "received": self._received,
+                "sent": self._sent,
+                "seconds": seconds,
+                "rate": rate,
+                "resumed": resumed,
+                "success": success,
+            }
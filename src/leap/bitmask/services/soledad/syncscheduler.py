@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+# syncscheduler.py
+# Copyright (C) 2015 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Background syncs of Soledad after the bootstrap.
+"""
+import glob
+import os
+
+from twisted.internet import defer, reactor
+from twisted.python.failure import Failure
+
+from leap.bitmask.logs.utils import get_logger
+from leap.bitmask.platform_init import IS_LINUX
+
+logger = get_logger()
+
+
+def is_on_battery():
+    """
+    Return whether the computer runs on battery.
+
+    Only Linux is supported for now, elsewhere we assume it doesn't.
+
+    :rtype: bool
+    """
+    if not IS_LINUX:
+        return False
+
+    mains = []
+    for supply in glob.glob("/sys/class/power_supply/*"):
+        try:
+            with open(os.path.join(supply, "type")) as f:
+                if f.read().strip() != "Mains":
+                    continue
+            with open(os.path.join(supply, "online")) as f:
+                mains.append(f.read().strip() == "1")
+        except IOError:
+            continue
+    # a desktop may not report any mains supply at all
+    return bool(mains) and not any(mains)
+
+
+class SyncScheduler(object):
+    """
+    Syncs Soledad in the background, through a Syncer.
+
+    The interval between syncs adapts to what the syncs find: it shrinks
+    while documents keep arriving and grows while there is nothing new.
+    Recent user activity keeps it at most at the base interval, and it is
+    stretched while running on battery.
+
+    The syncs requested while another one is running are coalesced into a
+    single sync after it.
+    """
+
+    MIN_INTERVAL = 15
+    MAX_INTERVAL = 900
+
+    # how the interval changes after a sync with and without changes
+    SPEED_UP = 0.5
+    SLOW_DOWN = 1.5
+
+    # seconds the user is considered active after some activity
+    ACTIVITY_WINDOW = 300
+
+    # how much the interval is stretched on battery
+    CONSTRAINED_FACTOR = 3
+
+    def __init__(self, syncer, base_interval=60, clock=reactor,
+                 is_constrained=is_on_battery):
+        """
+        Constructor for the sync scheduler.
+
+        :param syncer: syncs soledad, with retries and failover.
+        :type syncer: Syncer
+        :param base_interval: seconds between syncs when nothing is known,
+                              usually the mail check period.
+        :type base_interval: int
+        :param clock: schedules the syncs, used for testing.
+        :type clock: twisted.internet.interfaces.IReactorTime
+        :param is_constrained: returns whether syncing should be scarce, on
+                               battery by default.
+        :type is_constrained: callable
+        """
+        self._syncer = syncer
+        self._base_interval = base_interval
+        self._interval = base_interval
+        self._clock = clock
+        self._is_constrained = is_constrained
+
+        self._delayed_call = None
+        self._running = False
+        self._syncing = False
+        self._pending = []
+        self._last_activity = None
+        self._last_sync = None
+        self._last_stats = None
+
+    def _now(self):
+        return self._clock.seconds()
+
+    def start(self):
+        """
+        Start syncing in the background. The first sync is scheduled after
+        the current interval, the bootstrap just synced.
+        """
+        if self._running:
+            return
+        self._running = True
+        self._schedule()
+
+    def stop(self):
+        """
+        Stop syncing in the background. An ongoing sync is not cancelled.
+        """
+        self._running = False
+        self._cancel_delayed_call()
+
+    def _cancel_delayed_call(self):
+        if self._delayed_call is not None and self._delayed_call.active():
+            self._delayed_call.cancel()
+        self._delayed_call = None
+
+    def get_interval(self):
+        """
+        Return the seconds to wait until the next sync, as it stands now.
+
+        :rtype: float
+        """
+        interval = self._interval
+        if (self._last_activity is not None and
+                self._now() - self._last_activity < self.ACTIVITY_WINDOW):
+            interval = min(interval, self._base_interval)
+        try:
+            constrained = self._is_constrained()
+        except Exception as e:
+            logger.warning("Could not check the power state: %r" % (e,))
+            constrained = False
+        if constrained:
+            interval *= self.CONSTRAINED_FACTOR
+        return interval
+
+    def _schedule(self, interval=None):
+        """
+        Schedule the next sync.
+
+        :param interval: seconds until the sync, by default the current
+                         interval.
+        :type interval: float or None
+        """
+        self._cancel_delayed_call()
+        if not self._running:
+            return
+        if interval is None:
+            interval = self.get_interval()
+        self._delayed_call = self._clock.callLater(interval, self._sync)
+
+    def get_next_sync_time(self):
+        """
+        Return when the next sync is scheduled, or None if it isn't.
+
+        :rtype: float or None
+        """
+        if self._delayed_call is None or not self._delayed_call.active():
+            return None
+        return self._delayed_call.getTime()
+
+    def get_last_sync_time(self):
+        """
+        Return when the last sync finished, or None if none did.
+
+        :rtype: float or None
+        """
+        return self._last_sync
+
+    def get_last_stats(self):
+        """
+        Return the stats of the last attempt of the last sync, see
+        SyncProgress.finish_attempt.
+
+        :rtype: dict or None
+        """
+        return self._last_stats
+
+    def notify_activity(self):
+        """
+        Let the scheduler know the user is doing something with the mail,
+        so the next sync is not too far.
+        """
+        self._last_activity = self._now()
+        next_sync = self.get_next_sync_time()
+        if next_sync is not None:
+            interval = self.get_interval()
+            if next_sync - self._now() > interval:
+                self._schedule(interval)
+
+    def request_sync(self):
+        """
+        Sync now, or right after the ongoing sync if there is one.
+
+        :returns: a deferred that fires when the requested sync is done.
+        :rtype: twisted.internet.defer.Deferred
+        """
+        d = defer.Deferred()
+        self._pending.append(d)
+        if not self._syncing:
+            self._cancel_delayed_call()
+            self._sync()
+        return d
+
+    def _sync(self):
+        """
+        Run a sync through the syncer.
+        """
+        self._delayed_call = None
+        self._syncing = True
+        waiters, self._pending = self._pending, []
+
+        d = self._syncer.sync()
+        d.addCallbacks(self._sync_done, self._sync_failed)
+        d.addBoth(self._fire_waiters, waiters)
+        d.addBoth(self._after_sync)
+
+    def _sync_done(self, result):
+        self._last_sync = self._now()
+        self._last_stats = self._syncer.get_last_stats()
+        stats = self._last_stats or {}
+        changes = stats.get("received", 0) + stats.get("sent", 0)
+        if changes > 0:
+            self._interval = max(self.MIN_INTERVAL,
+                                 self._interval * self.SPEED_UP)
+        else:
+            self._interval = min(self.MAX_INTERVAL,
+                                 self._interval * self.SLOW_DOWN)
+        logger.debug("Background sync done, %s changes, next one in %.0f "
+                     "seconds." % (changes, self.get_interval()))
+        return result
+
+    def _sync_failed(self, failure):
+        self._last_stats = self._syncer.get_last_stats()
+        logger.warning("Background sync failed: %r" % (failure.value,))
+        return failure
+
+    def _fire_waiters(self, result, waiters):
+        for d in waiters:
+            if not d.called:
+                if isinstance(result, Failure):
+                    d.errback(result)
+                else:
+                    d.callback(result)
+        # the errors were logged and handed to the waiters
+        return None
+
+    def _after_sync(self, _):
+        self._syncing = False
+        if self._pending:
+            # the syncs requested meanwhile, all in one
+            self._sync()
+        else:
+            self._schedule()
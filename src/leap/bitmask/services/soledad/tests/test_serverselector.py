@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+# test_serverselector.py
+# Copyright (C) 2015 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the soledad server selection.
+"""
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+import os
+import socket
+import threading
+import time
+
+from BaseHTTPServer import BaseHTTPRequestHandler
+
+from leap.bitmask.services.soledad.serverselector import ServerSelector
+from leap.common.testing.basetest import BaseLeapTest
+from leap.common.testing.https_server import HTTPSServer
+
+HOST = "127.0.0.1"
+
+
+class SlowHTTPSServer(HTTPSServer):
+    """
+    An https server that takes a while to accept each connection.
+    """
+    delay = 0.3
+
+    def get_request(self):
+        time.sleep(self.delay)
+        return HTTPSServer.get_request(self)
+
+
+def start_server(server_class):
+    """
+    Start an https server in a thread and return it.
+    """
+    server = server_class((HOST, 0), BaseHTTPRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,))
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def get_closed_port():
+    """
+    Return a local port nobody listens on.
+    """
+    sock = socket.socket()
+    sock.bind((HOST, 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def entry(port):
+    return {"hostname": HOST, "port": port}
+
+
+class ServerSelectorTest(BaseLeapTest):
+
+    def setUp(self):
+        # the temporary dir is shared by all the tests of the class
+        self.path = os.path.join(self.tempdir, self.id(), "servers.json")
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def _selector(self):
+        return ServerSelector(self.path, resolve=lambda hostname: hostname)
+
+    def _start(self, server_class):
+        server = start_server(server_class)
+        self.servers.append(server)
+        return entry(server.server_address[1])
+
+    def test_ranks_by_latency(self):
+        fast = self._start(HTTPSServer)
+        slow = self._start(SlowHTTPSServer)
+        dead = entry(get_closed_port())
+
+        selector = self._selector()
+        self.assertEqual(selector.rank([dead, slow, fast]),
+                         [fast, slow, dead])
+        self.assertTrue(selector.get_stats(fast)["latency"] <
+                        selector.get_stats(slow)["latency"])
+        self.assertEqual(selector.get_stats(dead)["latency"], None)
+
+    def test_ranking_is_cached_until_a_failure(self):
+        fast = self._start(HTTPSServer)
+        slow = self._start(SlowHTTPSServer)
+
+        selector = self._selector()
+        measures = []
+        measure = selector.measure
+        selector.measure = lambda server: (measures.append(server) or
+                                           measure(server))
+
+        self.assertEqual(selector.rank([slow, fast]), [fast, slow])
+        self.assertEqual(selector.rank([fast, slow]), [fast, slow])
+        self.assertEqual(len(measures), 2)
+
+        selector.record_failure(fast)
+        selector.rank([fast, slow])
+        self.assertEqual(len(measures), 4)
+
+    def test_failures_demote_a_server(self):
+        one, two = entry(1), entry(2)
+        latencies = {1: 0.1, 2: 0.2}
+
+        selector = self._selector()
+        selector.measure = lambda server: latencies[server["port"]]
+        self.assertEqual(selector.rank([one, two]), [one, two])
+
+        for _ in range(5):
+            selector.record_failure(one)
+        self.assertEqual(selector.rank([one, two]), [two, one])
+
+    def test_stats_are_kept(self):
+        server = entry(1)
+        selector = self._selector()
+        selector.record_success(server)
+        selector.record_success(server)
+        selector.record_failure(server)
+
+        stats = self._selector().get_stats(server)
+        self.assertEqual(stats["successes"], 2)
+        self.assertEqual(stats["failures"], 1)
+
+    def test_single_server_is_not_measured(self):
+        server = entry(get_closed_port())
+        selector = self._selector()
+        selector.measure = None
+        self.assertEqual(selector.rank([server]), [server])
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+# test_soledadbootstrapper.py
+# Copyright (C) 2015 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the soledad bootstrapper and its syncer.
+"""
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from mock import MagicMock, patch
+from twisted.internet import defer, task
+from twisted.python.failure import Failure
+
+from leap.bitmask.services.soledad import soledadbootstrapper
+from leap.bitmask.services.soledad.soledadbootstrapper import (
+    SoledadBootstrapper, SoledadSyncError, Syncer)
+from leap.common.testing.basetest import BaseLeapTest
+from leap.keymanager.errors import KeyNotFound
+
+
+class FakeKeyManager(object):
+
+    def __init__(self, has_key=True, gen_key_error=None):
+        self.has_key = has_key
+        self.gen_key_error = gen_key_error
+        self.generated = False
+
+    def get_key(self, address, ktype, private=False, fetch_remote=True):
+        if self.has_key:
+            return defer.succeed("key")
+        return defer.fail(KeyNotFound(address))
+
+    def gen_key(self, ktype):
+        if self.gen_key_error is not None:
+            return defer.fail(self.gen_key_error)
+        self.generated = self.has_key = True
+        return defer.succeed("key")
+
+    def send_key(self, ktype):
+        return defer.succeed(None)
+
+
+class FakeSyncer(object):
+
+    def __init__(self):
+        self.bootstrapped = False
+        self.bootstrapped_before_sync = None
+        self.sync_deferred = None
+
+    def set_bootstrapped(self):
+        self.bootstrapped = True
+
+    def sync(self):
+        self.bootstrapped_before_sync = self.bootstrapped
+        self.sync_deferred = defer.Deferred()
+        return self.sync_deferred
+
+
+class FakeSoledad(object):
+    """
+    A soledad whose syncs fail, after moving some documents if `progress`
+    is set.
+    """
+
+    def __init__(self):
+        self.syncer = None
+        self.progress = False
+        self.syncs = 0
+
+    def sync(self, defer_decryption=True):
+        self.syncs += 1
+        if self.progress:
+            self.syncer._handle_status(None, {"received": 1})
+        return defer.fail(Exception("sync failed"))
+
+
+class SyncerTest(BaseLeapTest):
+
+    def setUp(self):
+        self.soledad = FakeSoledad()
+        self.signaler = MagicMock()
+        self.patches = [
+            patch.object(soledadbootstrapper, "reactor", task.Clock()),
+            patch.object(soledadbootstrapper, "leap_register"),
+            patch.object(soledadbootstrapper, "leap_unregister"),
+        ]
+        for p in self.patches:
+            p.start()
+        self.syncer = Syncer(self.soledad, self.signaler)
+        self.soledad.syncer = self.syncer
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+
+    def _sync(self):
+        failures = []
+        d = self.syncer.sync()
+        d.addErrback(failures.append)
+        self.assertEqual(len(failures), 1)
+        self.assertTrue(failures[0].check(SoledadSyncError))
+
+    def test_retries_the_failed_syncs(self):
+        self._sync()
+        self.assertEqual(self.soledad.syncs, Syncer.MAX_SYNC_RETRIES)
+        self.signaler.signal.assert_any_call(
+            self.signaler.soledad_bootstrap_failed)
+
+    def test_attempts_with_progress_are_capped(self):
+        self.soledad.progress = True
+        self._sync()
+        self.assertEqual(self.soledad.syncs, Syncer.MAX_SYNC_ATTEMPTS)
+
+        # a new sync gets its attempts again
+        self.soledad.syncs = 0
+        self._sync()
+        self.assertEqual(self.soledad.syncs, Syncer.MAX_SYNC_ATTEMPTS)
+
+
+class SoledadBootstrapperTest(BaseLeapTest):
+
+    def setUp(self):
+        self.signaler = MagicMock()
+        self.syncer = FakeSyncer()
+        self.patches = [
+            patch.object(soledadbootstrapper, "Syncer",
+                         lambda *args: self.syncer),
+            patch.object(soledadbootstrapper, "SyncScheduler"),
+            patch.object(soledadbootstrapper, "leap_register"),
+            patch.object(soledadbootstrapper, "leap_unregister"),
+            patch.object(soledadbootstrapper, "logger"),
+        ]
+        for p in self.patches:
+            p.start()
+
+        self.bootstrapper = SoledadBootstrapper(self.signaler)
+        self.bootstrapper._provider_config = MagicMock()
+        self.bootstrapper._provider_config.get_domain.return_value = \
+            "provider.test"
+        self.bootstrapper._user = "user"
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+
+    def _load(self, keymanager):
+        """
+        Load soledad online with the given keymanager, return the results
+        of the bootstrap deferred.
+        """
+        def init_keymanager(address, token):
+            self.bootstrapper._keymanager = keymanager
+            return defer.succeed(None)
+
+        def do_soledad_init(*args):
+            self.bootstrapper._soledad = MagicMock()
+            return [("https://soledad.provider.test", None)]
+
+        self.bootstrapper._init_keymanager = init_keymanager
+        self.bootstrapper._do_soledad_init = do_soledad_init
+
+        results = []
+        d = self.bootstrapper._load_soledad_online(
+            "uuid", "/tmp/secrets", "/tmp/uuid.db", None, "/tmp/cert",
+            "token")
+        d.addBoth(results.append)
+        return results
+
+    def _signaled(self, signal):
+        return any(args == (signal,)
+                   for args, _ in self.signaler.signal.call_args_list)
+
+    def _sync_scheduler_started(self):
+        scheduler = soledadbootstrapper.SyncScheduler.return_value
+        return scheduler.start.called
+
+    def _logged_errors(self):
+        logger = soledadbootstrapper.logger
+        return [args[0] for args, _ in logger.error.call_args_list]
+
+    def test_local_key_does_not_wait_for_the_sync(self):
+        results = self._load(FakeKeyManager(has_key=True))
+
+        self.assertEqual(results, [None])
+        self.assertTrue(self.syncer.bootstrapped_before_sync)
+        self.assertFalse(self.syncer.sync_deferred.called)
+
+        self.syncer.sync_deferred.errback(SoledadSyncError())
+        self.assertFalse(
+            self._signaled(self.signaler.soledad_bootstrap_failed))
+        self.assertTrue(self._sync_scheduler_started())
+
+    def test_missing_key_waits_for_the_sync(self):
+        keymanager = FakeKeyManager(has_key=False)
+        results = self._load(keymanager)
+
+        self.assertEqual(results, [])
+        self.assertFalse(self.syncer.bootstrapped_before_sync)
+
+        self.syncer.sync_deferred.callback(None)
+        self.assertEqual(len(results), 1)
+        self.assertFalse(isinstance(results[0], Failure))
+        self.assertTrue(keymanager.generated)
+        self.assertTrue(self._sync_scheduler_started())
+
+    def test_key_generation_fails_after_the_sync(self):
+        keymanager = FakeKeyManager(
+            has_key=False, gen_key_error=Exception("no key"))
+        results = self._load(keymanager)
+        self.syncer.sync_deferred.callback(None)
+
+        self.assertEqual(len(results), 1)
+        self.assertTrue(isinstance(results[0], Failure))
+        self.assertEqual(str(results[0].value), "no key")
+        self.assertTrue(
+            self._signaled(self.signaler.soledad_bootstrap_failed))
+        # the sync went fine, only the keys failed
+        self.assertTrue(self._sync_scheduler_started())
+        self.assertFalse([msg for msg in self._logged_errors()
+                          if "sync failed" in msg])
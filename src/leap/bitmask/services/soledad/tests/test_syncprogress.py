@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+# test_syncprogress.py
+# Copyright (C) 2015 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the progress and checkpoints of the soledad syncs.
+"""
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+import os
+
+from leap.bitmask.services.soledad.syncprogress import SyncProgress
+from leap.common.testing.basetest import BaseLeapTest
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class SyncProgressTest(BaseLeapTest):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        # the temporary dir is shared by all the tests of the class
+        self.path = os.path.join(self.tempdir, self.id(), "uuid.sync")
+
+    def tearDown(self):
+        pass
+
+    def _progress(self):
+        return SyncProgress(self.path, clock=self.clock)
+
+    def test_waits_the_longest_without_a_rate(self):
+        progress = self._progress()
+        progress.start_attempt()
+
+        self.clock.now += SyncProgress.MAX_STALL_SECONDS - 1
+        self.assertFalse(progress.is_stalled())
+        self.clock.now += 1
+        self.assertTrue(progress.is_stalled())
+
+    def test_progress_keeps_the_attempt_alive(self):
+        progress = self._progress()
+        progress.start_attempt()
+
+        for received in range(1, 4):
+            self.clock.now += SyncProgress.MAX_STALL_SECONDS - 1
+            progress.update(received=received, total=10)
+            self.assertFalse(progress.is_stalled())
+
+    def test_timeout_adapts_to_the_rate(self):
+        progress = self._progress()
+        progress.start_attempt()
+        self.clock.now += 250
+        progress.update(received=50, total=50)
+        stats = progress.finish_attempt(True)
+
+        self.assertEqual(stats["rate"], 0.2)
+        self.assertEqual(progress.get_stall_timeout(), 250)
+
+        progress.start_attempt()
+        self.clock.now += 10
+        progress.update(sent=100, total=100)
+        progress.finish_attempt(True)
+
+        self.assertEqual(progress.get_stall_timeout(),
+                         SyncProgress.MIN_STALL_SECONDS)
+
+    def test_interrupted_sync_is_resumed(self):
+        progress = self._progress()
+        progress.start_attempt()
+        self.clock.now += 5
+        progress.update(received=40, total=100)
+        stats = progress.finish_attempt(False)
+        self.assertFalse(stats["resumed"])
+        self.assertTrue(os.path.isfile(self.path))
+
+        # as if bitmask was restarted
+        progress = self._progress()
+        self.assertTrue(progress.is_resuming)
+        self.assertTrue(progress.get_stall_timeout() <
+                        SyncProgress.MAX_STALL_SECONDS)
+
+        progress.start_attempt()
+        progress.update(received=60, total=60)
+        stats = progress.finish_attempt(True)
+        self.assertTrue(stats["resumed"])
+        self.assertEqual(stats["attempt"], 1)
+        self.assertEqual(stats["received"], 60)
+
+        progress = self._progress()
+        self.assertFalse(progress.is_resuming)
+
+    def test_made_progress(self):
+        progress = self._progress()
+        progress.start_attempt()
+        self.assertFalse(progress.made_progress())
+        progress.update(received=0, total=10)
+        self.assertFalse(progress.made_progress())
+        progress.update(sent=1, total=10)
+        self.assertTrue(progress.made_progress())
+
+    def test_ignores_a_broken_checkpoint(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, "w") as f:
+            f.write("{not json")
+
+        progress = self._progress()
+        self.assertFalse(progress.is_resuming)
+        self.assertEqual(progress.get_stall_timeout(),
+                         SyncProgress.MAX_STALL_SECONDS)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
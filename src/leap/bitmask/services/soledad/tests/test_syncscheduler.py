@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+# test_syncscheduler.py
+# Copyright (C) 2015 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the background soledad syncs.
+"""
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from twisted.internet import defer, task
+
+from leap.bitmask.services.soledad.syncscheduler import SyncScheduler
+from leap.common.testing.basetest import BaseLeapTest
+
+BASE = 60
+
+
+class FakeSyncer(object):
+
+    def __init__(self):
+        self.syncs = []
+        self.stats = None
+
+    def sync(self):
+        d = defer.Deferred()
+        self.syncs.append(d)
+        return d
+
+    def finish(self, changes=0):
+        self.stats = {"received": changes, "sent": 0}
+        self.syncs[-1].callback(None)
+
+    def get_last_stats(self):
+        return self.stats
+
+
+class SyncSchedulerTest(BaseLeapTest):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.syncer = FakeSyncer()
+        self.constrained = False
+        self.scheduler = SyncScheduler(
+            self.syncer, base_interval=BASE, clock=self.clock,
+            is_constrained=lambda: self.constrained)
+
+    def tearDown(self):
+        self.scheduler.stop()
+
+    def _sync_after(self, seconds, changes=0):
+        count = len(self.syncer.syncs)
+        self.clock.advance(seconds - 1)
+        self.assertEqual(len(self.syncer.syncs), count)
+        self.clock.advance(1)
+        self.assertEqual(len(self.syncer.syncs), count + 1)
+        self.syncer.finish(changes)
+
+    def test_adapts_to_the_changes(self):
+        self.scheduler.start()
+        self.assertEqual(self.scheduler.get_next_sync_time(), BASE)
+
+        self._sync_after(BASE, changes=10)
+        self._sync_after(BASE / 2, changes=5)
+        self._sync_after(BASE / 4)
+        self._sync_after(BASE * 3 / 8.0)
+        self.assertEqual(self.scheduler.get_last_stats()["received"], 0)
+
+        for _ in range(20):
+            self.clock.advance(SyncScheduler.MAX_INTERVAL)
+            if self.syncer.syncs[-1].called is False:
+                self.syncer.finish()
+        self.assertEqual(self.scheduler.get_interval(),
+                         SyncScheduler.MAX_INTERVAL)
+
+    def test_activity_brings_the_sync_closer(self):
+        self.scheduler.start()
+        for _ in range(5):
+            self.clock.advance(self.scheduler.get_interval())
+            self.syncer.finish()
+        self.assertTrue(self.scheduler.get_interval() > BASE)
+
+        self.scheduler.notify_activity()
+        self.assertEqual(self.scheduler.get_next_sync_time(),
+                         self.clock.seconds() + BASE)
+
+    def test_slower_when_constrained(self):
+        self.constrained = True
+        self.scheduler.start()
+        self.assertEqual(self.scheduler.get_next_sync_time(),
+                         BASE * SyncScheduler.CONSTRAINED_FACTOR)
+
+    def test_requests_are_coalesced(self):
+        self.scheduler.start()
+        first = self.scheduler.request_sync()
+        self.assertEqual(len(self.syncer.syncs), 1)
+        self.assertEqual(self.scheduler.get_next_sync_time(), None)
+
+        second = self.scheduler.request_sync()
+        third = self.scheduler.request_sync()
+        self.assertEqual(len(self.syncer.syncs), 1)
+
+        self.syncer.finish()
+        self.assertTrue(first.called)
+        self.assertFalse(second.called)
+        self.assertEqual(len(self.syncer.syncs), 2)
+
+        self.syncer.finish()
+        self.assertTrue(second.called)
+        self.assertTrue(third.called)
+        self.assertEqual(len(self.syncer.syncs), 2)
+        self.assertNotEqual(self.scheduler.get_next_sync_time(), None)
+
+    def test_failed_sync_keeps_scheduling(self):
+        self.scheduler.start()
+        d = self.scheduler.request_sync()
+        failures = []
+        d.addErrback(failures.append)
+        self.syncer.syncs[-1].errback(Exception("sync failed"))
+
+        self.assertEqual(len(failures), 1)
+        self.assertEqual(self.scheduler.get_next_sync_time(),
+                         self.clock.seconds() + BASE)
+
+    def test_stop(self):
+        self.scheduler.start()
+        self.scheduler.stop()
+        self.clock.advance(SyncScheduler.MAX_INTERVAL)
+        self.assertEqual(self.syncer.syncs, [])
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
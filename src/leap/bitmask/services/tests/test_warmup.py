@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+# test_warmup.py
+# Copyright (C) 2015 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the post login warm up.
+"""
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+import mock
+
+from twisted.internet import defer
+
+from leap.bitmask.services import warmup
+from leap.common.testing.basetest import BaseLeapTest
+
+DOMAIN = "provider.test"
+
+
+class SessionWarmUpTest(BaseLeapTest):
+
+    def setUp(self):
+        self.warmup = warmup.SessionWarmUp()
+        self.pending = {}
+
+        def fake_task(session, name):
+            d = defer.Deferred()
+            self.pending[name] = d
+            return d
+
+        self.warmup._get_tasks = lambda config, userid: [
+            (name, fake_task, (name,)) for name in ("config", "cert")]
+        self.patcher = mock.patch.object(
+            warmup.threads, "deferToThread",
+            side_effect=lambda f, *args: f(*args))
+        self.patcher.start()
+
+        self.config = mock.Mock()
+        self.config.get_domain.return_value = DOMAIN
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def test_runs_the_downloads_concurrently(self):
+        self.warmup.run(self.config, "user@" + DOMAIN)
+        self.assertEqual(sorted(self.pending), ["cert", "config"])
+
+    def test_wait_without_warm_up(self):
+        d = self.warmup.wait(DOMAIN)
+        self.assertTrue(d.called)
+
+    def test_wait_for_the_running_warm_up(self):
+        self.warmup.run(self.config, "user@" + DOMAIN)
+        d = self.warmup.wait(DOMAIN)
+        other = self.warmup.wait("other.test")
+
+        self.assertTrue(other.called)
+        self.pending["config"].callback(None)
+        self.assertFalse(d.called)
+        self.pending["cert"].callback(None)
+        self.assertTrue(d.called)
+
+    def test_failures_are_not_propagated(self):
+        done = self.warmup.run(self.config, "user@" + DOMAIN)
+        d = self.warmup.wait(DOMAIN)
+        self.pending["config"].errback(Exception("download failed"))
+        self.pending["cert"].callback(None)
+
+        self.assertTrue(done.called)
+        self.assertTrue(d.called)
+        self.assertEqual(self.warmup.wait(DOMAIN).called, True)
+
+    def test_cancelled_wait(self):
+        self.warmup.run(self.config, "user@" + DOMAIN)
+        d = self.warmup.wait(DOMAIN)
+        d.addErrback(lambda failure: None)
+        d.cancel()
+
+        self.pending["config"].callback(None)
+        self.pending["cert"].callback(None)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+# warmup.py
+# Copyright (C) 2015 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Post login warm up of the services prerequisites.
+"""
+import os
+import time
+
+import requests
+
+from requests.adapters import HTTPAdapter
+from twisted.internet import defer, threads
+
+from leap.bitmask.crypto.certs import download_client_cert
+from leap.bitmask.crypto.certstore import get_cert_store
+from leap.bitmask.logs.utils import get_logger
+from leap.bitmask.services import download_service_config
+from leap.bitmask.services.eip.eipconfig import EIPConfig
+from leap.bitmask.services.mail.smtpconfig import SMTPConfig
+from leap.bitmask.services.soledad.soledadconfig import SoledadConfig
+
+logger = get_logger()
+
+
+class SessionWarmUp(object):
+    """
+    Right after the login, downloads at the same time everything the EIP,
+    Soledad and SMTP bootstrappers need: the service configs and the
+    client certificates. The bootstrappers started meanwhile wait for it
+    (see wait) and then find everything already on disk.
+
+    Nothing fails because of the warm up, whatever it could not download
+    is left to the bootstrappers.
+    """
+
+    def __init__(self):
+        self._domain = None
+        self._waiting = []
+
+    def _get_session(self, size):
+        """
+        Return a session whose connection pool can serve size concurrent
+        requests to the provider.
+
+        :type size: int
+        :rtype: requests.sessions.Session
+        """
+        session = requests.session()
+        session.mount("https://", HTTPAdapter(pool_connections=1,
+                                              pool_maxsize=size))
+        return session
+
+    def _get_tasks(self, provider_config, userid):
+        """
+        Return the downloads needed by the services of the provider.
+
+        :param provider_config: the provider the user is logged in.
+        :type provider_config: ProviderConfig
+        :param userid: the user id, in user@provider form
+        :type userid: str
+
+        :returns: a list of (name, function, args)
+        :rtype: list of tuple(str, callable, tuple)
+        """
+        tasks = []
+        if provider_config.provides_eip():
+            tasks.append(("eip config", self._download_config,
+                          (provider_config, EIPConfig())))
+            path = EIPConfig().get_client_cert_path(
+                provider_config, about_to_download=True)
+            tasks.append(("vpn cert", self._download_cert,
+                          (provider_config, path, "vpn")))
+        if provider_config.provides_mx():
+            tasks.append(("soledad config", self._download_config,
+                          (provider_config, SoledadConfig())))
+            tasks.append(("smtp config", self._download_config,
+                          (provider_config, SMTPConfig())))
+            path = SMTPConfig().get_client_cert_path(
+                userid, provider_config, about_to_download=True)
+            tasks.append(("smtp cert", self._download_cert,
+                          (provider_config, path, "smtp")))
+        return tasks
+
+    def _download_config(self, session, provider_config, service_config):
+        download_service_config(provider_config, service_config, session,
+                                download_if_needed=True)
+
+    def _download_cert(self, session, provider_config, path, kind):
+        if (os.path.isfile(path) and
+                not get_cert_store().should_redownload(path)):
+            return
+        download_client_cert(provider_config, path, session, kind=kind)
+
+    def run(self, provider_config, userid):
+        """
+        Download the prerequisites of the services of the logged in user.
+
+        :param provider_config: the provider the user is logged in.
+        :type provider_config: ProviderConfig
+        :param userid: the user id, in user@provider form
+        :type userid: str
+
+        :returns: a deferred that fires when all the downloads are done,
+                  it never fails.
+        :rtype: twisted.internet.defer.Deferred
+        """
+        tasks = self._get_tasks(provider_config, userid)
+        if not tasks:
+            return defer.succeed(None)
+
+        self._domain = provider_config.get_domain()
+        session = self._get_session(len(tasks))
+        start = time.time()
+
+        deferreds = []
+        for name, function, args in tasks:
+            d = threads.deferToThread(function, session, *args)
+            d.addErrback(self._task_failed, name)
+            deferreds.append(d)
+
+        d = defer.DeferredList(deferreds)
+        d.addCallback(self._done, start)
+        return d
+
+    def _task_failed(self, failure, name):
+        logger.warning("Could not warm up the %s: %r" %
+                       (name, failure.value))
+
+    def _done(self, _, start):
+        logger.debug("Services warmed up in %.2f seconds." %
+                     (time.time() - start,))
+        self._domain = None
+        waiting, self._waiting = self._waiting, []
+        for d in waiting:
+            if not d.called:
+                # it could have been cancelled while waiting
+                d.callback(None)
+
+    def wait(self, domain):
+        """
+        Return a deferred that fires once the running warm up for domain
+        is done, or right away if there is none.
+
+        :param domain: the domain of the provider
+        :type domain: unicode
+
+        :rtype: twisted.internet.defer.Deferred
+        """
+        if domain is None or domain != self._domain:
+            return defer.succeed(None)
+        d = defer.Deferred()
+        self._waiting.append(d)
+        return d
+
+
+_warmup = None
+
+
+def get_session_warmup():
+    """
+    Return the warm up shared by the backend components.
+
+    :rtype: SessionWarmUp
+    """
+    global _warmup
+    if _warmup is None:
+        _warmup = SessionWarmUp()
+    return _warmup
@@ -113,6 +113,24 @@ def make_address(user, provider):
     return "%s@%s" % (user, provider)
 
 
+def get_account_id(username, domain):
+    """
+    Return the id of the account of a user, as user@provider. Usernames
+    are case insensitive, the id always has it in lowercase.
+
+    :param username: the username, as typed by the user, None if it
+                     isn't known yet.
+    :type username: basestring or None
+    :param domain: the provider domain
+    :type domain: basestring
+
+    :rtype: basestring
+    """
+    if username is not None:
+        username = username.lower()
+    return make_address(username, domain)
+
+
 def force_eval(items):
     """
     Return a sequence that evaluates any callable in the sequence,
@@ -72,6 +72,16 @@ def build_parser():
     parser.add_argument('-o', '--offline', action="store_true",
                         help='Starts Bitmask in offline mode: will not '
                              'try to sync with remote replicas for email.')
+    parser.add_argument('--mail-on-demand', action="store_true",
+                        dest="mail_on_demand",
+                        help='Start the IMAP and SMTP services when a mail '
+                             'client connects, and stop them when it has '
+                             'been idle for a while.')
+    parser.add_argument('--mail-idle-timeout', metavar="SECONDS",
+                        type=int, default=600,
+                        action="store", dest="mail_idle_timeout",
+                        help='Seconds without clients before the on-demand '
+                             'mail services are stopped (default: 600).')
 
     # XXX not yet updated to new mail api for mail 0.4.0
 
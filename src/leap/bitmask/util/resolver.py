@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+# resolver.py
+# Copyright (C) 2015 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Asynchronous, caching name resolver.
+
+All the hostname lookups done by the backend (provider domains, soledad
+servers, the EIP dns check) go through a single CachingResolver, so a
+broken system resolver can't tie up the worker threads anymore.
+"""
+import socket
+
+from twisted.internet import defer, reactor, threads
+from twisted.internet.error import DNSLookupError
+from twisted.names import client, dns
+from twisted.names import error as dns_error
+
+from leap.bitmask.logs.utils import get_logger
+
+logger = get_logger()
+
+
+class CachingResolver(object):
+    """
+    A twisted.names based resolver that caches the answers for the TTL
+    given by the server, caches failed lookups for a short while, limits
+    the number of concurrent queries and gives up after a deadline.
+    """
+
+    # Bounds for the TTL of positive answers, in seconds.
+    MIN_TTL = 60
+    MAX_TTL = 3600
+
+    # How long we remember that a name does not exist, in seconds.
+    NEGATIVE_TTL = 30
+
+    # Max number of queries in flight at the same time.
+    MAX_CONCURRENT = 4
+
+    # Overall time we wait for an answer, in seconds. It includes the time
+    # spent waiting for a free query slot.
+    DEADLINE = 5
+
+    # Retransmission timeouts handed to twisted.names for each query.
+    QUERY_TIMEOUTS = (1, 3)
+
+    # Max number of CNAMEs to follow.
+    MAX_CNAME_DEPTH = 5
+
+    def __init__(self, servers=None, deadline=None, max_concurrent=None,
+                 clock=None):
+        """
+        Constructor for the resolver.
+
+        :param servers: list of (host, port) dns servers to query. If None,
+                        the system configuration (resolv.conf and hosts
+                        file) is used.
+        :type servers: list of tuple(str, int) or None
+        :param deadline: seconds to wait for an answer before failing.
+        :type deadline: float
+        :param max_concurrent: max number of queries in flight.
+        :type max_concurrent: int
+        :param clock: provider of the time and callLater, used for testing.
+        :type clock: twisted.internet.interfaces.IReactorTime
+        """
+        if clock is None:
+            clock = reactor
+        if deadline is None:
+            deadline = self.DEADLINE
+        if max_concurrent is None:
+            max_concurrent = self.MAX_CONCURRENT
+
+        self._clock = clock
+        self._deadline = deadline
+        self._resolver = client.createResolver(servers=servers)
+        self._semaphore = defer.DeferredSemaphore(max_concurrent)
+
+        # name -> (expiration, address or None)
+        self._cache = {}
+        # name -> list of Deferreds waiting for an ongoing query
+        self._pending = {}
+
+    def _normalize(self, name):
+        """
+        Return the cache key for a given hostname.
+
+        :param name: the hostname
+        :type name: str or unicode
+        :rtype: str
+        """
+        if isinstance(name, unicode):
+            name = name.encode('idna')
+        return name.lower().rstrip('.')
+
+    def _get_cached(self, name):
+        """
+        Return the cache entry for name, or None if there is no valid one.
+
+        :param name: the normalized hostname
+        :type name: str
+        :rtype: tuple(float, str or None) or None
+        """
+        entry = self._cache.get(name)
+        if entry is None:
+            return None
+        expiration, address = entry
+        if expiration <= self._clock.seconds():
+            del self._cache[name]
+            return None
+        return entry
+
+    def _store(self, name, address, ttl):
+        """
+        Store an answer in the cache.
+
+        :param name: the normalized hostname
+        :type name: str
+        :param address: the address, or None for a negative answer
+        :type address: str or None
+        :param ttl: seconds this answer is valid for
+        :type ttl: int
+        """
+        self._cache[name] = (self._clock.seconds() + ttl, address)
+
+    def resolve(self, name):
+        """
+        Resolve a hostname to an IPv4 address.
+
+        Must be called from the reactor thread, use `blocking_resolve` from
+        any other thread.
+
+        :param name: the hostname to resolve
+        :type name: str or unicode
+
+        :returns: a deferred that fires with the address as a dotted quad
+                  string or fails with DNSLookupError.
+        :rtype: twisted.internet.defer.Deferred
+        """
+        name = self._normalize(name)
+
+        if _is_ipv4(name):
+            return defer.succeed(name)
+
+        entry = self._get_cached(name)
+        if entry is not None:
+            address = entry[1]
+            if address is None:
+                return defer.fail(DNSLookupError(
+                    "%s (cached negative answer)" % (name,)))
+            return defer.succeed(address)
+
+        d = defer.Deferred()
+        timeout_call = self._clock.callLater(
+            self._deadline, self._timeout, name, d)
+        d.addBoth(self._cancel_timeout, timeout_call)
+
+        waiting = self._pending.get(name)
+        if waiting is not None:
+            # coalesce with the query already in flight
+            waiting.append(d)
+            return d
+
+        self._pending[name] = [d]
+        query = self._semaphore.run(self._query, name)
+        query.addCallbacks(self._fire_pending, self._fail_pending,
+                           callbackArgs=(name,), errbackArgs=(name,))
+        return d
+
+    def _cancel_timeout(self, result, timeout_call):
+        if timeout_call.active():
+            timeout_call.cancel()
+        return result
+
+    def _timeout(self, name, d):
+        """
+        Fail a waiting deferred that went over the deadline.
+        """
+        logger.warning("DNS lookup for %s timed out after %s seconds" %
+                       (name, self._deadline))
+        waiting = self._pending.get(name, [])
+        if d in waiting:
+            waiting.remove(d)
+        if not d.called:
+            d.errback(DNSLookupError("%s (timeout)" % (name,)))
+
+    def _fire_pending(self, address, name):
+        for d in self._pending.pop(name, []):
+            if not d.called:
+                d.callback(address)
+
+    def _fail_pending(self, failure, name):
+        for d in self._pending.pop(name, []):
+            if not d.called:
+                d.errback(failure)
+
+    @defer.inlineCallbacks
+    def _query(self, name):
+        """
+        Query the dns servers for name, following CNAMEs, and cache the
+        result.
+
+        :param name: the normalized hostname
+        :type name: str
+        """
+        target = name
+        for _ in range(self.MAX_CNAME_DEPTH):
+            try:
+                answers, _, _ = yield self._resolver.lookupAddress(
+                    target, self.QUERY_TIMEOUTS)
+            except (dns_error.DNSNameError, dns_error.DNSFormatError):
+                self._store(name, None, self.NEGATIVE_TTL)
+                raise DNSLookupError("%s (no such name)" % (name,))
+            except defer.TimeoutError:
+                raise DNSLookupError("%s (timeout)" % (name,))
+            except dns_error.DomainError:
+                raise DNSLookupError("%s (server failure)" % (name,))
+
+            cname = None
+            for answer in answers:
+                if answer.type == dns.A:
+                    ttl = min(max(answer.ttl, self.MIN_TTL), self.MAX_TTL)
+                    address = answer.payload.dottedQuad()
+                    self._store(name, address, ttl)
+                    defer.returnValue(address)
+                if answer.type == dns.CNAME and cname is None:
+                    cname = str(answer.payload.name)
+
+            if cname is None:
+                break
+            target = cname
+
+        self._store(name, None, self.NEGATIVE_TTL)
+        raise DNSLookupError("%s (no address)" % (name,))
+
+    def blocking_resolve(self, name):
+        """
+        Resolve a hostname from a thread other than the reactor one,
+        blocking until the answer arrives or the deadline is reached.
+
+        It mimics socket.gethostbyname and raises socket.gaierror on
+        failures, so it can be used as a replacement for it.
+
+        :param name: the hostname to resolve
+        :type name: str or unicode
+
+        :rtype: str
+        """
+        try:
+            return threads.blockingCallFromThread(reactor, self.resolve, name)
+        except DNSLookupError as e:
+            raise socket.gaierror(socket.EAI_NONAME, str(e))
+
+    def clear(self):
+        """
+        Forget every cached answer.
+        """
+        self._cache.clear()
+
+
+def _is_ipv4(name):
+    """
+    Return True if name is already a dotted quad address.
+
+    :param name: the hostname
+    :type name: str
+    :rtype: bool
+    """
+    try:
+        socket.inet_aton(name)
+    except socket.error:
+        return False
+    return name.count('.') == 3
+
+
+_resolver = None
+
+
+def get_resolver():
+    """
+    Return the resolver shared by the whole backend.
+
+    :rtype: CachingResolver
+    """
+    global _resolver
+    if _resolver is None:
+        _resolver = CachingResolver()
+    return _resolver
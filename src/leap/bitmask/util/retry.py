@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+# retry.py
+# Copyright (C) 2015 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Retries for the http requests done to the providers.
+
+Every request made through RetryPolicy.request is retried with exponential
+backoff and jitter while there is time left before the deadline of the
+operation. Only the requests that can safely be sent twice are retried
+after they could have reached the server, and a circuit breaker per host
+makes the requests to a host that keeps failing fail right away.
+
+The requests are blocking, this is meant to be used from the bootstrapper
+and authentication threads.
+"""
+import random
+import threading
+import time
+import urlparse
+
+import requests
+
+from leap.bitmask.logs.utils import get_logger
+from leap.bitmask.util.constants import REQUEST_TIMEOUT
+
+logger = get_logger()
+
+# Methods that can be repeated without side effects.
+IDEMPOTENT_METHODS = frozenset(("GET", "HEAD", "OPTIONS", "DELETE"))
+
+# Status codes that mean the server could do better on a second try.
+RETRY_STATUSES = frozenset((502, 503, 504))
+
+# Older requests versions don't tell apart failing to connect from failing
+# after the request was sent.
+_ConnectTimeout = getattr(requests.exceptions, "ConnectTimeout", None)
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """
+    Raised instead of doing a request to a host that is failing.
+    It is a ConnectionError so the callers handle it like any other
+    connection problem.
+    """
+    pass
+
+
+class CircuitBreaker(object):
+    """
+    Counts the consecutive failures of the requests to a host. After
+    FAILURE_THRESHOLD of them the circuit opens and the requests fail right
+    away for RESET_TIMEOUT seconds, after which a single request is let
+    through to check if the host came back.
+    """
+
+    FAILURE_THRESHOLD = 5
+    RESET_TIMEOUT = 30
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, host, clock=time.time):
+        """
+        Constructor for the circuit breaker.
+
+        :param host: the host this breaker is for, used for logging.
+        :type host: str
+        :param clock: returns the current time, used for testing.
+        :type clock: callable
+        """
+        self._host = host
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    @property
+    def state(self):
+        """
+        The current state of the breaker, one of CLOSED, OPEN or HALF_OPEN.
+
+        :rtype: str
+        """
+        with self._lock:
+            return self._get_state()
+
+    def _get_state(self):
+        """
+        Return the current state. The lock must be held.
+
+        :rtype: str
+        """
+        if self._opened_at is None:
+            return self.CLOSED
+        if self._clock() - self._opened_at < self.RESET_TIMEOUT:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def allow(self):
+        """
+        Return whether a request to the host can be done now.
+
+        :rtype: bool
+        """
+        with self._lock:
+            state = self._get_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        """
+        Record a successful request, closing the circuit.
+        """
+        with self._lock:
+            if self._opened_at is not None:
+                logger.debug("Circuit for %s closed." % (self._host,))
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def release_probe(self):
+        """
+        Let another request through, if the one that was let through to
+        check the host ended without telling whether the host is up.
+        """
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        """
+        Record a failed request, opening the circuit if there were too many
+        of them in a row.
+        """
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if (self._opened_at is not None or
+                    self._failures >= self.FAILURE_THRESHOLD):
+                if self._opened_at is None:
+                    logger.warning("Too many failures, circuit for %s "
+                                   "opened." % (self._host,))
+                self._opened_at = self._clock()
+
+
+def _get_host(url):
+    """
+    Return the host part of url, the whole url if it can't be parsed.
+
+    :type url: str
+    :rtype: str
+    """
+    try:
+        return urlparse.urlparse(url).netloc
+    except (AttributeError, TypeError):
+        return str(url)
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(host):
+    """
+    Return the circuit breaker shared by all the requests to a host.
+
+    :param host: the host, as in the netloc of the urls.
+    :type host: str
+
+    :rtype: CircuitBreaker
+    """
+    with _breakers_lock:
+        breaker = _breakers.get(host)
+        if breaker is None:
+            breaker = _breakers[host] = CircuitBreaker(host)
+        return breaker
+
+
+def reset_breakers():
+    """
+    Forget the state of all the circuit breakers.
+    """
+    with _breakers_lock:
+        _breakers.clear()
+
+
+class RetryPolicy(object):
+    """
+    How many times, how often and for how long to retry a request.
+    """
+
+    def __init__(self, attempts=4, base_delay=0.5, max_delay=8,
+                 deadline=60, timeout=REQUEST_TIMEOUT,
+                 sleep=time.sleep, clock=time.time):
+        """
+        Constructor for the policy.
+
+        :param attempts: max number of times a request is sent.
+        :type attempts: int
+        :param base_delay: seconds to wait before the first retry, it
+                           doubles on each retry.
+        :type base_delay: float
+        :param max_delay: max seconds to wait between two attempts.
+        :type max_delay: float
+        :param deadline: max seconds a whole request can take, retries and
+                         waits included.
+        :type deadline: float
+        :param timeout: max seconds a single attempt can take.
+        :type timeout: float
+        :param sleep: waits the given seconds, used for testing.
+        :type sleep: callable
+        :param clock: returns the current time, used for testing.
+        :type clock: callable
+        """
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.timeout = timeout
+        self._sleep = sleep
+        self._clock = clock
+
+    def get_delay(self, retry):
+        """
+        Return the seconds to wait before a retry, with full jitter.
+
+        :param retry: the number of the retry, starting at 0.
+        :type retry: int
+
+        :rtype: float
+        """
+        top = min(self.max_delay, self.base_delay * (2 ** retry))
+        return random.uniform(0, top)
+
+    def _can_retry(self, error, idempotent):
+        """
+        Return whether a request that failed with error can be sent again.
+
+        :type error: requests.exceptions.RequestException
+        :type idempotent: bool
+
+        :rtype: bool
+        """
+        if isinstance(error, CircuitOpenError):
+            return False
+        if idempotent:
+            return isinstance(error, (requests.exceptions.ConnectionError,
+                                      requests.exceptions.Timeout))
+        # the request may have reached the server, we only know it didn't
+        # if we couldn't even connect.
+        return (_ConnectTimeout is not None and
+                isinstance(error, _ConnectTimeout))
+
+    def request(self, session, method, url, idempotent=None, deadline=None,
+                **kwargs):
+        """
+        Do a request with session, retrying it according to this policy.
+
+        The timeout of each attempt is the policy timeout, or less if the
+        deadline is closer. If the last attempt got a response it is
+        returned whatever its status, it's up to the caller to check it.
+
+        :param session: the session to do the request with
+        :type session: requests.sessions.Session
+        :param method: the http method, e.g. 'GET'
+        :type method: str
+        :param url: the url to request
+        :type url: str
+        :param idempotent: whether the request can be repeated, by default
+                           it depends on the method.
+        :type idempotent: bool or None
+        :param deadline: overrides the deadline of the policy for this
+                         request.
+        :type deadline: float or None
+        :param kwargs: the rest of the parameters for the request.
+
+        :rtype: requests.Response
+        :raises requests.exceptions.RequestException: if no attempt got a
+                                                      response.
+        """
+        method = method.upper()
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        if deadline is None:
+            deadline = self.deadline
+        timeout = kwargs.pop("timeout", self.timeout)
+
+        breaker = get_breaker(_get_host(url))
+        call = getattr(session, method.lower())
+        end = self._clock() + deadline
+
+        attempt = 0
+        while True:
+            attempt += 1
+            remaining = end - self._clock()
+
+            error = response = None
+            if not breaker.allow():
+                error = CircuitOpenError(
+                    "Too many failures, not trying %s for now" % (url,))
+            else:
+                try:
+                    response = call(url, timeout=min(timeout, remaining),
+                                    **kwargs)
+                except requests.exceptions.SSLError:
+                    # a certificate problem won't go away by retrying, and
+                    # it says nothing about the host being down
+                    breaker.release_probe()
+                    raise
+                except (requests.exceptions.ConnectionError,
+                        requests.exceptions.Timeout) as e:
+                    breaker.record_failure()
+                    error = e
+                except BaseException:
+                    breaker.release_probe()
+                    raise
+
+            if response is not None:
+                if response.status_code not in RETRY_STATUSES:
+                    breaker.record_success()
+                    return response
+                breaker.record_failure()
+
+            if error is not None:
+                retry = self._can_retry(error, idempotent)
+            else:
+                retry = idempotent
+
+            delay = self.get_delay(attempt - 1)
+            if (not retry or attempt >= self.attempts or
+                    self._clock() + delay >= end):
+                if error is not None:
+                    raise error
+                return response
+
+            logger.debug("%s %s failed (%s), retrying in %.1f seconds." %
+                         (method, url, error or response.status_code, delay))
+            self._sleep(delay)
+
+
+DEFAULT_POLICY = RetryPolicy()
+
+
+def request(session, method, url, **kwargs):
+    """
+    Do a request with the default retry policy.
+    See RetryPolicy.request for the parameters.
+
+    :rtype: requests.Response
+    """
+    return DEFAULT_POLICY.request(session, method, url, **kwargs)
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+# test_resolver.py
+# Copyright (C) 2015 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the caching resolver, run against a local dns server.
+"""
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from nose.twistedtools import deferred, reactor
+from twisted.internet import defer, protocol, task
+from twisted.internet.error import DNSLookupError
+from twisted.names import common, dns, server
+from twisted.names import error as dns_error
+
+from leap.bitmask.util.resolver import CachingResolver
+from leap.common.testing.basetest import BaseLeapTest
+
+
+class FakeAuthority(common.ResolverBase):
+    """
+    A stand-in for a dns server that answers from a dict and counts the
+    queries it receives.
+    """
+
+    def __init__(self, records):
+        common.ResolverBase.__init__(self)
+        self.records = records
+        self.queries = 0
+
+    def _lookup(self, name, cls, type, timeout):
+        self.queries += 1
+        address = self.records.get(name)
+        if address is None:
+            return defer.fail(dns_error.DomainError(name))
+        answer = dns.RRHeader(name, dns.A, dns.IN, 300,
+                              dns.Record_A(address, 300))
+        return defer.succeed(([answer], [], []))
+
+
+class SilentServer(protocol.DatagramProtocol):
+    """
+    A dns server that never answers.
+    """
+
+    def datagramReceived(self, data, addr):
+        pass
+
+
+def expect_lookup_error(d):
+    """
+    Turn a DNSLookupError failure into a success, and a success into a
+    failure.
+    """
+    def unexpected(result):
+        raise AssertionError("Expected DNSLookupError, got %r" % (result,))
+
+    def expected(failure):
+        failure.trap(DNSLookupError)
+
+    d.addCallbacks(unexpected, expected)
+    return d
+
+
+class CachingResolverTest(BaseLeapTest):
+
+    def setUp(self):
+        self.authority = FakeAuthority({"provider.test": "10.0.0.1"})
+        factory = server.DNSServerFactory(authorities=[self.authority])
+        self.port = reactor.listenUDP(
+            0, dns.DNSDatagramProtocol(factory), interface="127.0.0.1")
+        self.resolver = CachingResolver(
+            servers=[("127.0.0.1", self.port.getHost().port)])
+
+    def tearDown(self):
+        self.port.stopListening()
+
+    @deferred()
+    def test_resolve(self):
+        d = self.resolver.resolve("provider.test")
+        d.addCallback(self.assertEqual, "10.0.0.1")
+        return d
+
+    @deferred()
+    def test_answers_are_cached(self):
+        d = self.resolver.resolve("provider.test")
+        d.addCallback(lambda _: self.resolver.resolve(u"Provider.Test."))
+
+        def check(address):
+            self.assertEqual(address, "10.0.0.1")
+            self.assertEqual(self.authority.queries, 1)
+        d.addCallback(check)
+        return d
+
+    @deferred()
+    def test_concurrent_lookups_are_coalesced(self):
+        d = defer.gatherResults([self.resolver.resolve("provider.test"),
+                                 self.resolver.resolve("provider.test")])
+
+        def check(addresses):
+            self.assertEqual(addresses, ["10.0.0.1", "10.0.0.1"])
+            self.assertEqual(self.authority.queries, 1)
+        d.addCallback(check)
+        return d
+
+    @deferred()
+    def test_negative_answers_are_cached(self):
+        def lookup(_):
+            d = self.resolver.resolve("nowhere.test")
+            return expect_lookup_error(d)
+
+        d = lookup(None)
+        d.addCallback(lookup)
+        d.addCallback(
+            lambda _: self.assertEqual(self.authority.queries, 1))
+        return d
+
+    @deferred()
+    def test_ip_addresses_are_not_looked_up(self):
+        d = self.resolver.resolve("10.1.2.3")
+        d.addCallback(self.assertEqual, "10.1.2.3")
+        d.addCallback(
+            lambda _: self.assertEqual(self.authority.queries, 0))
+        return d
+
+    @deferred()
+    def test_deadline(self):
+        silent = reactor.listenUDP(0, SilentServer(), interface="127.0.0.1")
+        resolver = CachingResolver(
+            servers=[("127.0.0.1", silent.getHost().port)], deadline=0.5)
+        d = resolver.resolve("provider.test")
+        d = expect_lookup_error(d)
+        d.addCallback(lambda _: silent.stopListening())
+        return d
+
+    def test_cache_expiration(self):
+        clock = task.Clock()
+        resolver = CachingResolver(servers=[("127.0.0.1", 53)], clock=clock)
+        resolver._store("provider.test", "10.0.0.2", 60)
+
+        results = []
+        resolver.resolve("provider.test").addCallback(results.append)
+        self.assertEqual(results, ["10.0.0.2"])
+
+        clock.advance(61)
+        self.assertIsNone(resolver._get_cached("provider.test"))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
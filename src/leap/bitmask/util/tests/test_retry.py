@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+# test_retry.py
+# Copyright (C) 2015 LEAP
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the retry policy and the circuit breakers.
+"""
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+import mock
+import requests
+
+from leap.bitmask.util import retry
+from leap.common.testing.basetest import BaseLeapTest
+
+URL = "https://provider.test/provider.json"
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def response(status_code):
+    res = mock.Mock()
+    res.status_code = status_code
+    return res
+
+
+class RetryPolicyTest(BaseLeapTest):
+
+    def setUp(self):
+        retry.reset_breakers()
+        self.clock = FakeClock()
+        self.policy = retry.RetryPolicy(
+            attempts=4, base_delay=1, max_delay=4, deadline=60, timeout=15,
+            sleep=self.clock.sleep, clock=self.clock)
+        self.session = mock.Mock()
+
+    def tearDown(self):
+        retry.reset_breakers()
+
+    def test_returns_the_first_response(self):
+        self.session.get.return_value = response(200)
+        res = self.policy.request(self.session, "GET", URL, verify=True)
+
+        self.assertEqual(res.status_code, 200)
+        self.session.get.assert_called_once_with(URL, timeout=15,
+                                                 verify=True)
+
+    def test_retries_idempotent_requests(self):
+        self.session.get.side_effect = [
+            requests.exceptions.ConnectionError(),
+            response(503),
+            response(200)]
+        res = self.policy.request(self.session, "GET", URL)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(self.session.get.call_count, 3)
+
+    def test_gives_up_after_the_attempts(self):
+        self.session.get.side_effect = requests.exceptions.Timeout()
+        self.assertRaises(requests.exceptions.Timeout,
+                          self.policy.request, self.session, "GET", URL)
+        self.assertEqual(self.session.get.call_count, 4)
+
+    def test_returns_the_last_response(self):
+        self.session.get.return_value = response(502)
+        res = self.policy.request(self.session, "GET", URL)
+
+        self.assertEqual(res.status_code, 502)
+        self.assertEqual(self.session.get.call_count, 4)
+
+    def test_does_not_retry_ssl_errors(self):
+        self.session.get.side_effect = requests.exceptions.SSLError()
+        self.assertRaises(requests.exceptions.SSLError,
+                          self.policy.request, self.session, "GET", URL)
+        self.assertEqual(self.session.get.call_count, 1)
+        self.assertEqual(retry.get_breaker("provider.test").state,
+                         retry.CircuitBreaker.CLOSED)
+
+    def test_does_not_retry_posts(self):
+        self.session.post.side_effect = requests.exceptions.ConnectionError()
+        self.assertRaises(requests.exceptions.ConnectionError,
+                          self.policy.request, self.session, "POST", URL)
+        self.assertEqual(self.session.post.call_count, 1)
+
+        self.session.put.return_value = response(503)
+        self.policy.request(self.session, "PUT", URL)
+        self.assertEqual(self.session.put.call_count, 1)
+
+    def test_retries_posts_marked_idempotent(self):
+        self.session.post.side_effect = [
+            requests.exceptions.ConnectionError(), response(200)]
+        res = self.policy.request(self.session, "POST", URL,
+                                  idempotent=True)
+        self.assertEqual(res.status_code, 200)
+
+    def test_respects_the_deadline(self):
+        def slow_get(url, timeout):
+            self.clock.now += timeout
+            raise requests.exceptions.Timeout()
+
+        self.session.get.side_effect = slow_get
+        self.assertRaises(requests.exceptions.Timeout,
+                          self.policy.request, self.session, "GET", URL,
+                          deadline=20)
+        self.assertTrue(self.clock.now <= 1020)
+        # the second attempt only gets the time that is left
+        timeouts = [c[1]["timeout"] for c in
+                    self.session.get.call_args_list]
+        self.assertEqual(timeouts[0], 15)
+        self.assertTrue(all(t <= 5 for t in timeouts[1:]))
+
+    def _open_circuit(self):
+        breaker = retry.CircuitBreaker("provider.test", clock=self.clock)
+        retry._breakers["provider.test"] = breaker
+        for _ in range(retry.CircuitBreaker.FAILURE_THRESHOLD):
+            breaker.record_failure()
+        self.clock.now += retry.CircuitBreaker.RESET_TIMEOUT
+        return breaker
+
+    def test_probe_with_ssl_error_does_not_block_the_host(self):
+        breaker = self._open_circuit()
+        self.session.get.side_effect = requests.exceptions.SSLError()
+        self.assertRaises(requests.exceptions.SSLError,
+                          self.policy.request, self.session, "GET", URL)
+
+        self.assertTrue(breaker.allow())
+
+    def test_probe_with_other_error_does_not_block_the_host(self):
+        breaker = self._open_circuit()
+        self.session.get.side_effect = ValueError()
+        self.assertRaises(ValueError,
+                          self.policy.request, self.session, "GET", URL)
+
+        self.session.get.side_effect = None
+        self.session.get.return_value = response(200)
+        res = self.policy.request(self.session, "GET", URL)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(breaker.state, retry.CircuitBreaker.CLOSED)
+
+    def test_backoff_is_bounded(self):
+        for retry_number in range(10):
+            delay = self.policy.get_delay(retry_number)
+            self.assertTrue(0 <= delay <= self.policy.max_delay)
+
+
+class CircuitBreakerTest(BaseLeapTest):
+
+    def setUp(self):
+        retry.reset_breakers()
+        self.clock = FakeClock()
+        self.breaker = retry.CircuitBreaker("provider.test",
+                                            clock=self.clock)
+
+    def tearDown(self):
+        retry.reset_breakers()
+
+    def _fail(self, times):
+        for _ in range(times):
+            self.breaker.record_failure()
+
+    def test_opens_after_consecutive_failures(self):
+        self._fail(retry.CircuitBreaker.FAILURE_THRESHOLD - 1)
+        self.breaker.record_success()
+        self._fail(retry.CircuitBreaker.FAILURE_THRESHOLD - 1)
+        self.assertTrue(self.breaker.allow())
+
+        self._fail(1)
+        self.assertEqual(self.breaker.state, retry.CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+
+    def test_half_open_lets_one_request_through(self):
+        self._fail(retry.CircuitBreaker.FAILURE_THRESHOLD)
+        self.clock.now += retry.CircuitBreaker.RESET_TIMEOUT
+
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, retry.CircuitBreaker.CLOSED)
+
+    def test_failed_probe_opens_again(self):
+        self._fail(retry.CircuitBreaker.FAILURE_THRESHOLD)
+        self.clock.now += retry.CircuitBreaker.RESET_TIMEOUT
+        self.breaker.allow()
+        self._fail(1)
+
+        self.assertEqual(self.breaker.state, retry.CircuitBreaker.OPEN)
+
+    def test_open_circuit_fails_fast(self):
+        breaker = retry.get_breaker("provider.test")
+        for _ in range(retry.CircuitBreaker.FAILURE_THRESHOLD):
+            breaker.record_failure()
+
+        session = mock.Mock()
+        policy = retry.RetryPolicy(sleep=lambda seconds: None)
+        self.assertRaises(retry.CircuitOpenError,
+                          policy.request, session, "GET", URL)
+        self.assertFalse(session.get.called)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)